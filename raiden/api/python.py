@@ -11,7 +11,7 @@ from raiden.blockchain.events import (
     get_all_registry_events,
     get_all_netting_channel_events,
 )
-from raiden.transfer import views
+from raiden.transfer import node, views
 from raiden.transfer.events import (
     EventTransferSentSuccess,
     EventTransferSentFailed,
@@ -47,6 +47,19 @@ EVENTS_EXTERNALLY_VISIBLE = (
 )
 
 
+def raiden_event_to_dict(block_number, event):
+    new_event = {
+        'block_number': block_number,
+        '_event_type': type(event).__name__.encode(),
+    }
+    new_event.update(event.__dict__)
+
+    # the channel is only stored to index the event, it is implied by the query
+    new_event.pop('channel_identifier', None)
+
+    return new_event
+
+
 class RaidenAPI:
     # pylint: disable=too-many-public-methods
 
@@ -556,20 +569,48 @@ class RaidenAPI:
             from_block=from_block,
             to_block=to_block,
         )
-        raiden_events = self.raiden.wal.storage.get_events_by_block(
+        # Here choose which raiden internal events we want to expose to the end user.
+        # The events stored by previous versions don't record their channel,
+        # these are returned for every channel, as before they were indexed.
+        raiden_events = self.raiden.wal.storage.get_events(
+            event_types=[event_type.__name__ for event_type in EVENTS_EXTERNALLY_VISIBLE],
+            channel_identifier=channel_address,
             from_block=from_block,
             to_block=to_block,
+            include_unknown_channel=True,
+        )
+        returned_events.extend(
+            raiden_event_to_dict(block_number, event)
+            for block_number, event in raiden_events
         )
-        # Here choose which raiden internal events we want to expose to the end user
-        for block_number, event in raiden_events:
-            if isinstance(event, EVENTS_EXTERNALLY_VISIBLE):
-                new_event = {
-                    'block_number': block_number,
-                    '_event_type': type(event).__name__.encode(),
-                }
-                new_event.update(event.__dict__)
-                returned_events.append(new_event)
 
         return returned_events
 
+    def get_dispatch_statistics(self):
+        """ Returns the number of calls, cumulative time and emitted events
+        per state change type dispatched since the node started.
+        """
+        return node.dispatch_statistics()
+
+    def get_round_trip_times(self):
+        """ Returns the smoothed round trip time, its variance and the
+        retransmission timeout of the peers, as measured by the transport.
+        """
+        return self.raiden.protocol.get_round_trip_times()
+
+    def get_payment_events(self, payment_identifier, from_block=0, to_block='latest'):
+        """ Returns the externally visible events of the payment
+        `payment_identifier`, for all channels.
+        """
+        raiden_events = self.raiden.wal.storage.get_events(
+            event_types=[event_type.__name__ for event_type in EVENTS_EXTERNALLY_VISIBLE],
+            payment_identifier=payment_identifier,
+            from_block=from_block,
+            to_block=to_block,
+        )
+        return [
+            raiden_event_to_dict(block_number, event)
+            for block_number, event in raiden_events
+        ]
+
     transfer = transfer_and_wait
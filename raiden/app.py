@@ -6,16 +6,30 @@ from binascii import unhexlify
 
 from raiden.raiden_service import RaidenService
 from raiden.settings import (
+    DEFAULT_COMPACTION_ENABLED,
+    DEFAULT_COMPACTION_EVENTS,
+    DEFAULT_DATABASE_READ_POOL_SIZE,
+    DEFAULT_DATABASE_SERIALIZER,
     DEFAULT_NAT_INVITATION_TIMEOUT,
     DEFAULT_NAT_KEEPALIVE_RETRIES,
     DEFAULT_NAT_KEEPALIVE_TIMEOUT,
+    DEFAULT_PROTOCOL_BUNDLE_MESSAGES,
     DEFAULT_PROTOCOL_RETRIES_BEFORE_BACKOFF,
     DEFAULT_PROTOCOL_THROTTLE_CAPACITY,
     DEFAULT_PROTOCOL_THROTTLE_FILL_RATE,
     DEFAULT_PROTOCOL_RETRY_INTERVAL,
+    DEFAULT_PROTOCOL_RETRY_TIMEOUT_MIN,
+    DEFAULT_PROTOCOL_SCHEDULER_TICK,
+    DEFAULT_PROTOCOL_SCHEDULER_WORKERS,
+    DEFAULT_PROTOCOL_DELIVERED_BATCH_TIMEOUT,
+    DEFAULT_PROTOCOL_WINDOW_SIZE,
     DEFAULT_REVEAL_TIMEOUT,
     DEFAULT_SETTLE_TIMEOUT,
     DEFAULT_SHUTDOWN_TIMEOUT,
+    DEFAULT_SNAPSHOT_INTERVAL,
+    DEFAULT_SNAPSHOT_LOG_SIZE,
+    DEFAULT_SNAPSHOT_STATE_CHANGES,
+    DEFAULT_WAL_GROUP_COMMIT,
     INITIAL_PORT,
 )
 from raiden.utils import (
@@ -34,12 +48,20 @@ class App:  # pylint: disable=too-few-public-methods
         'reveal_timeout': DEFAULT_REVEAL_TIMEOUT,
         'settle_timeout': DEFAULT_SETTLE_TIMEOUT,
         'database_path': '',
+        'database_serializer': DEFAULT_DATABASE_SERIALIZER,
+        'database_read_pool_size': DEFAULT_DATABASE_READ_POOL_SIZE,
         'msg_timeout': 100.0,
         'protocol': {
             'retry_interval': DEFAULT_PROTOCOL_RETRY_INTERVAL,
+            'retry_timeout_min': DEFAULT_PROTOCOL_RETRY_TIMEOUT_MIN,
             'retries_before_backoff': DEFAULT_PROTOCOL_RETRIES_BEFORE_BACKOFF,
             'throttle_capacity': DEFAULT_PROTOCOL_THROTTLE_CAPACITY,
             'throttle_fill_rate': DEFAULT_PROTOCOL_THROTTLE_FILL_RATE,
+            'window_size': DEFAULT_PROTOCOL_WINDOW_SIZE,
+            'delivered_batch_timeout': DEFAULT_PROTOCOL_DELIVERED_BATCH_TIMEOUT,
+            'bundle_messages': DEFAULT_PROTOCOL_BUNDLE_MESSAGES,
+            'scheduler_tick': DEFAULT_PROTOCOL_SCHEDULER_TICK,
+            'scheduler_workers': DEFAULT_PROTOCOL_SCHEDULER_WORKERS,
             'nat_invitation_timeout': DEFAULT_NAT_INVITATION_TIMEOUT,
             'nat_keepalive_retries': DEFAULT_NAT_KEEPALIVE_RETRIES,
             'nat_keepalive_timeout': DEFAULT_NAT_KEEPALIVE_TIMEOUT,
@@ -47,6 +69,17 @@ class App:  # pylint: disable=too-few-public-methods
         'rpc': True,
         'console': False,
         'shutdown_timeout': DEFAULT_SHUTDOWN_TIMEOUT,
+        'wal_group_commit': DEFAULT_WAL_GROUP_COMMIT,
+        'snapshot': {
+            'state_changes': DEFAULT_SNAPSHOT_STATE_CHANGES,
+            'interval': DEFAULT_SNAPSHOT_INTERVAL,
+            'log_size': DEFAULT_SNAPSHOT_LOG_SIZE,
+        },
+        'compaction': {
+            'enabled': DEFAULT_COMPACTION_ENABLED,
+            'events': DEFAULT_COMPACTION_EVENTS,
+            'archive_directory': None,
+        },
         'transport_type': 'udp',
         'matrix': {
             'server': 'auto',
@@ -26,7 +26,10 @@ from raiden.utils import pex
 log = slogging.get_logger(__name__)  # pylint: disable=invalid-name
 
 
-def handle_tokennetwork_new(raiden, event):
+def prepare_tokennetwork_new(raiden, event):
+    """ Install the listeners of the new token network and return its
+    state, queried from the blockchain.
+    """
     data = event.event_data
     manager_address = data['channel_manager_address']
 
@@ -42,12 +45,14 @@ def handle_tokennetwork_new(raiden, event):
     for channel_proxy in netting_channel_proxies:
         raiden.blockchain_events.add_netting_channel_listener(channel_proxy)
 
-    token_network_state = get_token_network_state_from_proxies(
+    return get_token_network_state_from_proxies(
         raiden,
         manager_proxy,
         netting_channel_proxies,
     )
 
+
+def handle_tokennetwork_new(raiden, event, token_network_state):
     new_payment_network = ContractReceiveNewTokenNetwork(
         event.originating_contract,
         token_network_state,
@@ -55,22 +60,35 @@ def handle_tokennetwork_new(raiden, event):
     raiden.handle_state_change(new_payment_network)
 
 
-def handle_channel_new(raiden, event):
+def prepare_channel_new(raiden, event):
+    """ Return the tuple (token_address, channel_proxy, channel_state), the
+    channel is only queried if this node is a participant, otherwise the
+    proxy and the state are None.
+    """
     data = event.event_data
-    registry_address = data['registry_address']
-    participant1 = data['participant1']
-    participant2 = data['participant2']
-    is_participant = raiden.address in (participant1, participant2)
+    is_participant = raiden.address in (data['participant1'], data['participant2'])
+
+    if not is_participant:
+        manager = raiden.chain.channel_manager(event.originating_contract)
+        return manager.token_address(), None, None
+
+    channel_proxy = raiden.chain.netting_channel(data['netting_channel'])
+    token_address = channel_proxy.token_address()
+    channel_state = get_channel_state(
+        token_address,
+        raiden.config['reveal_timeout'],
+        channel_proxy,
+    )
+
+    return token_address, channel_proxy, channel_state
 
-    if is_participant:
-        channel_proxy = raiden.chain.netting_channel(data['netting_channel'])
-        token_address = channel_proxy.token_address()
-        channel_state = get_channel_state(
-            token_address,
-            raiden.config['reveal_timeout'],
-            channel_proxy,
-        )
 
+def handle_channel_new(raiden, event, prepared, after_commit):
+    data = event.event_data
+    registry_address = data['registry_address']
+    token_address, channel_proxy, channel_state = prepared
+
+    if channel_proxy is not None:
         new_channel = ContractReceiveChannelNew(
             registry_address,
             token_address,
@@ -78,37 +96,43 @@ def handle_channel_new(raiden, event):
         )
         raiden.handle_state_change(new_channel)
 
-        partner_address = channel_state.partner_state.address
-        connection_manager = raiden.connection_manager_for_token(
-            registry_address, token_address
-        )
-
-        if ConnectionManager.BOOTSTRAP_ADDR != partner_address:
-            raiden.start_health_check_for(partner_address)
-
-        gevent.spawn(connection_manager.retry_connect, registry_address)
-
-        # Start the listener *after* the channel is registered, to avoid None
-        # exceptions (and not applying the event state change).
-        #
-        # TODO: install the filter on the same block or previous block in which
-        # the channel state was queried
-        raiden.blockchain_events.add_netting_channel_listener(channel_proxy)
+        after_commit.append(lambda: start_channel(
+            raiden,
+            registry_address,
+            token_address,
+            channel_proxy,
+            channel_state.partner_state.address,
+        ))
 
     else:
-        manager = raiden.chain.channel_manager(event.originating_contract)
-        token_address = manager.token_address()
-
         new_route = ContractReceiveRouteNew(
             registry_address,
             token_address,
-            participant1,
-            participant2,
+            data['participant1'],
+            data['participant2'],
         )
         raiden.handle_state_change(new_route)
 
 
-def handle_channel_new_balance(raiden, event):
+def start_channel(raiden, registry_address, token_address, channel_proxy, partner_address):
+    connection_manager = raiden.connection_manager_for_token(
+        registry_address, token_address
+    )
+
+    if ConnectionManager.BOOTSTRAP_ADDR != partner_address:
+        raiden.start_health_check_for(partner_address)
+
+    gevent.spawn(connection_manager.retry_connect, registry_address)
+
+    # Start the listener *after* the channel is registered, to avoid None
+    # exceptions (and not applying the event state change).
+    #
+    # TODO: install the filter on the same block or previous block in which
+    # the channel state was queried
+    raiden.blockchain_events.add_netting_channel_listener(channel_proxy)
+
+
+def handle_channel_new_balance(raiden, event, after_commit):
     data = event.event_data
     registry_address = data['registry_address']
     channel_identifier = event.originating_contract
@@ -145,16 +169,26 @@ def handle_channel_new_balance(raiden, event):
         raiden.handle_state_change(newbalance_statechange)
 
         if balance_was_zero:
-            connection_manager = raiden.connection_manager_for_token(
-                registry_address, token_address
-            )
-
-            gevent.spawn(
-                connection_manager.join_channel,
+            after_commit.append(lambda: join_channel(
+                raiden,
                 registry_address,
+                token_address,
                 participant_address,
                 new_balance,
-            )
+            ))
+
+
+def join_channel(raiden, registry_address, token_address, participant_address, new_balance):
+    connection_manager = raiden.connection_manager_for_token(
+        registry_address, token_address
+    )
+
+    gevent.spawn(
+        connection_manager.join_channel,
+        registry_address,
+        participant_address,
+        new_balance,
+    )
 
 
 def handle_channel_closed(raiden, event):
@@ -223,7 +257,26 @@ def handle_channel_withdraw(raiden, event):
         raiden.handle_state_change(withdrawn_state_change)
 
 
-def on_blockchain_event(raiden, event):
+def prepare_blockchain_event(raiden, event):
+    """ Do the blockchain calls needed to handle `event`, returns the data
+    for `on_blockchain_event`.
+    """
+    event_type = event.event_data['_event_type']
+
+    if event_type == b'TokenAdded':
+        return prepare_tokennetwork_new(raiden, event)
+
+    elif event_type == b'ChannelNew':
+        return prepare_channel_new(raiden, event)
+
+    return None
+
+
+def on_blockchain_event(raiden, event, prepared, after_commit):
+    """ Handle `event` with the data from `prepare_blockchain_event`. The
+    actions that must wait for the state changes to be committed are
+    appended to `after_commit`.
+    """
     if log.isEnabledFor(logging.DEBUG):
         log.debug('EVENT', node=pex(raiden.address), event=event)
 
@@ -231,13 +284,13 @@ def on_blockchain_event(raiden, event):
     assert isinstance(data['_event_type'], bytes)
 
     if data['_event_type'] == b'TokenAdded':
-        handle_tokennetwork_new(raiden, event)
+        handle_tokennetwork_new(raiden, event, prepared)
 
     elif data['_event_type'] == b'ChannelNew':
-        handle_channel_new(raiden, event)
+        handle_channel_new(raiden, event, prepared, after_commit)
 
     elif data['_event_type'] == b'ChannelNewBalance':
-        handle_channel_new_balance(raiden, event)
+        handle_channel_new_balance(raiden, event, after_commit)
 
     elif data['_event_type'] == b'ChannelClosed':
         handle_channel_closed(raiden, event)
@@ -250,3 +303,31 @@ def on_blockchain_event(raiden, event):
 
     elif log.isEnabledFor(logging.ERROR):
         log.error('Unknown event type', event=event)
+
+
+def on_blockchain_events(raiden, events):
+    """ Handle the ordered blockchain `events` of a poll, their state changes
+    are logged in a single transaction.
+
+    The other greenlets' state changes wait for the transaction, so the
+    blockchain is queried before it is opened. The node acts on the state
+    changes, e.g. connects to a new channel, only once they are committed.
+    """
+    prepared_events = list()
+    try:
+        for event in events:
+            prepared_events.append((event, prepare_blockchain_event(raiden, event)))
+    finally:
+        # the events are consumed from the filters, if a query fails the
+        # events before it are handled anyway
+        handle_prepared_events(raiden, prepared_events)
+
+
+def handle_prepared_events(raiden, prepared_events):
+    after_commit = list()
+    with raiden.batch_state_changes():
+        for event, prepared in prepared_events:
+            on_blockchain_event(raiden, event, prepared, after_commit)
+
+    for action in after_commit:
+        action()
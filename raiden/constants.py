@@ -25,6 +25,9 @@ NETTINGCHANNEL_SETTLE_TIMEOUT_MAX = 2700000
 # TODO: add this as an attribute of the transport class
 UDP_MAX_MESSAGE_SIZE = 1200
 
+# Maximum number of message identifiers acknowledged by a DeliveredBatch
+DELIVERED_BATCH_MAX_IDENTIFIERS = 32
+
 MAINNET = 'mainnet'
 ROPSTEN = 'ropsten'
 RINKEBY = 'rinkeby'
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from ethereum import slogging
 
-from raiden.constants import UINT64_MAX, UINT256_MAX
+from raiden.constants import DELIVERED_BATCH_MAX_IDENTIFIERS, UINT64_MAX, UINT256_MAX
 from raiden.encoding.encoders import integer, optional_bytes
 from raiden.encoding.format import (
     buffer_for,
@@ -35,6 +35,10 @@ LOCKEDTRANSFER = 7
 REFUNDTRANSFER = 8
 REVEALSECRET = 11
 DELIVERED = 12
+DELIVERED_BATCH = 13
+
+# Not a message, the cmdid of a bundle of messages
+BUNDLE = 14
 
 
 # pylint: disable=invalid-name
@@ -50,6 +54,13 @@ delivered_message_identifier = make_field(
     '8s',
     integer(0, UINT64_MAX),
 )
+# the unused identifiers are zeroed, the number of identifiers is in count
+delivered_message_identifiers = make_field(
+    'delivered_message_identifiers',
+    8 * DELIVERED_BATCH_MAX_IDENTIFIERS,
+    '{}s'.format(8 * DELIVERED_BATCH_MAX_IDENTIFIERS),
+)
+count = make_field('count', 1, 'B', integer(1, DELIVERED_BATCH_MAX_IDENTIFIERS))
 expiration = make_field('expiration', 8, '8s', integer(0, UINT64_MAX))
 
 registry_address = make_field('registry_address', 20, '20s')
@@ -93,6 +104,17 @@ Delivered = namedbuffer(
     ]
 )
 
+DeliveredBatch = namedbuffer(
+    'delivered_batch',
+    [
+        cmdid(DELIVERED_BATCH),
+        count,
+        pad(2),
+        delivered_message_identifiers,
+        signature,
+    ]
+)
+
 Ping = namedbuffer(
     'ping',
     [
@@ -244,6 +266,7 @@ CMDID_MESSAGE = {
     LOCKEDTRANSFER: LockedTransfer,
     REFUNDTRANSFER: RefundTransfer,
     DELIVERED: Delivered,
+    DELIVERED_BATCH: DeliveredBatch,
 }
 
 
@@ -268,3 +291,57 @@ def wrap(data):
         return
 
     return message
+
+
+def bundle(messages_data):
+    """ Pack the encoded messages in a single bundle.
+
+    The size of a message is known from its cmdid, so the bundle is just the
+    concatenation of the messages after the BUNDLE cmdid.
+    """
+    return bytes([BUNDLE]) + b''.join(messages_data)
+
+
+def unbundle(data):
+    """ Return the encoded messages of the bundle `data`, raises ValueError if
+    the bundle is malformed. Bundles cannot be nested.
+    """
+    messages_data = list()
+    position = 1
+
+    while position < len(data):
+        if data[position] == BUNDLE:
+            raise ValueError('nested bundle')
+
+        try:
+            size = CMDID_MESSAGE[data[position]].size
+        except KeyError:
+            raise ValueError('unknown cmdid {} in bundle'.format(data[position]))
+
+        if position + size > len(data):
+            raise ValueError('truncated message in bundle')
+
+        messages_data.append(data[position:position + size])
+        position += size
+
+    return messages_data
+
+
+def bundles(messages_data, max_size):
+    """ Pack the encoded messages, in order, in as few packets of at most
+    `max_size` bytes as possible. A message alone in a packet is not bundled.
+    """
+    packet = list()
+    packet_size = 1
+
+    for data in messages_data:
+        if packet and packet_size + len(data) > max_size:
+            yield packet[0] if len(packet) == 1 else bundle(packet)
+            packet = list()
+            packet_size = 1
+
+        packet.append(data)
+        packet_size += len(data)
+
+    if packet:
+        yield packet[0] if len(packet) == 1 else bundle(packet)
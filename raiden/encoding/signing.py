@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import cachetools
 from coincurve import PublicKey
 from ethereum.slogging import getLogger
 
@@ -7,20 +8,41 @@ from raiden.utils import sha3, publickey_to_address
 
 log = getLogger(__name__)  # pylint: disable=invalid-name
 
+# The same signature is recovered more than once, e.g. the balance proof of a
+# message when it is decoded and again when the channel validates it
+RECOVERY_CACHE_SIZE = 4096
+RECOVERED_PUBLICKEYS = cachetools.LRUCache(RECOVERY_CACHE_SIZE)
 
-def recover_publickey(messagedata, signature, hasher=sha3):
-    if len(signature) != 65:
-        raise ValueError('invalid signature')
+# Below this number of signatures to recover a batch is not worth the hand off
+# to the threadpool
+BATCH_THREADPOOL_THRESHOLD = 16
 
+
+def _recover_publickey_from_hash(messagehash, signature):
     signature = signature[:-1] + chr(signature[-1] - 27).encode()
     publickey = PublicKey.from_signature_and_message(
         signature,
-        messagedata,
-        hasher=hasher,
+        messagehash,
+        hasher=None,
     )
     return publickey.format(compressed=False)
 
 
+def recover_publickey(messagedata, signature, hasher=sha3):
+    if len(signature) != 65:
+        raise ValueError('invalid signature')
+
+    messagehash = hasher(messagedata)
+    key = (messagehash, signature)
+
+    publickey = RECOVERED_PUBLICKEYS.get(key)
+    if publickey is None:
+        publickey = _recover_publickey_from_hash(messagehash, signature)
+        RECOVERED_PUBLICKEYS[key] = publickey
+
+    return publickey
+
+
 def recover_publickey_safe(messagedata, signature, hasher=sha3):
     publickey = None
 
@@ -46,6 +68,59 @@ def recover_address(messagedata, signature, hasher=sha3):
     return publickey_to_address(public_key)
 
 
+def _recover_publickey_from_hash_safe(messagehash, signature):
+    try:
+        return _recover_publickey_from_hash(messagehash, signature)
+    except Exception:  # pylint: disable=broad-except
+        # secp256k1 is using bare Exception classes: raised if the recovery failed
+        return None
+
+
+def recover_addresses(messages_and_signatures, threadpool=None, hasher=sha3):
+    """ Recover the signers of a batch of (messagedata, signature) pairs.
+
+    The signatures that are not cached are recovered by `threadpool`, e.g.
+    `gevent.get_hub().threadpool`, if there are enough of them. The
+    secp256k1 library releases the GIL, so a burst of messages is verified
+    in parallel while the hub keeps running.
+
+    Returns the list of addresses, None for the invalid signatures.
+    """
+    keys = [
+        (hasher(messagedata), signature) if len(signature) == 65 else None
+        for messagedata, signature in messages_and_signatures
+    ]
+
+    missing = [
+        key
+        for key in set(keys)
+        if key is not None and key not in RECOVERED_PUBLICKEYS
+    ]
+
+    if threadpool is not None and len(missing) >= BATCH_THREADPOOL_THRESHOLD:
+        recovered = threadpool.map(lambda key: _recover_publickey_from_hash_safe(*key), missing)
+    else:
+        recovered = [_recover_publickey_from_hash_safe(*key) for key in missing]
+
+    publickeys = dict(zip(missing, recovered))
+    for key, publickey in publickeys.items():
+        if publickey is not None:
+            RECOVERED_PUBLICKEYS[key] = publickey
+
+    addresses = list()
+    for key in keys:
+        publickey = None
+        if key is not None:
+            publickey = publickeys.get(key) or RECOVERED_PUBLICKEYS.get(key)
+
+        if publickey is None:
+            addresses.append(None)
+        else:
+            addresses.append(publickey_to_address(publickey))
+
+    return addresses
+
+
 def sign(messagedata, private_key, hasher=sha3):
     signature = private_key.sign_recoverable(messagedata, hasher=hasher)
     if len(signature) != 65:
@@ -129,3 +129,8 @@ class TransactionThrew(RaidenError):
 
 class InvalidProtocolMessage(RaidenError):
     """Raised on an invalid or an unknown Raiden protocol message"""
+
+
+class SerializationError(RaidenError):
+    """ Raised when an object cannot be serialized or the stored data cannot be
+    deserialized. """
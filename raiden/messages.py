@@ -2,6 +2,7 @@ from ethereum.slogging import getLogger
 from eth_utils import big_endian_to_int
 
 from raiden.constants import (
+    DELIVERED_BATCH_MAX_IDENTIFIERS,
     UINT256_MAX,
     UINT64_MAX,
 )
@@ -23,6 +24,7 @@ from raiden.utils import (
 
 __all__ = (
     'Delivered',
+    'DeliveredBatch',
     'DirectTransfer',
     'Lock',
     'LockedTransfer',
@@ -390,6 +392,72 @@ class Delivered(SignedMessage):
         return delivered
 
 
+class DeliveredBatch(SignedMessage):
+    """ Acknowledges a set of messages with a single signature, it has the
+    same meaning as a `Delivered` for each of the identifiers.
+    """
+    cmdid = messages.DELIVERED_BATCH
+
+    def __init__(self, delivered_message_identifiers):
+        super().__init__()
+
+        if not delivered_message_identifiers:
+            raise ValueError('delivered_message_identifiers cannot be empty')
+
+        if len(delivered_message_identifiers) > DELIVERED_BATCH_MAX_IDENTIFIERS:
+            raise ValueError('too many delivered_message_identifiers')
+
+        if any(not 0 <= identifier <= UINT64_MAX for identifier in delivered_message_identifiers):
+            raise ValueError('delivered_message_identifiers must be uint64')
+
+        self.delivered_message_identifiers = list(delivered_message_identifiers)
+
+    @classmethod
+    def unpack(cls, packed):
+        data = packed.delivered_message_identifiers
+        delivered_batch = cls([
+            big_endian_to_int(data[position * 8:(position + 1) * 8])
+            for position in range(packed.count)
+        ])
+        delivered_batch.signature = packed.signature
+        return delivered_batch
+
+    def pack(self, packed):
+        data = b''.join(
+            identifier.to_bytes(8, byteorder='big')
+            for identifier in self.delivered_message_identifiers
+        )
+        packed.count = len(self.delivered_message_identifiers)
+        # the field is left padded, the unused identifiers are at the end
+        packed.delivered_message_identifiers = data.ljust(
+            8 * DELIVERED_BATCH_MAX_IDENTIFIERS,
+            b'\x00',
+        )
+        packed.signature = self.signature
+
+    def __repr__(self):
+        return '<{} [delivered_msgids:{}]>'.format(
+            self.__class__.__name__,
+            self.delivered_message_identifiers,
+        )
+
+    def to_dict(self):
+        return {
+            'type': self.__class__.__name__,
+            'delivered_message_identifiers': self.delivered_message_identifiers,
+            'signature': data_encoder(self.signature)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        assert data['type'] == cls.__name__
+        delivered_batch = cls(
+            delivered_message_identifiers=data['delivered_message_identifiers'],
+        )
+        delivered_batch.signature = data_decoder(data['signature'])
+        return delivered_batch
+
+
 class Pong(SignedMessage):
     """ Response to a Ping message. """
     cmdid = messages.PONG
@@ -1379,6 +1447,7 @@ class RefundTransfer(LockedTransfer):
 
 CMDID_TO_CLASS = {
     messages.DELIVERED: Delivered,
+    messages.DELIVERED_BATCH: DeliveredBatch,
     messages.DIRECTTRANSFER: DirectTransfer,
     messages.LOCKEDTRANSFER: LockedTransfer,
     messages.PING: Ping,
@@ -2,6 +2,7 @@ import binascii
 import json
 import logging
 import re
+import time
 from collections import namedtuple
 from enum import Enum
 from operator import itemgetter
@@ -26,15 +27,21 @@ from raiden.exceptions import (
 from raiden.messages import (
     decode as message_from_bytes,
     Delivered,
+    DeliveredBatch,
     from_dict as message_from_dict,
     Ping,
     SignedMessage,
     Pong,
     Message
 )
-from raiden.network.protocol import timeout_exponential_backoff
+from raiden.network.protocol import timeout_adaptive_backoff
+from raiden.network.transport import RoundTripTimeEstimator
 from raiden.network.utils import get_http_rtt
 from raiden.raiden_service import RaidenService
+from raiden.settings import (
+    DEFAULT_PROTOCOL_BUNDLE_MESSAGES,
+    DEFAULT_PROTOCOL_RETRY_TIMEOUT_MIN,
+)
 from raiden.transfer import events as transfer_events
 from raiden.transfer.architecture import Event
 from raiden.transfer.mediated_transfer import events as mediated_transfer_events
@@ -56,6 +63,11 @@ from raiden_libs.network.matrix import GMatrixClient, Room
 
 log = slogging.get_logger(__name__)
 
+# With bundling enabled, the messages sent to a node in the same iteration of
+# the event loop are sent in a single event, one message per line, the body of
+# an event is kept well below the 64KiB limit of the events
+MATRIX_MAX_BODY_SIZE = 32768
+
 SentMessageState = namedtuple('SentMessageState', (
     'async_result',
     'receiver_address',
@@ -90,6 +102,9 @@ class MatrixTransport:
         self._address_to_presence: Dict[typing.Address, UserPresence] = dict()
         self._userids_to_address: Dict[str, typing.Address] = dict()
         self._address_to_roomid: Dict[typing.Address, str] = dict()
+        self._address_to_roundtrip: Dict[typing.Address, RoundTripTimeEstimator] = dict()
+        self._address_to_outgoing: Dict[typing.Address, List[str]] = dict()
+        self._address_to_outgoing_flush: Dict[typing.Address, gevent.Greenlet] = dict()
 
         self._discovery_room_alias = None
         self._discovery_room_alias_full = None
@@ -163,7 +178,7 @@ class MatrixTransport:
             raise ValueError('Invalid address {}'.format(pex(receiver_address)))
 
         # These are not protocol messages, but transport specific messages
-        if isinstance(message, (Delivered, Ping, Pong)):
+        if isinstance(message, (Delivered, DeliveredBatch, Ping, Pong)):
             raise ValueError(
                 'Do not use send_async for {} messages'.format(message.__class__.__name__)
             )
@@ -180,7 +195,17 @@ class MatrixTransport:
 
         return self._messageids_to_asyncresult[message_id]
 
+    def get_round_trip_times(self):
+        """ Return the round trip time metrics of the peers. """
+        return {
+            address: roundtrip.to_dict()
+            for address, roundtrip in self._address_to_roundtrip.items()
+        }
+
     def stop_and_wait(self):
+        # the queued messages are sent while the client is still logged in
+        gevent.wait(list(self._address_to_outgoing_flush.values()))
+
         self._client.set_presence_state(UserPresence.OFFLINE.value)
         self._client.stop_listener_thread()
         self._client.logout()
@@ -348,61 +373,66 @@ class MatrixTransport:
                 return
             self._userids_to_address[sender_id] = peer_address
 
-        data = event['content']['body']
-        if data.startswith('0x'):
-            message = message_from_bytes(data_decoder(data))
-        else:
-            message_dict = json.loads(data)
-            log.trace('MESSAGE_DATA', data=message_dict)
-            message = message_from_dict(message_dict)
+        # a body may carry several messages, one per line
+        for data in event['content']['body'].splitlines():
+            if data.startswith('0x'):
+                message = message_from_bytes(data_decoder(data))
+            else:
+                message_dict = json.loads(data)
+                log.trace('MESSAGE_DATA', data=message_dict)
+                message = message_from_dict(message_dict)
 
-        if isinstance(message, SignedMessage) and not message.sender:
-            # FIXME: This can't be right
-            message.sender = peer_address
+            if isinstance(message, SignedMessage) and not message.sender:
+                # FIXME: This can't be right
+                message.sender = peer_address
 
-        if isinstance(message, Delivered):
-            self._receive_delivered(message)
-        elif isinstance(message, Ping):
-            log.warning(
-                'Not required Ping received',
-                message=data,
-            )
-        elif isinstance(message, SignedMessage):
-            self._receive_message(message)
-        elif log.isEnabledFor(logging.ERROR):
-            log.error(
-                'Invalid message',
-                message=data,
-            )
+            if isinstance(message, (Delivered, DeliveredBatch)):
+                self._receive_delivered(message)
+            elif isinstance(message, Ping):
+                log.warning(
+                    'Not required Ping received',
+                    message=data,
+                )
+            elif isinstance(message, SignedMessage):
+                self._receive_message(message)
+            elif log.isEnabledFor(logging.ERROR):
+                log.error(
+                    'Invalid message',
+                    message=data,
+                )
 
-    def _receive_delivered(self, delivered: Delivered):
+    def _receive_delivered(self, delivered: typing.Union[Delivered, DeliveredBatch]):
         # FIXME: The signature doesn't seem to be verified - check in UDPTransport as well
-        self._raiden_service.handle_state_change(
-            ReceiveDelivered(delivered.delivered_message_identifier)
-        )
+        if isinstance(delivered, DeliveredBatch):
+            message_identifiers = delivered.delivered_message_identifiers
+        else:
+            message_identifiers = [delivered.delivered_message_identifier]
 
-        async_result = self._messageids_to_asyncresult.pop(
-            delivered.delivered_message_identifier,
-            None
-        )
+        self._raiden_service.handle_state_changes([
+            ReceiveDelivered(message_identifier)
+            for message_identifier in message_identifiers
+        ])
 
-        if async_result is not None:
-            async_result.set(True)
-            if log.isEnabledFor(logging.DEBUG):
-                log.debug(
-                    'DELIVERED MESSAGE RECEIVED',
-                    node=pex(self._raiden_service.address),
-                    receiver=pex(delivered.sender),
-                    message_identifier=delivered.delivered_message_identifier,
-                )
+        for message_identifier in message_identifiers:
+            async_result = self._messageids_to_asyncresult.pop(message_identifier, None)
+
+            if async_result is not None:
+                async_result.set(True)
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(
+                        'DELIVERED MESSAGE RECEIVED',
+                        node=pex(self._raiden_service.address),
+                        receiver=pex(delivered.sender),
+                        message_identifier=message_identifier,
+                    )
 
-        else:
-            if log.isEnabledFor(logging.DEBUG):
-                log.debug(
-                    'DELIVERED MESSAGE UNKNOWN',
-                    node=pex(self._raiden_service.address),
-                    message_identifier=delivered.delivered_message_identifier,
-                )
+            else:
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(
+                        'DELIVERED MESSAGE UNKNOWN',
+                        node=pex(self._raiden_service.address),
+                        message_identifier=message_identifier,
+                    )
 
     def _receive_message(self, message):
         is_debug_log_enabled = log.isEnabledFor(logging.DEBUG)
@@ -424,7 +454,7 @@ class MatrixTransport:
                 #       See: https://matrix.org/docs/spec/client_server/r0.3.0.html#id57
                 delivered_message = Delivered(message.message_identifier)
                 self._raiden_service.sign(delivered_message)
-                self._send_immediate(message.sender, json.dumps(delivered_message.to_dict()))
+                self._send_message(message.sender, json.dumps(delivered_message.to_dict()))
 
         except (InvalidAddress, UnknownAddress, UnknownTokenAddress):
             if is_debug_log_enabled:
@@ -456,23 +486,89 @@ class MatrixTransport:
         async_result: AsyncResult,
         data: str
     ):
+        roundtrip = self._get_roundtrip(receiver_address)
+
         def retry():
-            timeout_generator = timeout_exponential_backoff(
+            timeout_generator = timeout_adaptive_backoff(
                 self._raiden_service.config['protocol']['retries_before_backoff'],
-                self._raiden_service.config['protocol']['retry_interval'],
-                self._raiden_service.config['protocol']['retry_interval'] * 10
+                roundtrip,
             )
+            sent_at = time.monotonic()
+            transmissions = 0
+
             while async_result.value is None:
-                self._send_immediate(receiver_address, data)
-                gevent.sleep(next(timeout_generator))
+                self._send_message(receiver_address, data)
+                transmissions += 1
+
+                timeout = next(timeout_generator)
+                if not async_result.wait(timeout) and async_result.value is None:
+                    roundtrip.expired(timeout)
+
+            # Only the Delivered of a message sent once is a sample, the
+            # results are set to False when the transport is stopped
+            if async_result.value is True and transmissions == 1:
+                roundtrip.update(time.monotonic() - sent_at)
 
         self.greenlets.append(gevent.spawn(retry))
 
-    def _send_immediate(self, receiver_address, data):
+    def _get_roundtrip(self, receiver_address: typing.Address) -> RoundTripTimeEstimator:
+        roundtrip = self._address_to_roundtrip.get(receiver_address)
+
+        if roundtrip is None:
+            protocol_config = self._raiden_service.config['protocol']
+            roundtrip = RoundTripTimeEstimator(
+                protocol_config['retry_interval'],
+                protocol_config.get('retry_timeout_min', DEFAULT_PROTOCOL_RETRY_TIMEOUT_MIN),
+                protocol_config['retry_interval'] * 10,
+            )
+            self._address_to_roundtrip[receiver_address] = roundtrip
+
+        return roundtrip
+
+    def _send_message(self, receiver_address, data):
+        """ Send `data` at the end of the current iteration of the event loop,
+        together with the other messages for `receiver_address`, or right
+        away if bundling is disabled.
+
+        A bundle is an event with a message per line, which the nodes that
+        predate the bundles can't decode.
+        """
+        protocol_config = self._raiden_service.config['protocol']
+        if not protocol_config.get('bundle_messages', DEFAULT_PROTOCOL_BUNDLE_MESSAGES):
+            self._send_bodies(receiver_address, [data])
+            return
+
+        outgoing = self._address_to_outgoing.get(receiver_address)
+
+        if outgoing is None:
+            outgoing = self._address_to_outgoing[receiver_address] = list()
+            flush = gevent.spawn(self._flush_outgoing, receiver_address)
+            self._address_to_outgoing_flush[receiver_address] = flush
+            # the flush is waited on until it finishes, and forgotten after
+            self.greenlets.append(flush)
+            flush.link(self.greenlets.remove)
+
+        outgoing.append(data)
+
+    def _flush_outgoing(self, receiver_address):
+        del self._address_to_outgoing_flush[receiver_address]
+        messages_data = self._address_to_outgoing.pop(receiver_address)
+
+        bodies = list()
+        for data in messages_data:
+            if bodies and len(bodies[-1]) + 1 + len(data) <= MATRIX_MAX_BODY_SIZE:
+                bodies[-1] = bodies[-1] + '\n' + data
+            else:
+                bodies.append(data)
+
+        self._send_bodies(receiver_address, bodies)
+
+    def _send_bodies(self, receiver_address, bodies):
         # FIXME: Send message to all matching rooms
         room = self._get_room_for_address(receiver_address)
-        log.debug('SEND: %r => %r', room, data)
-        room.send_text(data)
+        for body in bodies:
+            log.debug('SEND: %r => %r', room, body)
+            room.send_text(body)
 
     def _get_room_for_address(
         self,
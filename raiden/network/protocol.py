@@ -2,17 +2,17 @@
 import logging
 import random
 import socket
+import time
 from binascii import hexlify
-from collections import namedtuple
-from itertools import repeat
+from collections import deque, namedtuple
 
 import cachetools
 import gevent
 from gevent.event import (
-    _AbstractLinkable,
     AsyncResult,
     Event,
 )
+from gevent.queue import Queue
 from gevent.server import DatagramServer
 from ethereum import slogging
 
@@ -21,11 +21,23 @@ from raiden.exceptions import (
     UnknownAddress,
     RaidenShuttingDown,
 )
-from raiden.constants import UDP_MAX_MESSAGE_SIZE
-from raiden.messages import decode, Delivered, Ping, Pong
-from raiden.settings import CACHE_TTL
+from raiden.network.scheduler import RetryScheduler
+from raiden.network.transport import RoundTripTimeEstimator
+from raiden.constants import DELIVERED_BATCH_MAX_IDENTIFIERS, UDP_MAX_MESSAGE_SIZE
+from raiden.encoding.messages import BUNDLE, bundles, unbundle
+from raiden.messages import decode, Delivered, DeliveredBatch, Ping, Pong
+from raiden.raiden_event_handler import on_raiden_event
+from raiden.settings import (
+    CACHE_TTL,
+    DEFAULT_PROTOCOL_BUNDLE_MESSAGES,
+    DEFAULT_PROTOCOL_DELIVERED_BATCH_TIMEOUT,
+    DEFAULT_PROTOCOL_SCHEDULER_TICK,
+    DEFAULT_PROTOCOL_SCHEDULER_WHEEL_SIZE,
+    DEFAULT_PROTOCOL_SCHEDULER_WORKERS,
+    DEFAULT_PROTOCOL_RETRY_TIMEOUT_MIN,
+    DEFAULT_PROTOCOL_WINDOW_SIZE,
+)
 from raiden.utils import isaddress, pex, typing
-from raiden.utils.notifying_queue import NotifyingQueue
 from raiden.udp_message_handler import on_udp_message
 from raiden.transfer import views
 from raiden.transfer.state_change import ReceiveDelivered
@@ -52,6 +64,11 @@ HealthEvents = namedtuple('HealthEvents', (
     'event_unhealthy',
 ))
 
+# Messages of the other queues are sent in order, these queues carry the
+# balance proofs of a channel and the partner rejects a balance proof received
+# before its predecessor
+UNORDERED_QUEUE_NAMES = (b'global', 'global')
+
 # GOALS:
 # - Each netting channel must have the messages processed in-order, the
 # protocol must detect unacknowledged messages and retry them.
@@ -63,36 +80,45 @@ HealthEvents = namedtuple('HealthEvents', (
 # handling messages.
 
 
-def event_first_of(*events):
-    """ Waits until one of `events` is set.
+def timeout_exponential_backoff(retries, timeout, maximum):
+    """ Timeouts generator with an exponential backoff strategy.
 
-    The event returned is /not/ cleared with any of the `events`, this value
-    must not be reused if the clearing behavior is used.
+    Timeouts start spaced by `timeout`, after `retries` exponentially increase
+    the retry delays until `maximum`, then maximum is returned indefinitely.
     """
-    first_finished = Event()
+    yield timeout
 
-    if not all(isinstance(e, _AbstractLinkable) for e in events):
-        raise ValueError('all events must be linkable')
+    tries = 1
+    while tries < retries:
+        tries += 1
+        yield timeout
 
-    for event in events:
-        event.rawlink(lambda _: first_finished.set())
+    while timeout < maximum:
+        timeout = min(timeout * 2, maximum)
+        yield timeout
 
-    return first_finished
+    while True:
+        yield maximum
 
 
-def timeout_exponential_backoff(retries, timeout, maximum):
-    """ Timeouts generator with an exponential backoff strategy.
+def timeout_adaptive_backoff(retries, roundtrip):
+    """ Timeouts generator with an exponential backoff strategy, starting
+    from the retransmission timeout of the peer.
 
-    Timeouts start spaced by `timeout`, after `retries` exponentially increase
-    the retry delays until `maximum`, then maximum is returned indefinitely.
+    The first `retries` timeouts follow the current timeout of the
+    `roundtrip` estimator, then the retry delays increase exponentially until
+    its maximum, which is returned indefinitely.
     """
+    timeout = roundtrip.timeout
     yield timeout
 
     tries = 1
     while tries < retries:
         tries += 1
+        timeout = roundtrip.timeout
         yield timeout
 
+    maximum = roundtrip.maximum_timeout
     while timeout < maximum:
         timeout = min(timeout * 2, maximum)
         yield timeout
@@ -113,361 +139,372 @@ def timeout_two_stage(retries, timeout1, timeout2):
         yield timeout2
 
 
-def retry(protocol, messagedata, message_id, recipient, event_stop, timeout_backoff):
-    """ Send messagedata until it's acknowledged.
-
-    Exit when:
-
-    - The message is delivered.
-    - Event_stop is set.
-    - The iterator timeout_backoff runs out.
+class InFlightMessage:
+    """ A message waiting for a Delivered. """
+    __slots__ = (
+        'messagedata',
+        'backoff',
+        'async_result',
+        'timer',
+        'paused',
+        'sent_at',
+        'transmissions',
+        'timeout',
+    )
 
-    Returns:
-        bool: True if the message was acknowledged, False otherwise.
-    """
+    def __init__(self, messagedata, backoff):
+        self.messagedata = messagedata
+        self.backoff = backoff
+        self.async_result = None
+        self.timer = None
+        self.paused = False
+        self.sent_at = None
+        self.transmissions = 0
+        self.timeout = None
 
-    async_result = protocol.maybe_sendraw_with_result(
-        recipient,
-        messagedata,
-        message_id,
-    )
 
-    event_quit = event_first_of(
-        async_result,
-        event_stop,
-    )
+class QueueSender:
+    """ Sends the messages of the queue `(recipient, queue_name)` until they
+    are acknowledged, with up to `window_size` messages waiting for a
+    Delivered at the same time.
 
-    for timeout in timeout_backoff:
+    The sender has no greenlet, the transmissions and retransmissions are
+    callbacks of the protocol's scheduler. Ordered queues must use a window
+    of 1, the next message is only sent once the previous one is
+    acknowledged.
 
-        if event_quit.wait(timeout=timeout) is True:
-            break
+    Notes:
+    - Messages are not sent while the recipient is unhealthy, the
+      retransmissions are resumed by the recipient's `HealthCheck`.
+    - The retransmission timeouts start from the timeout of the recipient's
+      `roundtrip` estimator, which is fed by the acknowledgements.
+    - This assumes the endpoint is never cleared after it's first known.
+    """
 
-        protocol.maybe_sendraw_with_result(
+    def __init__(
+            self,
+            protocol,
             recipient,
-            messagedata,
-            message_id,
-        )
-
-    return async_result.ready()
+            health_check,
+            roundtrip,
+            window_size,
+            message_retries,
+            items=()):
 
+        self.protocol = protocol
+        self.recipient = recipient
+        self.health_check = health_check
+        self.roundtrip = roundtrip
+        self.window_size = window_size
+        self.message_retries = message_retries
 
-def wait_recovery(event_stop, event_healthy):
-    event_first_of(
-        event_stop,
-        event_healthy,
-    ).wait()
+        self.queue = deque(items)
+        self.messageids_to_inflight = dict()
 
-    if event_stop.is_set():
-        return
+    def __len__(self):
+        return len(self.queue) + len(self.messageids_to_inflight)
 
-    # There may be multiple threads waiting, do not restart them all at
-    # once to avoid message flood.
-    gevent.sleep(random.random())
+    def put(self, messagedata, message_id):
+        self.queue.append((messagedata, message_id))
+        self.fill_window()
 
+    def fill_window(self):
+        """ Move messages from the queue to the window while there are free
+        slots and the recipient is healthy.
+        """
+        while (
+                self.queue and
+                len(self.messageids_to_inflight) < self.window_size and
+                self.health_check.is_healthy()
+        ):
+            messagedata, message_id = self.queue.popleft()
+
+            backoff = timeout_adaptive_backoff(self.message_retries, self.roundtrip)
+            self.messageids_to_inflight[message_id] = InFlightMessage(messagedata, backoff)
+            self.protocol.scheduler.call_soon(self.transmit, message_id)
+
+    def transmit(self, message_id):
+        """ Send the message and schedule its retransmission. """
+        in_flight = self.messageids_to_inflight.get(message_id)
+
+        if in_flight is None:
+            return
 
-def retry_with_recovery(
-        protocol,
-        messagedata,
-        message_id,
-        recipient,
-        event_stop,
-        event_healthy,
-        event_unhealthy,
-        backoff,
-):
-    """ Send messagedata while the node is healthy until it's acknowledged.
+        # Packets must not be sent to an unhealthy node, the message waits
+        # for the recovery
+        if not self.health_check.is_healthy():
+            in_flight.paused = True
+            return
 
-    Note:
-        backoff must be an infinite iterator, otherwise this task will
-        become a hot loop.
-    """
+        if in_flight.transmissions == 0:
+            in_flight.sent_at = time.monotonic()
+        elif in_flight.timeout is not None:
+            self.roundtrip.expired(in_flight.timeout)
+        in_flight.transmissions += 1
 
-    # The underlying unhealthy will be cleared, care must be taken to properly
-    # clear stop_or_unhealthy too.
-    stop_or_unhealthy = event_first_of(
-        event_stop,
-        event_unhealthy,
-    )
+        async_result = self.protocol.maybe_sendraw_with_result(
+            self.recipient,
+            in_flight.messagedata,
+            message_id,
+        )
 
-    acknowledged = False
-    while not event_stop.is_set() and not acknowledged:
+        if in_flight.async_result is None:
+            in_flight.async_result = async_result
+            async_result.rawlink(lambda _: self.acknowledged(message_id))
 
-        # Packets must not be sent to an unhealthy node, nor should the task
-        # wait for it to become available if the message has been acknowledged.
-        if event_unhealthy.is_set():
-            wait_recovery(
-                event_stop,
-                event_healthy,
+        if message_id in self.messageids_to_inflight:
+            in_flight.timeout = next(in_flight.backoff)
+            in_flight.timer = self.protocol.scheduler.call_later(
+                in_flight.timeout,
+                self.transmit,
+                message_id,
             )
 
-            # Assume wait_recovery returned because unhealthy was cleared and
-            # continue execution, this is safe to do because event_stop is
-            # checked below.
-            stop_or_unhealthy.clear()
+    def acknowledged(self, message_id):
+        in_flight = self.messageids_to_inflight.pop(message_id, None)
 
-            if event_stop.is_set():
-                return acknowledged
+        if in_flight is not None:
+            if in_flight.timer is not None:
+                in_flight.timer.cancel()
 
-        acknowledged = retry(
-            protocol,
-            messagedata,
-            message_id,
-            recipient,
+            # the results are set to False when the transport is stopped
+            delivered = in_flight.async_result.value is not False
+            if delivered and in_flight.transmissions == 1:
+                self.roundtrip.update(time.monotonic() - in_flight.sent_at)
 
-            # retry will stop when this event is set, allowing this task to
-            # wait for recovery when the node becomes unhealthy or to quit if
-            # the stop event is set.
-            stop_or_unhealthy,
+            self.fill_window()
 
-            # Intentionally reusing backoff to restart from the last
-            # timeout/number of iterations.
-            backoff,
-        )
+    def recovered(self):
+        """ Resume the messages paused while the recipient was unhealthy. """
+        for message_id, in_flight in self.messageids_to_inflight.items():
+            if in_flight.paused:
+                in_flight.paused = False
 
-    return acknowledged
+                # There may be many messages waiting, do not restart them all
+                # at once to avoid message flood. The backoff restarts from
+                # the last timeout/number of iterations.
+                self.protocol.scheduler.call_later(
+                    random.random(),
+                    self.transmit,
+                    message_id,
+                )
+                # the message didn't expire, it waited for the recovery
+                in_flight.timeout = None
 
+        self.fill_window()
 
-def single_queue_send(
-        protocol,
-        recipient,
-        queue,
-        event_stop,
-        event_healthy,
-        event_unhealthy,
-        message_retries,
-        message_retry_timeout,
-        message_retry_max_timeout):
 
-    """ Handles a single message queue for `recipient`.
+class HealthCheck:
+    """ Sends a periodical Ping to `recipient` to check its health.
 
-    Notes:
-    - This task must be the only consumer of queue.
-    - This task can be killed at any time, but the intended usage is to stop it
-      with the event_stop.
-    - If there are many queues for the same recipient, it is the
-      caller's responsibility to not start them together to avoid congestion.
-    - This task assumes the endpoint is never cleared after it's first known.
-      If this assumption changes the code must be updated to handle unknown
-      addresses.
+    Like the `QueueSender` this is driven by the protocol's scheduler, the
+    Pongs are also samples for the `roundtrip` estimator of `recipient`.
     """
 
-    # A NotifyingQueue is required to implement cancelability, otherwise the
-    # task cannot be stopped while the greenlet waits for an element to be
-    # inserted in the queue.
-    if not isinstance(queue, NotifyingQueue):
-        raise ValueError('queue must be a NotifyingQueue.')
-
-    # Reusing the event, clear must be carefully done
-    data_or_stop = event_first_of(
-        queue,
-        event_stop,
-    )
-
-    # Wait for the endpoint registration or to quit
-    event_first_of(
-        event_healthy,
-        event_stop,
-    ).wait()
+    def __init__(
+            self,
+            protocol,
+            recipient,
+            roundtrip,
+            nat_keepalive_retries,
+            nat_keepalive_timeout,
+            nat_invitation_timeout,
+            ping_nonce):
+
+        self.protocol = protocol
+        self.recipient = recipient
+        self.roundtrip = roundtrip
+        self.nat_keepalive_retries = nat_keepalive_retries
+        self.nat_keepalive_timeout = nat_keepalive_timeout
+        self.nat_invitation_timeout = nat_invitation_timeout
+        self.ping_nonce = ping_nonce
+
+        self.events = HealthEvents(
+            event_healthy=Event(),
+            event_unhealthy=Event(),
+        )
+        self.queue_senders = list()
 
-    while True:
-        data_or_stop.wait()
+        self.last_state = NODE_NETWORK_UNKNOWN
+        self.registration_backoff = None
+        self.unanswered = 0
+        self.ping_sent_at = None
+        self.ping_transmissions = 0
+        self.timer = None
 
-        if event_stop.is_set():
-            return
+    def is_healthy(self):
+        return self.events.event_healthy.is_set()
 
-        # The queue is not empty at this point, so this won't raise Empty.
-        # This task being the only consumer is a requirement.
-        (messagedata, message_id) = queue.peek(block=False)
+    def start(self):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                'starting healthcheck for',
+                node=pex(self.protocol.raiden.address),
+                to=pex(self.recipient),
+            )
 
-        backoff = timeout_exponential_backoff(
-            message_retries,
-            message_retry_timeout,
-            message_retry_max_timeout,
+        # The state of the node is unknown, the events are set to allow the
+        # queues to do work once the endpoint is known.
+        self.protocol.set_node_network_state(
+            self.recipient,
+            self.last_state,
         )
+        self.check_endpoint()
 
+    def check_endpoint(self):
+        """ Wait for the endpoint registration, the first Ping is sent once
+        the endpoint is known.
+        """
         try:
-            acknowledged = retry_with_recovery(
-                protocol,
-                messagedata,
-                message_id,
-                recipient,
-                event_stop,
-                event_healthy,
-                event_unhealthy,
-                backoff,
+            self.protocol.get_host_port(self.recipient)
+        except UnknownAddress:
+            if self.registration_backoff is None:
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(
+                        'waiting for endpoint registration',
+                        node=pex(self.protocol.raiden.address),
+                        to=pex(self.recipient),
+                    )
+
+                self.set_unhealthy()
+                self.registration_backoff = timeout_exponential_backoff(
+                    self.nat_keepalive_retries,
+                    self.nat_keepalive_timeout,
+                    self.nat_invitation_timeout,
+                )
+
+            self.timer = self.protocol.scheduler.call_later(
+                next(self.registration_backoff),
+                self.check_endpoint,
             )
-        except RaidenShuttingDown:  # For a clean shutdown process
             return
 
-        if acknowledged:
-            queue.get()
-
-            # Checking the length of the queue does not trigger a
-            # context-switch, so it's safe to assume the length of the queue
-            # won't change under our feet and when a new item will be added the
-            # event will be set again.
-            if not queue:
-                data_or_stop.clear()
-
-                if event_stop.is_set():
-                    return
-
-
-def healthcheck(
-        protocol,
-        recipient,
-        event_stop,
-        event_healthy,
-        event_unhealthy,
-        nat_keepalive_retries,
-        nat_keepalive_timeout,
-        nat_invitation_timeout,
-        ping_nonce):
-
-    """ Sends a periodical Ping to `recipient` to check its health. """
-    # pylint: disable=too-many-branches
-
-    if log.isEnabledFor(logging.DEBUG):
-        log.debug(
-            'starting healthcheck for',
-            node=pex(protocol.raiden.address),
-            to=pex(recipient),
-        )
+        self.registration_backoff = None
 
-    # The state of the node is unknown, the events are set to allow the tasks
-    # to do work.
-    last_state = NODE_NETWORK_UNKNOWN
-    protocol.set_node_network_state(
-        recipient,
-        last_state,
-    )
+        # Don't wait to send the first Ping and to start sending messages if
+        # the endpoint is known
+        self.set_healthy()
+        self.protocol.scheduler.call_soon(self.send_ping)
 
-    # Always call `clear` before `set`, since only `set` does context-switches
-    # it's easier to reason about tasks that are waiting on both events.
+    def send_ping(self):
+        self.ping_nonce['nonce'] += 1
+        self.unanswered = 0
+        self.ping_transmissions = 0
+        self.transmit_ping(self.ping_nonce['nonce'])
 
-    # Wait for the end-point registration or for the node to quit
-    try:
-        protocol.get_host_port(recipient)
-    except UnknownAddress:
-        if log.isEnabledFor(logging.DEBUG):
-            log.debug(
-                'waiting for endpoint registration',
-                node=pex(protocol.raiden.address),
-                to=pex(recipient),
-            )
+    def transmit_ping(self, nonce):
+        """ Send the Ping a few times before setting the node as unreachable,
+        then keep sending it until the node answers, this is used for
+        checking the node status and for NAT punching.
+        """
+        if nonce != self.ping_nonce['nonce']:
+            return
 
-        event_healthy.clear()
-        event_unhealthy.set()
+        if self.ping_transmissions == 0:
+            self.ping_sent_at = time.monotonic()
+        self.ping_transmissions += 1
 
-        backoff = timeout_exponential_backoff(
-            nat_keepalive_retries,
-            nat_keepalive_timeout,
-            nat_invitation_timeout,
+        message_id = ('ping', nonce, self.recipient)
+        async_result = self.protocol.maybe_sendraw_with_result(
+            self.recipient,
+            self.protocol.get_ping(nonce),
+            message_id,
         )
-        sleep = next(backoff)
 
-        while not event_stop.wait(sleep):
-            try:
-                protocol.get_host_port(recipient)
-            except UnknownAddress:
-                sleep = next(backoff)
-            else:
-                break
+        if self.ping_transmissions == 1:
+            async_result.rawlink(lambda _: self.ping_acknowledged(nonce))
 
-    # Don't wait to send the first Ping and to start sending messages if the
-    # endpoint is known
-    sleep = 0
-    event_unhealthy.clear()
-    event_healthy.set()
+        if async_result.ready():
+            return
 
-    while not event_stop.wait(sleep):
-        sleep = nat_keepalive_timeout
+        if self.unanswered < self.nat_keepalive_retries:
+            self.unanswered += 1
+            timeout = self.nat_keepalive_timeout
+        else:
+            if self.last_state != NODE_NETWORK_UNREACHABLE:
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug(
+                        'node is unresponsive',
+                        node=pex(self.protocol.raiden.address),
+                        to=pex(self.recipient),
+                        current_state=self.last_state,
+                        new_state=NODE_NETWORK_UNREACHABLE,
+                        retries=self.nat_keepalive_retries,
+                        timeout=self.nat_keepalive_timeout,
+                    )
+
+                # The node is not healthy, the queues stop sending
+                self.last_state = NODE_NETWORK_UNREACHABLE
+                self.protocol.set_node_network_state(
+                    self.recipient,
+                    self.last_state,
+                )
+                self.set_unhealthy()
 
-        ping_nonce['nonce'] += 1
-        messagedata = protocol.get_ping(ping_nonce['nonce'])
-        message_id = ('ping', ping_nonce['nonce'], recipient)
+            timeout = self.nat_invitation_timeout
 
-        # Send Ping a few times before setting the node as unreachable
-        try:
-            acknowledged = retry(
-                protocol,
-                messagedata,
-                message_id,
-                recipient,
-                event_stop,
-                [nat_keepalive_timeout] * nat_keepalive_retries,
-            )
-        except RaidenShuttingDown:  # For a clean shutdown process
-            return
+        self.timer = self.protocol.scheduler.call_later(timeout, self.transmit_ping, nonce)
 
-        if event_stop.is_set():
+    def ping_acknowledged(self, nonce):
+        if nonce != self.ping_nonce['nonce']:
             return
 
-        if not acknowledged:
-            if log.isEnabledFor(logging.DEBUG):
-                log.debug(
-                    'node is unresponsive',
-                    node=pex(protocol.raiden.address),
-                    to=pex(recipient),
-                    current_state=last_state,
-                    new_state=NODE_NETWORK_UNREACHABLE,
-                    retries=nat_keepalive_retries,
-                    timeout=nat_keepalive_timeout,
-                )
+        if self.timer is not None:
+            self.timer.cancel()
 
-            # The node is not healthy, clear the event to stop all queue
-            # tasks
-            last_state = NODE_NETWORK_UNREACHABLE
-            protocol.set_node_network_state(
-                recipient,
-                last_state,
+        # the Pong of a Ping sent once
+        if self.ping_transmissions == 1:
+            self.roundtrip.update(time.monotonic() - self.ping_sent_at)
+
+        self.timer = self.protocol.scheduler.call_later(
+            self.nat_keepalive_timeout,
+            self.send_ping,
+        )
+        self.protocol.scheduler.call_soon(self.node_answered)
+
+    def node_answered(self):
+        if log.isEnabledFor(logging.DEBUG):
+            current_state = views.get_node_network_status(
+                views.state_from_raiden(self.protocol.raiden),
+                self.recipient,
+            )
+            log.debug(
+                'node answered',
+                node=pex(self.protocol.raiden.address),
+                to=pex(self.recipient),
+                current_state=current_state,
+                new_state=NODE_NETWORK_REACHABLE,
             )
-            event_healthy.clear()
-            event_unhealthy.set()
 
-            # Retry until recovery, used for:
-            # - Checking node status.
-            # - Nat punching.
-            try:
-                acknowledged = retry(
-                    protocol,
-                    messagedata,
-                    message_id,
-                    recipient,
-                    event_stop,
-                    repeat(nat_invitation_timeout),
-                )
-            except RaidenShuttingDown:  # For a clean shutdown process
-                return
+        if self.last_state != NODE_NETWORK_REACHABLE:
+            self.last_state = NODE_NETWORK_REACHABLE
+            self.protocol.set_node_network_state(
+                self.recipient,
+                self.last_state,
+            )
+            self.set_healthy()
 
-        if acknowledged:
-            if log.isEnabledFor(logging.DEBUG):
-                current_state = views.get_node_network_status(
-                    views.state_from_raiden(protocol.raiden),
-                    recipient,
-                )
-                log.debug(
-                    'node answered',
-                    node=pex(protocol.raiden.address),
-                    to=pex(recipient),
-                    current_state=current_state,
-                    new_state=NODE_NETWORK_REACHABLE,
-                )
+    # Always call `clear` before `set`, since only `set` does context-switches
+    # it's easier to reason about tasks that are waiting on both events.
+    def set_healthy(self):
+        was_healthy = self.is_healthy()
 
-            if last_state != NODE_NETWORK_REACHABLE:
-                last_state = NODE_NETWORK_REACHABLE
-                protocol.set_node_network_state(
-                    recipient,
-                    last_state,
-                )
-                event_unhealthy.clear()
-                event_healthy.set()
+        self.events.event_unhealthy.clear()
+        self.events.event_healthy.set()
+
+        if not was_healthy:
+            for queue_sender in self.queue_senders:
+                queue_sender.recovered()
+
+    def set_unhealthy(self):
+        self.events.event_healthy.clear()
+        self.events.event_unhealthy.set()
 
 
 class UDPTransport:
     def __init__(self, discovery, udpsocket, throttle_policy, config):
         # these values are initialized by the start method
-        self.queueids_to_queues: typing.Dict
+        self.queueids_to_senders: typing.Dict
         self.raiden: 'RaidenService'
 
         self.discovery = discovery
@@ -478,15 +515,51 @@ class UDPTransport:
         self.nat_keepalive_retries = config['nat_keepalive_retries']
         self.nat_keepalive_timeout = config['nat_keepalive_timeout']
         self.nat_invitation_timeout = config['nat_invitation_timeout']
-
-        self.event_stop = Event()
-
-        self.greenlets = list()
-        self.addresses_events = dict()
+        self.window_size = config.get('window_size', DEFAULT_PROTOCOL_WINDOW_SIZE)
+        self.retry_timeout_min = config.get(
+            'retry_timeout_min',
+            DEFAULT_PROTOCOL_RETRY_TIMEOUT_MIN,
+        )
+        self.delivered_batch_timeout = config.get(
+            'delivered_batch_timeout',
+            DEFAULT_PROTOCOL_DELIVERED_BATCH_TIMEOUT,
+        )
+        self.bundle_messages = config.get('bundle_messages', DEFAULT_PROTOCOL_BUNDLE_MESSAGES)
+
+        # The retransmissions of all the queues and the pings of all the
+        # health checks are timers of this scheduler
+        self.scheduler = RetryScheduler(
+            config.get('scheduler_tick', DEFAULT_PROTOCOL_SCHEDULER_TICK),
+            DEFAULT_PROTOCOL_SCHEDULER_WHEEL_SIZE,
+            config.get('scheduler_workers', DEFAULT_PROTOCOL_SCHEDULER_WORKERS),
+        )
+        self.addresses_healthchecks = dict()
 
         # Maps the message_id to a SentMessageState
         self.messageids_to_asyncresults = dict()
 
+        # Maps the addresses to their RoundTripTimeEstimator
+        self.addresses_to_roundtrip = dict()
+
+        # Maps the addresses to the identifiers of the received messages that
+        # were not acknowledged yet, and to the greenlet that will send the
+        # acknowledgement. The timer wheel of the scheduler is too coarse for
+        # this window.
+        self.addresses_to_delivered = dict()
+        self.addresses_to_delivered_flush = dict()
+
+        # Maps the addresses to the encoded messages waiting to be sent, and
+        # to the greenlet that will send them. The messages sent to a node in
+        # the same iteration of the event loop share the datagrams.
+        self.addresses_to_outgoing = dict()
+        self.addresses_to_outgoing_flush = dict()
+
+        # The network state changes of the health checks, handled in order by
+        # a dedicated greenlet so that the scheduler workers don't wait for
+        # the commit of the state change
+        self.network_state_changes = Queue()
+        self.network_state_greenlet = None
+
         # Maps the addresses to a dict with the latest nonce (using a dict
         # because python integers are immutable)
         self.nodeaddresses_to_nonces = dict()
@@ -503,15 +576,19 @@ class UDPTransport:
 
     def start(self, raiden, queueids_to_queues):
         self.raiden = raiden
-        self.queueids_to_queues = dict()
+        self.queueids_to_senders = dict()
+        self.scheduler.start()
+        self.network_state_greenlet = gevent.spawn(self.handle_network_state_changes)
 
         # server.stop() clears the handle. Since this may be a restart the
         # handle must always be set
         self.server.set_handle(self._receive)
 
-        for (recipient, queue_name), queue in queueids_to_queues.items():
-            queue_copy = list(queue)
-            self.init_queue_for(recipient, queue_name, queue_copy)
+        # The queues of the node state hold the send events of the messages
+        # that were not acknowledged, these are sent again
+        for queue in queueids_to_queues.values():
+            for event in queue:
+                on_raiden_event(raiden, event)
 
         self.server.start()
 
@@ -520,9 +597,29 @@ class UDPTransport:
         # socket can only be safely closed after all outgoing tasks are stopped
         self.server.stop_accepting()
 
-        # Stop processing the outgoing queues
-        self.event_stop.set()
-        gevent.wait(self.greenlets)
+        # Stop processing the outgoing queues and the health checks
+        self.scheduler.stop()
+        if self.network_state_greenlet is not None:
+            self.network_state_greenlet.kill()
+            self.network_state_greenlet = None
+        self.network_state_changes = Queue()
+
+        # Send the pending acknowledgements and the messages waiting for the
+        # end of the event loop iteration once, anything else is retried by
+        # the partners and, after a restart, from the node's queues
+        for recipient in list(self.addresses_to_delivered):
+            self.send_delivered(recipient)
+
+        for recipient, flush in list(self.addresses_to_outgoing_flush.items()):
+            flush.kill()
+            self.flush_outgoing(recipient)
+
+        gevent.killall(list(self.addresses_to_delivered_flush.values()))
+        gevent.killall(list(self.addresses_to_outgoing_flush.values()))
+        self.addresses_to_delivered_flush = dict()
+        self.addresses_to_delivered = dict()
+        self.addresses_to_outgoing_flush = dict()
+        self.addresses_to_outgoing = dict()
 
         # All outgoing tasks are stopped. Now it's safe to close the socket. At
         # this point there might be some incoming message being processed,
@@ -543,69 +640,84 @@ class UDPTransport:
             async_result.set(False)
 
     def get_health_events(self, recipient):
-        """ Starts a healthcheck task for `recipient` and returns a
-        HealthEvents with locks to react on its current state.
+        """ Starts a healthcheck for `recipient` and returns a HealthEvents
+        with locks to react on its current state.
         """
-        if recipient not in self.addresses_events:
+        return self.get_health_check(recipient).events
+
+    def get_health_check(self, recipient):
+        if recipient not in self.addresses_healthchecks:
             self.start_health_check(recipient)
 
-        return self.addresses_events[recipient]
+        return self.addresses_healthchecks[recipient]
+
+    def get_roundtrip(self, recipient):
+        """ Return the round trip time estimator of `recipient`. """
+        roundtrip = self.addresses_to_roundtrip.get(recipient)
+
+        if roundtrip is None:
+            # until there is a sample the configured retry interval is used
+            roundtrip = RoundTripTimeEstimator(
+                self.retry_interval,
+                self.retry_timeout_min,
+                self.retry_interval * 10,
+            )
+            self.addresses_to_roundtrip[recipient] = roundtrip
+
+        return roundtrip
+
+    def get_round_trip_times(self):
+        """ Return the round trip time metrics of the peers. """
+        return {
+            address: roundtrip.to_dict()
+            for address, roundtrip in self.addresses_to_roundtrip.items()
+        }
 
     def start_health_check(self, recipient):
-        """ Starts a task for healthchecking `recipient` if there is not
-        one yet.
-        """
-        if recipient not in self.addresses_events:
+        """ Starts healthchecking `recipient` if it is not done yet. """
+        if recipient not in self.addresses_healthchecks:
             ping_nonce = self.nodeaddresses_to_nonces.setdefault(
                 recipient,
                 {'nonce': 0},  # HACK: Allows the task to mutate the object
             )
 
-            events = HealthEvents(
-                event_healthy=Event(),
-                event_unhealthy=Event(),
-            )
-
-            self.addresses_events[recipient] = events
-
-            self.greenlets.append(gevent.spawn(
-                healthcheck,
+            health_check = HealthCheck(
                 self,
                 recipient,
-                self.event_stop,
-                events.event_healthy,
-                events.event_unhealthy,
+                self.get_roundtrip(recipient),
                 self.nat_keepalive_retries,
                 self.nat_keepalive_timeout,
                 self.nat_invitation_timeout,
                 ping_nonce,
-            ))
+            )
+            self.addresses_healthchecks[recipient] = health_check
+            self.scheduler.call_soon(health_check.start)
 
     def init_queue_for(self, recipient, queue_name, items):
         """ Create the queue identified by the pair `(recipient, queue_name)`
         and initialize it with `items`.
         """
         queueid = (recipient, queue_name)
-        queue = self.queueids_to_queues.get(queueid)
-        assert queue is None
-
-        queue = NotifyingQueue(items=items)
-        self.queueids_to_queues[queueid] = queue
+        queue_sender = self.queueids_to_senders.get(queueid)
+        assert queue_sender is None
 
-        events = self.get_health_events(recipient)
+        if queue_name in UNORDERED_QUEUE_NAMES:
+            window_size = self.window_size
+        else:
+            window_size = 1
 
-        self.greenlets.append(gevent.spawn(
-            single_queue_send,
+        health_check = self.get_health_check(recipient)
+        queue_sender = QueueSender(
             self,
             recipient,
-            queue,
-            self.event_stop,
-            events.event_healthy,
-            events.event_unhealthy,
+            health_check,
+            self.get_roundtrip(recipient),
+            window_size,
             self.retries_before_backoff,
-            self.retry_interval,
-            self.retry_interval * 10,
-        ))
+            items,
+        )
+        health_check.queue_senders.append(queue_sender)
+        self.queueids_to_senders[queueid] = queue_sender
 
         if log.isEnabledFor(logging.DEBUG):
             log.debug(
@@ -615,21 +727,24 @@ class UDPTransport:
                 to=pex(recipient),
             )
 
-        return queue
+        queue_sender.fill_window()
+
+        return queue_sender
 
     def get_queue_for(self, recipient, queue_name):
-        """ Return the queue identified by the pair `(recipient, queue_name)`.
+        """ Return the QueueSender of the queue identified by the pair
+        `(recipient, queue_name)`.
 
         If the queue doesn't exist it will be instantiated.
         """
         queueid = (recipient, queue_name)
-        queue = self.queueids_to_queues.get(queueid)
+        queue_sender = self.queueids_to_senders.get(queueid)
 
-        if queue is None:
+        if queue_sender is None:
             items = ()
-            queue = self.init_queue_for(recipient, queue_name, items)
+            queue_sender = self.init_queue_for(recipient, queue_name, items)
 
-        return queue
+        return queue_sender
 
     def send_async(self, queue_name, recipient, message):
         """ Send a new ordered message to recipient.
@@ -641,7 +756,7 @@ class UDPTransport:
             raise ValueError('Invalid address {}'.format(pex(recipient)))
 
         # These are not protocol messages, but transport specific messages
-        if isinstance(message, (Delivered, Ping, Pong)):
+        if isinstance(message, (Delivered, DeliveredBatch, Ping, Pong)):
             raise ValueError('Do not use send for {} messages'.format(message.__class__.__name__))
 
         messagedata = message.encode()
@@ -657,8 +772,8 @@ class UDPTransport:
         if message_id not in self.messageids_to_asyncresults:
             self.messageids_to_asyncresults[message_id] = AsyncResult()
 
-            queue = self.get_queue_for(recipient, queue_name)
-            queue.put((messagedata, message_id))
+            queue_sender = self.get_queue_for(recipient, queue_name)
+            queue_sender.put(messagedata, message_id)
 
             if log.isEnabledFor(logging.DEBUG):
                 log.debug(
@@ -676,9 +791,7 @@ class UDPTransport:
             raise InvalidAddress('Invalid address {}'.format(pex(recipient)))
 
         messagedata = message.encode()
-        host_port = self.get_host_port(recipient)
-
-        self.maybe_sendraw(host_port, messagedata)
+        self.enqueue(recipient, messagedata)
 
     def maybe_sendraw_with_result(self, recipient, messagedata, message_id):
         """ Send message to recipient if the transport is running.
@@ -693,13 +806,48 @@ class UDPTransport:
             async_result = AsyncResult()
             self.messageids_to_asyncresults[message_id] = async_result
 
-        host_port = self.get_host_port(recipient)
-        self.maybe_sendraw(host_port, messagedata)
+        self.enqueue(recipient, messagedata)
 
         return async_result
 
+    def enqueue(self, recipient, messagedata):
+        """ Queue the encoded message to be sent to `recipient` at the end of
+        the current iteration of the event loop, or send it right away if
+        bundling is disabled.
+        """
+        # fail early for unknown addresses
+        host_port = self.get_host_port(recipient)
+
+        if not self.bundle_messages:
+            self.maybe_sendraw(host_port, messagedata)
+            return
+
+        outgoing = self.addresses_to_outgoing.setdefault(recipient, list())
+        outgoing.append(messagedata)
+
+        if recipient not in self.addresses_to_outgoing_flush:
+            self.addresses_to_outgoing_flush[recipient] = gevent.spawn(
+                self.flush_outgoing,
+                recipient,
+            )
+
+    def flush_outgoing(self, recipient):
+        """ Send the queued messages to `recipient`, bundling them in as few
+        datagrams as possible.
+        """
+        # The pending acknowledgements are piggybacked on the messages, this
+        # is done before removing the flush so that they join this batch
+        self.send_delivered(recipient)
+
+        del self.addresses_to_outgoing_flush[recipient]
+        messages_data = self.addresses_to_outgoing.pop(recipient)
+        host_port = self.get_host_port(recipient)
+
+        for datagram in bundles(messages_data, UDP_MAX_MESSAGE_SIZE):
+            self.maybe_sendraw(host_port, datagram)
+
     def maybe_sendraw(self, host_port, messagedata):
-        """ Send message to recipient if the transport is running. """
+        """ Send the datagram to `host_port` if the transport is running. """
 
         # Don't sleep if timeout is zero, otherwise a context-switch is done
         # and the message is delayed, increasing it's latency
@@ -721,8 +869,13 @@ class UDPTransport:
         except RaidenShuttingDown:  # For a clean shutdown
             return
 
-    def receive(self, messagedata):
-        """ Handle an UDP packet. """
+    def receive(self, messagedata, acknowledgements=None):
+        """ Handle an UDP packet.
+
+        If `acknowledgements` is given the acknowledgements of the protocol
+        messages are appended to it instead of being sent, see
+        `receive_bundle`.
+        """
         # pylint: disable=unidiomatic-typecheck
 
         if len(messagedata) > UDP_MAX_MESSAGE_SIZE:
@@ -734,16 +887,20 @@ class UDPTransport:
             )
             return
 
+        if messagedata and messagedata[0] == BUNDLE:
+            self.receive_bundle(messagedata)
+            return
+
         message = decode(messagedata)
 
         if type(message) == Pong:
             self.receive_pong(message)
         elif type(message) == Ping:
             self.receive_ping(message)
-        elif type(message) == Delivered:
+        elif type(message) in (Delivered, DeliveredBatch):
             self.receive_delivered(message)
         elif message is not None:
-            self.receive_message(message)
+            self.receive_message(message, acknowledgements)
         elif log.isEnabledFor(logging.ERROR):
             log.error(
                 'INVALID MESSAGE: Unknown cmdid',
@@ -751,7 +908,42 @@ class UDPTransport:
                 message=hexlify(messagedata),
             )
 
-    def receive_message(self, message):
+    def receive_bundle(self, messagedata):
+        """ Handle the messages of a bundle.
+
+        The state changes of the messages are logged in a single transaction,
+        the messages are acknowledged once it is committed. A message that
+        fails to be handled doesn't prevent the others from being handled.
+        """
+        try:
+            messages_data = unbundle(messagedata)
+        except ValueError as e:
+            log.error(
+                'INVALID MESSAGE: Malformed bundle',
+                node=pex(self.raiden.address),
+                message=hexlify(messagedata),
+                error=str(e),
+            )
+            return
+
+        acknowledgements = list()
+        with self.raiden.batch_state_changes():
+            for data in messages_data:
+                try:
+                    self.receive(data, acknowledgements)
+                except RaidenShuttingDown:
+                    raise
+                except Exception:  # pylint: disable=broad-except
+                    log.exception(
+                        'Error handling a message of a bundle',
+                        node=pex(self.raiden.address),
+                        message=hexlify(data),
+                    )
+
+        for recipient, message_id in acknowledgements:
+            self.acknowledge(recipient, message_id)
+
+    def receive_message(self, message, acknowledgements=None):
         """ Handle a Raiden protocol message.
 
         The protocol requires durability of the messages. The UDP transport
@@ -774,32 +966,90 @@ class UDPTransport:
             #   state change
             # - Decode it, save to the WAL, and process it (the current
             #   implementation)
-            delivered_message = Delivered(message.message_identifier)
-            self.raiden.sign(delivered_message)
+            #
+            # With the WAL's group commit the message handler returns only
+            # after the transaction with this message's state change is
+            # committed, so the Delivered is never sent for a message that
+            # could be lost.
+            if acknowledgements is None:
+                self.acknowledge(message.sender, message.message_identifier)
+            else:
+                acknowledgements.append((message.sender, message.message_identifier))
+
+    def acknowledge(self, recipient, message_id):
+        """ Acknowledge the message `message_id` received from `recipient`.
+
+        The acknowledgements of the messages received from the same node
+        within `delivered_batch_timeout` are sent in a single DeliveredBatch,
+        saving a signature and a datagram per message in a burst.
+        """
+        pending = self.addresses_to_delivered.setdefault(recipient, list())
+        pending.append(message_id)
 
-            self.maybe_send(
-                message.sender,
-                delivered_message,
+        if not self.delivered_batch_timeout or len(pending) >= DELIVERED_BATCH_MAX_IDENTIFIERS:
+            self.send_delivered(recipient)
+
+        elif recipient not in self.addresses_to_delivered_flush:
+            self.addresses_to_delivered_flush[recipient] = gevent.spawn_later(
+                self.delivered_batch_timeout,
+                self.flush_delivered,
+                recipient,
             )
 
-    def receive_delivered(self, delivered: Delivered):
-        """ Handle a Delivered message.
+    def flush_delivered(self, recipient):
+        # Once running the flush must not be killed by `acknowledge`, the
+        # identifiers would be lost
+        del self.addresses_to_delivered_flush[recipient]
+        self.send_delivered(recipient)
+
+    def send_delivered(self, recipient):
+        """ Send the pending acknowledgements for `recipient`. """
+        flush = self.addresses_to_delivered_flush.pop(recipient, None)
+        if flush is not None:
+            flush.kill(block=False)
+
+        message_ids = self.addresses_to_delivered.pop(recipient, None)
+
+        if not message_ids:
+            return
+
+        if len(message_ids) == 1:
+            delivered_message = Delivered(message_ids[0])
+        else:
+            delivered_message = DeliveredBatch(message_ids)
+        self.raiden.sign(delivered_message)
+
+        try:
+            self.maybe_send(recipient, delivered_message)
+        except (InvalidAddress, UnknownAddress) as e:
+            log.debug("Couldn't send the `Delivered` message", e=e)
+
+    def receive_delivered(self, delivered: typing.Union[Delivered, DeliveredBatch]):
+        """ Handle a Delivered or a DeliveredBatch message.
 
         The Delivered message is how the UDP transport guarantees persistence
         by the partner node. The message itself is not part of the raiden
         protocol, but it's required by this transport to provide the required
         properties.
         """
-        processed = ReceiveDelivered(delivered.delivered_message_identifier)
-        self.raiden.handle_state_change(processed)
+        # pylint: disable=unidiomatic-typecheck
+        if type(delivered) == Delivered:
+            message_ids = [delivered.delivered_message_identifier]
+        else:
+            message_ids = delivered.delivered_message_identifiers
 
-        message_id = delivered.delivered_message_identifier
-        async_result = self.raiden.protocol.messageids_to_asyncresults.get(message_id)
+        # the state changes of a batch are logged in a single transaction
+        self.raiden.handle_state_changes([
+            ReceiveDelivered(message_id)
+            for message_id in message_ids
+        ])
 
-        # clear the async result, otherwise we have a memory leak
-        if async_result is not None:
-            del self.messageids_to_asyncresults[message_id]
-            async_result.set()
+        for message_id in message_ids:
+            # clear the async result, otherwise we have a memory leak
+            async_result = self.messageids_to_asyncresults.pop(message_id, None)
+
+            if async_result is not None:
+                async_result.set()
 
     # Pings and Pongs are used to check the health status of another node. They
     # are /not/ part of the raiden protocol, only part of the UDP transport,
@@ -853,5 +1103,22 @@ class UDPTransport:
         return message_data
 
     def set_node_network_state(self, node_address, node_state):
+        """ Queue the change of the network state of `node_address`, see
+        `handle_network_state_changes`.
+        """
         state_change = ActionChangeNodeNetworkState(node_address, node_state)
-        self.raiden.handle_state_change(state_change)
+        self.network_state_changes.put(state_change)
+
+    def handle_network_state_changes(self):
+        """ Handle the network state changes queued by the health checks, in
+        order.
+        """
+        while True:
+            state_change = self.network_state_changes.get()
+
+            try:
+                self.raiden.handle_state_change(state_change)
+            except RaidenShuttingDown:
+                return
+            except:  # NOQA pylint: disable=bare-except
+                log.exception('unexpected exception on network state change')
@@ -369,46 +369,67 @@ class NettingChannel:
                 )
 
     def withdraw(self, unlock_proof):
+        self.withdraw_many([unlock_proof])
+
+    def withdraw_many(self, unlock_proofs):
+        """ Withdraw the locks of `unlock_proofs`.
+
+        The transactions are sent one after the other, with the nonces
+        assigned locally by the client, and then waited on together, so the
+        withdraws are mined in the same blocks instead of one per poll.
+
+        Raises:
+            TransactionThrew: If any of the withdraws failed, after all of
+                them were mined.
+        """
         if log.isEnabledFor(logging.INFO):
             log.info(
                 'withdraw called',
                 node=pex(self.node_address),
                 contract=pex(self.address),
+                locks=len(unlock_proofs),
             )
 
-        if isinstance(unlock_proof.lock_encoded, messages.Lock):
-            raise ValueError('unlock must be called with a lock encoded `.as_bytes`')
+        for unlock_proof in unlock_proofs:
+            if isinstance(unlock_proof.lock_encoded, messages.Lock):
+                raise ValueError('unlock must be called with a lock encoded `.as_bytes`')
+
+        transaction_hashes = [
+            estimate_and_transact(
+                self.proxy,
+                'withdraw',
+                unlock_proof.lock_encoded,
+                b''.join(unlock_proof.merkle_proof),
+                unlock_proof.secret,
+            )
+            for unlock_proof in unlock_proofs
+        ]
 
-        merkleproof_encoded = ''.join(unlock_proof.merkle_proof)
+        failed = None
+        for unlock_proof, transaction_hash in zip(unlock_proofs, transaction_hashes):
+            self.client.poll(unhexlify(transaction_hash), timeout=self.poll_timeout)
+            receipt_or_none = check_transaction_threw(self.client, transaction_hash)
 
-        transaction_hash = estimate_and_transact(
-            self.proxy,
-            'withdraw',
-            unlock_proof.lock_encoded,
-            merkleproof_encoded,
-            unlock_proof.secret,
-        )
+            if receipt_or_none:
+                log.critical(
+                    'withdraw failed',
+                    node=pex(self.node_address),
+                    contract=pex(self.address),
+                    lock=unlock_proof,
+                )
+                failed = failed or receipt_or_none
 
-        self.client.poll(unhexlify(transaction_hash), timeout=self.poll_timeout)
-        receipt_or_none = check_transaction_threw(self.client, transaction_hash)
+            elif log.isEnabledFor(logging.INFO):
+                log.info(
+                    'withdraw successful',
+                    node=pex(self.node_address),
+                    contract=pex(self.address),
+                    lock=unlock_proof,
+                )
 
-        if receipt_or_none:
-            log.critical(
-                'withdraw failed',
-                node=pex(self.node_address),
-                contract=pex(self.address),
-                lock=unlock_proof,
-            )
+        if failed:
             self._check_exists()
-            raise TransactionThrew('Withdraw', receipt_or_none)
-
-        elif log.isEnabledFor(logging.INFO):
-            log.info(
-                'withdraw successful',
-                node=pex(self.node_address),
-                contract=pex(self.address),
-                lock=unlock_proof,
-            )
+            raise TransactionThrew('Withdraw', failed)
 
     def settle(self):
         """ Settle the channel.
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+""" Scheduler for the retransmissions and pings of the transport.
+
+All the pending timers live in a hashed timing wheel, a single greenlet
+sleeps until the next slot with timers and hands the due callbacks to a
+small set of workers. The cost of the scheduler depends on the number of
+timers that are due, not on the number of partners or queues.
+"""
+import math
+import time
+
+import gevent
+from ethereum import slogging
+from gevent.event import Event
+from gevent.queue import Queue
+
+from raiden.exceptions import RaidenShuttingDown
+
+log = slogging.get_logger(__name__)  # pylint: disable=invalid-name
+
+STOP_WORKER = object()
+
+
+class Timer:
+    """ A callback scheduled in the wheel, cancelling it is O(1), the entry
+    is dropped once its slot is visited.
+    """
+    __slots__ = (
+        'tick',
+        'callback',
+        'args',
+        'cancelled',
+    )
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """ Hashed timing wheel with `wheel_size` slots of `tick` seconds.
+
+    A timer is stored in the slot of its tick modulo `wheel_size`, timers
+    further than one rotation share the slot with earlier timers and are
+    skipped until their tick is reached.
+    """
+
+    def __init__(self, tick, wheel_size, now):
+        self.tick = tick
+        self.slots = [list() for _ in range(wheel_size)]
+        self.current_tick = math.floor(now / tick)
+        self.timers = 0
+
+    def __len__(self):
+        return self.timers
+
+    def add(self, deadline, callback, args):
+        """ Add a timer for `callback` at `deadline` and return it. The timer
+        is due at the first tick after `deadline`.
+        """
+        timer_tick = max(math.ceil(deadline / self.tick), self.current_tick + 1)
+        timer = Timer(timer_tick, callback, args)
+
+        self.slots[timer_tick % len(self.slots)].append(timer)
+        self.timers += 1
+
+        return timer
+
+    def next_deadline(self):
+        """ Return the time of the next tick with a timer, None if there are
+        no timers. The cancelled timers found on the way are dropped.
+        """
+        wheel_size = len(self.slots)
+        later_tick = None
+
+        for offset in range(1, wheel_size + 1):
+            if not self.timers:
+                break
+
+            tick = self.current_tick + offset
+            slot = self.slots[tick % wheel_size]
+            if not slot:
+                continue
+
+            live = [timer for timer in slot if not timer.cancelled]
+            if len(live) != len(slot):
+                self.timers -= len(slot) - len(live)
+                self.slots[tick % wheel_size] = live
+
+            for timer in live:
+                if timer.tick <= tick:
+                    return tick * self.tick
+
+                # the timers of the following rotations
+                if later_tick is None or timer.tick < later_tick:
+                    later_tick = timer.tick
+
+        if later_tick is None:
+            return None
+
+        return later_tick * self.tick
+
+    def advance(self, now):
+        """ Move the wheel up to `now` and return the due timers, ordered by
+        tick. Cancelled timers are dropped.
+        """
+        target_tick = math.floor(now / self.tick)
+        wheel_size = len(self.slots)
+
+        due = list()
+        # after a full rotation every slot was visited once
+        last_tick = min(target_tick, self.current_tick + wheel_size)
+        for tick in range(self.current_tick + 1, last_tick + 1):
+            slot = self.slots[tick % wheel_size]
+            if not slot:
+                continue
+
+            remaining = list()
+            for timer in slot:
+                if timer.cancelled:
+                    self.timers -= 1
+                elif timer.tick <= target_tick:
+                    self.timers -= 1
+                    due.append(timer)
+                else:
+                    remaining.append(timer)
+
+            self.slots[tick % wheel_size] = remaining
+
+        self.current_tick = max(self.current_tick, target_tick)
+        due.sort(key=lambda timer: timer.tick)
+        return due
+
+
+class RetryScheduler:
+    """ Runs callbacks after a delay from a fixed number of worker greenlets.
+
+    The callbacks run in a worker, they may block for a short time (e.g. to
+    throttle a send), but a long block delays the other callbacks.
+    """
+
+    def __init__(self, tick, wheel_size, workers, time_function=None):
+        self._time = time_function or time.monotonic
+        self.wheel = TimerWheel(tick, wheel_size, self._time())
+        self.number_of_workers = workers
+
+        self.ready = Queue()
+        self.wakeup = Event()
+        self.sleeping_until = None
+
+        self.driver = None
+        self.workers = list()
+
+    def start(self):
+        self.wheel.current_tick = math.floor(self._time() / self.wheel.tick)
+        self.driver = gevent.spawn(self._run)
+        self.workers = [
+            gevent.spawn(self._work)
+            for _ in range(self.number_of_workers)
+        ]
+
+    def stop(self):
+        """ Stop the scheduler, the pending timers are dropped and the
+        callbacks running in the workers are allowed to finish.
+        """
+        if self.driver is not None:
+            self.driver.kill()
+            self.driver = None
+
+        for _ in self.workers:
+            self.ready.put(STOP_WORKER)
+        gevent.wait(self.workers)
+        self.workers = list()
+
+        self.wheel = TimerWheel(self.wheel.tick, len(self.wheel.slots), self._time())
+        self.ready = Queue()
+
+    def call_soon(self, callback, *args):
+        """ Run `callback` in a worker as soon as one is available. """
+        self.ready.put((callback, args))
+
+    def call_later(self, delay, callback, *args):
+        """ Run `callback` in a worker after `delay` seconds, returns the timer
+        that can be cancelled.
+        """
+        timer = self.wheel.add(self._time() + delay, callback, args)
+
+        wake_earlier = (
+            self.sleeping_until is None or
+            timer.tick * self.wheel.tick < self.sleeping_until
+        )
+        if wake_earlier:
+            self.wakeup.set()
+
+        return timer
+
+    def _run(self):
+        while True:
+            deadline = self.wheel.next_deadline()
+
+            self.sleeping_until = deadline
+            if deadline is None:
+                self.wakeup.wait()
+            else:
+                self.wakeup.wait(max(deadline - self._time(), 0))
+
+            self.wakeup.clear()
+            self.sleeping_until = None
+
+            for timer in self.wheel.advance(self._time()):
+                self.ready.put((timer.callback, timer.args))
+
+    def _work(self):
+        while True:
+            item = self.ready.get()
+
+            if item is STOP_WORKER:
+                return
+
+            callback, args = item
+            try:
+                callback(*args)
+            except RaidenShuttingDown:
+                pass
+            except:  # NOQA pylint: disable=bare-except
+                log.exception('unexpected exception on scheduled callback')
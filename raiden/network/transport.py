@@ -50,3 +50,70 @@ class TokenBucket:
         if self.tokens > self.capacity:
             self.tokens = self.capacity
         self.timestamp = now
+
+
+class RoundTripTimeEstimator:
+    """ Smoothed round trip time and variance of a peer, used to compute the
+    retransmission timeout (Jacobson/Karels, as in RFC 6298).
+
+    Only messages that were sent once must be sampled, the acknowledgement
+    of a retransmitted message can't be matched to one of its transmissions.
+    For this reason the timeout is doubled on an expiration and kept until
+    the next sample (Karn's algorithm), otherwise a peer slower than the
+    timeout would never be sampled.
+    """
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, initial_timeout, minimum_timeout, maximum_timeout):
+        self.initial_timeout = initial_timeout
+        self.minimum_timeout = minimum_timeout
+        self.maximum_timeout = maximum_timeout
+
+        self.smoothed = None
+        self.variance = None
+        self.samples = 0
+        self.backed_off_timeout = None
+
+    def update(self, sample):
+        """ Add a round trip time sample, in seconds. """
+        if self.smoothed is None:
+            self.smoothed = sample
+            self.variance = sample / 2
+        else:
+            self.variance = (
+                (1 - self.BETA) * self.variance +
+                self.BETA * abs(self.smoothed - sample)
+            )
+            self.smoothed = (1 - self.ALPHA) * self.smoothed + self.ALPHA * sample
+
+        self.samples += 1
+        self.backed_off_timeout = None
+
+    def expired(self, timeout):
+        """ A message sent with `timeout` was not acknowledged in time. """
+        # the messages sent together expire together, back off only once
+        if timeout >= self.timeout:
+            self.backed_off_timeout = min(timeout * 2, self.maximum_timeout)
+
+    @property
+    def timeout(self):
+        """ The retransmission timeout, the initial timeout until there is
+        a sample.
+        """
+        if self.backed_off_timeout is not None:
+            return self.backed_off_timeout
+
+        if self.smoothed is None:
+            return self.initial_timeout
+
+        timeout = self.smoothed + 4 * self.variance
+        return min(max(timeout, self.minimum_timeout), self.maximum_timeout)
+
+    def to_dict(self):
+        return {
+            'smoothed': self.smoothed,
+            'variance': self.variance,
+            'timeout': self.timeout,
+            'samples': self.samples,
+        }
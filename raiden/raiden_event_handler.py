@@ -223,13 +223,17 @@ def handle_contract_channelwithdraw(
     channel = raiden.chain.netting_channel(channel_withdraw_event.channel_identifier)
     block_number = raiden.get_block_number()
 
+    unlock_proofs = list()
     for unlock_proof in channel_withdraw_event.unlock_proofs:
         lock = Lock.from_bytes(unlock_proof.lock_encoded)
 
         if lock.expiration < block_number:
             log.error('Lock has expired!', lock=lock)
         else:
-            channel.withdraw(unlock_proof)
+            unlock_proofs.append(unlock_proof)
+
+    if unlock_proofs:
+        channel.withdraw_many(unlock_proofs)
 
 
 def handle_contract_channelsettle(
@@ -5,6 +5,7 @@ import os
 import random
 import sys
 from collections import defaultdict
+from contextlib import contextmanager
 
 import filelock
 import gevent
@@ -13,7 +14,7 @@ from coincurve import PrivateKey
 from ethereum import slogging
 
 from raiden import routing, waiting
-from raiden.blockchain_events_handler import on_blockchain_event
+from raiden.blockchain_events_handler import on_blockchain_events
 from raiden.constants import (
     UINT64_MAX,
     NETTINGCHANNEL_SETTLE_TIMEOUT_MIN,
@@ -57,7 +58,7 @@ from raiden.utils import (
     privatekey_to_address,
     random_secret,
 )
-from raiden.storage import wal, serialize, sqlite
+from raiden.storage import compaction, wal, serialize, sqlite
 
 log = slogging.get_logger(__name__)  # pylint: disable=invalid-name
 
@@ -90,6 +91,7 @@ def initiator_init(
         target_address,
         transfer_amount,
         previous_address,
+        raiden.route_planner,
     )
     init_initiator_statechange = ActionInitInitiator(
         registry_address,
@@ -110,6 +112,7 @@ def mediator_init(raiden, transfer: LockedTransfer):
         from_transfer.target,
         from_transfer.lock.amount,
         transfer.sender,
+        raiden.route_planner,
     )
     from_route = RouteState(
         transfer.sender,
@@ -251,6 +254,12 @@ class RaidenService:
         # important to give a consistent view of the node state.
         self.event_poll_lock = gevent.lock.Semaphore()
 
+        # Events of the state changes of the open batch, handled once the
+        # batch is committed
+        self.batched_events = None
+
+        self.route_planner = routing.RoutePlanner(self.address)
+
         self.start()
 
     def start(self):
@@ -263,10 +272,32 @@ class RaidenService:
             assert self.db_lock.is_locked
 
         # The database may be :memory:
-        storage = sqlite.SQLiteStorage(self.database_path, serialize.PickleSerializer())
+        serializer = serialize.SERIALIZERS[self.config['database_serializer']]()
+        storage = sqlite.SQLiteStorage(
+            self.database_path,
+            serializer,
+            self.config['database_read_pool_size'],
+        )
+        snapshot_policy = wal.SnapshotPolicy(
+            state_changes=self.config['snapshot']['state_changes'],
+            interval=self.config['snapshot']['interval'],
+            log_size=self.config['snapshot']['log_size'],
+        )
+        compactor = None
+        if self.config['compaction']['enabled']:
+            compactor = compaction.Compactor(
+                storage,
+                archive_directory=self.config['compaction']['archive_directory'],
+                compact_events=self.config['compaction']['events'],
+            )
+
         self.wal, unapplied_events = wal.restore_from_latest_snapshot(
             node.state_transition,
             storage,
+            snapshot_policy,
+            self.config['wal_group_commit'],
+            self.log_replay_progress,
+            compactor,
         )
 
         last_log_block_number = None
@@ -283,6 +314,8 @@ class RaidenService:
             # Get the last known block number after reapplying all the state changes from the log
             last_log_block_number = views.block_number(self.wal.state_manager.current_state)
 
+        self.route_planner.sync(self.wal.state_manager.current_state)
+
         # The alarm task must be started after the snapshot is loaded or the
         # state is primed, the callbacks assume the node is initialized.
         self.alarm.start()
@@ -314,6 +347,14 @@ class RaidenService:
 
         self.start_event.set()
 
+    def log_replay_progress(self, replayed, total):
+        log.info(
+            'replaying state changes',
+            node=pex(self.address),
+            replayed=replayed,
+            total=total,
+        )
+
     def start_neighbours_healthcheck(self):
         for neighbour in views.all_neighbour_nodes(self.wal.state_manager.current_state):
             if neighbour != ConnectionManager.BOOTSTRAP_ADDR:
@@ -345,6 +386,9 @@ class RaidenService:
         except (gevent.timeout.Timeout, RaidenShuttingDown):
             pass
 
+        # Bound the number of state changes replayed on the next start
+        self.wal.snapshot()
+
         if self.db_lock is not None:
             self.db_lock.release()
 
@@ -369,6 +413,54 @@ class RaidenService:
             block_number = self.get_block_number()
 
         event_list = self.wal.log_and_dispatch(state_change, block_number)
+        self.route_planner.on_state_change(self.wal.state_manager.current_state, state_change)
+
+        if self.batched_events is not None and self.wal.open_batch.owner is gevent.getcurrent():
+            self.batched_events.extend(event_list)
+        else:
+            self.handle_events(event_list)
+
+        return event_list
+
+    def handle_state_changes(self, state_changes, block_number=None):
+        """ Log and dispatch the ordered `state_changes` in a single
+        transaction, the events are handled once it is committed.
+
+        Returns the list of events of each state change.
+        """
+        with self.batch_state_changes():
+            return [
+                self.handle_state_change(state_change, block_number)
+                for state_change in state_changes
+            ]
+
+    @contextmanager
+    def batch_state_changes(self):
+        """ Log the state changes handled by the calling greenlet inside the
+        block in a single transaction, see `WriteAheadLog.batch`.
+
+        The events are handled once the transaction is committed, the state
+        read inside the block already includes the state changes.
+        """
+        if self.batched_events is not None and self.wal.open_batch.owner is gevent.getcurrent():
+            yield
+            return
+
+        batch = None
+        events = list()
+        try:
+            with self.wal.batch() as batch:
+                self.batched_events = events
+                try:
+                    yield
+                finally:
+                    self.batched_events = None
+        finally:
+            if batch is not None and batch.committed.successful():
+                self.handle_events(events)
+
+    def handle_events(self, event_list):
+        is_logging = log.isEnabledFor(logging.DEBUG)
 
         for event in event_list:
             if is_logging:
@@ -376,8 +468,6 @@ class RaidenService:
 
             on_raiden_event(self, event)
 
-        return event_list
-
     def set_node_network_state(self, node_address, network_state):
         state_change = ActionChangeNodeNetworkState(node_address, network_state)
         self.wal.log_and_dispatch(state_change, self.get_block_number())
@@ -390,8 +480,10 @@ class RaidenService:
 
     def poll_blockchain_events(self, current_block=None):  # pylint: disable=unused-argument
         with self.event_poll_lock:
-            for event in self.blockchain_events.poll_blockchain_events():
-                on_blockchain_event(self, event)
+            # a poll may return many events, e.g. when catching up after a
+            # restart, they are logged in a single transaction
+            events = list(self.blockchain_events.poll_blockchain_events())
+            on_blockchain_events(self, events)
 
     def sign(self, message):
         """ Sign message inplace. """
@@ -1,22 +1,58 @@
 # -*- coding: utf-8 -*-
 import logging
+import weakref
+from collections import namedtuple
 from typing import List, Tuple
-from heapq import heappush, heappop
+from heapq import heappop
 
+import cachetools
 import networkx
 from ethereum import slogging
 
+from raiden.settings import DEFAULT_ROUTE_PLANNER_MAX_PATHS
 from raiden.transfer import channel, views
+from raiden.transfer.mediated_transfer.state_change import (
+    ReceiveSecretReveal,
+    ReceiveTransferRefund,
+    ReceiveTransferRefundCancelRoute,
+)
 from raiden.transfer.state import (
     CHANNEL_STATE_OPENED,
     NODE_NETWORK_REACHABLE,
     NODE_NETWORK_UNKNOWN,
+    NODE_NETWORK_UNREACHABLE,
+)
+from raiden.transfer.state_change import (
+    ActionChangeNodeNetworkState,
+    ContractReceiveChannelClosed,
+    ContractReceiveChannelNew,
+    ContractReceiveChannelSettled,
+    ContractReceiveRouteNew,
 )
 from raiden.utils import isaddress, pex, typing
 from raiden.transfer.state import RouteState
 
 log = slogging.get_logger(__name__)  # pylint: disable=invalid-name
 
+# Ordered partners per (from_address, to_address), for each graph. The graph
+# of a token network is never changed in place, a new route replaces it with a
+# copy, so a graph is its own version and the entries of the previous graphs
+# are dropped with them.
+ROUTE_CACHE_SIZE = 256
+GRAPHS_TO_ORDERED_PARTNERS = weakref.WeakKeyDictionary()
+
+# The cost of a path is its number of hops, plus the failure rate of its first
+# hop, minus the fraction of our channel's distributable amount left after the
+# transfer, both weighted in hops
+FAILURE_RATE_WEIGHT = 2.0
+HEADROOM_WEIGHT = 0.5
+
+# Weight of the previous outcomes of a partner when a new one is recorded, the
+# failure rate follows the recent payments
+OUTCOME_DECAY = 0.9
+
+PlannedPath = namedtuple('PlannedPath', ('path', 'channel_identifier', 'cost'))
+
 
 def make_graph(
     edge_list: List[Tuple[typing.Address, typing.Address]]
@@ -52,29 +88,130 @@ def get_ordered_partners(
     from_address: typing.Address,
     to_address: typing.Address
 ) -> List:
-    paths = list()
+    """ Returns the heap of (distance to `to_address`, neighbor) for the
+    neighbors of `from_address` connected to `to_address`.
+
+    The result is cached for the graph, the caller may change the list.
+    """
+    cache = GRAPHS_TO_ORDERED_PARTNERS.get(network_graph)
+
+    if cache is None:
+        cache = cachetools.LRUCache(ROUTE_CACHE_SIZE)
+        GRAPHS_TO_ORDERED_PARTNERS[network_graph] = cache
+
+    key = (from_address, to_address)
+    paths = cache.get(key)
+
+    if paths is None:
+        paths = compute_ordered_partners(network_graph, from_address, to_address)
+        cache[key] = paths
+
+    return list(paths)
 
-    try:
-        all_neighbors = networkx.all_neighbors(network_graph, from_address)
-    except networkx.NetworkXError:
+
+def compute_ordered_partners(
+    network_graph: networkx.Graph,
+    from_address: typing.Address,
+    to_address: typing.Address
+) -> List:
+    """ Computes the distances of the neighbors of `from_address` with a
+    single breadth first search from `to_address`, which stops once all the
+    neighbors are reached.
+    """
+    if from_address not in network_graph or to_address not in network_graph:
         # If `our_address` is not in the graph, no channels opened with the
         # address
         return []
 
-    for neighbor in all_neighbors:
-        try:
-            length = networkx.shortest_path_length(
-                network_graph,
-                neighbor,
-                to_address,
-            )
-            heappush(paths, (length, neighbor))
-        except (networkx.NetworkXNoPath, networkx.NodeNotFound):
-            pass
+    adjacency = network_graph.adj
+    remaining = set(adjacency[from_address])
+    paths = list()
+
+    distance = 0
+    layer = [to_address]
+    visited = {to_address}
+
+    while layer and remaining:
+        for address in layer:
+            if address in remaining:
+                remaining.discard(address)
+                paths.append((distance, address))
 
+        next_layer = list()
+        for address in layer:
+            for neighbor in adjacency[address]:
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    next_layer.append(neighbor)
+
+        distance += 1
+        layer = next_layer
+
+    # a sorted list is a heap
+    paths.sort()
     return paths
 
 
+def get_usable_channel(
+    node_state: 'NodeState',
+    payment_network_id: typing.Address,
+    token_address: typing.Address,
+    from_address: typing.Address,
+    partner_address: typing.Address,
+    amount: int,
+    network_statuses: typing.Dict,
+):
+    """ Returns the channel with `partner_address` if it is opened, has the
+    capacity for `amount` and the partner is reachable, None otherwise.
+    """
+    channel_state = views.get_channelstate_for(
+        node_state,
+        payment_network_id,
+        token_address,
+        partner_address,
+    )
+
+    if channel_state is None:
+        return None
+
+    if channel.get_status(channel_state) != CHANNEL_STATE_OPENED:
+        if log.isEnabledFor(logging.INFO):
+            log.info(
+                'channel %s - %s is not opened, ignoring',
+                pex(from_address),
+                pex(partner_address),
+            )
+        return None
+
+    distributable = channel.get_distributable(
+        channel_state.our_state,
+        channel_state.partner_state,
+    )
+
+    if amount > distributable:
+        if log.isEnabledFor(logging.INFO):
+            log.info(
+                'channel %s - %s doesnt have enough funds [%s], ignoring',
+                pex(from_address),
+                pex(partner_address),
+                amount,
+            )
+        return None
+
+    network_state = network_statuses.get(partner_address, NODE_NETWORK_UNKNOWN)
+    if network_state != NODE_NETWORK_REACHABLE:
+        if log.isEnabledFor(logging.INFO):
+            log.info(
+                'partner for channel %s - %s is not %s, ignoring',
+                pex(from_address),
+                pex(partner_address),
+                NODE_NETWORK_REACHABLE,
+            )
+        return None
+
+    return channel_state
+
+
 def get_best_routes(
     node_state: 'NodeState',
     payment_network_id: typing.Address,
@@ -83,15 +220,27 @@ def get_best_routes(
     to_address: typing.Address,
     amount: int,
     previous_address: typing.Address,
+    route_planner: 'RoutePlanner' = None,
 ) -> List[RouteState]:
     """ Returns a list of channels that can be used to make a transfer.
 
     This will filter out channels that are not open and don't have enough
-    capacity.
+    capacity. With a `route_planner` the channels are those of its best
+    paths, otherwise they are ordered by the distance of the partner.
     """
-    # TODO: Route ranking.
-    # Rate each route to optimize the fee price/quality of each route and add a
-    # rate from in the range [0.0,1.0].
+    if route_planner is not None:
+        planned_paths = route_planner.plan(
+            node_state,
+            payment_network_id,
+            token_address,
+            to_address,
+            amount,
+            previous_address,
+        )
+        return [
+            RouteState(planned_path.path[1], planned_path.channel_identifier)
+            for planned_path in planned_paths
+        ]
 
     available_routes = list()
 
@@ -119,53 +268,344 @@ def get_best_routes(
     while neighbors_heap:
         _, partner_address = heappop(neighbors_heap)
 
-        channel_state = views.get_channelstate_for(
+        # don't send the message backwards
+        if partner_address == previous_address:
+            continue
+
+        channel_state = get_usable_channel(
             node_state,
             payment_network_id,
             token_address,
+            from_address,
             partner_address,
+            amount,
+            network_statuses,
         )
 
-        # don't send the message backwards
-        if partner_address == previous_address:
-            continue
+        if channel_state is not None:
+            route_state = RouteState(partner_address, channel_state.identifier)
+            available_routes.append(route_state)
 
-        if channel.get_status(channel_state) != CHANNEL_STATE_OPENED:
-            if log.isEnabledFor(logging.INFO):
-                log.info(
-                    'channel %s - %s is not opened, ignoring',
-                    pex(from_address),
-                    pex(partner_address),
-                )
-            continue
+    return available_routes
+
+
+class CompactGraph:
+    """ The channels of a token network, with the addresses replaced by
+    integers and the neighbors of each node in a set.
+
+    The distances of the neighbors of our node to a target are computed once
+    per version of the graph.
+    """
+
+    def __init__(self):
+        self.addresses_to_indexes = dict()
+        self.addresses = list()
+        self.adjacency = list()
+        self.version = 0
+        self.targets_to_paths = cachetools.LRUCache(ROUTE_CACHE_SIZE)
+
+    def index(self, address):
+        index = self.addresses_to_indexes.get(address)
+
+        if index is None:
+            index = len(self.addresses)
+            self.addresses_to_indexes[address] = index
+            self.addresses.append(address)
+            self.adjacency.append(set())
+
+        return index
 
-        distributable = channel.get_distributable(
-            channel_state.our_state,
-            channel_state.partner_state,
+    def add_edge(self, address1, address2):
+        index1 = self.index(address1)
+        index2 = self.index(address2)
+
+        if index2 not in self.adjacency[index1]:
+            self.adjacency[index1].add(index2)
+            self.adjacency[index2].add(index1)
+            self.changed()
+
+    def remove_edge(self, address1, address2):
+        index1 = self.addresses_to_indexes.get(address1)
+        index2 = self.addresses_to_indexes.get(address2)
+
+        if index1 is not None and index2 in self.adjacency[index1]:
+            self.adjacency[index1].discard(index2)
+            self.adjacency[index2].discard(index1)
+            self.changed()
+
+    def changed(self):
+        self.version += 1
+        self.targets_to_paths.clear()
+
+    def shortest_paths(self, from_address, to_address, excluded_addresses):
+        """ Returns the list of (hops, path) of the shortest loop-free path
+        through each neighbor of `from_address` to `to_address`, the paths
+        don't go through `excluded_addresses` unless it is the target.
+        """
+        key = (from_address, to_address, excluded_addresses)
+        paths = self.targets_to_paths.get(key)
+
+        if paths is None:
+            paths = self._compute_shortest_paths(from_address, to_address, excluded_addresses)
+            self.targets_to_paths[key] = paths
+
+        return paths
+
+    def _compute_shortest_paths(self, from_address, to_address, excluded_addresses):
+        from_index = self.addresses_to_indexes.get(from_address)
+        to_index = self.addresses_to_indexes.get(to_address)
+
+        if from_index is None or to_index is None:
+            return []
+
+        adjacency = self.adjacency
+        excluded = {
+            self.addresses_to_indexes[address]
+            for address in excluded_addresses
+            if address in self.addresses_to_indexes and address != to_address
+        }
+
+        # the paths must not go back through our node
+        excluded.add(from_index)
+
+        remaining = adjacency[from_index] - excluded
+        if to_index in adjacency[from_index]:
+            remaining.add(to_index)
+
+        # breadth first search from the target, which stops once the distance
+        # of all our neighbors is known
+        parents = {to_index: None}
+        found = list()
+        distance = 0
+        layer = [to_index]
+
+        while layer and remaining:
+            next_layer = list()
+
+            for index in layer:
+                if index in remaining:
+                    remaining.discard(index)
+                    found.append((distance, index))
+
+                for neighbor in adjacency[index]:
+                    if neighbor not in parents and neighbor not in excluded:
+                        parents[neighbor] = index
+                        next_layer.append(neighbor)
+
+            distance += 1
+            layer = next_layer
+
+        addresses = self.addresses
+        paths = list()
+        for distance, index in found:
+            path = [from_address]
+            while index is not None:
+                path.append(addresses[index])
+                index = parents[index]
+
+            paths.append((distance + 1, path))
+
+        return paths
+
+
+class RoutePlanner:
+    """ Plans the paths of the payments of our node.
+
+    The planner keeps a `CompactGraph` per token network, the reachability of
+    the nodes and the outcome of the payments through each partner, updated
+    with the state changes as they are dispatched.
+
+    The paths skip the nodes known to be unreachable. The best paths have the
+    fewest hops, a first hop with a low failure rate and the most capacity
+    left in our channel after the transfer.
+    """
+
+    def __init__(self, our_address):
+        self.our_address = our_address
+        self.token_networks = dict()
+        self.unreachable = frozenset()
+
+        # partner address to [successes, failures], with decay
+        self.outcomes = dict()
+
+    def sync(self, node_state):
+        """ Rebuild the graphs and the reachability from `node_state`. """
+        self.token_networks = dict()
+
+        for payment_network in node_state.identifiers_to_paymentnetworks.values():
+            token_networks = payment_network.tokenaddresses_to_tokennetworks.items()
+
+            for token_address, token_network in token_networks:
+                graph = self.get_graph(payment_network.address, token_address)
+
+                for address1, address2 in token_network.network_graph.network.edges():
+                    graph.add_edge(address1, address2)
+
+                for channel_state in token_network.channelidentifiers_to_channels.values():
+                    if channel.get_status(channel_state) != CHANNEL_STATE_OPENED:
+                        graph.remove_edge(self.our_address, channel_state.partner_state.address)
+
+        self.unreachable = frozenset(
+            address
+            for address, network_state in views.get_networkstatuses(node_state).items()
+            if network_state == NODE_NETWORK_UNREACHABLE
         )
 
-        if amount > distributable:
-            if log.isEnabledFor(logging.INFO):
-                log.info(
-                    'channel %s - %s doesnt have enough funds [%s], ignoring',
-                    pex(from_address),
-                    pex(partner_address),
-                    amount,
-                )
-            continue
+    def get_graph(self, payment_network_id, token_address):
+        key = (payment_network_id, token_address)
+        graph = self.token_networks.get(key)
+
+        if graph is None:
+            graph = CompactGraph()
+            self.token_networks[key] = graph
+
+        return graph
+
+    def on_state_change(self, node_state, state_change):
+        """ Update the planner with a state change, once it is dispatched. """
+        # pylint: disable=unidiomatic-typecheck
+        state_change_type = type(state_change)
+
+        if state_change_type == ContractReceiveRouteNew:
+            self.get_graph(
+                state_change.payment_network_identifier,
+                state_change.token_address,
+            ).add_edge(state_change.participant1, state_change.participant2)
+
+        elif state_change_type == ContractReceiveChannelNew:
+            self.get_graph(
+                state_change.payment_network_identifier,
+                state_change.token_address,
+            ).add_edge(
+                state_change.channel_state.our_state.address,
+                state_change.channel_state.partner_state.address,
+            )
+
+        elif state_change_type in (ContractReceiveChannelClosed, ContractReceiveChannelSettled):
+            channel_state = views.get_channelstate_by_id(
+                node_state,
+                state_change.payment_network_identifier,
+                state_change.token_address,
+                state_change.channel_identifier,
+            )
 
-        network_state = network_statuses.get(partner_address, NODE_NETWORK_UNKNOWN)
-        if network_state != NODE_NETWORK_REACHABLE:
-            if log.isEnabledFor(logging.INFO):
-                log.info(
-                    'partner for channel %s - %s is not %s, ignoring',
-                    pex(from_address),
-                    pex(partner_address),
-                    NODE_NETWORK_REACHABLE,
+            if channel_state is not None:
+                self.get_graph(
+                    state_change.payment_network_identifier,
+                    state_change.token_address,
+                ).remove_edge(
+                    channel_state.our_state.address,
+                    channel_state.partner_state.address,
                 )
-            continue
 
-        route_state = RouteState(partner_address, channel_state.identifier)
-        available_routes.append(route_state)
+        elif state_change_type == ActionChangeNodeNetworkState:
+            self.set_reachability(state_change.node_address, state_change.network_state)
 
-    return available_routes
+        elif state_change_type in (ReceiveTransferRefund, ReceiveTransferRefundCancelRoute):
+            # the partner could not find a path for our transfer
+            self.record_outcome(state_change.sender, success=False)
+
+        elif state_change_type == ReceiveSecretReveal:
+            self.record_outcome(state_change.sender, success=True)
+
+    def set_reachability(self, address, network_state):
+        is_unreachable = network_state == NODE_NETWORK_UNREACHABLE
+
+        if is_unreachable != (address in self.unreachable):
+            if is_unreachable:
+                self.unreachable = self.unreachable | {address}
+            else:
+                self.unreachable = self.unreachable - {address}
+
+            # the unreachable nodes are part of the cache keys, the entries
+            # for the previous set won't be used again
+            for graph in self.token_networks.values():
+                graph.targets_to_paths.clear()
+
+    def record_outcome(self, partner_address, success):
+        successes, failures = self.outcomes.get(partner_address, (0.0, 0.0))
+
+        successes *= OUTCOME_DECAY
+        failures *= OUTCOME_DECAY
+
+        if success:
+            successes += 1
+        else:
+            failures += 1
+
+        self.outcomes[partner_address] = (successes, failures)
+
+    def failure_rate(self, partner_address):
+        successes, failures = self.outcomes.get(partner_address, (0.0, 0.0))
+
+        # a partner without history is assumed to fail half of the time
+        return (failures + 1) / (successes + failures + 2)
+
+    def plan(
+            self,
+            node_state,
+            payment_network_id,
+            token_address,
+            to_address,
+            amount,
+            previous_address,
+            max_paths=DEFAULT_ROUTE_PLANNER_MAX_PATHS,
+    ):
+        """ Returns up to `max_paths` loop-free `PlannedPath`s to
+        `to_address`, cheapest first, one per usable channel of our node.
+        """
+        graph = self.token_networks.get((payment_network_id, token_address))
+
+        if graph is None:
+            return []
+
+        excluded_addresses = self.unreachable
+        if previous_address is not None:
+            excluded_addresses = excluded_addresses | {previous_address}
+
+        network_statuses = views.get_networkstatuses(node_state)
+        planned_paths = list()
+
+        shortest_paths = graph.shortest_paths(self.our_address, to_address, excluded_addresses)
+        for hops, path in shortest_paths:
+            partner_address = path[1]
+
+            # don't send the message backwards
+            if partner_address == previous_address:
+                continue
+
+            channel_state = get_usable_channel(
+                node_state,
+                payment_network_id,
+                token_address,
+                self.our_address,
+                partner_address,
+                amount,
+                network_statuses,
+            )
+
+            if channel_state is None:
+                continue
+
+            distributable = channel.get_distributable(
+                channel_state.our_state,
+                channel_state.partner_state,
+            )
+            headroom = (distributable - amount) / distributable if distributable else 0
+
+            cost = (
+                hops +
+                FAILURE_RATE_WEIGHT * self.failure_rate(partner_address) -
+                HEADROOM_WEIGHT * headroom
+            )
+            planned_paths.append(PlannedPath(path, channel_state.identifier, cost))
+
+        if not planned_paths and log.isEnabledFor(logging.WARNING):
+            log.warn(
+                'No routes available from %s to %s',
+                pex(self.our_address),
+                pex(to_address),
+            )
+
+        planned_paths.sort(key=lambda planned_path: (planned_path.cost, planned_path.path))
+        return planned_paths[:max_paths]
@@ -15,6 +15,18 @@ DEFAULT_PROTOCOL_RETRIES_BEFORE_BACKOFF = 5
 DEFAULT_PROTOCOL_THROTTLE_CAPACITY = 10.
 DEFAULT_PROTOCOL_THROTTLE_FILL_RATE = 10.
 DEFAULT_PROTOCOL_RETRY_INTERVAL = 1.
+DEFAULT_PROTOCOL_RETRY_TIMEOUT_MIN = 0.1
+DEFAULT_PROTOCOL_WINDOW_SIZE = 16
+# Nodes older than the DeliveredBatch message can't decode it, 0 sends a
+# Delivered per message. Enable it once every node of the network supports it.
+DEFAULT_PROTOCOL_DELIVERED_BATCH_TIMEOUT = 0
+# Nodes older than the bundles can't decode them and the peers can't
+# negotiate them yet, so they are disabled unless every node of the network
+# supports them
+DEFAULT_PROTOCOL_BUNDLE_MESSAGES = False
+DEFAULT_PROTOCOL_SCHEDULER_TICK = 0.05
+DEFAULT_PROTOCOL_SCHEDULER_WHEEL_SIZE = 1024
+DEFAULT_PROTOCOL_SCHEDULER_WORKERS = 4
 
 DEFAULT_REVEAL_TIMEOUT = 10
 DEFAULT_SETTLE_TIMEOUT = DEFAULT_REVEAL_TIMEOUT * 9
@@ -31,5 +43,15 @@ DEFAULT_NAT_INVITATION_TIMEOUT = 15
 
 DEFAULT_SHUTDOWN_TIMEOUT = 2
 
+DEFAULT_DATABASE_SERIALIZER = 'pickle'
+DEFAULT_DATABASE_READ_POOL_SIZE = 2
+DEFAULT_WAL_GROUP_COMMIT = True
+DEFAULT_SNAPSHOT_STATE_CHANGES = 500
+DEFAULT_SNAPSHOT_INTERVAL = 10 * 60
+DEFAULT_SNAPSHOT_LOG_SIZE = 4 * 1024 * 1024
+DEFAULT_COMPACTION_ENABLED = True
+DEFAULT_COMPACTION_EVENTS = False
+DEFAULT_ROUTE_PLANNER_MAX_PATHS = 5
+
 ORACLE_BLOCKNUMBER_DRIFT_TOLERANCE = 3
 ETHERSCAN_API = 'https://{network}.etherscan.io/api?module=proxy&action={action}'
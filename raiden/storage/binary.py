@@ -0,0 +1,945 @@
+# -*- coding: utf-8 -*-
+""" Compact binary encoding for the objects stored by the write-ahead log.
+
+Layout of a record::
+
+    MAGIC | schema version (varint) | value
+
+Every value starts with a one byte tag. Integers in [0, 192) are encoded in the
+tag itself, other integers and lengths use varints, 20 and 32 bytes strings
+(addresses and hashes) are stored without a length prefix.
+
+Objects are encoded as the class identifier followed by the values of the
+fields listed in `SCHEMA`, in order, so the encoding does not depend on the
+module or the attribute layout of the class. An object that appears more than
+once in a record, e.g. a channel in both mappings of its token network, is
+encoded once and then referenced by its position, which preserves the
+sharing of the decoded object tree.
+
+Schema changes:
+
+- New classes are appended to `SCHEMA`, the identifier of a class is its
+  position in the list and must never change.
+- Changing the fields of a class requires bumping `SCHEMA_VERSION`, adding the
+  previous fields of the class to `LEGACY_FIELDS` under the versions using them,
+  and a function to `UPGRADES` that converts the fields of a decoded object
+  from the previous version.
+"""
+import random
+import struct
+
+import networkx
+
+from raiden.exceptions import SerializationError
+from raiden.transfer import channel, events, state, state_change
+from raiden.transfer.mediated_transfer import events as mediated_events
+from raiden.transfer.mediated_transfer import state as mediated_state
+from raiden.transfer.mediated_transfer import state_change as mediated_state_change
+
+MAGIC = 0xb1
+SCHEMA_VERSION = 6
+
+SCHEMA = [
+    # raiden.transfer.state
+    (state.NodeState, (
+        'pseudo_random_generator',
+        'block_number',
+        'queueids_to_queues',
+        'identifiers_to_paymentnetworks',
+        'nodeaddresses_to_networkstates',
+        'payment_mapping',
+        'channel_deadlines',
+        'paymenttask_deadlines',
+        'messageidentifiers_to_queueids',
+    )),
+    (state.PaymentNetworkState, (
+        'address',
+        'tokenidentifiers_to_tokennetworks',
+        'tokenaddresses_to_tokennetworks',
+    )),
+    (state.TokenNetworkState, (
+        'address',
+        'token_address',
+        'network_graph',
+        'channelidentifiers_to_channels',
+        'partneraddresses_to_channels',
+    )),
+    (state.TokenNetworkGraphState, (
+        'network',
+    )),
+    (state.PaymentMappingState, (
+        'secrethashes_to_task',
+    )),
+    (state.RouteState, (
+        'node_address',
+        'channel_identifier',
+    )),
+    (state.BalanceProofUnsignedState, (
+        'nonce',
+        'transferred_amount',
+        'locked_amount',
+        'locksroot',
+        'channel_address',
+    )),
+    (state.BalanceProofSignedState, (
+        'nonce',
+        'transferred_amount',
+        'locked_amount',
+        'locksroot',
+        'channel_address',
+        'message_hash',
+        'signature',
+        'sender',
+    )),
+    (state.HashTimeLockState, (
+        'amount',
+        'expiration',
+        'secrethash',
+        'encoded',
+        'lockhash',
+    )),
+    (state.UnlockPartialProofState, (
+        'lock',
+        'secret',
+    )),
+    (state.UnlockProofState, (
+        'merkle_proof',
+        'lock_encoded',
+        'secret',
+    )),
+    (state.TransactionExecutionStatus, (
+        'started_block_number',
+        'finished_block_number',
+        'result',
+    )),
+    (state.MerkleTreeState, (
+        'layers',
+    )),
+    (state.NettingChannelEndState, (
+        'address',
+        'contract_balance',
+        'secrethashes_to_lockedlocks',
+        'secrethashes_to_unlockedlocks',
+        'merkletree',
+        'balance_proof',
+        'amount_locked',
+    )),
+    (state.NettingChannelState, (
+        'identifier',
+        'token_address',
+        'reveal_timeout',
+        'settle_timeout',
+        'our_state',
+        'partner_state',
+        'deposit_transaction_queue',
+        'open_transaction',
+        'close_transaction',
+        'settle_transaction',
+    )),
+    (state.TransactionChannelNewBalance, (
+        'participant_address',
+        'contract_balance',
+        'deposit_block_number',
+    )),
+    # raiden.transfer.state_change
+    (state_change.Block, (
+        'block_number',
+    )),
+    (state_change.ActionCancelPayment, (
+        'payment_identifier',
+    )),
+    (state_change.ActionChannelClose, (
+        'payment_network_identifier',
+        'token_address',
+        'channel_identifier',
+    )),
+    (state_change.ActionCancelTransfer, (
+        'identifier',
+    )),
+    (state_change.ActionTransferDirect, (
+        'payment_network_identifier',
+        'token_address',
+        'amount',
+        'receiver_address',
+        'payment_identifier',
+    )),
+    (state_change.ContractReceiveChannelNew, (
+        'payment_network_identifier',
+        'token_address',
+        'channel_state',
+    )),
+    (state_change.ContractReceiveChannelClosed, (
+        'payment_network_identifier',
+        'token_address',
+        'channel_identifier',
+        'closing_address',
+        'closed_block_number',
+    )),
+    (state_change.ActionInitNode, (
+        'pseudo_random_generator',
+        'block_number',
+    )),
+    (state_change.ActionNewTokenNetwork, (
+        'payment_network_identifier',
+        'token_network',
+    )),
+    (state_change.ContractReceiveChannelNewBalance, (
+        'payment_network_identifier',
+        'token_address',
+        'channel_identifier',
+        'deposit_transaction',
+    )),
+    (state_change.ContractReceiveChannelSettled, (
+        'payment_network_identifier',
+        'token_address',
+        'channel_identifier',
+        'settle_block_number',
+    )),
+    (state_change.ActionLeaveAllNetworks, ()),
+    (state_change.ActionChangeNodeNetworkState, (
+        'node_address',
+        'network_state',
+    )),
+    (state_change.ContractReceiveNewPaymentNetwork, (
+        'payment_network',
+    )),
+    (state_change.ContractReceiveNewTokenNetwork, (
+        'payment_network_identifier',
+        'token_network',
+    )),
+    (state_change.ContractReceiveChannelWithdraw, (
+        'payment_network_identifier',
+        'token_address',
+        'channel_identifier',
+        'secret',
+        'secrethash',
+        'receiver',
+    )),
+    (state_change.ContractReceiveNewRoute, (
+        'participant1',
+        'participant2',
+    )),
+    (state_change.ContractReceiveRouteNew, (
+        'payment_network_identifier',
+        'token_address',
+        'participant1',
+        'participant2',
+    )),
+    (state_change.ReceiveTransferDirect, (
+        'payment_network_identifier',
+        'token_address',
+        'message_identifier',
+        'payment_identifier',
+        'balance_proof',
+    )),
+    (state_change.ReceiveUnlock, (
+        'message_identifier',
+        'secret',
+        'secrethash',
+        'balance_proof',
+    )),
+    (state_change.ReceiveDelivered, (
+        'message_identifier',
+    )),
+    (state_change.ReceiveProcessed, (
+        'message_identifier',
+    )),
+    # raiden.transfer.events
+    (events.ContractSendChannelClose, (
+        'channel_identifier',
+        'token_address',
+        'balance_proof',
+    )),
+    (events.ContractSendChannelSettle, (
+        'channel_identifier',
+    )),
+    (events.ContractSendChannelUpdateTransfer, (
+        'channel_identifier',
+        'balance_proof',
+    )),
+    (events.ContractSendChannelWithdraw, (
+        'channel_identifier',
+        'unlock_proofs',
+    )),
+    (events.EventTransferSentSuccess, (
+        'identifier',
+        'amount',
+        'target',
+        'channel_identifier',
+    )),
+    (events.EventTransferSentFailed, (
+        'identifier',
+        'reason',
+        'channel_identifier',
+    )),
+    (events.EventTransferReceivedSuccess, (
+        'identifier',
+        'amount',
+        'initiator',
+        'channel_identifier',
+    )),
+    (events.EventTransferReceivedInvalidDirectTransfer, (
+        'identifier',
+        'reason',
+    )),
+    (events.SendDirectTransfer, (
+        'recipient',
+        'queue_name',
+        'message_identifier',
+        'payment_identifier',
+        'balance_proof',
+        'registry_address',
+        'token',
+    )),
+    (events.SendProcessed, (
+        'recipient',
+        'queue_name',
+        'message_identifier',
+    )),
+    # raiden.transfer.mediated_transfer.state
+    (mediated_state.InitiatorPaymentState, (
+        'initiator',
+        'cancelled_channels',
+    )),
+    (mediated_state.InitiatorTransferState, (
+        'transfer_description',
+        'channel_identifier',
+        'transfer',
+        'secretrequest',
+        'revealsecret',
+    )),
+    (mediated_state.MediatorTransferState, (
+        'secrethash',
+        'secret',
+        'transfers_pair',
+        'pairs_deadlines',
+    )),
+    (mediated_state.TargetTransferState, (
+        'route',
+        'transfer',
+        'secret',
+        'state',
+    )),
+    (mediated_state.LockedTransferUnsignedState, (
+        'payment_identifier',
+        'registry_address',
+        'token',
+        'balance_proof',
+        'lock',
+        'initiator',
+        'target',
+    )),
+    (mediated_state.LockedTransferSignedState, (
+        'message_identifier',
+        'payment_identifier',
+        'registry_address',
+        'token',
+        'balance_proof',
+        'lock',
+        'initiator',
+        'target',
+    )),
+    (mediated_state.TransferDescriptionWithSecretState, (
+        'payment_identifier',
+        'amount',
+        'registry',
+        'token',
+        'initiator',
+        'target',
+        'secret',
+        'secrethash',
+    )),
+    (mediated_state.MediationPairState, (
+        'payer_transfer',
+        'payee_address',
+        'payee_transfer',
+        'payer_state',
+        'payee_state',
+    )),
+    # raiden.transfer.mediated_transfer.state_change
+    (mediated_state_change.ActionInitInitiator, (
+        'payment_network_identifier',
+        'transfer',
+        'routes',
+    )),
+    (mediated_state_change.ActionInitMediator, (
+        'payment_network_identifier',
+        'routes',
+        'from_route',
+        'from_transfer',
+    )),
+    (mediated_state_change.ActionInitTarget, (
+        'payment_network_identifier',
+        'route',
+        'transfer',
+    )),
+    (mediated_state_change.ActionCancelRoute, (
+        'registry_address',
+        'identifier',
+        'routes',
+    )),
+    (mediated_state_change.ReceiveSecretRequest, (
+        'payment_identifier',
+        'amount',
+        'secrethash',
+        'sender',
+        'revealsecret',
+    )),
+    (mediated_state_change.ReceiveSecretReveal, (
+        'secret',
+        'secrethash',
+        'sender',
+    )),
+    (mediated_state_change.ReceiveTransferRefundCancelRoute, (
+        'registry_address',
+        'sender',
+        'transfer',
+        'routes',
+        'secrethash',
+        'secret',
+    )),
+    (mediated_state_change.ReceiveTransferRefund, (
+        'message_identifier',
+        'sender',
+        'transfer',
+    )),
+    (mediated_state_change.ContractReceiveWithdraw, (
+        'channel_address',
+        'secrethash',
+        'receiver',
+        'secret',
+    )),
+    (mediated_state_change.ContractReceiveClosed, (
+        'channel_address',
+        'closing_address',
+        'block_number',
+    )),
+    (mediated_state_change.ContractReceiveSettled, (
+        'channel_address',
+        'block_number',
+    )),
+    (mediated_state_change.ContractReceiveBalance, (
+        'channel_address',
+        'token_address',
+        'participant_address',
+        'balance',
+        'block_number',
+    )),
+    (mediated_state_change.ContractReceiveNewChannel, (
+        'manager_address',
+        'channel_address',
+        'participant1',
+        'participant2',
+        'settle_timeout',
+    )),
+    (mediated_state_change.ContractReceiveTokenAdded, (
+        'registry_address',
+        'token_address',
+        'manager_address',
+    )),
+    # raiden.transfer.mediated_transfer.events
+    (mediated_events.SendLockedTransfer, (
+        'recipient',
+        'queue_name',
+        'message_identifier',
+        'transfer',
+    )),
+    (mediated_events.SendRevealSecret, (
+        'recipient',
+        'queue_name',
+        'message_identifier',
+        'secret',
+        'secrethash',
+        'token',
+    )),
+    (mediated_events.SendBalanceProof, (
+        'recipient',
+        'queue_name',
+        'message_identifier',
+        'payment_identifier',
+        'token',
+        'secret',
+        'balance_proof',
+    )),
+    (mediated_events.SendSecretRequest, (
+        'recipient',
+        'queue_name',
+        'message_identifier',
+        'payment_identifier',
+        'amount',
+        'secrethash',
+    )),
+    (mediated_events.SendRefundTransfer, (
+        'recipient',
+        'queue_name',
+        'message_identifier',
+        'payment_identifier',
+        'registry_address',
+        'token',
+        'balance_proof',
+        'lock',
+        'initiator',
+        'target',
+    )),
+    (mediated_events.EventUnlockSuccess, (
+        'identifier',
+        'secrethash',
+    )),
+    (mediated_events.EventUnlockFailed, (
+        'identifier',
+        'secrethash',
+        'reason',
+    )),
+    (mediated_events.EventWithdrawSuccess, (
+        'identifier',
+        'secrethash',
+    )),
+    (mediated_events.EventWithdrawFailed, (
+        'identifier',
+        'secrethash',
+        'reason',
+    )),
+    # namedtuples
+    (channel.TransactionOrder, channel.TransactionOrder._fields),
+    (state.PaymentMappingState.InitiatorTask, state.PaymentMappingState.InitiatorTask._fields),
+    (state.PaymentMappingState.MediatorTask, state.PaymentMappingState.MediatorTask._fields),
+    (state.PaymentMappingState.TargetTask, state.PaymentMappingState.TargetTask._fields),
+    (state.DeadlineQueueState, (
+        'keys_to_blocks',
+        'ordered',
+    )),
+]
+
+NODE_STATE_FIELDS_V2 = (
+    'pseudo_random_generator',
+    'block_number',
+    'queueids_to_queues',
+    'identifiers_to_paymentnetworks',
+    'nodeaddresses_to_networkstates',
+    'payment_mapping',
+)
+NODE_STATE_FIELDS_V3 = NODE_STATE_FIELDS_V2 + (
+    'channel_deadlines',
+    'paymenttask_deadlines',
+)
+NETTING_CHANNEL_END_STATE_FIELDS_V4 = (
+    'address',
+    'contract_balance',
+    'secrethashes_to_lockedlocks',
+    'secrethashes_to_unlockedlocks',
+    'merkletree',
+    'balance_proof',
+)
+MEDIATOR_TRANSFER_STATE_FIELDS_V5 = (
+    'secrethash',
+    'secret',
+    'transfers_pair',
+)
+
+# Fields of the classes in the records of a previous version, for every class
+# changed after that version
+LEGACY_FIELDS = {
+    1: {
+        events.EventTransferSentSuccess: ('identifier', 'amount', 'target'),
+        events.EventTransferSentFailed: ('identifier', 'reason'),
+        events.EventTransferReceivedSuccess: ('identifier', 'amount', 'initiator'),
+        state.NodeState: NODE_STATE_FIELDS_V2,
+        state.NettingChannelEndState: NETTING_CHANNEL_END_STATE_FIELDS_V4,
+        mediated_state.MediatorTransferState: MEDIATOR_TRANSFER_STATE_FIELDS_V5,
+    },
+    2: {
+        state.NodeState: NODE_STATE_FIELDS_V2,
+        state.NettingChannelEndState: NETTING_CHANNEL_END_STATE_FIELDS_V4,
+        mediated_state.MediatorTransferState: MEDIATOR_TRANSFER_STATE_FIELDS_V5,
+    },
+    3: {
+        state.NodeState: NODE_STATE_FIELDS_V3,
+        state.NettingChannelEndState: NETTING_CHANNEL_END_STATE_FIELDS_V4,
+        mediated_state.MediatorTransferState: MEDIATOR_TRANSFER_STATE_FIELDS_V5,
+    },
+    4: {
+        state.NettingChannelEndState: NETTING_CHANNEL_END_STATE_FIELDS_V4,
+        mediated_state.MediatorTransferState: MEDIATOR_TRANSFER_STATE_FIELDS_V5,
+    },
+    5: {
+        mediated_state.MediatorTransferState: MEDIATOR_TRANSFER_STATE_FIELDS_V5,
+    },
+}
+
+
+def upgrade_add_channel_identifier(fields):
+    fields['channel_identifier'] = None
+    return fields
+
+
+def upgrade_add_deadlines(fields):
+    # computed from the rest of the state on the first transition
+    fields['channel_deadlines'] = None
+    fields['paymenttask_deadlines'] = None
+    return fields
+
+
+def upgrade_add_message_index(fields):
+    # built from the queues on the first transition
+    fields['messageidentifiers_to_queueids'] = None
+    return fields
+
+
+def upgrade_add_amount_locked(fields):
+    # computed from the locks the first time it is read
+    fields['amount_locked'] = None
+    return fields
+
+
+def upgrade_add_pairs_deadlines(fields):
+    # computed from the pairs on the next transition of the task
+    fields['pairs_deadlines'] = None
+    return fields
+
+
+# Functions converting the fields of an object from the given version to the
+# next one
+UPGRADES = {
+    1: {
+        events.EventTransferSentSuccess: upgrade_add_channel_identifier,
+        events.EventTransferSentFailed: upgrade_add_channel_identifier,
+        events.EventTransferReceivedSuccess: upgrade_add_channel_identifier,
+    },
+    2: {
+        state.NodeState: upgrade_add_deadlines,
+    },
+    3: {
+        state.NodeState: upgrade_add_message_index,
+    },
+    4: {
+        state.NettingChannelEndState: upgrade_add_amount_locked,
+    },
+    5: {
+        mediated_state.MediatorTransferState: upgrade_add_pairs_deadlines,
+    },
+}
+
+TAG_NONE = 0
+TAG_TRUE = 1
+TAG_FALSE = 2
+TAG_INT = 3
+TAG_NEGATIVE_INT = 4
+TAG_FLOAT = 5
+TAG_BYTES20 = 6
+TAG_BYTES32 = 7
+TAG_BYTES = 8
+TAG_STR = 9
+TAG_LIST = 10
+TAG_TUPLE = 11
+TAG_DICT = 12
+TAG_SET = 13
+TAG_OBJECT = 14
+TAG_REFERENCE = 15
+TAG_MISSING = 16
+TAG_RANDOM = 17
+TAG_GRAPH = 18
+TAG_SMALL_INT = 0x40
+
+SMALL_INT_LIMIT = 0x100 - TAG_SMALL_INT
+
+# state of the Mersenne Twister, 624 words plus the position
+RANDOM_STATE = struct.Struct('<625I')
+FLOAT = struct.Struct('<d')
+
+MISSING = object()
+
+CLASS_TO_IDENTIFIER = {
+    class_: identifier
+    for identifier, (class_, _) in enumerate(SCHEMA)
+}
+CLASS_TO_FIELDS = dict(SCHEMA)
+
+
+def write_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, pos):
+    result = 0
+    shift = 0
+
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+
+        if byte < 0x80:
+            return result, pos
+
+        shift += 7
+
+
+def encode_value(value, out, references):
+    """ Append the encoding of `value` to the bytearray `out`.
+
+    `references` maps the id of the objects already encoded to their position.
+    """
+    # pylint: disable=too-many-branches,too-many-statements
+    value_type = type(value)
+
+    if value_type is int:
+        if 0 <= value < SMALL_INT_LIMIT:
+            out.append(TAG_SMALL_INT + value)
+        elif value >= 0:
+            out.append(TAG_INT)
+            write_varint(value, out)
+        else:
+            out.append(TAG_NEGATIVE_INT)
+            write_varint(-value, out)
+
+    elif value_type is bytes:
+        length = len(value)
+
+        if length == 20:
+            out.append(TAG_BYTES20)
+        elif length == 32:
+            out.append(TAG_BYTES32)
+        else:
+            out.append(TAG_BYTES)
+            write_varint(length, out)
+
+        out += value
+
+    elif value is None:
+        out.append(TAG_NONE)
+
+    elif value_type in CLASS_TO_IDENTIFIER:
+        position = references.get(id(value))
+
+        if position is not None:
+            out.append(TAG_REFERENCE)
+            write_varint(position, out)
+            return
+
+        # the object is kept alive by the encoded tree, so its id is not reused
+        references[id(value)] = len(references)
+
+        identifier = CLASS_TO_IDENTIFIER[value_type]
+        out.append(TAG_OBJECT)
+        write_varint(identifier, out)
+
+        for name in SCHEMA[identifier][1]:
+            field = getattr(value, name, MISSING)
+
+            if field is MISSING:
+                out.append(TAG_MISSING)
+            else:
+                encode_value(field, out, references)
+
+    elif value_type is bool:
+        out.append(TAG_TRUE if value else TAG_FALSE)
+
+    elif value_type is str:
+        data = value.encode('utf8')
+        out.append(TAG_STR)
+        write_varint(len(data), out)
+        out += data
+
+    elif value_type is list or value_type is tuple or value_type is set:
+        if value_type is list:
+            out.append(TAG_LIST)
+        elif value_type is tuple:
+            out.append(TAG_TUPLE)
+        else:
+            out.append(TAG_SET)
+
+        write_varint(len(value), out)
+        for item in value:
+            encode_value(item, out, references)
+
+    elif value_type is dict:
+        out.append(TAG_DICT)
+        write_varint(len(value), out)
+
+        for key, item in value.items():
+            encode_value(key, out, references)
+            encode_value(item, out, references)
+
+    elif value_type is float:
+        out.append(TAG_FLOAT)
+        out += FLOAT.pack(value)
+
+    elif value_type is random.Random:
+        version, internal_state, gauss_next = value.getstate()
+
+        out.append(TAG_RANDOM)
+        write_varint(version, out)
+        out += RANDOM_STATE.pack(*internal_state)
+        encode_value(gauss_next, out, references)
+
+    elif value_type is networkx.Graph:
+        out.append(TAG_GRAPH)
+        encode_value(list(value.nodes()), out, references)
+        encode_value(list(value.edges(data=True)), out, references)
+
+    else:
+        raise SerializationError('Cannot serialize {}'.format(value_type))
+
+
+def decode_value(data, pos, version):
+    """ Decode the value encoded at `data[pos:]`. """
+    # pylint: disable=too-many-branches,too-many-statements
+    references = list()
+
+    def decode():
+        nonlocal pos
+
+        tag = data[pos]
+        pos += 1
+
+        if tag >= TAG_SMALL_INT:
+            return tag - TAG_SMALL_INT
+
+        if tag == TAG_BYTES20:
+            pos += 20
+            return data[pos - 20:pos]
+
+        if tag == TAG_BYTES32:
+            pos += 32
+            return data[pos - 32:pos]
+
+        if tag == TAG_OBJECT:
+            return decode_object()
+
+        if tag == TAG_NONE:
+            return None
+
+        if tag == TAG_INT or tag == TAG_NEGATIVE_INT:
+            value, pos = read_varint(data, pos)
+            return value if tag == TAG_INT else -value
+
+        if tag == TAG_LIST:
+            length, pos = read_varint(data, pos)
+            return [decode() for _ in range(length)]
+
+        if tag == TAG_DICT:
+            length, pos = read_varint(data, pos)
+            result = dict()
+            for _ in range(length):
+                key = decode()
+                result[key] = decode()
+            return result
+
+        if tag == TAG_REFERENCE:
+            position, pos = read_varint(data, pos)
+            return references[position]
+
+        if tag == TAG_TRUE:
+            return True
+
+        if tag == TAG_FALSE:
+            return False
+
+        if tag == TAG_MISSING:
+            return MISSING
+
+        if tag == TAG_BYTES or tag == TAG_STR:
+            length, pos = read_varint(data, pos)
+            pos += length
+            value = data[pos - length:pos]
+            return value if tag == TAG_BYTES else value.decode('utf8')
+
+        if tag == TAG_TUPLE or tag == TAG_SET:
+            length, pos = read_varint(data, pos)
+            items = [decode() for _ in range(length)]
+            return tuple(items) if tag == TAG_TUPLE else set(items)
+
+        if tag == TAG_FLOAT:
+            value, = FLOAT.unpack_from(data, pos)
+            pos += FLOAT.size
+            return value
+
+        if tag == TAG_RANDOM:
+            random_version, pos = read_varint(data, pos)
+            internal_state = RANDOM_STATE.unpack_from(data, pos)
+            pos += RANDOM_STATE.size
+
+            value = random.Random()
+            value.setstate((random_version, internal_state, decode()))
+            return value
+
+        if tag == TAG_GRAPH:
+            value = networkx.Graph()
+            value.add_nodes_from(decode())
+            value.add_edges_from(decode())
+            return value
+
+        raise SerializationError('Invalid tag {}'.format(tag))
+
+    def decode_object():
+        nonlocal pos
+
+        identifier, pos = read_varint(data, pos)
+
+        try:
+            class_, fields = SCHEMA[identifier]
+        except IndexError:
+            raise SerializationError('Unknown class identifier {}'.format(identifier))
+
+        # reserve the position before decoding the fields, the encoder
+        # numbers the objects in the same order
+        position = len(references)
+        references.append(None)
+
+        if version != SCHEMA_VERSION:
+            value = decode_legacy_object(class_, fields)
+
+        elif issubclass(class_, tuple):
+            value = class_._make([decode() for _ in fields])
+
+        else:
+            value = class_.__new__(class_)
+            for name in fields:
+                field = decode()
+                if field is not MISSING:
+                    setattr(value, name, field)
+
+        references[position] = value
+        return value
+
+    def decode_legacy_object(class_, fields):
+        fields = LEGACY_FIELDS.get(version, {}).get(class_, fields)
+        values = {name: decode() for name in fields}
+
+        for from_version in range(version, SCHEMA_VERSION):
+            upgrade = UPGRADES.get(from_version, {}).get(class_)
+            if upgrade is not None:
+                values = upgrade(values)
+
+        if issubclass(class_, tuple):
+            return class_(**values)
+
+        value = class_.__new__(class_)
+        for name, field in values.items():
+            if field is not MISSING:
+                setattr(value, name, field)
+
+        return value
+
+    return decode()
+
+
+def encode(value):
+    out = bytearray([MAGIC])
+    write_varint(SCHEMA_VERSION, out)
+    encode_value(value, out, dict())
+    return bytes(out)
+
+
+def decode(data):
+    if not data or data[0] != MAGIC:
+        raise SerializationError('Data is not in the binary format, migrate the database')
+
+    version, pos = read_varint(data, 1)
+    if version > SCHEMA_VERSION:
+        raise SerializationError('Unsupported schema version {}'.format(version))
+
+    return decode_value(bytes(data), pos, version)
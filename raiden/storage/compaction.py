@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+""" Compaction of the write-ahead log.
+
+Once a snapshot is written, the state changes it includes are not needed to
+restore the node anymore. The compaction deletes them from the database,
+optionally archiving them first into compressed segment files, so the size
+of the database of a long running node doesn't grow with its age.
+
+The rows are removed in small batches, each in its own short transaction,
+yielding to the other greenlets in between, so the dispatch of new state
+changes is not paused while a compaction runs.
+"""
+import gzip
+import os
+import struct
+import zlib
+
+import gevent
+
+COMPACTION_BATCH_SIZE = 1000
+
+SEGMENT_MAGIC = b'RDNSEG1\n'
+SEGMENT_SUFFIX = '.gz'
+PARTIAL_SUFFIX = '.partial'
+
+RECORD_STATE_CHANGE = 0
+RECORD_EVENT = 1
+
+# kind, identifier, source_statechange_id, block_number, length of the data
+RECORD_HEADER = struct.Struct('>BQQQI')
+
+
+def write_records(segment, kind, rows):
+    """ Append `rows` to the open `segment`, the rows are tuples of
+    (identifier, source_statechange_id, block_number, data).
+    """
+    for identifier, source_statechange_id, block_number, data in rows:
+        segment.write(RECORD_HEADER.pack(
+            kind,
+            identifier,
+            source_statechange_id,
+            block_number,
+            len(data),
+        ))
+        segment.write(data)
+
+
+def read_segment(path):
+    """ Yield the records archived in the segment file at `path` as tuples
+    of (kind, identifier, source_statechange_id, block_number, data).
+
+    The `data` is as it was stored in the database, to be decoded with the
+    database serializer. For state changes `source_statechange_id` and
+    `block_number` are zero.
+
+    A segment left partial by a crash is read up to its last complete batch.
+    """
+    with gzip.open(path, 'rb') as segment:
+        try:
+            magic = segment.read(len(SEGMENT_MAGIC))
+            if magic != SEGMENT_MAGIC:
+                raise ValueError('{} is not a segment file'.format(path))
+
+            while True:
+                header = segment.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+
+                kind, identifier, source_statechange_id, block_number, length = (
+                    RECORD_HEADER.unpack(header)
+                )
+                data = segment.read(length)
+                if len(data) < length:
+                    return
+
+                yield kind, identifier, source_statechange_id, block_number, data
+        except EOFError:
+            # the compressed stream of a partial segment is not terminated
+            return
+
+
+class Compactor:
+    """ Removes the state changes included in the latest snapshot from the
+    database.
+
+    Args:
+        storage: The `SQLiteStorage` to compact.
+        archive_directory: If given, the removed rows are written to a segment
+            file in this directory before being deleted.
+        compact_events: Whether to remove the events of the compacted state
+            changes too. The events are the history returned by the API, if
+            they are kept the state changes which produced them are kept as
+            well, these are a small fraction of the log.
+        batch_size: Number of state changes removed per transaction.
+    """
+
+    def __init__(
+            self,
+            storage,
+            archive_directory=None,
+            compact_events=False,
+            batch_size=COMPACTION_BATCH_SIZE,
+    ):
+        self.storage = storage
+        self.archive_directory = archive_directory
+        self.compact_events = compact_events
+        self.batch_size = batch_size
+
+        # State changes up to this identifier were already visited, the ones
+        # left were kept because of their events
+        self.compacted_up_to = 0
+
+    def compact(self):
+        """ Remove the state changes older than the latest snapshot.
+
+        Returns a dictionary with the number of removed rows per table.
+        """
+        result = {'state_changes': 0, 'state_events': 0}
+
+        snapshot_statechange_id = self.storage.get_state_snapshot_statechange_id()
+        if snapshot_statechange_id is None:
+            return result
+
+        segment = None
+        raw_segment = None
+        partial_path = None
+        first_identifier = None
+        last_identifier = None
+
+        try:
+            while True:
+                rows = self.storage.conn.execute(
+                    'SELECT identifier, data FROM state_changes '
+                    'WHERE identifier > ? AND identifier < ? '
+                    'ORDER BY identifier LIMIT ?',
+                    (self.compacted_up_to, snapshot_statechange_id, self.batch_size),
+                ).fetchall()
+
+                if not rows:
+                    break
+
+                batch_first = rows[0][0]
+                batch_last = rows[-1][0]
+
+                event_rows = self.storage.conn.execute(
+                    'SELECT identifier, source_statechange_id, block_number, data '
+                    'FROM state_events WHERE source_statechange_id BETWEEN ? AND ? '
+                    'ORDER BY identifier',
+                    (batch_first, batch_last),
+                ).fetchall()
+
+                if self.compact_events:
+                    removed_events = event_rows
+                    removed_state_changes = rows
+                else:
+                    removed_events = list()
+                    referenced = {event_row[1] for event_row in event_rows}
+                    removed_state_changes = [
+                        row
+                        for row in rows
+                        if row[0] not in referenced
+                    ]
+
+                if self.archive_directory is not None and removed_state_changes:
+                    if segment is None:
+                        first_identifier = removed_state_changes[0][0]
+                        partial_path = os.path.join(
+                            self.archive_directory,
+                            'segment-{:016d}{}{}'.format(
+                                first_identifier,
+                                SEGMENT_SUFFIX,
+                                PARTIAL_SUFFIX,
+                            ),
+                        )
+                        raw_segment = open(partial_path, 'wb')
+                        segment = gzip.GzipFile(fileobj=raw_segment, mode='wb')
+                        segment.write(SEGMENT_MAGIC)
+
+                    write_records(
+                        segment,
+                        RECORD_STATE_CHANGE,
+                        ((identifier, 0, 0, data) for identifier, data in removed_state_changes),
+                    )
+                    write_records(segment, RECORD_EVENT, removed_events)
+
+                    # the archive must be durable before the rows are deleted
+                    segment.flush(zlib.Z_SYNC_FLUSH)
+                    raw_segment.flush()
+                    os.fsync(raw_segment.fileno())
+
+                    last_identifier = removed_state_changes[-1][0]
+
+                with self.storage.transaction():
+                    self.storage.conn.executemany(
+                        'DELETE FROM state_events WHERE identifier = ?',
+                        ((event_row[0], ) for event_row in removed_events),
+                    )
+                    self.storage.conn.executemany(
+                        'DELETE FROM state_changes WHERE identifier = ?',
+                        ((row[0], ) for row in removed_state_changes),
+                    )
+
+                    # fetchall is required to free all the pages, each step
+                    # of the pragma frees a single one
+                    self.storage.conn.execute('PRAGMA incremental_vacuum').fetchall()
+
+                self.compacted_up_to = batch_last
+                result['state_changes'] += len(removed_state_changes)
+                result['state_events'] += len(removed_events)
+
+                # let the dispatch run between the batches
+                gevent.sleep(0)
+        finally:
+            if segment is not None:
+                segment.close()
+                raw_segment.close()
+
+        # if the compaction failed the segment is left with the partial
+        # suffix, it is still readable up to the last deleted batch
+        if segment is not None:
+            segment_path = os.path.join(
+                self.archive_directory,
+                'segment-{:016d}-{:016d}{}'.format(
+                    first_identifier,
+                    last_identifier,
+                    SEGMENT_SUFFIX,
+                ),
+            )
+            os.rename(partial_path, segment_path)
+
+        return result
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+""" Converts the data of an existing database to another serializer.
+
+Usage::
+
+    python -m raiden.storage.migrate_serializer --from pickle --to binary log.db
+
+The node must be stopped, all the tables are converted in a single
+transaction.
+"""
+import click
+
+from raiden.storage.serialize import SERIALIZERS
+from raiden.storage.sqlite import SQLiteStorage
+
+MIGRATED_TABLES = (
+    'state_changes',
+    'state_snapshot',
+    'state_events',
+)
+BATCH_SIZE = 1000
+
+
+def convert(data, from_serializer, to_serializer):
+    """ Return `data` encoded with `to_serializer`, data that is already in
+    the target format is returned unchanged, so a migration can be resumed.
+    """
+    try:
+        value = from_serializer.deserialize(data)
+    except Exception:  # pylint: disable=broad-except
+        # raises if the data is in neither format
+        to_serializer.deserialize(data)
+        return data
+
+    return to_serializer.serialize(value)
+
+
+def migrate_table(conn, table, from_serializer, to_serializer):
+    migrated = 0
+    last_identifier = -1
+
+    while True:
+        rows = conn.execute(
+            'SELECT identifier, data FROM {} WHERE identifier > ? '
+            'ORDER BY identifier LIMIT ?'.format(table),
+            (last_identifier, BATCH_SIZE),
+        ).fetchall()
+
+        if not rows:
+            return migrated
+
+        conn.executemany(
+            'UPDATE {} SET data = ? WHERE identifier = ?'.format(table),
+            [
+                (convert(data, from_serializer, to_serializer), identifier)
+                for identifier, data in rows
+            ],
+        )
+
+        migrated += len(rows)
+        last_identifier = rows[-1][0]
+
+
+def migrate_serializer(database_path, from_serializer, to_serializer):
+    """ Re-encode all the state changes, snapshots and events stored in the
+    database at `database_path`.
+
+    Returns a dictionary with the number of rows migrated per table.
+    """
+    # the indexed columns of a database created by a previous version are
+    # filled when it is opened, from the events in the source format
+    storage = SQLiteStorage(database_path, from_serializer)
+    result = dict()
+
+    with storage.transaction():
+        for table in MIGRATED_TABLES:
+            result[table] = migrate_table(
+                storage.conn,
+                table,
+                from_serializer,
+                to_serializer,
+            )
+
+    storage.conn.close()
+    return result
+
+
+@click.command()
+@click.option('--from', 'from_name', type=click.Choice(SERIALIZERS), default='pickle')
+@click.option('--to', 'to_name', type=click.Choice(SERIALIZERS), default='binary')
+@click.argument('database_path', type=click.Path(exists=True, dir_okay=False))
+def main(from_name, to_name, database_path):
+    result = migrate_serializer(
+        database_path,
+        SERIALIZERS[from_name](),
+        SERIALIZERS[to_name](),
+    )
+
+    for table, migrated in result.items():
+        click.echo('{}: {} rows migrated'.format(table, migrated))
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
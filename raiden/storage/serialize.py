@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import pickle
 
+from raiden.storage import binary
+
 
 class PickleSerializer:
     @staticmethod
@@ -10,3 +12,23 @@ class PickleSerializer:
     @staticmethod
     def deserialize(data):
         return pickle.loads(data)
+
+
+class BinarySerializer:
+    """ Compact and versioned encoding of the transfer objects, see
+    `raiden.storage.binary`.
+    """
+
+    @staticmethod
+    def serialize(transaction):
+        return binary.encode(transaction)
+
+    @staticmethod
+    def deserialize(data):
+        return binary.decode(data)
+
+
+SERIALIZERS = {
+    'pickle': PickleSerializer,
+    'binary': BinarySerializer,
+}
@@ -1,19 +1,126 @@
 # -*- coding: utf-8 -*-
+import os
 import sqlite3
 import threading
+from contextlib import contextmanager
 from typing import (
     Any,
     Optional,
     Tuple,
 )
+from urllib.request import pathname2url
+
+from gevent.queue import Queue
+from gevent.threadpool import ThreadPool
+
+# Number of rows read at once by the streaming queries
+DEFAULT_READ_CHUNK_SIZE = 1000
+
+EVENT_INDEX_COLUMNS = (
+    ('event_type', 'TEXT'),
+    ('channel_identifier', 'BINARY'),
+    ('token_address', 'BINARY'),
+    ('payment_identifier', 'INTEGER'),
+)
+
+
+def event_index_columns(event) -> Tuple:
+    """ Return the values of the indexed columns of `event`, the tuple
+    (event_type, channel_identifier, token_address, payment_identifier), the
+    values which don't apply to the event are None.
+    """
+    transfer = getattr(event, 'transfer', None)
+    balance_proof = getattr(event, 'balance_proof', None)
+    if balance_proof is None and transfer is not None:
+        balance_proof = transfer.balance_proof
+
+    channel_identifier = getattr(event, 'channel_identifier', None)
+    if channel_identifier is None and balance_proof is not None:
+        channel_identifier = balance_proof.channel_address
+
+    token_address = getattr(event, 'token', None) or getattr(event, 'token_address', None)
+    if token_address is None and transfer is not None:
+        token_address = transfer.token
+
+    payment_identifier = getattr(event, 'payment_identifier', None)
+    if payment_identifier is None and transfer is not None:
+        payment_identifier = transfer.payment_identifier
+    if payment_identifier is None:
+        # the EventTransfer*, EventUnlock* and EventWithdraw* events name the
+        # payment identifier `identifier`
+        payment_identifier = getattr(event, 'identifier', None)
+
+    return (
+        type(event).__name__,
+        channel_identifier,
+        token_address,
+        payment_identifier,
+    )
+
+
+class ReadConnectionPool:
+    """ A pool of read-only connections to the database at `database_path`,
+    used from the threads of a dedicated thread pool.
+
+    SQLite releases the GIL while it executes a statement, and with the
+    write-ahead journal readers don't block the writer, so queries run here
+    don't compete with the dispatch for the connection nor for the hub.
+    """
+
+    def __init__(self, database_path, size):
+        self.threadpool = ThreadPool(size)
+        self.connections = Queue()
+
+        uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(database_path)))
+        for _ in range(size):
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.text_factory = str
+            self.connections.put(conn)
+
+    def run(self, query):
+        # A connection is used by a single thread at a time
+        conn = self.connections.get()
+        try:
+            return self.threadpool.apply(query, (conn, ))
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        self.threadpool.kill()
+
+        while not self.connections.empty():
+            self.connections.get().close()
 
 
 class SQLiteStorage:
-    def __init__(self, database_path, serializer):
+    def __init__(self, database_path, serializer, read_pool_size=0):
+        """
+        Args:
+            read_pool_size: Number of read-only connections used by the
+                queries for the API, zero to use the writer connection.
+                In-memory databases can't be shared, so they always use the
+                writer connection.
+        """
+        # `close` is called by `__del__` even if the initialization fails
+        self.conn = None
+        self.read_pool = None
+
         conn = sqlite3.connect(database_path)
         conn.text_factory = str
         conn.execute('PRAGMA foreign_keys=ON')
 
+        # Lets the compaction return the pages of the pruned rows to the file
+        # system in small steps. This only applies to new databases, for
+        # existing ones the freed pages are reused by the new rows.
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+
+        # With a write-ahead journal a commit is a single append plus fsync to
+        # the journal file, instead of the rollback journal's writes to both
+        # the journal and the database. synchronous=FULL keeps commits durable,
+        # a Delivered message may only be sent once the state change is on disk.
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+
         with conn:
             cursor = conn.cursor()
             cursor.execute(
@@ -36,10 +143,18 @@ class SQLiteStorage:
                 '    source_statechange_id INTEGER NOT NULL, '
                 '    block_number INTEGER NOT NULL, '
                 '    data BINARY, '
+                '    event_type TEXT, '
+                '    channel_identifier BINARY, '
+                '    token_address BINARY, '
+                '    payment_identifier INTEGER, '
                 '    FOREIGN KEY(source_statechange_id) REFERENCES state_changes(identifier)'
                 ')'
             )
 
+        self.conn = conn
+        self.serializer = serializer
+        self.upgrade_state_events()
+
         # When writting to a table where the primary key is the identifier and we want
         # to return said identifier we use cursor.lastrowid, which uses sqlite's last_insert_rowid
         # https://github.com/python/cpython/blob/2.7/Modules/_sqlite/cursor.c#L727-L732
@@ -52,39 +167,143 @@ class SQLiteStorage:
         # TODO (If possible):
         # Improve on this and find a better way to protect against this potential race
         # condition.
-        self.write_lock = threading.Lock()
-        self.conn = conn
-        self.serializer = serializer
+        #
+        # The lock is reentrant so the write methods can be used inside of
+        # `transaction`.
+        self.write_lock = threading.RLock()
+        self.transaction_depth = 0
+
+        # Number of bytes written to the log by this instance, used by the
+        # snapshot policy
+        self.log_size = 0
+
+        if read_pool_size and database_path != ':memory:':
+            self.read_pool = ReadConnectionPool(database_path, read_pool_size)
+
+    def upgrade_state_events(self):
+        """ Add the indexed columns to a `state_events` table created by a
+        previous version, and fill them for the events without them.
+
+        Every written event has an `event_type`, so the fill is a no-op once
+        the table is upgraded.
+        """
+        cursor = self.conn.execute('PRAGMA table_info(state_events)')
+        existing_columns = {row[1] for row in cursor.fetchall()}
+        missing_columns = [
+            (name, column_type)
+            for name, column_type in EVENT_INDEX_COLUMNS
+            if name not in existing_columns
+        ]
+
+        with self.conn:
+            # sqlite3 doesn't open a transaction for ALTER TABLE, the columns
+            # must not be added if filling them fails
+            self.conn.execute('BEGIN')
+
+            for name, column_type in missing_columns:
+                self.conn.execute(
+                    'ALTER TABLE state_events ADD COLUMN {} {}'.format(name, column_type),
+                )
+
+            cursor = self.conn.execute(
+                'SELECT identifier, data FROM state_events WHERE event_type IS NULL',
+            )
+            rows = cursor.fetchall()
+            if rows:
+                self.conn.executemany(
+                    'UPDATE state_events SET '
+                    '    event_type = ?, channel_identifier = ?, token_address = ?, '
+                    '    payment_identifier = ? '
+                    'WHERE identifier = ?',
+                    [
+                        event_index_columns(self.serializer.deserialize(data)) + (identifier,)
+                        for identifier, data in rows
+                    ],
+                )
+
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_block_number '
+                'ON state_events(block_number)'
+            )
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_event_type '
+                'ON state_events(event_type, block_number)'
+            )
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_channel_identifier '
+                'ON state_events(channel_identifier, block_number)'
+            )
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_token_address '
+                'ON state_events(token_address, block_number)'
+            )
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_payment_identifier '
+                'ON state_events(payment_identifier)'
+            )
+            self.conn.execute(
+                'CREATE INDEX IF NOT EXISTS state_events_source_statechange_id '
+                'ON state_events(source_statechange_id)'
+            )
+
+    @contextmanager
+    def transaction(self):
+        """ Group all the writes done inside the context in a single
+        transaction, committed when the outermost context exits or rolled
+        back if it raises.
+        """
+        with self.write_lock:
+            self.transaction_depth += 1
+
+            try:
+                if self.transaction_depth == 1:
+                    with self.conn:
+                        yield
+                else:
+                    yield
+            finally:
+                self.transaction_depth -= 1
 
     def write_state_change(self, state_change):
         serialized_data = self.serializer.serialize(state_change)
 
-        with self.write_lock, self.conn:
+        with self.transaction():
             cursor = self.conn.execute(
                 'INSERT INTO state_changes(identifier, data) VALUES(null, ?)',
                 (serialized_data,)
             )
             last_id = cursor.lastrowid
 
+        self.log_size += len(serialized_data)
+
         return last_id
 
     def write_state_snapshot(self, statechange_id, snapshot):
-        # TODO: Snapshotting is not yet implemented. This is just skeleton code
-        # (Issue #682)
-        #
-        # This skeleton code assumes we only keep a single snapshot and
-        # overwrite it each time.
+        """ Save a snapshot of the state after the state change
+        `statechange_id` was applied.
+
+        Only the latest snapshot is needed to restore the node, the older ones
+        are removed in the same transaction.
+        """
         serialized_data = self.serializer.serialize(snapshot)
+        return self.write_serialized_state_snapshot(statechange_id, serialized_data)
 
-        with self.write_lock, self.conn:
+    def write_serialized_state_snapshot(self, statechange_id, serialized_data):
+        """ Save a snapshot already serialized with `self.serializer`, see
+        `write_state_snapshot`.
+        """
+        with self.transaction():
             cursor = self.conn.execute(
-                'INSERT OR REPLACE INTO state_snapshot('
-                '    identifier, statechange_id, data'
-                ') VALUES(?, ?, ?)',
-                (1, statechange_id, serialized_data)
+                'INSERT INTO state_snapshot(statechange_id, data) VALUES(?, ?)',
+                (statechange_id, serialized_data),
             )
             last_id = cursor.lastrowid
 
+            self.conn.execute(
+                'DELETE FROM state_snapshot WHERE identifier < ?',
+                (last_id,),
+            )
+
         return last_id
 
     def write_events(self, state_change_id, block_number, events):
@@ -96,32 +315,69 @@ class SQLiteStorage:
             events: List of Event objects.
         """
         events_data = [
-            (None, state_change_id, block_number, self.serializer.serialize(event))
+            (
+                None,
+                state_change_id,
+                block_number,
+                self.serializer.serialize(event),
+                *event_index_columns(event),
+            )
             for event in events
         ]
 
-        with self.write_lock, self.conn:
+        with self.transaction():
             self.conn.executemany(
                 'INSERT INTO state_events('
-                '   identifier, source_statechange_id, block_number, data'
-                ') VALUES(?, ?, ?, ?)',
+                '   identifier, source_statechange_id, block_number, data, '
+                '   event_type, channel_identifier, token_address, payment_identifier'
+                ') VALUES(?, ?, ?, ?, ?, ?, ?, ?)',
                 events_data,
             )
 
+        self.log_size += sum(len(event_data[3]) for event_data in events_data)
+
     def get_state_snapshot(self) -> Optional[Tuple[int, Any]]:
         """ Return the tuple of (last_applied_state_change_id, snapshot) or None"""
-        cursor = self.conn.execute('SELECT statechange_id, data from state_snapshot')
-        serialized = cursor.fetchall()
+        cursor = self.conn.execute(
+            'SELECT statechange_id, data FROM state_snapshot '
+            'ORDER BY identifier DESC LIMIT 1'
+        )
+        serialized = cursor.fetchone()
 
         result = None
         if serialized:
-            assert len(serialized) == 1
-            last_applied_state_change_id = serialized[0][0]
-            snapshot_state = self.serializer.deserialize(serialized[0][1])
-            return (last_applied_state_change_id, snapshot_state)
+            last_applied_state_change_id = serialized[0]
+            snapshot_state = self.serializer.deserialize(serialized[1])
+            result = (last_applied_state_change_id, snapshot_state)
 
         return result
 
+    def get_state_snapshot_statechange_id(self) -> Optional[int]:
+        """ Return the identifier of the last state change included in the
+        latest snapshot, without deserializing it.
+        """
+        cursor = self.conn.execute(
+            'SELECT statechange_id FROM state_snapshot '
+            'ORDER BY identifier DESC LIMIT 1'
+        )
+        result = cursor.fetchone()
+
+        if result:
+            return result[0]
+
+        return None
+
+    def get_latest_state_change_id(self) -> Optional[int]:
+        cursor = self.conn.execute(
+            'SELECT identifier FROM state_changes ORDER BY identifier DESC LIMIT 1',
+        )
+        result = cursor.fetchone()
+
+        if result:
+            return result[0]
+
+        return None
+
     def get_statechanges_by_identifier(self, from_identifier, to_identifier):
         if not (from_identifier == 'latest' or isinstance(from_identifier, int)):
             raise ValueError("from_identifier must be an integer or 'latest'")
@@ -156,6 +412,51 @@ class SQLiteStorage:
         ]
         return result
 
+    def count_statechanges(self, from_identifier) -> int:
+        """ Return the number of state changes with an identifier greater or
+        equal to `from_identifier`.
+        """
+        cursor = self.conn.execute(
+            'SELECT COUNT(*) FROM state_changes WHERE identifier >= ?',
+            (from_identifier, ),
+        )
+        return cursor.fetchone()[0]
+
+    def iterate_statechanges(self, from_identifier, chunk_size=DEFAULT_READ_CHUNK_SIZE):
+        """ Yield the state changes with an identifier greater or equal to
+        `from_identifier`, in order.
+
+        The rows are read `chunk_size` at a time and deserialized as they are
+        consumed, so at most one chunk of serialized data is held in memory,
+        independently of the size of the log.
+
+        Each chunk is a separate query continuing from the last identifier
+        read, instead of a cursor held open across the iteration, so the
+        connection can be used for writes by the consumer.
+        """
+        if not isinstance(from_identifier, int):
+            raise ValueError('from_identifier must be an integer')
+
+        last_identifier = from_identifier - 1
+
+        while True:
+            cursor = self.conn.execute(
+                'SELECT identifier, data FROM state_changes WHERE identifier > ? '
+                'ORDER BY identifier LIMIT ?',
+                (last_identifier, chunk_size),
+            )
+            rows = cursor.fetchall()
+
+            if not rows:
+                return
+
+            last_identifier = rows[-1][0]
+
+            for _, data in rows:
+                yield self.serializer.deserialize(data)
+
+            del rows
+
     def get_events_by_identifier(self, from_identifier, to_identifier):
         if not (from_identifier == 'latest' or isinstance(from_identifier, int)):
             raise ValueError("from_identifier must be an integer or 'latest'")
@@ -163,32 +464,36 @@ class SQLiteStorage:
         if not (to_identifier == 'latest' or isinstance(to_identifier, int)):
             raise ValueError("to_identifier must be an integer or 'latest'")
 
-        cursor = self.conn.cursor()
-
-        if from_identifier == 'latest':
-            assert to_identifier is None
-
-            cursor.execute(
-                'SELECT identifier FROM state_events ORDER BY identifier DESC LIMIT 1',
-            )
-            from_identifier = cursor.fetchone()
-
-        if to_identifier == 'latest':
-            cursor.execute(
-                'SELECT block_number, data FROM state_events WHERE identifier >= ?',
-                (from_identifier,)
-            )
-        else:
-            cursor.execute(
-                'SELECT block_number, data FROM state_events WHERE identifier '
-                'BETWEEN ? AND ?', (from_identifier, to_identifier)
-            )
+        def query(conn):
+            nonlocal from_identifier
+            cursor = conn.cursor()
 
-        result = [
-            (entry[0], self.serializer.deserialize(entry[1]))
-            for entry in cursor.fetchall()
-        ]
-        return result
+            if from_identifier == 'latest':
+                assert to_identifier is None
+
+                cursor.execute(
+                    'SELECT identifier FROM state_events ORDER BY identifier DESC LIMIT 1',
+                )
+                from_identifier = cursor.fetchone()
+
+            if to_identifier == 'latest':
+                cursor.execute(
+                    'SELECT block_number, data FROM state_events WHERE identifier >= ?',
+                    (from_identifier,)
+                )
+            else:
+                cursor.execute(
+                    'SELECT block_number, data FROM state_events WHERE identifier '
+                    'BETWEEN ? AND ?', (from_identifier, to_identifier)
+                )
+
+            result = [
+                (entry[0], self.serializer.deserialize(entry[1]))
+                for entry in cursor.fetchall()
+            ]
+            return result
+
+        return self.read(query)
 
     def get_events_by_block(self, from_block, to_block):
         if not (from_block == 'latest' or isinstance(from_block, int)):
@@ -197,35 +502,136 @@ class SQLiteStorage:
         if not (to_block == 'latest' or isinstance(to_block, int)):
             raise ValueError("to_block must be an integer or 'latest'")
 
-        cursor = self.conn.cursor()
+        def query(conn):
+            nonlocal from_block
+            cursor = conn.cursor()
 
-        if from_block is None:
-            from_block = 0
+            if from_block is None:
+                from_block = 0
+
+            if from_block == 'latest':
+                assert to_block is None
+
+                cursor.execute(
+                    'SELECT block_number FROM state_events ORDER BY block_number DESC LIMIT 1'
+                )
+                from_block = cursor.fetchone()
+
+            if to_block == 'latest':
+                cursor.execute(
+                    'SELECT block_number, data FROM state_events WHERE block_number >= ?',
+                    (from_block, )
+                )
+            else:
+                cursor.execute(
+                    'SELECT block_number, data FROM state_events WHERE block_number '
+                    'BETWEEN ? AND ?', (from_block, to_block)
+                )
+
+            result = [
+                (entry[0], self.serializer.deserialize(entry[1]))
+                for entry in cursor.fetchall()
+            ]
+            return result
+
+        return self.read(query)
+
+    def get_events(
+            self,
+            event_types=None,
+            channel_identifier=None,
+            token_address=None,
+            payment_identifier=None,
+            from_block=0,
+            to_block='latest',
+            include_unknown_channel=False,
+    ):
+        """ Return the list of (block_number, event) matching all the given
+        filters, in the order the events were produced.
+
+        The filters are applied by the database using the indexed columns, so
+        only the matching events are deserialized.
 
-        if from_block == 'latest':
-            assert to_block is None
+        Args:
+            event_types: Iterable of event class names, e.g.
+                ['EventTransferReceivedSuccess'].
+            channel_identifier: Channel the event refers to.
+            token_address: Token of the token network the event refers to.
+            payment_identifier: Payment the event refers to.
+            from_block: First block number, inclusive.
+            to_block: Last block number, inclusive, or 'latest'.
+            include_unknown_channel: Also match the events for which the
+                channel is not known, stored before the events recorded it
+                or which don't refer to a single channel, when filtering by
+                `channel_identifier`.
+        """
+        if not isinstance(from_block, int):
+            raise ValueError('from_block must be an integer')
 
-            cursor.execute(
-                'SELECT block_number FROM state_events ORDER BY block_number DESC LIMIT 1'
-            )
-            from_block = cursor.fetchone()
+        if not (to_block == 'latest' or isinstance(to_block, int)):
+            raise ValueError("to_block must be an integer or 'latest'")
 
-        if to_block == 'latest':
-            cursor.execute(
-                'SELECT block_number, data FROM state_events WHERE block_number >= ?',
-                (from_block, )
-            )
-        else:
-            cursor.execute(
-                'SELECT block_number, data FROM state_events WHERE block_number '
-                'BETWEEN ? AND ?', (from_block, to_block)
+        conditions = ['block_number >= ?']
+        parameters = [from_block]
+
+        if to_block != 'latest':
+            conditions.append('block_number <= ?')
+            parameters.append(to_block)
+
+        if event_types is not None:
+            event_types = list(event_types)
+            conditions.append('event_type IN ({})'.format(','.join('?' * len(event_types))))
+            parameters.extend(event_types)
+
+        if channel_identifier is not None and include_unknown_channel:
+            conditions.append('(channel_identifier = ? OR channel_identifier IS NULL)')
+            parameters.append(channel_identifier)
+        elif channel_identifier is not None:
+            conditions.append('channel_identifier = ?')
+            parameters.append(channel_identifier)
+
+        for column, value in (
+                ('token_address', token_address),
+                ('payment_identifier', payment_identifier)):
+            if value is not None:
+                conditions.append('{} = ?'.format(column))
+                parameters.append(value)
+
+        def query(conn):
+            cursor = conn.execute(
+                'SELECT block_number, data FROM state_events WHERE {} '
+                'ORDER BY identifier'.format(' AND '.join(conditions)),
+                parameters,
             )
 
-        result = [
-            (entry[0], self.serializer.deserialize(entry[1]))
-            for entry in cursor.fetchall()
-        ]
-        return result
+            result = [
+                (entry[0], self.serializer.deserialize(entry[1]))
+                for entry in cursor.fetchall()
+            ]
+            return result
+
+        return self.read(query)
+
+    def read(self, query):
+        """ Return the result of `query(connection)`.
+
+        With a read pool the query is run by a worker thread on a read-only
+        connection, the calling greenlet waits for it without blocking the
+        hub, so history queries don't delay the dispatch. `query` must only
+        read from the connection and must not use gevent.
+        """
+        if self.read_pool is None:
+            return query(self.conn)
+
+        return self.read_pool.run(query)
+
+    def close(self):
+        if self.read_pool is not None:
+            self.read_pool.close()
+            self.read_pool = None
+
+        if self.conn is not None:
+            self.conn.close()
 
     def __del__(self):
-        self.conn.close()
+        self.close()
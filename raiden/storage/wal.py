@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
+import time
 from collections import namedtuple
+from contextlib import contextmanager
+
+import gevent
+from gevent.event import AsyncResult
 
 from raiden.transfer.architecture import StateManager
 
@@ -8,36 +13,156 @@ InternalEvent = namedtuple(
     ('identifier', 'state_change_id', 'block_number', 'event_object'),
 )
 
+# Number of replayed state changes between two calls to the progress callback
+REPLAY_PROGRESS_STEP = 10000
+
+
+def restore_from_latest_snapshot(
+        transition_function,
+        storage,
+        snapshot_policy=None,
+        group_commit=False,
+        progress_callback=None,
+        compactor=None,
+):
+    """ Restore the state from the latest snapshot and replay the state
+    changes logged after it. Without a snapshot the whole log is replayed,
+    starting from no state.
+
+    The state changes are streamed from the storage while they are replayed,
+    so the memory used by the replay doesn't depend on the length of the log.
 
-def restore_from_latest_snapshot(transition_function, storage):
+    Args:
+        progress_callback: Optional callable, called with the number of
+            replayed state changes and the total to replay, every
+            `REPLAY_PROGRESS_STEP` state changes and once the replay is done.
+
+    Returns the tuple (wal, events), where events are the events produced by
+    the replayed state changes.
+    """
     events = list()
     snapshot = storage.get_state_snapshot()
 
     if snapshot:
         last_applied_state_change_id, state = snapshot
-        unapplied_state_changes = storage.get_statechanges_by_identifier(
-            from_identifier=last_applied_state_change_id,
-            to_identifier='latest',
-        )
     else:
-        state = None
-        unapplied_state_changes = list()
+        last_applied_state_change_id, state = 0, None
+
+    # The snapshot already includes the state change `last_applied_state_change_id`
+    first_unapplied_id = last_applied_state_change_id + 1
+    unapplied_state_changes = storage.iterate_statechanges(first_unapplied_id)
+
+    total = None
+    if progress_callback is not None:
+        total = storage.count_statechanges(first_unapplied_id)
 
     state_manager = StateManager(transition_function, state)
-    wal = WriteAheadLog(state_manager, storage)
+    wal = WriteAheadLog(state_manager, storage, snapshot_policy, group_commit, compactor)
 
+    replayed = 0
     for state_change in unapplied_state_changes:
         events.extend(state_manager.dispatch(state_change))
+        replayed += 1
+
+        if progress_callback is not None and replayed % REPLAY_PROGRESS_STEP == 0:
+            progress_callback(replayed, total)
+
+    if progress_callback is not None:
+        progress_callback(replayed, total)
+
+    wal.state_change_id = storage.get_latest_state_change_id()
+
+    # The replayed state changes count towards the next snapshot, so a long
+    # replay is not repeated on the next restart
+    wal.state_changes_since_snapshot = replayed
 
     return wal, events
 
 
+class SnapshotPolicy:
+    """ Decides when the `WriteAheadLog` should take a snapshot.
+
+    A snapshot is due once any of the limits is reached since the last one,
+    a limit set to None is disabled.
+
+    Args:
+        state_changes: Number of logged state changes.
+        interval: Number of seconds, this is only checked when a state change
+            is logged.
+        log_size: Number of bytes written to the log.
+    """
+
+    def __init__(self, state_changes=None, interval=None, log_size=None):
+        self.state_changes = state_changes
+        self.interval = interval
+        self.log_size = log_size
+
+    def is_due(self, state_changes, elapsed, log_size):
+        return (
+            (self.state_changes is not None and state_changes >= self.state_changes) or
+            (self.interval is not None and elapsed >= self.interval) or
+            (self.log_size is not None and log_size >= self.log_size)
+        )
+
+
+class StateChangeBatch:
+    """ The state changes dispatched while a `WriteAheadLog.batch` is open,
+    to be logged when it is closed.
+    """
+
+    def __init__(self, owner, previous_state):
+        self.owner = owner
+        self.previous_state = previous_state
+
+        # (state_change, block_number, events) in the order of the dispatch
+        self.dispatched = list()
+
+        # set once the batch is committed, other greenlets dispatching while
+        # the batch is open wait on it
+        self.committed = AsyncResult()
+
+
 class WriteAheadLog:
-    def __init__(self, state_manager, storage):
+    """ Logs the state changes before they are dispatched.
+
+    With `group_commit` the state changes logged concurrently, e.g. by the
+    greenlets handling the received messages, are written and dispatched in
+    a single transaction. Each caller is released once the transaction with
+    its state change is committed, so a batch of N messages costs one fsync
+    instead of N.
+
+    A greenlet can also dispatch an ordered batch of state changes, e.g. the
+    blockchain events of a poll, with `log_and_dispatch_batch` or inside a
+    `batch` block. The batch is logged in a single transaction.
+    """
+
+    def __init__(
+            self,
+            state_manager,
+            storage,
+            snapshot_policy=None,
+            group_commit=False,
+            compactor=None,
+    ):
         self.state_manager = state_manager
         self.state_change_id = None
         self.storage = storage
 
+        self.group_commit = group_commit
+        self.pending_state_changes = list()
+        self.commit_greenlet = None
+
+        self.snapshot_policy = snapshot_policy
+        self.snapshot_greenlet = None
+        self.state_changes_since_snapshot = 0
+        self.last_snapshot_time = time.monotonic()
+        self.last_snapshot_log_size = storage.log_size
+
+        self.compactor = compactor
+        self.compaction_greenlet = None
+
+        self.open_batch = None
+
     def log_and_dispatch(self, state_change, block_number):
         """ Log and apply a state change.
 
@@ -47,24 +172,288 @@ class WriteAheadLog:
 
         Events produced by applying state change are also saved.
         """
+        if self.open_batch is not None:
+            return self._dispatch_in_batch(state_change, block_number)
+
+        if not self.group_commit:
+            previous_state = self.state_manager.current_state
+            previous_state_change_id = self.state_change_id
+            previous_count = self.state_changes_since_snapshot
+
+            try:
+                with self.storage.transaction():
+                    events = self._log_and_dispatch(state_change, block_number)
+            except Exception:
+                # the transaction is rolled back, the state change must not
+                # be applied either
+                self.state_manager.current_state = previous_state
+                self.state_change_id = previous_state_change_id
+                self.state_changes_since_snapshot = previous_count
+                raise
+
+            self._maybe_snapshot()
+            return events
+
+        async_result = AsyncResult()
+        self.pending_state_changes.append((state_change, block_number, async_result))
+
+        if self.commit_greenlet is None or self.commit_greenlet.ready():
+            self.commit_greenlet = gevent.spawn(self._commit_pending)
+
+        return async_result.get()
+
+    def log_and_dispatch_batch(self, state_changes, block_number):
+        """ Apply the ordered `state_changes` and log them in a single
+        transaction.
+
+        Returns the list of events of each state change. If a state change
+        fails the previous ones are logged and the exception is raised.
+        """
+        with self.batch():
+            return [
+                self.log_and_dispatch(state_change, block_number)
+                for state_change in state_changes
+            ]
+
+    @contextmanager
+    def batch(self):
+        """ Log the state changes dispatched inside the block in a single
+        transaction, once the block exits.
+
+        The state changes are applied immediately, so the state read inside
+        the block includes them, but their events must not be acted upon
+        before the batch is committed: the state changes are not durable
+        until then. The block yields the `StateChangeBatch`, whose
+        `committed` result is set once they are.
+
+        State changes dispatched by other greenlets while the batch is open
+        are logged with it, in the order they were applied, and their callers
+        are released once the batch is committed.
+        """
+        current = gevent.getcurrent()
+
+        if self.open_batch is not None and self.open_batch.owner is current:
+            yield self.open_batch
+            return
+
+        # the state changes of the open batch and of the pending group commit
+        # must be logged in the order they were applied
+        while self.open_batch is not None:
+            self.open_batch.committed.wait()
+
+        if self.commit_greenlet is not None:
+            self.commit_greenlet.join()
+
+        batch = StateChangeBatch(current, self.state_manager.current_state)
+        self.open_batch = batch
+
+        try:
+            yield batch
+        finally:
+            self.open_batch = None
+            self._commit_open_batch(batch)
+
+    def _dispatch_in_batch(self, state_change, block_number):
+        batch = self.open_batch
+        events = self.state_manager.dispatch(state_change)
+        batch.dispatched.append((state_change, block_number, events))
+
+        if batch.owner is not gevent.getcurrent():
+            batch.committed.get()
+
+        return events
+
+    def _commit_open_batch(self, batch):
+        previous_state_change_id = self.state_change_id
+        previous_count = self.state_changes_since_snapshot
+
+        try:
+            with self.storage.transaction():
+                for state_change, block_number, events in batch.dispatched:
+                    state_change_id = self.storage.write_state_change(state_change)
+                    self.storage.write_events(state_change_id, block_number, events)
+
+                    self.state_change_id = state_change_id
+                    self.state_changes_since_snapshot += 1
+        except Exception as e:  # pylint: disable=broad-except
+            # nothing was logged, none of the state changes must be applied
+            self.state_manager.current_state = batch.previous_state
+            self.state_change_id = previous_state_change_id
+            self.state_changes_since_snapshot = previous_count
+            batch.committed.set_exception(e)
+            raise
+
+        batch.committed.set(None)
+        self._maybe_snapshot()
+
+    def _log_and_dispatch(self, state_change, block_number):
         state_change_id = self.storage.write_state_change(state_change)
 
         events = self.state_manager.dispatch(state_change)
 
         self.state_change_id = state_change_id
         self.storage.write_events(state_change_id, block_number, events)
+        self.state_changes_since_snapshot += 1
 
         return events
 
+    def _commit_pending(self):
+        """ Write and dispatch the pending state changes in batches, until
+        there are none left.
+        """
+        while self.pending_state_changes:
+            batch = self.pending_state_changes
+            self.pending_state_changes = list()
+
+            error = self._commit_batch(batch)
+
+            if error is not None and len(batch) == 1:
+                batch[0][2].set_exception(error)
+
+            elif error is not None:
+                # Don't fail the whole batch because of a single state
+                # change, retry them one by one
+                for item in batch:
+                    error = self._commit_batch([item])
+
+                    if error is not None:
+                        item[2].set_exception(error)
+
+            self._maybe_snapshot()
+
+    def _commit_batch(self, batch):
+        """ Write and dispatch `batch` in one transaction and release the
+        callers. If any of the state changes fail the transaction is rolled
+        back and the exception returned.
+        """
+        # The states are never modified once produced, so rolling back the
+        # dispatch only requires restoring the previous state
+        previous_state = self.state_manager.current_state
+        previous_state_change_id = self.state_change_id
+        previous_count = self.state_changes_since_snapshot
+
+        results = list()
+        try:
+            with self.storage.transaction():
+                for state_change, block_number, async_result in batch:
+                    events = self._log_and_dispatch(state_change, block_number)
+                    results.append((async_result, events))
+        except Exception as e:  # pylint: disable=broad-except
+            self.state_manager.current_state = previous_state
+            self.state_change_id = previous_state_change_id
+            self.state_changes_since_snapshot = previous_count
+            return e
+
+        for async_result, events in results:
+            async_result.set(events)
+
+        return None
+
+    def _maybe_snapshot(self):
+        if self.is_snapshot_due():
+            self.snapshot_async()
+
+    def is_snapshot_due(self):
+        if self.snapshot_policy is None:
+            return False
+
+        return self.snapshot_policy.is_due(
+            self.state_changes_since_snapshot,
+            time.monotonic() - self.last_snapshot_time,
+            self.storage.log_size - self.last_snapshot_log_size,
+        )
+
+    def snapshot_async(self):
+        """ Snapshot the application state in a new greenlet.
+
+        The state transitions never change a state once it is produced, so the
+        current state can be serialized after the caller has handled the
+        events of the state change, instead of while doing it. For the same
+        reason it is serialized in the hub's threadpool, the other greenlets
+        keep running meanwhile.
+
+        Once the snapshot is written the log is compacted in another
+        greenlet, see `compact_async`.
+
+        Returns the snapshot greenlet, or None if no snapshot was started.
+        """
+        pending = self.snapshot_greenlet is not None and not self.snapshot_greenlet.ready()
+
+        # the current state includes the state changes of the open batch,
+        # which are not logged yet
+        if pending or self.open_batch is not None:
+            return None
+
+        # otherwise no state change was dispatched
+        if not self.state_change_id:
+            return None
+
+        self.snapshot_greenlet = gevent.spawn(
+            self._write_snapshot,
+            self.state_change_id,
+            self.state_manager.current_state,
+        )
+        self._snapshot_taken()
+
+        return self.snapshot_greenlet
+
+    def _write_snapshot(self, state_change_id, state):
+        threadpool = gevent.get_hub().threadpool
+        serialized_data = threadpool.apply(self.storage.serializer.serialize, (state,))
+
+        # the connection is only used from the hub's thread
+        self.storage.write_serialized_state_snapshot(state_change_id, serialized_data)
+
+        # the state changes before the snapshot are not needed to restore the
+        # node anymore
+        self.compact_async()
+
+    def compact_async(self):
+        """ Remove the state changes and events covered by the latest
+        snapshot in a new greenlet.
+
+        Returns the compaction greenlet, or None if there is no compactor or
+        a compaction is still running, the next snapshot will compact what
+        that one misses.
+        """
+        if self.compactor is None:
+            return None
+
+        if self.compaction_greenlet is not None and not self.compaction_greenlet.ready():
+            return None
+
+        self.compaction_greenlet = gevent.spawn(self.compactor.compact)
+        return self.compaction_greenlet
+
     def snapshot(self):
         """ Snapshot the application state.
 
         Snapshots are used to restore the application state, either after a
         restart or a crash.
         """
+        if self.commit_greenlet is not None:
+            self.commit_greenlet.join()
+
+        if self.snapshot_greenlet is not None:
+            self.snapshot_greenlet.join()
+
+        current = gevent.getcurrent()
+        while self.open_batch is not None and self.open_batch.owner is not current:
+            self.open_batch.committed.wait()
+
+        # the state includes the state changes of the caller's open batch
+        if self.open_batch is not None:
+            return
+
         current_state = self.state_manager.current_state
         state_change_id = self.state_change_id
 
         # otherwise no state change was dispatched
         if state_change_id:
             self.storage.write_state_snapshot(state_change_id, current_state)
+            self._snapshot_taken()
+
+    def _snapshot_taken(self):
+        self.state_changes_since_snapshot = 0
+        self.last_snapshot_time = time.monotonic()
+        self.last_snapshot_log_size = self.storage.log_size
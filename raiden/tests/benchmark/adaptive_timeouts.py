@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+""" Simulates peers with different round trip times over a lossy link and
+compares the fixed retransmission timeouts with the timeouts adapted to the
+round trip time of each peer.
+
+Reports the sends per message (1.0 means no duplicates) and the latency
+from queueing a message to its acknowledgement.
+"""
+import time
+
+from gevent.event import AsyncResult
+
+from raiden.network.protocol import QueueSender
+from raiden.network.scheduler import RetryScheduler
+from raiden.network.transport import RoundTripTimeEstimator
+from raiden.settings import (
+    DEFAULT_PROTOCOL_RETRIES_BEFORE_BACKOFF,
+    DEFAULT_PROTOCOL_SCHEDULER_WHEEL_SIZE,
+)
+from raiden.tests.benchmark.udp_window import Healthy, LossyLink
+from raiden.tests.utils import factories
+
+PEERS = (
+    ('lan', 0.002),
+    ('wan', 0.08),
+    ('slow', 0.6),
+)
+
+
+class FixedTimeout(RoundTripTimeEstimator):
+    """ Ignores the samples and the expirations, the timeout is always the
+    initial timeout.
+    """
+
+    def update(self, sample):
+        pass
+
+    def expired(self, timeout):
+        pass
+
+
+def simulate(round_trip_time, adaptive, args):
+    scheduler = RetryScheduler(0.005, DEFAULT_PROTOCOL_SCHEDULER_WHEEL_SIZE, 1)
+    link = LossyLink(round_trip_time, args.loss, args.messages, scheduler, jitter=0.2)
+
+    estimator_class = RoundTripTimeEstimator if adaptive else FixedTimeout
+    roundtrip = estimator_class(
+        args.retry_interval,
+        args.retry_timeout_min,
+        args.retry_interval * 10,
+    )
+    queue_sender = QueueSender(
+        link,
+        factories.HOP1,
+        Healthy(),
+        roundtrip,
+        args.window,
+        DEFAULT_PROTOCOL_RETRIES_BEFORE_BACKOFF,
+    )
+    scheduler.start()
+
+    latencies = list()
+
+    def acknowledged(queued_at):
+        latencies.append(time.monotonic() - queued_at)
+
+    for message_id in range(args.messages):
+        async_result = link.messageids_to_asyncresults[message_id] = AsyncResult()
+        async_result.rawlink(lambda _, queued_at=time.monotonic(): acknowledged(queued_at))
+        queue_sender.put(b'data', message_id)
+
+    for message_id in range(args.messages):
+        link.messageids_to_asyncresults[message_id].wait()
+
+    scheduler.stop()
+
+    return link.sent / args.messages, sum(latencies) / len(latencies), roundtrip.timeout
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', default=100, type=int)
+    parser.add_argument('--window', default=16, type=int)
+    parser.add_argument('--loss', default=0.05, type=float)
+    parser.add_argument('--retry-interval', default=0.2, type=float)
+    parser.add_argument('--retry-timeout-min', default=0.01, type=float)
+    args = parser.parse_args()
+
+    print('{:>6} {:>10} {:>10} {:>12} {:>10}'.format(
+        'peer',
+        'timeouts',
+        'sends/msg',
+        'latency',
+        'timeout',
+    ))
+
+    for name, round_trip_time in PEERS:
+        for adaptive in (False, True):
+            sends, latency, timeout = simulate(round_trip_time, adaptive, args)
+            print('{:>6} {:>10} {:>10.2f} {:>10.1f}ms {:>8.1f}ms'.format(
+                name,
+                'adaptive' if adaptive else 'fixed',
+                sends,
+                latency * 1000,
+                timeout * 1000,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+""" Measures the time to log and dispatch the blockchain events of a poll,
+one transaction per state change against a single transaction per poll.
+"""
+import os
+import tempfile
+import time
+
+from raiden.storage.serialize import PickleSerializer
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.storage.wal import WriteAheadLog
+from raiden.tests.benchmark.dispatch_speed import make_node_state
+from raiden.transfer import node
+from raiden.transfer.architecture import StateManager
+from raiden.transfer.state_change import Block
+
+
+def bench_poll(batched, events_per_poll, polls):
+    node_state, _ = make_node_state(10)
+
+    with tempfile.TemporaryDirectory() as database_dir:
+        storage = SQLiteStorage(os.path.join(database_dir, 'log.db'), PickleSerializer())
+        state_manager = StateManager(node.state_transition, node_state)
+        wal = WriteAheadLog(state_manager, storage)
+
+        block_number = node_state.block_number
+        start = time.perf_counter()
+
+        for _ in range(polls):
+            state_changes = list()
+            for _ in range(events_per_poll):
+                block_number += 1
+                state_changes.append(Block(block_number))
+
+            if batched:
+                wal.log_and_dispatch_batch(state_changes, block_number)
+            else:
+                for state_change in state_changes:
+                    wal.log_and_dispatch(state_change, block_number)
+
+        elapsed = time.perf_counter() - start
+        storage.close()
+
+    return elapsed / (polls * events_per_poll)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events-per-poll', default='1,10,100')
+    parser.add_argument('--polls', default=20, type=int)
+    args = parser.parse_args()
+
+    print('{:>10} {:>16} {:>16} {:>8}'.format('events', 'individual', 'batched', 'speedup'))
+
+    for events_per_poll in map(int, args.events_per_poll.split(',')):
+        individual = bench_poll(False, events_per_poll, args.polls)
+        batched = bench_poll(True, events_per_poll, args.polls)
+        print('{:>10} {:>12.3f}ms/sc {:>12.3f}ms/sc {:>7.1f}x'.format(
+            events_per_poll,
+            individual * 1000,
+            batched * 1000,
+            individual / batched,
+        ))
+
+
+if __name__ == '__main__':
+    main()
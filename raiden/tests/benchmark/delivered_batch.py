@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+""" Compares the cost of acknowledging a burst of messages with a Delivered
+per message and with DeliveredBatch messages.
+
+The receiver signs and encodes the acknowledgements, the sender decodes
+them and recovers the signer.
+"""
+import time
+
+from raiden.constants import DELIVERED_BATCH_MAX_IDENTIFIERS
+from raiden.messages import decode, Delivered, DeliveredBatch
+from raiden.tests.utils.factories import make_privkey_address
+
+
+def make_acknowledgements(message_ids, batched):
+    if not batched:
+        return [Delivered(message_id) for message_id in message_ids]
+
+    return [
+        DeliveredBatch(message_ids[start:start + DELIVERED_BATCH_MAX_IDENTIFIERS])
+        for start in range(0, len(message_ids), DELIVERED_BATCH_MAX_IDENTIFIERS)
+    ]
+
+
+def bench_acknowledgements(burst, batched):
+    private_key, address = make_privkey_address()
+    message_ids = list(range(burst))
+
+    start = time.perf_counter()
+    datagrams = list()
+    for acknowledgement in make_acknowledgements(message_ids, batched):
+        acknowledgement.sign(private_key, address)
+        datagrams.append(acknowledgement.encode())
+    receiver = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for data in datagrams:
+        assert decode(data).sender == address
+    sender = time.perf_counter() - start
+
+    return len(datagrams), sum(map(len, datagrams)), receiver, sender
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bursts', default='1,8,32,256')
+    args = parser.parse_args()
+
+    print('{:>8} {:>10} {:>10} {:>10} {:>12} {:>12}'.format(
+        'burst',
+        'acks',
+        'datagrams',
+        'bytes',
+        'receiver',
+        'sender',
+    ))
+
+    for burst in map(int, args.bursts.split(',')):
+        for batched in (False, True):
+            datagrams, size, receiver, sender = bench_acknowledgements(burst, batched)
+            print('{:>8} {:>10} {:>10} {:>10} {:>10.2f}ms {:>10.2f}ms'.format(
+                burst,
+                'batched' if batched else 'single',
+                datagrams,
+                size,
+                receiver * 1000,
+                sender * 1000,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+""" Measures the cost of `StateManager.dispatch` as the number of channels
+grows.
+
+The dispatch cost must depend on the part of the state changed by the state
+change, not on the size of the node state, the `deepcopy` column shows the
+cost of copying the whole state for comparison.
+"""
+import random
+import time
+from copy import deepcopy
+
+import networkx
+
+from raiden.tests.utils import factories
+from raiden.transfer import node
+from raiden.transfer.architecture import StateManager
+from raiden.transfer.state import (
+    NodeState,
+    PaymentNetworkState,
+    TokenNetworkGraphState,
+    TokenNetworkState,
+    TransactionChannelNewBalance,
+)
+from raiden.transfer.state_change import (
+    Block,
+    ContractReceiveChannelNewBalance,
+    ReceiveDelivered,
+)
+
+PAYMENT_NETWORK_ADDRESS = b'registryregistryregi'
+TOKEN_NETWORK_ADDRESS = b'networknetworknetwor'
+TOKEN_ADDRESS = b'tokentokentokentoken'
+
+
+def make_node_state(number_of_channels):
+    our_address = factories.make_address()
+    graph = networkx.Graph()
+    channels = list()
+
+    for _ in range(number_of_channels):
+        channel_state = factories.make_channel(
+            our_balance=100,
+            partner_balance=100,
+            our_address=our_address,
+            token_address=TOKEN_ADDRESS,
+        )
+        graph.add_edge(our_address, channel_state.partner_state.address)
+        channels.append(channel_state)
+
+    token_network_state = TokenNetworkState(
+        TOKEN_NETWORK_ADDRESS,
+        TOKEN_ADDRESS,
+        TokenNetworkGraphState(graph),
+        channels,
+    )
+    payment_network_state = PaymentNetworkState(
+        PAYMENT_NETWORK_ADDRESS,
+        [token_network_state],
+    )
+
+    node_state = NodeState(random.Random(), 1)
+    node_state.identifiers_to_paymentnetworks[PAYMENT_NETWORK_ADDRESS] = payment_network_state
+
+    return node_state, channels
+
+
+def measure(function, repetitions):
+    start = time.time()
+
+    for _ in range(repetitions):
+        function()
+
+    return (time.time() - start) / repetitions
+
+
+def bench_dispatch(number_of_channels, repetitions):
+    node_state, channels = make_node_state(number_of_channels)
+    state_manager = StateManager(node.state_transition, node_state)
+
+    block_number = [1]
+
+    def dispatch_block():
+        block_number[0] += 1
+        state_manager.dispatch(Block(block_number[0]))
+
+    def dispatch_delivered():
+        state_manager.dispatch(ReceiveDelivered(random.randint(0, 2 ** 64)))
+
+    def dispatch_deposit():
+        channel_state = random.choice(channels)
+        deposit = TransactionChannelNewBalance(
+            channel_state.our_state.address,
+            channel_state.our_state.contract_balance + 1,
+            block_number[0],
+        )
+        state_change = ContractReceiveChannelNewBalance(
+            PAYMENT_NETWORK_ADDRESS,
+            TOKEN_ADDRESS,
+            channel_state.identifier,
+            deposit,
+        )
+        state_manager.dispatch(state_change)
+
+    def copy_state():
+        deepcopy(state_manager.current_state)
+
+    return (
+        measure(dispatch_block, repetitions),
+        measure(dispatch_delivered, repetitions),
+        measure(dispatch_deposit, repetitions),
+        measure(copy_state, repetitions),
+    )
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', default='10,100,1000,10000')
+    parser.add_argument('--repetitions', default=100, type=int)
+    args = parser.parse_args()
+
+    print('{:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+        'channels',
+        'Block',
+        'Delivered',
+        'NewBalance',
+        'deepcopy',
+    ))
+
+    for number_of_channels in map(int, args.channels.split(',')):
+        timings = bench_dispatch(number_of_channels, args.repetitions)
+        print('{:>10} {:>10.1f}us {:>10.1f}us {:>10.1f}us {:>10.1f}us'.format(
+            number_of_channels,
+            *(timing * 1e6 for timing in timings)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+""" Measures the handling of a `Block` by a mediator task for a growing
+number of transfer pairs, with a single pair expiring in the block.
+"""
+import time
+
+from raiden.tests.utils import factories
+from raiden.transfer.mediated_transfer import mediator
+from raiden.transfer.mediated_transfer.state import MediationPairState, MediatorTransferState
+from raiden.transfer.state_change import Block
+
+
+def make_mediator_state(number_of_pairs, first_expiration):
+    payer_channel = factories.make_channel(reveal_timeout=10)
+    channelmap = {payer_channel.identifier: payer_channel}
+
+    mediator_state = MediatorTransferState(factories.UNIT_SECRETHASH)
+    for position in range(number_of_pairs):
+        payer_expiration = first_expiration + 100 + position
+        payer_transfer = factories.make_signed_transfer(
+            10,
+            factories.UNIT_TRANSFER_INITIATOR,
+            factories.UNIT_TRANSFER_TARGET,
+            payer_expiration,
+            factories.UNIT_SECRET,
+            channel_identifier=payer_channel.identifier,
+        )
+        payee_transfer = factories.make_transfer(
+            10,
+            factories.UNIT_TRANSFER_INITIATOR,
+            factories.UNIT_TRANSFER_TARGET,
+            # the payee lock of the first pair expires first
+            first_expiration + position * 10,
+            factories.UNIT_SECRET,
+        )
+        mediator_state.transfers_pair.append(
+            MediationPairState(payer_transfer, factories.HOP2, payee_transfer),
+        )
+
+    return channelmap, mediator_state
+
+
+def bench_block(number_of_pairs, rounds, indexed):
+    first_expiration = 50
+    elapsed = 0.0
+
+    for _ in range(rounds):
+        channelmap, mediator_state = make_mediator_state(number_of_pairs, first_expiration)
+        if indexed:
+            mediator.update_pairs_deadlines(channelmap, mediator_state, 1)
+
+        block_number = first_expiration + 1
+        start = time.perf_counter()
+        iteration = mediator.handle_block(
+            channelmap,
+            mediator_state,
+            Block(block_number),
+            block_number,
+        )
+        mediator.get_next_block_due(channelmap, iteration.new_state, block_number)
+        elapsed += time.perf_counter() - start
+
+        assert len(iteration.events) == 1
+
+    return elapsed / rounds
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pairs', default='1,10,100,1000')
+    parser.add_argument('--rounds', default=50, type=int)
+    args = parser.parse_args()
+
+    print('{:>8} {:>14} {:>14}'.format('pairs', 'all pairs', 'indexed'))
+
+    for number_of_pairs in map(int, args.pairs.split(',')):
+        # without the index the mediator computes it on the first Block
+        full = bench_block(number_of_pairs, args.rounds, indexed=False)
+        indexed = bench_block(number_of_pairs, args.rounds, indexed=True)
+        print('{:>8} {:>12.1f}us {:>12.1f}us'.format(
+            number_of_pairs,
+            full * 1e6,
+            indexed * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
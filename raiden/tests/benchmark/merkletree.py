@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+""" Measures adding and removing a lock of a channel end with a growing number
+of pending locks, recomputing the merkle tree from its leaves against
+updating it, and the computation of a proof.
+"""
+import random
+import time
+
+from raiden.transfer.merkle_tree import (
+    LEAVES,
+    compute_layers,
+    compute_layers_with,
+    compute_layers_without,
+    compute_merkleproof_for,
+)
+from raiden.transfer.state import MerkleTreeState
+from raiden.utils import sha3
+
+
+def per_operation(function, elements):
+    start = time.perf_counter()
+    for element in elements:
+        function(element)
+    return (time.perf_counter() - start) / len(elements)
+
+
+def bench_tree(number_of_locks, operations):
+    leaves = [sha3(str(value).encode()) for value in range(number_of_locks)]
+    layers = compute_layers(leaves)
+    tree = MerkleTreeState(layers)
+
+    new_leaves = [sha3(b'new' + str(value).encode()) for value in range(operations)]
+    old_leaves = random.sample(leaves, operations)
+
+    def full_add(leaf):
+        compute_layers(layers[LEAVES] + [leaf])
+
+    def full_remove(leaf):
+        remaining = list(layers[LEAVES])
+        remaining.remove(leaf)
+        compute_layers(remaining)
+
+    def list_proof(leaf):
+        # the leaf lookup before the position index
+        layers[LEAVES].index(leaf)
+        compute_merkleproof_for(tree, leaf)
+
+    return (
+        per_operation(full_add, new_leaves),
+        per_operation(lambda leaf: compute_layers_with(layers, leaf), new_leaves),
+        per_operation(full_remove, old_leaves),
+        per_operation(lambda leaf: compute_layers_without(layers, leaf), old_leaves),
+        per_operation(list_proof, old_leaves),
+        per_operation(lambda leaf: compute_merkleproof_for(tree, leaf), old_leaves),
+    )
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--locks', default='10,100,1000,10000')
+    parser.add_argument('--operations', default=100, type=int)
+    args = parser.parse_args()
+
+    print('{:>8} {:>20} {:>20} {:>20}'.format('locks', 'add', 'remove', 'proof'))
+
+    for number_of_locks in map(int, args.locks.split(',')):
+        operations = min(args.operations, number_of_locks)
+        results = bench_tree(number_of_locks, operations)
+        print('{:>8} {}'.format(
+            number_of_locks,
+            ' '.join(
+                '{:>8.1f} -> {:>6.1f}us'.format(before * 1e6, after * 1e6)
+                for before, after in zip(results[::2], results[1::2])
+            ),
+        ))
+
+
+if __name__ == '__main__':
+    main()
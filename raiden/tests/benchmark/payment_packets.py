@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+""" Counts the datagrams of the messages of a direct payment between two
+UDPTransports over the loopback interface, with and without bundling the
+messages for the same node in a datagram.
+
+The nodes answer with the next message of the payment instead of running
+the state machines:
+
+    LockedTransfer -> SecretRequest -> RevealSecret -> RevealSecret -> Secret
+"""
+import random
+import time
+from contextlib import contextmanager
+
+import gevent
+from coincurve import PrivateKey
+from gevent import socket
+from gevent.event import Event
+
+from raiden.app import App
+from raiden.constants import UINT64_MAX
+from raiden.messages import LockedTransfer, RevealSecret, Secret, SecretRequest
+from raiden.network.protocol import UDPTransport
+from raiden.network.transport import DummyPolicy
+from raiden.tests.utils.messages import make_mediated_transfer
+from raiden.utils import privatekey_to_address, sha3
+
+SECRET = sha3(b'secret')
+SECRETHASH = sha3(SECRET)
+
+
+def random_identifier():
+    return random.randint(0, UINT64_MAX)
+
+
+class PaymentNode:
+    """ Stands in for the RaidenService. """
+
+    def __init__(self, seed):
+        self.private_key = PrivateKey(sha3(seed))
+        self.address = privatekey_to_address(self.private_key.secret)
+        self.payment_finished = Event()
+
+    def sign(self, message):
+        message.sign(self.private_key, self.address)
+
+    def handle_state_change(self, state_change):  # pylint: disable=unused-argument,no-self-use
+        return list()
+
+    def handle_state_changes(self, state_changes):  # pylint: disable=unused-argument,no-self-use
+        return list()
+
+    @contextmanager
+    def batch_state_changes(self):  # pylint: disable=no-self-use
+        yield
+
+
+def answer(message, is_initiator):
+    """ Return the next message of the payment, None once it's finished. """
+    # pylint: disable=unidiomatic-typecheck
+    if type(message) == LockedTransfer:
+        return SecretRequest(random_identifier(), 0, SECRETHASH, 1)
+
+    if type(message) == SecretRequest:
+        return RevealSecret(random_identifier(), SECRET)
+
+    if type(message) == RevealSecret and not is_initiator:
+        return RevealSecret(random_identifier(), SECRET)
+
+    if type(message) == RevealSecret:
+        channel = message.sender
+        return Secret(random_identifier(), 0, 2, channel, 1, 0, SECRETHASH, SECRET)
+
+    return None
+
+
+class PaymentTransport(UDPTransport):
+    def __init__(self, *args, is_initiator, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_initiator = is_initiator
+        self.datagrams = 0
+
+    def maybe_sendraw(self, host_port, messagedata):
+        self.datagrams += 1
+        super().maybe_sendraw(host_port, messagedata)
+
+    def receive_message(self, message, acknowledgements=None):
+        reply = answer(message, self.is_initiator)
+        if reply is not None:
+            self.raiden.sign(reply)
+            self.send_async(b'channel', message.sender, reply)
+        else:
+            self.raiden.payment_finished.set()
+
+        if acknowledgements is None:
+            self.acknowledge(message.sender, message.message_identifier)
+        else:
+            acknowledgements.append((message.sender, message.message_identifier))
+
+
+def make_nodes(bundling):
+    discovery = dict()
+    config = dict(App.DEFAULT_CONFIG['protocol'])
+    config['nat_keepalive_timeout'] = 60
+    config['bundle_messages'] = bundling
+
+    transports = list()
+    for seed in (b'initiator', b'target'):
+        udpsocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udpsocket.bind(('127.0.0.1', 0))
+
+        raiden = PaymentNode(seed)
+        discovery[raiden.address] = udpsocket.getsockname()
+
+        transport = PaymentTransport(
+            discovery,
+            udpsocket,
+            DummyPolicy(),
+            config,
+            is_initiator=seed == b'initiator',
+        )
+        transport.start(raiden, dict())
+        transports.append(transport)
+
+    return transports
+
+
+def bench_payments(payments, bundling):
+    initiator, target = make_nodes(bundling)
+
+    start = time.time()
+    for _ in range(payments):
+        target.raiden.payment_finished.clear()
+
+        locked_transfer = make_mediated_transfer(
+            message_identifier=random_identifier(),
+            recipient=target.raiden.address,
+            target=target.raiden.address,
+            initiator=initiator.raiden.address,
+        )
+        initiator.raiden.sign(locked_transfer)
+        initiator.send_async(b'channel', target.raiden.address, locked_transfer)
+
+        target.raiden.payment_finished.wait()
+
+    # wait for the last Delivered
+    gevent.sleep(0.1)
+    elapsed = time.time() - start
+
+    datagrams = initiator.datagrams + target.datagrams
+    for transport in (initiator, target):
+        transport.stop_and_wait()
+
+    return datagrams / payments, elapsed / payments
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--payments', default=100, type=int)
+    args = parser.parse_args()
+
+    print('{:>10} {:>18} {:>12}'.format('bundling', 'datagrams/payment', 'latency'))
+
+    for bundling in (False, True):
+        datagrams, latency = bench_payments(args.payments, bundling)
+        print('{:>10} {:>18.2f} {:>10.1f}ms'.format(
+            'on' if bundling else 'off',
+            datagrams,
+            latency * 1000,
+        ))
+
+
+if __name__ == '__main__':
+    main()
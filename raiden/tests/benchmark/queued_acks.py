@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+""" Measures the dispatch of `ReceiveDelivered` and `ReceiveProcessed` for a
+growing number of messages waiting for an acknowledgement in the node queues.
+"""
+import random
+import time
+
+from raiden.tests.benchmark.dispatch_speed import make_node_state
+from raiden.tests.utils import factories
+from raiden.transfer import node
+from raiden.transfer.architecture import StateManager
+from raiden.transfer.events import SendProcessed
+from raiden.transfer.state_change import ReceiveDelivered, ReceiveProcessed
+
+
+def make_queues(number_of_messages, number_of_queues):
+    recipients = [factories.make_address() for _ in range(number_of_queues)]
+    queueids_to_queues = {
+        (recipient, 'global'): list()
+        for recipient in recipients
+    }
+
+    message_identifiers = random.sample(range(2 ** 62), number_of_messages)
+    for position, message_identifier in enumerate(message_identifiers):
+        recipient = recipients[position % number_of_queues]
+        queueids_to_queues[(recipient, 'global')].append(
+            SendProcessed(recipient, 'global', message_identifier),
+        )
+
+    return queueids_to_queues, message_identifiers
+
+
+def percentile(values, fraction):
+    return sorted(values)[int(len(values) * fraction)]
+
+
+def bench_acks(number_of_messages, number_of_queues, acks):
+    node_state, _ = make_node_state(10)
+    queueids_to_queues, message_identifiers = make_queues(number_of_messages, number_of_queues)
+    node_state.queueids_to_queues = queueids_to_queues
+
+    state_manager = StateManager(node.state_transition, node_state)
+
+    # the first transition builds the indexes of the node state
+    state_manager.dispatch(ReceiveProcessed(-1))
+
+    latencies = {ReceiveDelivered: list(), ReceiveProcessed: list()}
+    # the messages are acknowledged in order
+    for position, message_identifier in enumerate(message_identifiers[:acks]):
+        state_change_type = ReceiveDelivered if position % 2 else ReceiveProcessed
+
+        start = time.perf_counter()
+        state_manager.dispatch(state_change_type(message_identifier))
+        latencies[state_change_type].append(time.perf_counter() - start)
+
+    queues = state_manager.current_state.queueids_to_queues.values()
+    remaining = sum(len(queue) for queue in queues)
+    assert remaining == number_of_messages - acks
+
+    return (
+        percentile(latencies[ReceiveDelivered], 0.5),
+        percentile(latencies[ReceiveProcessed], 0.5),
+    )
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', default='1000,10000,100000')
+    parser.add_argument('--queues', default=100, type=int)
+    parser.add_argument('--acks', default=1000, type=int)
+    args = parser.parse_args()
+
+    print('{:>10} {:>8} {:>14} {:>14}'.format('queued', 'queues', 'Delivered', 'Processed'))
+
+    for number_of_messages in map(int, args.messages.split(',')):
+        delivered, processed = bench_acks(number_of_messages, args.queues, args.acks)
+        print('{:>10} {:>8} {:>12.1f}us {:>12.1f}us'.format(
+            number_of_messages,
+            args.queues,
+            delivered * 1e6,
+            processed * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
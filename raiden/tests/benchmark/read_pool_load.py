@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+""" Measures the latency of the dispatch of received messages while API
+clients query the event history, with the queries running on the writer
+connection and on the read pool.
+"""
+import os
+import random
+import tempfile
+import time
+
+import gevent
+
+from raiden.storage.serialize import PickleSerializer
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.storage.wal import WriteAheadLog
+from raiden.tests.benchmark.dispatch_speed import make_node_state
+from raiden.tests.utils import factories
+from raiden.transfer import node
+from raiden.transfer.architecture import StateManager
+from raiden.transfer.events import EventTransferReceivedSuccess
+from raiden.transfer.state_change import ReceiveDelivered
+
+
+def fill_events(storage, number_of_events, channels):
+    state_change_id = storage.write_state_change(ReceiveDelivered(1))
+    events = [
+        EventTransferReceivedSuccess(
+            identifier,
+            1,
+            factories.HOP1,
+            random.choice(channels),
+        )
+        for identifier in range(number_of_events)
+    ]
+    storage.write_events(state_change_id, 1, events)
+
+
+def percentile(values, fraction):
+    return sorted(values)[int(len(values) * fraction)]
+
+
+def bench_latency(read_pool_size, queriers, messages, number_of_events):
+    node_state, _ = make_node_state(10)
+    channels = [factories.make_address() for _ in range(10)]
+
+    with tempfile.TemporaryDirectory() as database_dir:
+        storage = SQLiteStorage(
+            os.path.join(database_dir, 'log.db'),
+            PickleSerializer(),
+            read_pool_size,
+        )
+        fill_events(storage, number_of_events, channels)
+
+        state_manager = StateManager(node.state_transition, node_state)
+        wal = WriteAheadLog(state_manager, storage, group_commit=True)
+
+        running = True
+        queries = 0
+
+        def query_history():
+            nonlocal queries
+            while running:
+                storage.get_events(channel_identifier=random.choice(channels))
+                queries += 1
+                gevent.sleep(0)
+
+        query_greenlets = [gevent.spawn(query_history) for _ in range(queriers)]
+
+        latencies = list()
+        for _ in range(messages):
+            start = time.time()
+            wal.log_and_dispatch(ReceiveDelivered(random.randint(0, 2 ** 64)), 1)
+            latencies.append(time.time() - start)
+
+            # messages arrive independently of the queries
+            gevent.sleep(0.001)
+
+        running = False
+        gevent.joinall(query_greenlets, raise_error=True)
+        storage.close()
+
+    return percentile(latencies, 0.5), percentile(latencies, 0.99), queries
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queriers', default='0,4')
+    parser.add_argument('--messages', default=200, type=int)
+    parser.add_argument('--events', default=10000, type=int)
+    parser.add_argument('--read-pool-size', default=2, type=int)
+    args = parser.parse_args()
+
+    print('{:>10} {:>14} {:>12} {:>12} {:>10}'.format(
+        'queriers',
+        'reads',
+        'p50',
+        'p99',
+        'queries',
+    ))
+
+    for queriers in map(int, args.queriers.split(',')):
+        for name, read_pool_size in (('writer', 0), ('read pool', args.read_pool_size)):
+            p50, p99, queries = bench_latency(
+                read_pool_size,
+                queriers,
+                args.messages,
+                args.events,
+            )
+            print('{:>10} {:>14} {:>10.2f}ms {:>10.2f}ms {:>10}'.format(
+                queriers,
+                name,
+                p50 * 1000,
+                p99 * 1000,
+                queries,
+            ))
+
+
+if __name__ == '__main__':
+    main()
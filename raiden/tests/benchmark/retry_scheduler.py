@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+""" Compares the cost of keeping a periodic timer per partner (e.g. the
+health check pings) with one greenlet per partner and with the timer wheel
+of the `RetryScheduler`.
+
+Every model runs in its own process to measure its resident memory.
+"""
+import os
+import random
+import subprocess
+import sys
+import time
+
+import gevent
+
+from raiden.network.scheduler import RetryScheduler
+from raiden.settings import (
+    DEFAULT_PROTOCOL_SCHEDULER_TICK,
+    DEFAULT_PROTOCOL_SCHEDULER_WHEEL_SIZE,
+    DEFAULT_PROTOCOL_SCHEDULER_WORKERS,
+)
+
+MODELS = ('greenlets', 'scheduler')
+
+
+def resident_memory():
+    with open('/proc/self/statm') as handler:
+        return int(handler.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def run_greenlets(partners, period, duration):
+    fired = [0]
+
+    def periodic(phase):
+        gevent.sleep(phase)
+        while True:
+            fired[0] += 1
+            gevent.sleep(period)
+
+    greenlets = [gevent.spawn(periodic, random.random() * period) for _ in range(partners)]
+    gevent.sleep(duration)
+    gevent.killall(greenlets)
+
+    return fired[0]
+
+
+def run_scheduler(partners, period, duration):
+    fired = [0]
+    scheduler = RetryScheduler(
+        DEFAULT_PROTOCOL_SCHEDULER_TICK,
+        DEFAULT_PROTOCOL_SCHEDULER_WHEEL_SIZE,
+        DEFAULT_PROTOCOL_SCHEDULER_WORKERS,
+    )
+
+    def periodic():
+        fired[0] += 1
+        scheduler.call_later(period, periodic)
+
+    scheduler.start()
+    for _ in range(partners):
+        scheduler.call_later(random.random() * period, periodic)
+
+    gevent.sleep(duration)
+    scheduler.stop()
+
+    return fired[0]
+
+
+def run_model(model, partners, period, duration):
+    memory_before = resident_memory()
+    cpu_before = time.process_time()
+
+    if model == 'greenlets':
+        fired = run_greenlets(partners, period, duration)
+    else:
+        fired = run_scheduler(partners, period, duration)
+
+    cpu = time.process_time() - cpu_before
+    memory = resident_memory() - memory_before
+    print('{} {} {} {}'.format(model, fired, cpu, memory))
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--partners', default='100,1000,10000')
+    parser.add_argument('--period', default=5.0, type=float, help='seconds between timers')
+    parser.add_argument('--duration', default=5.0, type=float)
+    parser.add_argument('--model', choices=MODELS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.model:
+        run_model(args.model, int(args.partners), args.period, args.duration)
+        return
+
+    print('{:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'partners',
+        'model',
+        'fired',
+        'cpu',
+        'memory',
+    ))
+    for partners in map(int, args.partners.split(',')):
+        for model in MODELS:
+            output = subprocess.check_output([
+                sys.executable,
+                '-m',
+                __spec__.name,
+                '--model', model,
+                '--partners', str(partners),
+                '--period', str(args.period),
+                '--duration', str(args.duration),
+            ])
+            _, fired, cpu, memory = output.decode().split()
+            print('{:>10} {:>10} {:>10} {:>8.0f}ms {:>8.1f}MB'.format(
+                partners,
+                model,
+                fired,
+                float(cpu) * 1000,
+                int(memory) / 2 ** 20,
+            ))
+
+
+if __name__ == '__main__':
+    main()
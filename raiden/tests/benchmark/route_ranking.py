@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+""" Measures the ranking of the partners of a hub on synthetic token networks,
+with one shortest path search per neighbor, one search from the target for
+all of them, and the cached ranking.
+"""
+import random
+import time
+
+import networkx
+
+from raiden import routing
+
+
+def rank_per_neighbor(network_graph, from_address, to_address):
+    paths = list()
+    for neighbor in network_graph.neighbors(from_address):
+        try:
+            length = networkx.shortest_path_length(network_graph, neighbor, to_address)
+            paths.append((length, neighbor))
+        except networkx.NetworkXNoPath:
+            pass
+    return sorted(paths)
+
+
+def per_call(function, network_graph, from_address, targets):
+    start = time.perf_counter()
+    for to_address in targets:
+        function(network_graph, from_address, to_address)
+    return (time.perf_counter() - start) / len(targets)
+
+
+def bench_graph(number_of_nodes, edges_per_node, number_of_targets):
+    # preferential attachment, a few hubs with a high degree like the nodes
+    # that mediate most payments
+    network_graph = networkx.barabasi_albert_graph(number_of_nodes, edges_per_node, seed=1)
+    hub = max(network_graph, key=network_graph.degree)
+    targets = random.Random(1).sample(list(network_graph), number_of_targets)
+
+    per_neighbor = per_call(rank_per_neighbor, network_graph, hub, targets)
+    single_search = per_call(routing.compute_ordered_partners, network_graph, hub, targets)
+
+    routing.GRAPHS_TO_ORDERED_PARTNERS.clear()
+    for to_address in targets:
+        routing.get_ordered_partners(network_graph, hub, to_address)
+    cached = per_call(routing.get_ordered_partners, network_graph, hub, targets)
+
+    return network_graph.degree(hub), per_neighbor, single_search, cached
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', default='10000,100000')
+    parser.add_argument('--edges-per-node', default=3, type=int)
+    parser.add_argument('--targets', default=20, type=int)
+    args = parser.parse_args()
+
+    print('{:>8} {:>8} {:>14} {:>14} {:>12}'.format(
+        'nodes',
+        'degree',
+        'per neighbor',
+        'single BFS',
+        'cached',
+    ))
+
+    for number_of_nodes in map(int, args.nodes.split(',')):
+        degree, per_neighbor, single_search, cached = bench_graph(
+            number_of_nodes,
+            args.edges_per_node,
+            args.targets,
+        )
+        print('{:>8} {:>8} {:>12.2f}ms {:>12.2f}ms {:>10.1f}us'.format(
+            number_of_nodes,
+            degree,
+            per_neighbor * 1000,
+            single_search * 1000,
+            cached * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+""" Compares the database serializers: state change write throughput, replay
+decoding speed, snapshot encoding and the size of the database on disk.
+
+The state changes are written in a single transaction, so the write
+throughput measures the serializer and not the fsyncs.
+"""
+import os
+import random
+import tempfile
+import time
+
+from raiden.storage.serialize import SERIALIZERS
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.tests.benchmark.dispatch_speed import make_node_state
+from raiden.tests.utils import factories
+from raiden.transfer.mediated_transfer.state_change import (
+    ActionInitMediator,
+    ReceiveSecretReveal,
+)
+from raiden.transfer.state_change import Block, ReceiveDelivered
+
+
+def make_state_changes(number_of_state_changes):
+    channel_state = factories.make_channel(our_balance=100)
+    route = factories.route_from_channel(channel_state)
+
+    state_changes = list()
+    for position in range(number_of_state_changes):
+        kind = position % 4
+
+        if kind == 0:
+            state_change = Block(5000000 + position)
+        elif kind == 1:
+            state_change = ReceiveDelivered(random.randint(0, 2 ** 64))
+        elif kind == 2:
+            transfer = factories.make_signed_transfer(
+                10,
+                factories.make_address(),
+                factories.make_address(),
+                expiration=100,
+                secret=factories.UNIT_SECRET,
+            )
+            state_change = ActionInitMediator(
+                factories.UNIT_REGISTRY_IDENTIFIER,
+                [route],
+                route,
+                transfer,
+            )
+        else:
+            state_change = ReceiveSecretReveal(factories.UNIT_SECRET, factories.make_address())
+
+        state_changes.append(state_change)
+
+    return state_changes
+
+
+def bench_serializer(serializer, state_changes, node_state):
+    with tempfile.TemporaryDirectory() as database_dir:
+        database_path = os.path.join(database_dir, 'log.db')
+        storage = SQLiteStorage(database_path, serializer)
+
+        start = time.time()
+        with storage.transaction():
+            for state_change in state_changes:
+                storage.write_state_change(state_change)
+        write_elapsed = time.time() - start
+
+        start = time.time()
+        storage.get_statechanges_by_identifier(0, 'latest')
+        replay_elapsed = time.time() - start
+
+        start = time.time()
+        snapshot_data = serializer.serialize(node_state)
+        serializer.deserialize(snapshot_data)
+        snapshot_elapsed = time.time() - start
+
+        storage.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size = os.path.getsize(database_path)
+        storage.conn.close()
+
+    return (
+        len(state_changes) / write_elapsed,
+        len(state_changes) / replay_elapsed,
+        snapshot_elapsed,
+        len(snapshot_data),
+        size,
+    )
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--state-changes', default=20000, type=int)
+    parser.add_argument('--channels', default=1000, type=int)
+    args = parser.parse_args()
+
+    state_changes = make_state_changes(args.state_changes)
+    node_state, _ = make_node_state(args.channels)
+
+    print('{:>8} {:>16} {:>16} {:>22} {:>14} {:>12}'.format(
+        'format',
+        'write',
+        'replay',
+        'snapshot enc+dec',
+        'snapshot size',
+        'db size',
+    ))
+
+    for name, serializer_class in sorted(SERIALIZERS.items()):
+        result = bench_serializer(serializer_class(), state_changes, node_state)
+        print('{:>8} {:>12.0f} sc/s {:>12.0f} sc/s {:>20.1f}ms {:>12}B {:>10}kB'.format(
+            name,
+            result[0],
+            result[1],
+            result[2] * 1000,
+            result[3],
+            result[4] // 1024,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+""" Measures the signatures verified per second: one recovery at a time
+without and with the recovery cache, and in batches on a threadpool.
+"""
+import time
+
+import gevent
+from gevent.threadpool import ThreadPool
+
+from raiden.encoding import signing
+from raiden.tests.utils.factories import make_privkey_address
+
+
+def make_batch(number_of_messages):
+    privkey, _ = make_privkey_address()
+    batch = list()
+
+    for position in range(number_of_messages):
+        messagedata = 'message {} {}'.format(position, time.time()).encode()
+        batch.append((messagedata, signing.sign(messagedata, privkey)))
+
+    return batch
+
+
+def per_second(function, batch):
+    signing.RECOVERED_PUBLICKEYS.clear()
+
+    start = time.perf_counter()
+    function(batch)
+    return len(batch) / (time.perf_counter() - start)
+
+
+def recover_one_by_one(batch):
+    for messagedata, signature in batch:
+        signing.recover_address(messagedata, signature)
+
+
+def recover_twice(batch):
+    # a message is decoded and then its balance proof validated
+    recover_one_by_one(batch)
+    recover_one_by_one(batch)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', default=2000, type=int)
+    parser.add_argument('--threads', default='1,2,4')
+    args = parser.parse_args()
+
+    batch = make_batch(args.messages)
+
+    print('{:<30} {:>12}'.format('verification', 'messages/s'))
+    print('{:<30} {:>12.0f}'.format('one by one', per_second(recover_one_by_one, batch)))
+    print('{:<30} {:>12.0f}'.format(
+        'decode and validate, cached',
+        per_second(recover_twice, batch) * 2,
+    ))
+
+    for threads in map(int, args.threads.split(',')):
+        pool = ThreadPool(threads)
+
+        def recover_batch(batch):
+            # pylint: disable=cell-var-from-loop
+            signing.recover_addresses(batch, pool)
+
+        rate = per_second(recover_batch, batch)
+        print('{:<30} {:>12.0f}'.format('batch, {} threads'.format(threads), rate))
+        pool.kill()
+        gevent.sleep(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+""" Measures the time to restore the node state from the write-ahead log as
+the log grows.
+
+Without snapshots the whole log is replayed on startup, with a snapshot policy
+the replay is bounded by the snapshot interval.
+"""
+import os
+import random
+import tempfile
+import time
+
+import gevent
+
+from raiden.storage.serialize import PickleSerializer
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.storage.wal import SnapshotPolicy, restore_from_latest_snapshot
+from raiden.tests.benchmark.dispatch_speed import PAYMENT_NETWORK_ADDRESS, make_node_state
+from raiden.transfer import node
+from raiden.transfer.state_change import (
+    ActionInitNode,
+    Block,
+    ContractReceiveNewPaymentNetwork,
+)
+
+
+def fill_log(database_path, number_of_channels, number_of_blocks, snapshot_policy):
+    storage = SQLiteStorage(database_path, PickleSerializer())
+    wal, _ = restore_from_latest_snapshot(node.state_transition, storage, snapshot_policy)
+
+    node_state, _ = make_node_state(number_of_channels)
+    payment_network_state = node_state.identifiers_to_paymentnetworks[PAYMENT_NETWORK_ADDRESS]
+
+    wal.log_and_dispatch(ActionInitNode(random.Random(), 1), 1)
+    wal.log_and_dispatch(ContractReceiveNewPaymentNetwork(payment_network_state), 1)
+
+    for block_number in range(2, number_of_blocks + 2):
+        wal.log_and_dispatch(Block(block_number), block_number)
+
+        # give the snapshot greenlet a chance to run
+        gevent.sleep(0)
+
+    if wal.snapshot_greenlet is not None:
+        wal.snapshot_greenlet.join()
+
+    storage.conn.close()
+
+
+def measure_restore(database_path):
+    start = time.time()
+
+    storage = SQLiteStorage(database_path, PickleSerializer())
+    wal, _ = restore_from_latest_snapshot(node.state_transition, storage)
+
+    elapsed = time.time() - start
+
+    replayed = wal.state_changes_since_snapshot
+    storage.conn.close()
+
+    return elapsed, replayed
+
+
+def bench_startup(number_of_channels, number_of_blocks, snapshot_policy):
+    with tempfile.TemporaryDirectory() as database_dir:
+        database_path = os.path.join(database_dir, 'log.db')
+        fill_log(database_path, number_of_channels, number_of_blocks, snapshot_policy)
+        return measure_restore(database_path)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--channels', default=100, type=int)
+    parser.add_argument('--blocks', default='1000,10000,50000')
+    parser.add_argument('--snapshot-state-changes', default=500, type=int)
+    args = parser.parse_args()
+
+    print('{:>10} {:>22} {:>22}'.format(
+        'blocks',
+        'no snapshot',
+        'snapshot every {}'.format(args.snapshot_state_changes),
+    ))
+
+    for number_of_blocks in map(int, args.blocks.split(',')):
+        without_snapshot = bench_startup(args.channels, number_of_blocks, None)
+        with_snapshot = bench_startup(
+            args.channels,
+            number_of_blocks,
+            SnapshotPolicy(state_changes=args.snapshot_state_changes),
+        )
+
+        print('{:>10} {:>10.3f}s {:>6} replayed {:>7.3f}s {:>6} replayed'.format(
+            number_of_blocks,
+            without_snapshot[0],
+            without_snapshot[1],
+            with_snapshot[0],
+            with_snapshot[1],
+        ))
+
+
+if __name__ == '__main__':
+    main()
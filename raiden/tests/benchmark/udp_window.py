@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+""" Measures the throughput of a message queue over a simulated lossy link,
+with a window of one message (stop-and-wait) and with larger windows.
+
+The link delays every datagram by half the round trip time and drops it
+with the given probability, the Delivered goes through the same link.
+"""
+import random
+import time
+
+import gevent
+from gevent.event import AsyncResult
+
+from raiden.network.protocol import QueueSender
+from raiden.network.scheduler import RetryScheduler
+from raiden.network.transport import RoundTripTimeEstimator
+from raiden.settings import (
+    DEFAULT_PROTOCOL_SCHEDULER_TICK,
+    DEFAULT_PROTOCOL_SCHEDULER_WHEEL_SIZE,
+    DEFAULT_PROTOCOL_SCHEDULER_WORKERS,
+)
+from raiden.tests.utils import factories
+
+
+class LossyLink:
+    """ Stands in for the UDPTransport, the partner acknowledges every
+    message it receives.
+    """
+
+    def __init__(self, round_trip_time, loss, seed, scheduler, jitter=0):
+        self.round_trip_time = round_trip_time
+        self.loss = loss
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.scheduler = scheduler
+        self.messageids_to_asyncresults = dict()
+        self.sent = 0
+
+    def maybe_sendraw_with_result(self, recipient, messagedata, message_id):
+        self.sent += 1
+        async_result = self.messageids_to_asyncresults.setdefault(message_id, AsyncResult())
+
+        # the message and its Delivered may both be lost
+        delivered = (
+            self.random.random() >= self.loss and
+            self.random.random() >= self.loss
+        )
+        if delivered:
+            delay = self.round_trip_time * (1 + self.random.uniform(-self.jitter, self.jitter))
+            gevent.spawn_later(delay, async_result.set)
+
+        return async_result
+
+
+class Healthy:
+    def is_healthy(self):  # pylint: disable=no-self-use
+        return True
+
+
+def bench_sender(window_size, messages, round_trip_time, loss, retry_timeout):
+    scheduler = RetryScheduler(
+        DEFAULT_PROTOCOL_SCHEDULER_TICK / 10,
+        DEFAULT_PROTOCOL_SCHEDULER_WHEEL_SIZE,
+        DEFAULT_PROTOCOL_SCHEDULER_WORKERS,
+    )
+    link = LossyLink(round_trip_time, loss, messages, scheduler)
+    queue_sender = QueueSender(
+        link,
+        factories.HOP1,
+        Healthy(),
+        RoundTripTimeEstimator(retry_timeout, retry_timeout, retry_timeout * 10),
+        window_size,
+        5,
+    )
+    scheduler.start()
+
+    start = time.time()
+    for message_id in range(messages):
+        link.messageids_to_asyncresults[message_id] = AsyncResult()
+        queue_sender.put(b'data', message_id)
+
+    for message_id in range(messages):
+        link.messageids_to_asyncresults[message_id].wait()
+    elapsed = time.time() - start
+
+    scheduler.stop()
+
+    return messages / elapsed, link.sent / messages
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--windows', default='1,4,16')
+    parser.add_argument('--losses', default='0,0.05,0.2')
+    parser.add_argument('--messages', default=200, type=int)
+    parser.add_argument('--rtt', default=0.005, type=float, help='round trip time in seconds')
+    parser.add_argument('--retry-timeout', default=0.02, type=float)
+    args = parser.parse_args()
+
+    print('{:>8} {:>8} {:>14} {:>14}'.format('loss', 'window', 'throughput', 'sends/msg'))
+
+    for loss in map(float, args.losses.split(',')):
+        for window_size in map(int, args.windows.split(',')):
+            throughput, sends = bench_sender(
+                window_size,
+                args.messages,
+                args.rtt,
+                loss,
+                args.retry_timeout,
+            )
+            print('{:>8} {:>8} {:>10.0f}msg/s {:>14.2f}'.format(
+                loss,
+                window_size,
+                throughput,
+                sends,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+""" Measures how many received messages per second the write-ahead log can
+durably store, with concurrent greenlets logging state changes the same way
+the UDP transport does for each received packet.
+"""
+import os
+import random
+import tempfile
+import time
+
+import gevent
+
+from raiden.storage.serialize import PickleSerializer
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.storage.wal import WriteAheadLog
+from raiden.tests.benchmark.dispatch_speed import make_node_state
+from raiden.transfer import node
+from raiden.transfer.architecture import StateManager
+from raiden.transfer.state_change import ReceiveDelivered
+
+
+def bench_throughput(journal_mode, group_commit, concurrency, messages, number_of_channels):
+    node_state, _ = make_node_state(number_of_channels)
+
+    with tempfile.TemporaryDirectory() as database_dir:
+        storage = SQLiteStorage(os.path.join(database_dir, 'log.db'), PickleSerializer())
+        storage.conn.execute('PRAGMA journal_mode={}'.format(journal_mode))
+
+        state_manager = StateManager(node.state_transition, node_state)
+        wal = WriteAheadLog(state_manager, storage, group_commit=group_commit)
+
+        def receive_messages():
+            for _ in range(messages):
+                state_change = ReceiveDelivered(random.randint(0, 2 ** 64))
+                wal.log_and_dispatch(state_change, 1)
+
+                # let the other receivers run, as the transport does between
+                # packets
+                gevent.sleep(0)
+
+        start = time.time()
+        gevent.joinall(
+            [gevent.spawn(receive_messages) for _ in range(concurrency)],
+            raise_error=True,
+        )
+        elapsed = time.time() - start
+
+        storage.conn.close()
+
+    return concurrency * messages / elapsed
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', default='1,10,100')
+    parser.add_argument('--messages', default=2000, type=int, help='total per run')
+    parser.add_argument('--channels', default=100, type=int)
+    args = parser.parse_args()
+
+    modes = [
+        ('rollback journal', 'DELETE', False),
+        ('WAL journal', 'WAL', False),
+        ('WAL + group commit', 'WAL', True),
+    ]
+
+    print('{:>12} {}'.format(
+        'concurrency',
+        ' '.join('{:>20}'.format(name) for name, _, _ in modes),
+    ))
+
+    for concurrency in map(int, args.concurrency.split(',')):
+        messages_per_greenlet = max(args.messages // concurrency, 1)
+
+        throughputs = [
+            bench_throughput(
+                journal_mode,
+                group_commit,
+                concurrency,
+                messages_per_greenlet,
+                args.channels,
+            )
+            for _, journal_mode, group_commit in modes
+        ]
+
+        print('{:>12} {}'.format(
+            concurrency,
+            ' '.join('{:>14.0f} msg/s'.format(throughput) for throughput in throughputs),
+        ))
+
+
+if __name__ == '__main__':
+    main()
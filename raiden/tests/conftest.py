@@ -14,10 +14,12 @@ from ethereum.tools.keys import PBKDF2_CONSTANTS
 
 from raiden.exceptions import RaidenShuttingDown
 from raiden.tests.fixtures import *  # noqa: F401,F403
+from raiden.transfer import channel
 
 gevent.get_hub().SYSTEM_ERROR = BaseException
 gevent.get_hub().NOT_ERROR = (gevent.GreenletExit, SystemExit, RaidenShuttingDown)
 PBKDF2_CONSTANTS['c'] = 100
+channel.CHECK_AMOUNT_LOCKED = True
 
 CATCH_LOG_HANDLER_NAME = 'catch_log_handler'
 
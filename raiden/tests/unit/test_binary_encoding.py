@@ -5,10 +5,12 @@ import pytest
 
 from raiden.messages import (
     decode,
+    DeliveredBatch,
     Processed,
     Ping,
 )
-from raiden.constants import UINT256_MAX, UINT64_MAX
+from raiden.constants import DELIVERED_BATCH_MAX_IDENTIFIERS, UINT256_MAX, UINT64_MAX
+from raiden.encoding.messages import bundle, bundles, unbundle
 from raiden.utils import sha3
 from raiden.tests.utils.messages import (
     make_direct_transfer,
@@ -63,6 +65,66 @@ def test_processed():
     assert sha3(decoded_processed_message.encode()) == sha3(data)
 
 
+@pytest.mark.parametrize('number_of_identifiers', [1, DELIVERED_BATCH_MAX_IDENTIFIERS])
+def test_delivered_batch(number_of_identifiers):
+    message_identifiers = [
+        random.randint(0, UINT64_MAX)
+        for _ in range(number_of_identifiers - 1)
+    ]
+    message_identifiers.append(UINT64_MAX)
+
+    delivered_batch = DeliveredBatch(message_identifiers)
+    delivered_batch.sign(PRIVKEY, ADDRESS)
+
+    data = delivered_batch.encode()
+    decoded_delivered_batch = decode(data)
+
+    assert decoded_delivered_batch.delivered_message_identifiers == message_identifiers
+    assert decoded_delivered_batch.sender == ADDRESS
+    assert sha3(decoded_delivered_batch.encode()) == sha3(data)
+
+
+@pytest.mark.parametrize('message_identifiers', [
+    [],
+    [-1],
+    [UINT64_MAX + 1],
+    list(range(DELIVERED_BATCH_MAX_IDENTIFIERS + 1)),
+])
+def test_delivered_batch_out_of_bounds_values(message_identifiers):
+    with pytest.raises(ValueError):
+        DeliveredBatch(message_identifiers)
+
+
+def test_bundles():
+    messages_data = list()
+    for nonce in range(10):
+        ping = Ping(nonce=nonce)
+        ping.sign(PRIVKEY, ADDRESS)
+        messages_data.append(ping.encode())
+    ping_size = len(messages_data[0])
+
+    packets = list(bundles(messages_data, 1 + 4 * ping_size))
+    assert [len(packet) for packet in packets] == [
+        1 + 4 * ping_size,
+        1 + 4 * ping_size,
+        1 + 2 * ping_size,
+    ]
+    assert sum((unbundle(packet) for packet in packets), []) == messages_data
+
+    # a message alone is not bundled
+    assert list(bundles(messages_data[:1], ping_size)) == messages_data[:1]
+
+
+@pytest.mark.parametrize('data', [
+    bundle([b'\xff']),
+    bundle([Ping(nonce=0).encode()])[:-1],
+    bundle([bundle([Ping(nonce=0).encode()])]),
+])
+def test_unbundle_malformed(data):
+    with pytest.raises(ValueError):
+        unbundle(data)
+
+
 @pytest.mark.parametrize('payment_identifier', [0, UINT64_MAX])
 @pytest.mark.parametrize('nonce', [1, UINT64_MAX])
 @pytest.mark.parametrize('transferred_amount', [0, UINT256_MAX])
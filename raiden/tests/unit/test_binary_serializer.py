@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import random
+import sqlite3
+
+import pytest
+
+from raiden.exceptions import SerializationError
+from raiden.storage import binary
+from raiden.storage.migrate_serializer import migrate_serializer
+from raiden.storage.serialize import BinarySerializer, PickleSerializer
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.storage.wal import restore_from_latest_snapshot
+from raiden.tests.unit.transfer.test_node import make_node_state
+from raiden.tests.utils import factories
+from raiden.tests.utils.factories import (
+    UNIT_REGISTRY_IDENTIFIER,
+    UNIT_SECRET,
+    UNIT_TOKEN_ADDRESS,
+    UNIT_TRANSFER_AMOUNT,
+)
+from raiden.transfer import node
+from raiden.transfer.events import ContractSendChannelClose, EventTransferSentFailed
+from raiden.transfer.mediated_transfer.state_change import (
+    ActionInitInitiator,
+    ActionInitMediator,
+)
+from raiden.transfer.state_change import (
+    ActionInitNode,
+    Block,
+    ContractReceiveChannelClosed,
+    ContractReceiveNewPaymentNetwork,
+    ReceiveDelivered,
+)
+
+
+def all_slots(class_):
+    return {
+        name
+        for klass in class_.__mro__
+        for name in vars(klass).get('__slots__', ())
+    }
+
+
+def assert_same_object(value, expected):
+    if value != expected:
+        # some state changes and events don't define __eq__
+        assert type(value) == type(expected)
+        assert vars(value) == vars(expected)
+
+
+def make_initiator_node_state():
+    node_state, channels = make_node_state(number_of_channels=3)
+    channel_state = channels[0]
+
+    transfer_description = factories.make_transfer_description(
+        UNIT_TRANSFER_AMOUNT,
+        UNIT_SECRET,
+        identifier=1,
+        target=channel_state.partner_state.address,
+    )
+    init_initiator = ActionInitInitiator(
+        UNIT_REGISTRY_IDENTIFIER,
+        transfer_description,
+        [factories.route_from_channel(channel_state)],
+    )
+
+    return node.state_transition(node_state, init_initiator).new_state
+
+
+def test_schema_matches_slots():
+    for class_, fields in binary.SCHEMA:
+        if issubclass(class_, tuple):
+            assert fields == class_._fields
+        elif all_slots(class_):
+            assert set(fields) == all_slots(class_), class_
+
+    classes = [class_ for class_, _ in binary.SCHEMA]
+    assert len(classes) == len(set(classes))
+
+
+@pytest.mark.parametrize('value', [
+    None,
+    True,
+    False,
+    0,
+    191,
+    192,
+    2 ** 256 - 1,
+    -1,
+    -2 ** 64,
+    0.5,
+    b'',
+    b'a' * 20,
+    b'b' * 32,
+    b'c' * 33,
+    '',
+    'raiden',
+    [1, [2, b'x']],
+    (1, 'a'),
+    {b'a': [1], (b'b', 'c'): None},
+    {1, 2, 3},
+])
+def test_roundtrip_builtin_values(value):
+    assert binary.decode(binary.encode(value)) == value
+
+
+def test_roundtrip_state_changes_and_events():
+    channel_state = factories.make_channel(our_balance=UNIT_TRANSFER_AMOUNT)
+    route = factories.route_from_channel(channel_state)
+    transfer = factories.make_signed_transfer(
+        UNIT_TRANSFER_AMOUNT,
+        factories.HOP1,
+        factories.HOP2,
+        expiration=100,
+        secret=UNIT_SECRET,
+    )
+
+    values = [
+        Block(2 ** 40),
+        ReceiveDelivered(2 ** 63),
+        ActionInitMediator(UNIT_REGISTRY_IDENTIFIER, [route], route, transfer),
+        ContractReceiveChannelClosed(
+            UNIT_REGISTRY_IDENTIFIER,
+            UNIT_TOKEN_ADDRESS,
+            channel_state.identifier,
+            factories.HOP1,
+            10,
+        ),
+        ContractSendChannelClose(
+            channel_state.identifier,
+            UNIT_TOKEN_ADDRESS,
+            transfer.balance_proof,
+        ),
+        EventTransferSentFailed(1, 'no route'),
+        channel_state,
+    ]
+
+    for value in values:
+        data = BinarySerializer.serialize(value)
+        assert_same_object(BinarySerializer.deserialize(data), value)
+        assert len(data) < len(PickleSerializer.serialize(value))
+
+
+def test_roundtrip_node_state_keeps_shared_objects():
+    node_state = make_initiator_node_state()
+    restored = binary.decode(binary.encode(node_state))
+
+    random_generator = node_state.pseudo_random_generator
+    assert restored.pseudo_random_generator.getstate() == random_generator.getstate()
+    restored.pseudo_random_generator = random_generator
+
+    payment_network_state = restored.identifiers_to_paymentnetworks[UNIT_REGISTRY_IDENTIFIER]
+    token_network_state = payment_network_state.tokenaddresses_to_tokennetworks[
+        UNIT_TOKEN_ADDRESS
+    ]
+    assert token_network_state in payment_network_state.tokenidentifiers_to_tokennetworks.values()
+
+    for channel_state in token_network_state.channelidentifiers_to_channels.values():
+        partner_address = channel_state.partner_state.address
+        assert token_network_state.partneraddresses_to_channels[partner_address] is channel_state
+
+    original_token_network = node_state.identifiers_to_paymentnetworks[
+        UNIT_REGISTRY_IDENTIFIER
+    ].tokenaddresses_to_tokennetworks[UNIT_TOKEN_ADDRESS]
+    assert (
+        sorted(token_network_state.network_graph.network.edges()) ==
+        sorted(original_token_network.network_graph.network.edges())
+    )
+    token_network_state.network_graph = original_token_network.network_graph
+
+    assert restored == node_state
+
+
+def test_decode_rejects_other_formats():
+    with pytest.raises(SerializationError):
+        binary.decode(pickle.dumps(Block(1)))
+
+    with pytest.raises(SerializationError):
+        binary.encode(object())
+
+
+def test_decode_upgrades_legacy_schema(monkeypatch):
+    data = binary.encode(Block(21))
+
+    monkeypatch.setattr(binary, 'SCHEMA_VERSION', binary.SCHEMA_VERSION + 1)
+    monkeypatch.setattr(binary, 'LEGACY_FIELDS', {
+        binary.SCHEMA_VERSION - 1: {Block: ('block_number',)},
+    })
+
+    def upgrade_block(fields):
+        return {'block_number': fields['block_number'] * 2}
+
+    monkeypatch.setattr(binary, 'UPGRADES', {
+        binary.SCHEMA_VERSION - 1: {Block: upgrade_block},
+    })
+
+    assert binary.decode(data).block_number == 42
+
+
+def test_migrate_serializer(tmpdir):
+    database_path = os.path.join(str(tmpdir), 'log.db')
+    node_state, _ = make_node_state(number_of_channels=3)
+    payment_network_state = node_state.identifiers_to_paymentnetworks[UNIT_REGISTRY_IDENTIFIER]
+
+    storage = SQLiteStorage(database_path, PickleSerializer())
+    wal, _ = restore_from_latest_snapshot(node.state_transition, storage)
+    wal.log_and_dispatch(ActionInitNode(random.Random(), 1), 1)
+    wal.log_and_dispatch(ContractReceiveNewPaymentNetwork(payment_network_state), 1)
+    wal.snapshot()
+
+    for block_number in range(2, 5):
+        wal.log_and_dispatch(Block(block_number), block_number)
+
+    expected_block_number = wal.state_manager.current_state.block_number
+    storage.conn.close()
+
+    result = migrate_serializer(database_path, PickleSerializer(), BinarySerializer())
+    assert result == {'state_changes': 5, 'state_snapshot': 1, 'state_events': 0}
+
+    # migrating an already migrated database is a no-op
+    migrate_serializer(database_path, PickleSerializer(), BinarySerializer())
+
+    storage = SQLiteStorage(database_path, BinarySerializer())
+    restored, _ = restore_from_latest_snapshot(node.state_transition, storage)
+    assert restored.state_manager.current_state.block_number == expected_block_number
+
+    restored_payment_network = restored.state_manager.current_state.identifiers_to_paymentnetworks[
+        UNIT_REGISTRY_IDENTIFIER
+    ]
+    assert (
+        restored_payment_network.tokenaddresses_to_tokennetworks.keys() ==
+        payment_network_state.tokenaddresses_to_tokennetworks.keys()
+    )
+
+
+def test_migrate_serializer_from_the_previous_schema(tmpdir):
+    """ The events of a database created before the indexed columns are
+    indexed from the source format before the migration.
+    """
+    database_path = os.path.join(str(tmpdir), 'log.db')
+    channel_identifier = factories.make_address()
+
+    event = EventTransferSentFailed(1, 'no route', channel_identifier)
+
+    conn = sqlite3.connect(database_path)
+    with conn:
+        conn.execute(
+            'CREATE TABLE state_changes ('
+            '    identifier INTEGER PRIMARY KEY AUTOINCREMENT, '
+            '    data BINARY'
+            ')'
+        )
+        conn.execute(
+            'CREATE TABLE state_snapshot ('
+            '    identifier INTEGER PRIMARY KEY, '
+            '    statechange_id INTEGER, '
+            '    data BINARY, '
+            '    FOREIGN KEY(statechange_id) REFERENCES state_changes(identifier)'
+            ')'
+        )
+        conn.execute(
+            'CREATE TABLE state_events ('
+            '    identifier INTEGER PRIMARY KEY, '
+            '    source_statechange_id INTEGER NOT NULL, '
+            '    block_number INTEGER NOT NULL, '
+            '    data BINARY, '
+            '    FOREIGN KEY(source_statechange_id) REFERENCES state_changes(identifier)'
+            ')'
+        )
+        conn.execute(
+            'INSERT INTO state_changes(data) VALUES(?)',
+            (PickleSerializer.serialize(Block(1)), ),
+        )
+        conn.execute(
+            'INSERT INTO state_events(source_statechange_id, block_number, data) '
+            'VALUES(1, 1, ?)',
+            (PickleSerializer.serialize(event), ),
+        )
+    conn.close()
+
+    result = migrate_serializer(database_path, PickleSerializer(), BinarySerializer())
+    assert result == {'state_changes': 1, 'state_snapshot': 0, 'state_events': 1}
+
+    storage = SQLiteStorage(database_path, BinarySerializer())
+    events = storage.get_events(channel_identifier=channel_identifier)
+    assert [event.identifier for _, event in events] == [1]
+    assert storage.get_statechanges_by_identifier(0, 'latest')[0].block_number == 1
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+
+import pytest
+
+from raiden.blockchain_events_handler import on_blockchain_events
+from raiden.tests.utils import factories
+from raiden.transfer.state_change import (
+    ContractReceiveChannelNew,
+    ContractReceiveRouteNew,
+)
+
+
+class Event:
+    def __init__(self, originating_contract, event_data):
+        self.originating_contract = originating_contract
+        self.event_data = event_data
+
+
+class ProxyCall:
+    """ Fails the blockchain calls done while a batch is open. """
+
+    def __init__(self, raiden, result):
+        self.raiden = raiden
+        self.result = result
+
+    def __call__(self, *args):
+        assert not self.raiden.in_batch, 'blockchain call inside the batch'
+        self.raiden.actions.append('rpc')
+        return self.result
+
+
+class NettingChannelProxy:
+    def __init__(self, raiden, address, partner_address):
+        self.address = address
+        self.token_address = ProxyCall(raiden, factories.make_address())
+        self.detail = ProxyCall(raiden, {
+            'our_address': raiden.address,
+            'our_balance': 0,
+            'partner_address': partner_address,
+            'partner_balance': 0,
+            'settle_timeout': 50,
+        })
+        self.opened = ProxyCall(raiden, 1)
+        self.closed = ProxyCall(raiden, 0)
+
+
+class ChannelManagerProxy:
+    def __init__(self, raiden):
+        self.token_address = ProxyCall(raiden, factories.make_address())
+
+
+class Chain:
+    def __init__(self, raiden):
+        self.raiden = raiden
+        self.channels = dict()
+
+    def netting_channel(self, address):
+        return self.channels[address]
+
+    def channel_manager(self, address):  # pylint: disable=unused-argument
+        return ChannelManagerProxy(self.raiden)
+
+
+class BlockchainEvents:
+    def __init__(self, raiden):
+        self.raiden = raiden
+
+    def add_netting_channel_listener(self, channel_proxy):
+        self.raiden.actions.append(('listener', channel_proxy.address))
+
+
+class ConnectionManager:
+    def retry_connect(self, registry_address):
+        pass
+
+
+class BlockchainRaiden:
+    """ Stands in for the RaidenService, records the actions in order. """
+
+    def __init__(self):
+        self.address = factories.make_address()
+        self.config = {'reveal_timeout': 10}
+        self.chain = Chain(self)
+        self.blockchain_events = BlockchainEvents(self)
+        self.in_batch = False
+        self.actions = list()
+
+    @contextmanager
+    def batch_state_changes(self):
+        self.in_batch = True
+        try:
+            yield
+        finally:
+            self.in_batch = False
+            self.actions.append('commit')
+
+    def handle_state_change(self, state_change):
+        assert self.in_batch
+        self.actions.append(type(state_change))
+
+    def connection_manager_for_token(  # pylint: disable=unused-argument
+            self,
+            registry_address,
+            token_address,
+    ):
+        assert not self.in_batch, 'the state changes must be committed first'
+        return ConnectionManager()
+
+    def start_health_check_for(self, node_address):
+        assert not self.in_batch, 'the state changes must be committed first'
+        self.actions.append(('health check', node_address))
+
+
+def channel_new_event(raiden, participant1, participant2, netting_channel):
+    return Event(factories.make_address(), {
+        '_event_type': b'ChannelNew',
+        'registry_address': factories.make_address(),
+        'participant1': participant1,
+        'participant2': participant2,
+        'netting_channel': netting_channel,
+    })
+
+
+def test_blockchain_is_queried_outside_the_batch():
+    raiden = BlockchainRaiden()
+    partner = factories.make_address()
+    channel_address = factories.make_address()
+    raiden.chain.channels[channel_address] = NettingChannelProxy(raiden, channel_address, partner)
+
+    events = [
+        channel_new_event(raiden, raiden.address, partner, channel_address),
+        channel_new_event(
+            raiden,
+            factories.make_address(),
+            factories.make_address(),
+            factories.make_address(),
+        ),
+    ]
+    on_blockchain_events(raiden, events)
+
+    first_state_change = raiden.actions.index(ContractReceiveChannelNew)
+    assert all(action == 'rpc' for action in raiden.actions[:first_state_change])
+    assert raiden.actions[first_state_change:] == [
+        ContractReceiveChannelNew,
+        ContractReceiveRouteNew,
+        'commit',
+        ('health check', partner),
+        ('listener', channel_address),
+    ]
+
+
+def test_prepared_events_are_handled_if_a_query_fails():
+    raiden = BlockchainRaiden()
+    partner = factories.make_address()
+
+    events = [
+        channel_new_event(
+            raiden,
+            factories.make_address(),
+            factories.make_address(),
+            factories.make_address(),
+        ),
+        # the netting channel is unknown to the chain
+        channel_new_event(raiden, raiden.address, partner, factories.make_address()),
+    ]
+
+    with pytest.raises(KeyError):
+        on_blockchain_events(raiden, events)
+
+    assert raiden.actions[-2:] == [ContractReceiveRouteNew, 'commit']
@@ -1315,3 +1315,62 @@ def test_channel_withdraw_must_not_change_merkletree():
     new_channel = iteration.new_state
     assert merkleroot(new_channel.partner_state.merkletree) == lock.lockhash
     assert not channel.is_lock_pending(new_channel.partner_state, lock.secrethash)
+
+
+def test_amount_locked_follows_the_locks():
+    our_model1, _ = create_model(70)
+    partner_model1, privkey2 = create_model(100)
+    channel_state = create_channel_from_models(our_model1, partner_model1)
+    partner_state = channel_state.partner_state
+    payment_network_identifier = factories.make_address()
+
+    lock_secrets = [sha3(b'test_amount_locked_1'), sha3(b'test_amount_locked_2')]
+    locks = [
+        HashTimeLockState(amount, 100, sha3(lock_secret))
+        for amount, lock_secret in zip((10, 7), lock_secrets)
+    ]
+
+    for nonce, lock in enumerate(locks, 1):
+        receive_lockedtransfer = make_receive_transfer_mediated(
+            channel_state,
+            privkey2,
+            nonce,
+            0,
+            lock,
+            merkletree_leaves=[lock.lockhash for lock in locks[:nonce]],
+            locked_amount=sum(lock.amount for lock in locks[:nonce]),
+        )
+        is_valid, _, msg = channel.handle_receive_lockedtransfer(
+            channel_state,
+            receive_lockedtransfer,
+        )
+        assert is_valid, msg
+
+    assert partner_state.amount_locked == 17
+
+    # an unlocked lock is locked until it is claimed
+    channel.register_secret(channel_state, lock_secrets[0], locks[0].secrethash)
+    assert partner_state.amount_locked == 17
+
+    # states stored without the counter compute it from the locks
+    partner_state.amount_locked = None
+    assert channel.get_amount_locked(partner_state) == 17
+
+    closed_block_number = 77
+    channel.handle_channel_closed(channel_state, ContractReceiveChannelClosed(
+        payment_network_identifier,
+        channel_state.token_address,
+        channel_state.identifier,
+        partner_model1.participant_address,
+        closed_block_number,
+    ))
+    channel.handle_channel_withdraw(channel_state, ContractReceiveChannelWithdraw(
+        payment_network_identifier,
+        channel_state.token_address,
+        channel_state.identifier,
+        lock_secrets[0],
+        channel_state.our_state.address,
+    ))
+
+    assert partner_state.amount_locked == 7
+    assert channel.get_distributable(partner_state, channel_state.our_state) == 100 - 7
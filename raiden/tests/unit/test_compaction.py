@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import os
+
+from raiden.storage.compaction import (
+    RECORD_EVENT,
+    RECORD_STATE_CHANGE,
+    Compactor,
+    read_segment,
+)
+from raiden.storage.serialize import PickleSerializer
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.storage.wal import restore_from_latest_snapshot
+from raiden.tests.unit.test_wal import CountState
+from raiden.transfer.architecture import TransitionResult
+from raiden.transfer.events import EventTransferSentFailed
+from raiden.transfer.state_change import Block
+
+
+def state_transition_event_on_even_block(state, state_change):
+    count = state.count if state else 0
+
+    events = list()
+    if state_change.block_number % 2 == 0:
+        events.append(EventTransferSentFailed(state_change.block_number, 'even'))
+
+    return TransitionResult(CountState(count + 1), events)
+
+
+def fill_log(storage, compactor, first_block, last_block):
+    wal, _ = restore_from_latest_snapshot(
+        state_transition_event_on_even_block,
+        storage,
+        compactor=compactor,
+    )
+
+    for block_number in range(first_block, last_block + 1):
+        wal.log_and_dispatch(Block(block_number), block_number)
+
+    return wal
+
+
+def count_rows(storage, table):
+    return storage.conn.execute('SELECT COUNT(*) FROM {}'.format(table)).fetchone()[0]
+
+
+def test_compaction_keeps_state_changes_with_events(tmpdir):
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    compactor = Compactor(storage, archive_directory=str(tmpdir), batch_size=3)
+    wal = fill_log(storage, compactor, 1, 10)
+
+    # nothing to compact without a snapshot
+    assert compactor.compact() == {'state_changes': 0, 'state_events': 0}
+
+    wal.snapshot_async().join()
+    wal.compaction_greenlet.join()
+
+    # the state changes with an event are kept, and the state change 10
+    # because the snapshot refers to it
+    assert count_rows(storage, 'state_changes') == 5
+    assert count_rows(storage, 'state_events') == 5
+
+    segments = os.listdir(str(tmpdir))
+    assert segments == ['segment-{:016d}-{:016d}.gz'.format(1, 9)]
+
+    records = list(read_segment(os.path.join(str(tmpdir), segments[0])))
+    assert [record[0] for record in records] == [RECORD_STATE_CHANGE] * 5
+    assert [
+        PickleSerializer.deserialize(record[4]).block_number
+        for record in records
+    ] == [1, 3, 5, 7, 9]
+
+    restored, _ = restore_from_latest_snapshot(state_transition_event_on_even_block, storage)
+    assert restored.state_manager.current_state.count == 10
+
+    # the visited state changes are not scanned again
+    wal.log_and_dispatch(Block(11), 11)
+    wal.snapshot()
+    assert compactor.compact() == {'state_changes': 0, 'state_events': 0}
+    assert compactor.compacted_up_to == 10
+
+
+def test_compaction_of_events():
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    compactor = Compactor(storage, compact_events=True)
+    wal = fill_log(storage, compactor, 1, 10)
+    wal.snapshot()
+
+    assert compactor.compact() == {'state_changes': 9, 'state_events': 4}
+    assert count_rows(storage, 'state_changes') == 1
+    assert storage.get_events() == [
+        (10, EventTransferSentFailed(10, 'even')),
+    ]
+
+
+def test_compaction_archives_events(tmpdir):
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    compactor = Compactor(storage, archive_directory=str(tmpdir), compact_events=True)
+    wal = fill_log(storage, compactor, 1, 4)
+    wal.snapshot()
+    compactor.compact()
+
+    segment_path = os.path.join(str(tmpdir), os.listdir(str(tmpdir))[0])
+    events = [
+        (record[2], record[3], PickleSerializer.deserialize(record[4]))
+        for record in read_segment(segment_path)
+        if record[0] == RECORD_EVENT
+    ]
+    assert events == [(2, 2, EventTransferSentFailed(2, 'even'))]
+
+
+def test_compaction_bounds_the_database_size(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    compactor = Compactor(storage, compact_events=True)
+    wal, _ = restore_from_latest_snapshot(
+        state_transition_event_on_even_block,
+        storage,
+        compactor=compactor,
+    )
+
+    sizes = list()
+    block_number = 0
+    for _ in range(10):
+        for _ in range(500):
+            block_number += 1
+            wal.log_and_dispatch(Block(block_number), block_number)
+
+        wal.snapshot_async().join()
+        wal.compaction_greenlet.join()
+        storage.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        sizes.append(os.path.getsize(database_path))
+
+    assert count_rows(storage, 'state_changes') == 1
+    assert max(sizes[2:]) <= sizes[1]
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import random
+
 import pytest
 
 from raiden.exceptions import HashLengthNot32
@@ -7,7 +9,10 @@ from raiden.transfer.state import EMPTY_MERKLE_ROOT
 from raiden.transfer.merkle_tree import (
     MERKLEROOT,
     compute_layers,
+    compute_layers_with,
+    compute_layers_without,
     compute_merkleproof_for,
+    compute_merkleproofs_for,
     validate_proof,
     merkleroot,
 )
@@ -144,3 +149,61 @@ def test_many(tree_up_to=10):
 
         reversed_tree = MerkleTreeState(compute_layers(reversed(leaves)))
         assert root == merkleroot(reversed_tree)
+
+
+def test_incremental_layers_match_full_computation():
+    random_generator = random.Random(1)
+    leaves = list()
+    layers = None
+
+    for value in range(40):
+        leaf = sha3(str(value).encode())
+
+        if layers is None:
+            layers = compute_layers([leaf])
+        else:
+            layers = compute_layers_with(layers, leaf)
+
+        leaves.append(leaf)
+        assert layers == compute_layers(leaves)
+
+    random_generator.shuffle(leaves)
+    while len(leaves) > 1:
+        leaf = leaves.pop()
+        layers = compute_layers_without(layers, leaf)
+        assert layers == compute_layers(leaves)
+
+        tree = MerkleTreeState(layers)
+        for value in leaves:
+            assert validate_proof(compute_merkleproof_for(tree, value), merkleroot(tree), value)
+
+
+def test_incremental_layers_invalid_elements():
+    hash_0 = sha3(b'x')
+    layers = compute_layers([hash_0])
+
+    with pytest.raises(ValueError):
+        compute_layers_with(layers, hash_0)
+
+    with pytest.raises(HashLengthNot32):
+        compute_layers_with(layers, b'not32bytes')
+
+    with pytest.raises(ValueError):
+        compute_layers_without(layers, sha3(b'y'))
+
+    with pytest.raises(ValueError):
+        compute_merkleproof_for(MerkleTreeState(layers), sha3(b'y'))
+
+
+def test_merkleproofs_for_many_elements():
+    leaves = [sha3(str(value).encode()) for value in range(13)]
+    tree = MerkleTreeState(compute_layers(leaves))
+
+    elements = leaves[::-3]
+    proofs = compute_merkleproofs_for(tree, elements)
+
+    assert proofs == [compute_merkleproof_for(tree, element) for element in elements]
+    assert compute_merkleproofs_for(tree, []) == []
+
+    with pytest.raises(ValueError):
+        compute_merkleproofs_for(tree, [leaves[0], sha3(b'unknown')])
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import random
+
+from click.testing import CliRunner
+
+from raiden.storage.serialize import PickleSerializer
+from raiden.storage.sqlite import SQLiteStorage
+from raiden.storage.wal import restore_from_latest_snapshot
+from raiden.tests.unit.transfer.test_node import make_node_state
+from raiden.tests.utils.factories import UNIT_REGISTRY_IDENTIFIER
+from raiden.transfer import node
+from raiden.transfer.state_change import (
+    ActionInitNode,
+    Block,
+    ContractReceiveNewPaymentNetwork,
+)
+from raiden.utils.profiling import replay
+
+
+def make_database(database_path, number_of_blocks, snapshot_after=None):
+    node_state, _ = make_node_state(number_of_channels=3)
+    payment_network_state = node_state.identifiers_to_paymentnetworks[UNIT_REGISTRY_IDENTIFIER]
+
+    storage = SQLiteStorage(database_path, PickleSerializer())
+    wal, _ = restore_from_latest_snapshot(node.state_transition, storage)
+    wal.log_and_dispatch(ActionInitNode(random.Random(), 1), 1)
+    wal.log_and_dispatch(ContractReceiveNewPaymentNetwork(payment_network_state), 1)
+
+    for block_number in range(2, number_of_blocks + 2):
+        wal.log_and_dispatch(Block(block_number), block_number)
+
+        if block_number == snapshot_after:
+            wal.snapshot()
+
+    storage.conn.close()
+
+
+def test_replay(tmpdir):
+    database_path = os.path.join(str(tmpdir), 'log.db')
+    make_database(database_path, number_of_blocks=10)
+
+    conn = replay.open_read_only(database_path)
+    result = replay.replay(conn, PickleSerializer())
+    handlers = replay.profile_handlers(conn, PickleSerializer())
+    conn.close()
+
+    assert result['state_changes'] == 12
+    assert result['per_type']['Block']['count'] == 10
+    assert handlers['node.handle_block']['calls'] == 10
+
+    # the handlers are restored once profiled
+    assert node.handle_block.__module__ == node.__name__
+    assert not hasattr(node.handle_block, '__wrapped__')
+
+
+def test_replay_starts_from_the_latest_snapshot(tmpdir):
+    database_path = os.path.join(str(tmpdir), 'log.db')
+    # the log is not compacted, it still starts at the first state change
+    make_database(database_path, number_of_blocks=10, snapshot_after=5)
+
+    conn = replay.open_read_only(database_path)
+    result = replay.replay(conn, PickleSerializer())
+    conn.close()
+
+    # the init, the payment network and the blocks 2 to 5 are in the snapshot
+    assert result['state_changes'] == 6
+    assert result['per_type']['Block']['count'] == 6
+    assert 'ActionInitNode' not in result['per_type']
+
+
+def test_compare_to_baseline():
+    baseline = {
+        'throughput': 1000.0,
+        'per_type': {
+            'Block': {'count': 1000, 'p50': 0.001, 'p99': 0.002},
+            'ActionInitNode': {'count': 1, 'p50': 0.001, 'p99': 0.001},
+        },
+    }
+    assert not replay.compare_to_baseline(baseline, baseline, tolerance=0.1)
+
+    result = {
+        'throughput': 800.0,
+        'per_type': {
+            'Block': {'count': 1000, 'p50': 0.001, 'p99': 0.003},
+            # too few samples to be compared
+            'ActionInitNode': {'count': 1, 'p50': 0.01, 'p99': 0.01},
+        },
+    }
+    regressions = replay.compare_to_baseline(result, baseline, tolerance=0.1)
+    assert len(regressions) == 2
+    assert regressions[0].startswith('throughput')
+    assert regressions[1].startswith('Block p99')
+
+
+def test_replay_cli_baseline(tmpdir):
+    database_path = os.path.join(str(tmpdir), 'log.db')
+    baseline_path = os.path.join(str(tmpdir), 'baseline.json')
+    make_database(database_path, number_of_blocks=10)
+
+    runner = CliRunner()
+    result = runner.invoke(replay.main, [database_path, '--save-baseline', baseline_path])
+    assert result.exit_code == 0, result.output
+
+    with open(baseline_path) as handler:
+        baseline = json.load(handler)
+    assert baseline['state_changes'] == 12
+
+    # a baseline much faster than any replay
+    baseline['throughput'] *= 1000
+    with open(baseline_path, 'w') as handler:
+        json.dump(baseline, handler)
+
+    result = runner.invoke(replay.main, [database_path, '--baseline', baseline_path])
+    assert result.exit_code == 1
+    assert 'Regressions against' in result.output
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+import random
+
+import networkx
+
+from raiden import routing
+from raiden.transfer.copy_on_write import TransitionUpdates
+from raiden.transfer.state import (
+    NODE_NETWORK_REACHABLE,
+    NODE_NETWORK_UNREACHABLE,
+    NodeState,
+    PaymentNetworkState,
+    TokenNetworkGraphState,
+    TokenNetworkState,
+)
+from raiden.transfer.state_change import (
+    ActionChangeNodeNetworkState,
+    ContractReceiveChannelClosed,
+    ContractReceiveRouteNew,
+)
+from raiden.transfer.token_network import add_edge
+from raiden.tests.utils import factories
+from raiden.tests.utils.factories import UNIT_REGISTRY_IDENTIFIER, UNIT_TOKEN_ADDRESS
+
+PAYMENT_NETWORK_ADDRESS = UNIT_REGISTRY_IDENTIFIER
+TOKEN_ADDRESS = UNIT_TOKEN_ADDRESS
+
+
+def ordered_partners_per_neighbor(network_graph, from_address, to_address):
+    """ One search per neighbor, the ranking the single search must match. """
+    paths = list()
+
+    for neighbor in network_graph.neighbors(from_address):
+        try:
+            length = networkx.shortest_path_length(network_graph, neighbor, to_address)
+        except networkx.NetworkXNoPath:
+            continue
+
+        paths.append((length, neighbor))
+
+    return sorted(paths)
+
+
+def test_ordered_partners_match_the_shortest_paths():
+    random_generator = random.Random(7)
+    addresses = [factories.make_address() for _ in range(200)]
+
+    network_graph = networkx.Graph()
+    for _ in range(300):
+        network_graph.add_edge(*random_generator.sample(addresses, 2))
+
+    # a component that is not connected to the rest of the graph
+    isolated = factories.make_address()
+    network_graph.add_edge(isolated, factories.make_address())
+
+    from_address = max(network_graph, key=network_graph.degree)
+    network_graph.add_edge(from_address, isolated)
+
+    for to_address in random_generator.sample(list(network_graph), 20):
+        expected = ordered_partners_per_neighbor(network_graph, from_address, to_address)
+        assert routing.get_ordered_partners(network_graph, from_address, to_address) == expected
+
+    unknown = factories.make_address()
+    assert routing.get_ordered_partners(network_graph, unknown, from_address) == []
+    assert routing.get_ordered_partners(network_graph, from_address, unknown) == []
+
+
+def test_ordered_partners_are_cached_per_graph():
+    our_address, partner, middle, target = [factories.make_address() for _ in range(4)]
+
+    token_network_state = TokenNetworkState(
+        factories.make_address(),
+        factories.make_address(),
+        TokenNetworkGraphState(networkx.Graph()),
+        [],
+    )
+    add_edge(token_network_state, our_address, partner, TransitionUpdates())
+    add_edge(token_network_state, partner, middle, TransitionUpdates())
+    add_edge(token_network_state, middle, target, TransitionUpdates())
+
+    network_graph = token_network_state.network_graph.network
+    paths = routing.get_ordered_partners(network_graph, our_address, target)
+    assert paths == [(2, partner)]
+
+    # the callers pop from the returned heap
+    paths.pop()
+    assert routing.get_ordered_partners(network_graph, our_address, target) == [(2, partner)]
+
+    # a new route replaces the graph, the previous ranking is not used
+    add_edge(token_network_state, our_address, target, TransitionUpdates())
+    new_graph = token_network_state.network_graph.network
+    assert routing.get_ordered_partners(new_graph, our_address, target) == [
+        (0, target),
+        (2, partner),
+    ]
+
+
+def make_node_state(number_of_channels):
+    our_address = factories.make_address()
+    channels = [
+        factories.make_channel(
+            our_balance=100,
+            our_address=our_address,
+            token_address=TOKEN_ADDRESS,
+        )
+        for _ in range(number_of_channels)
+    ]
+
+    graph = networkx.Graph()
+    for channel_state in channels:
+        graph.add_edge(our_address, channel_state.partner_state.address)
+
+    token_network_state = TokenNetworkState(
+        factories.make_address(),
+        TOKEN_ADDRESS,
+        TokenNetworkGraphState(graph),
+        channels,
+    )
+    node_state = NodeState(random.Random(), 1)
+    node_state.identifiers_to_paymentnetworks[PAYMENT_NETWORK_ADDRESS] = PaymentNetworkState(
+        PAYMENT_NETWORK_ADDRESS,
+        [token_network_state],
+    )
+
+    return node_state, channels
+
+
+def make_planner():
+    """ Our node has channels with three partners, with paths of 2, 3 and 4
+    hops through them to the target.
+    """
+    node_state, channels = make_node_state(3)
+    partners = [channel_state.partner_state.address for channel_state in channels]
+    our_address = channels[0].our_state.address
+
+    for partner in partners:
+        node_state.nodeaddresses_to_networkstates[partner] = NODE_NETWORK_REACHABLE
+
+    planner = routing.RoutePlanner(our_address)
+    planner.sync(node_state)
+
+    target, middle1, middle2, middle3 = [factories.make_address() for _ in range(4)]
+    routes = [
+        (partners[0], target),
+        (partners[1], middle1),
+        (middle1, target),
+        (partners[2], middle2),
+        (middle2, middle3),
+        (middle3, target),
+    ]
+    for participant1, participant2 in routes:
+        route_new = ContractReceiveRouteNew(
+            PAYMENT_NETWORK_ADDRESS,
+            TOKEN_ADDRESS,
+            participant1,
+            participant2,
+        )
+        planner.on_state_change(node_state, route_new)
+
+    return planner, node_state, channels, target, middle1
+
+
+def plan(planner, node_state, target, amount=10, previous_address=None):
+    return [
+        planned_path.path
+        for planned_path in planner.plan(
+            node_state,
+            PAYMENT_NETWORK_ADDRESS,
+            TOKEN_ADDRESS,
+            target,
+            amount,
+            previous_address,
+        )
+    ]
+
+
+def test_route_planner_ranks_loop_free_paths():
+    planner, node_state, channels, target, middle1 = make_planner()
+    our_address = channels[0].our_state.address
+    partners = [channel_state.partner_state.address for channel_state in channels]
+
+    assert [len(path) - 1 for path in plan(planner, node_state, target)] == [2, 3, 4]
+    assert plan(planner, node_state, target)[1] == [our_address, partners[1], middle1, target]
+
+    # the planned channels are the routes of the payment
+    routes = routing.get_best_routes(
+        node_state,
+        PAYMENT_NETWORK_ADDRESS,
+        TOKEN_ADDRESS,
+        our_address,
+        target,
+        10,
+        None,
+        planner,
+    )
+    assert [route.node_address for route in routes] == partners
+    assert [route.channel_identifier for route in routes] == [
+        channel_state.identifier
+        for channel_state in channels
+    ]
+
+    # a path must not go back through the payer nor through our node
+    paths = plan(planner, node_state, target, previous_address=partners[0])
+    assert [path[1] for path in paths] == [partners[1], partners[2]]
+
+    # the channels without the capacity for the transfer are skipped
+    assert plan(planner, node_state, target, amount=101) == []
+
+
+def test_route_planner_follows_the_network():
+    planner, node_state, channels, target, middle1 = make_planner()
+    partners = [channel_state.partner_state.address for channel_state in channels]
+
+    # the path through an unreachable node is not used
+    planner.on_state_change(
+        node_state,
+        ActionChangeNodeNetworkState(middle1, NODE_NETWORK_UNREACHABLE),
+    )
+    assert [path[1] for path in plan(planner, node_state, target)] == [partners[0], partners[2]]
+
+    planner.on_state_change(
+        node_state,
+        ActionChangeNodeNetworkState(middle1, NODE_NETWORK_REACHABLE),
+    )
+    assert [path[1] for path in plan(planner, node_state, target)] == partners
+
+    # a partner that keeps failing is tried after the longer paths
+    for _ in range(5):
+        planner.record_outcome(partners[0], success=False)
+        planner.record_outcome(partners[1], success=True)
+    assert [path[1] for path in plan(planner, node_state, target)] == [
+        partners[1],
+        partners[0],
+        partners[2],
+    ]
+
+    # the channel is closed
+    closed = ContractReceiveChannelClosed(
+        PAYMENT_NETWORK_ADDRESS,
+        TOKEN_ADDRESS,
+        channels[1].identifier,
+        partners[1],
+        10,
+    )
+    planner.on_state_change(node_state, closed)
+    assert [path[1] for path in plan(planner, node_state, target)] == [partners[0], partners[2]]
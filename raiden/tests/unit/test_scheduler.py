@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import gevent
+
+from raiden.network.scheduler import RetryScheduler, TimerWheel
+
+
+def test_timer_wheel():
+    wheel = TimerWheel(tick=1, wheel_size=8, now=0)
+
+    first = wheel.add(2.5, 'first', ())
+    wheel.add(1, 'second', ())
+    # the same slot as `second` after one rotation
+    wheel.add(9, 'rotation', ())
+    cancelled = wheel.add(2, 'cancelled', ())
+    cancelled.cancel()
+
+    assert len(wheel) == 4
+    assert wheel.next_deadline() == 1
+
+    assert [timer.callback for timer in wheel.advance(2)] == ['second']
+    assert [timer.callback for timer in wheel.advance(3)] == [first.callback]
+    assert not wheel.advance(8)
+
+    # a late advance returns the timers of all the visited slots
+    wheel.add(10, 'late', ())
+    due = wheel.advance(30)
+    assert [timer.callback for timer in due] == ['rotation', 'late']
+    assert len(wheel) == 0
+    assert wheel.next_deadline() is None
+
+    # a deadline in the past is due on the next tick
+    wheel.add(0, 'past', ())
+    assert wheel.next_deadline() == 31
+
+
+def test_timer_wheel_next_deadline():
+    wheel = TimerWheel(tick=1, wheel_size=8, now=0)
+
+    # the cancelled timers are not waited for
+    wheel.add(2, 'cancelled', ()).cancel()
+    assert wheel.next_deadline() is None
+    assert len(wheel) == 0
+
+    # the slot of a timer after one rotation is not due before its tick
+    wheel.add(9, 'rotation', ())
+    wheel.add(12, 'later', ())
+    wheel.add(4, 'cancelled', ()).cancel()
+    assert wheel.next_deadline() == 9
+    assert len(wheel) == 2
+
+
+def test_retry_scheduler():
+    scheduler = RetryScheduler(tick=0.01, wheel_size=16, workers=2)
+    scheduler.start()
+
+    called = list()
+    scheduler.call_later(0.05, called.append, 'later')
+    scheduler.call_later(0.01, called.append, 'sooner')
+    scheduler.call_later(0.02, called.append, 'cancelled').cancel()
+    scheduler.call_soon(called.append, 'soon')
+
+    gevent.sleep(0.1)
+    assert called == ['soon', 'sooner', 'later']
+
+    scheduler.stop()
+    scheduler.call_later(0.01, called.append, 'stopped')
+    gevent.sleep(0.05)
+    assert called == ['soon', 'sooner', 'later']
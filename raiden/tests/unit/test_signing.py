@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import gevent
+
+from raiden.encoding import signing
+from raiden.tests.utils.factories import make_privkey_address
+
+
+def signed_messages(number_of_messages):
+    result = list()
+    for position in range(number_of_messages):
+        privkey, address = make_privkey_address()
+        messagedata = 'message {}'.format(position).encode()
+        result.append((messagedata, signing.sign(messagedata, privkey), address))
+
+    return result
+
+
+def test_recovery_is_cached(monkeypatch):
+    (messagedata, signature, address), = signed_messages(1)
+
+    recoveries = list()
+    recover_from_hash = signing._recover_publickey_from_hash
+
+    def count_recoveries(messagehash, signature):
+        recoveries.append(messagehash)
+        return recover_from_hash(messagehash, signature)
+
+    monkeypatch.setattr(signing, '_recover_publickey_from_hash', count_recoveries)
+
+    assert signing.recover_address(messagedata, signature) == address
+    assert signing.recover_address(messagedata, signature) == address
+    assert signing.recover_addresses([(messagedata, signature)]) == [address]
+    assert len(recoveries) == 1
+
+
+def test_recover_addresses_in_threadpool():
+    messages = signed_messages(signing.BATCH_THREADPOOL_THRESHOLD * 2)
+
+    messagedata, signature, _ = messages[0]
+    invalid_signature = signature[:-1] + b'\x00'
+    batch = [(messagedata, signature) for messagedata, signature, _ in messages]
+    batch.append((messagedata, invalid_signature))
+    batch.append((messagedata, signature[:-1]))
+
+    addresses = signing.recover_addresses(batch, gevent.get_hub().threadpool)
+
+    assert addresses[:-2] == [address for _, _, address in messages]
+    assert addresses[-2:] == [None, None]
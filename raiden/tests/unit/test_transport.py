@@ -1,5 +1,20 @@
 # -*- coding: utf-8 -*-
-from raiden.network.transport import TokenBucket
+from contextlib import contextmanager
+
+import gevent
+import pytest
+from gevent import socket
+from gevent.event import AsyncResult
+
+from raiden.constants import DELIVERED_BATCH_MAX_IDENTIFIERS
+from raiden.encoding.messages import BUNDLE, bundle, unbundle
+from raiden.messages import decode, Delivered, DeliveredBatch, Ping
+from raiden.network.protocol import QueueSender, UDPTransport
+from raiden.network.scheduler import RetryScheduler
+from raiden.network.transport import RoundTripTimeEstimator, TokenBucket
+from raiden.tests.utils import factories
+from raiden.tests.utils.factories import make_privkey_address
+from raiden.transfer.state import NODE_NETWORK_REACHABLE, NODE_NETWORK_UNREACHABLE
 
 
 def test_token_bucket():
@@ -21,3 +36,361 @@ def test_token_bucket():
 
     for num in range(1, 9):
         assert num * token_refill == bucket.consume(1)
+
+
+def test_round_trip_time_estimator():
+    roundtrip = RoundTripTimeEstimator(1, 0.1, 10)
+    assert roundtrip.timeout == 1
+
+    roundtrip.update(0.2)
+    assert roundtrip.smoothed == 0.2
+    assert roundtrip.variance == 0.1
+    assert roundtrip.timeout == pytest.approx(0.6)
+
+    # a stable round trip time reduces the variance and the timeout
+    for _ in range(50):
+        roundtrip.update(0.2)
+    assert roundtrip.smoothed == pytest.approx(0.2)
+    assert roundtrip.timeout == pytest.approx(0.2, abs=0.01)
+
+    # the timeout is bounded
+    for _ in range(50):
+        roundtrip.update(0.001)
+    assert roundtrip.timeout == 0.1
+
+    for _ in range(50):
+        roundtrip.update(30)
+    assert roundtrip.timeout == 10
+    assert roundtrip.to_dict()['samples'] == 151
+
+
+def test_round_trip_time_estimator_backoff():
+    roundtrip = RoundTripTimeEstimator(1, 0.1, 10)
+
+    # the messages sent with the same timeout back off once
+    roundtrip.expired(1)
+    roundtrip.expired(1)
+    assert roundtrip.timeout == 2
+
+    roundtrip.expired(2)
+    assert roundtrip.timeout == 4
+
+    # the next sample clears the backoff
+    roundtrip.update(0.5)
+    assert roundtrip.timeout == pytest.approx(1.5)
+
+
+def test_queue_sender_samples_round_trip_time():
+    protocol = RecordingProtocol()
+    protocol.scheduler.start()
+
+    queue_sender = make_queue_sender(
+        protocol,
+        StubHealthCheck(),
+        window_size=2,
+        retry_timeout=0.05,
+    )
+    queue_sender.put(b'data', 0)
+    queue_sender.put(b'data', 1)
+
+    gevent.sleep(0.02)
+    protocol.messageids_to_asyncresults[0].set()
+
+    # the second message is retransmitted, it's not a sample
+    gevent.sleep(0.1)
+    protocol.messageids_to_asyncresults[1].set()
+    gevent.sleep(0.01)
+
+    assert protocol.sent.count(1) > 1
+    assert queue_sender.roundtrip.samples == 1
+    assert queue_sender.roundtrip.smoothed == pytest.approx(0.02, abs=0.01)
+
+    protocol.scheduler.stop()
+
+
+class RecordingProtocol:
+    """ Records the sent messages, they are acknowledged by the test. """
+
+    def __init__(self):
+        self.sent = list()
+        self.messageids_to_asyncresults = dict()
+        self.scheduler = RetryScheduler(0.01, 64, 2)
+
+    def maybe_sendraw_with_result(self, recipient, messagedata, message_id):
+        self.sent.append(message_id)
+        return self.messageids_to_asyncresults.setdefault(message_id, AsyncResult())
+
+
+class StubHealthCheck:
+    def __init__(self):
+        self.healthy = True
+
+    def is_healthy(self):
+        return self.healthy
+
+
+def make_queue_sender(protocol, health_check, window_size, retry_timeout=10):
+    return QueueSender(
+        protocol,
+        factories.HOP1,
+        health_check,
+        RoundTripTimeEstimator(retry_timeout, retry_timeout, retry_timeout),
+        window_size,
+        1,
+    )
+
+
+def test_queue_sender_window():
+    protocol = RecordingProtocol()
+    protocol.scheduler.start()
+
+    queue_sender = make_queue_sender(protocol, StubHealthCheck(), window_size=2)
+    for message_id in range(5):
+        queue_sender.put(b'data', message_id)
+
+    gevent.sleep(0.01)
+    assert protocol.sent == [0, 1]
+
+    # the acknowledgements may arrive out of order
+    protocol.messageids_to_asyncresults[1].set()
+    gevent.sleep(0.01)
+    assert protocol.sent == [0, 1, 2]
+
+    for message_id in (0, 2, 3, 4):
+        protocol.messageids_to_asyncresults[message_id].set()
+        gevent.sleep(0.01)
+
+    assert protocol.sent == [0, 1, 2, 3, 4]
+    assert not queue_sender
+
+    protocol.scheduler.stop()
+
+
+def test_queue_sender_retries_until_recovery():
+    protocol = RecordingProtocol()
+    protocol.scheduler.start()
+    health_check = StubHealthCheck()
+
+    queue_sender = make_queue_sender(protocol, health_check, window_size=1, retry_timeout=0.02)
+    queue_sender.put(b'data', 0)
+    queue_sender.put(b'data', 1)
+
+    # the head of an ordered queue is retransmitted until acknowledged
+    gevent.sleep(0.1)
+    assert set(protocol.sent) == {0}
+    assert len(protocol.sent) > 1
+
+    # nothing is sent while the node is unhealthy
+    health_check.healthy = False
+    gevent.sleep(0.05)
+    sent = len(protocol.sent)
+    gevent.sleep(0.1)
+    assert len(protocol.sent) == sent
+
+    health_check.healthy = True
+    protocol.messageids_to_asyncresults[0].set()
+    queue_sender.recovered()
+    gevent.sleep(0.01)
+    assert protocol.sent[-1] == 1
+
+    protocol.scheduler.stop()
+
+
+class AcknowledgingRaiden:
+    def __init__(self):
+        self.private_key, self.address = make_privkey_address()
+        self.state_changes = list()
+        self.batches = 0
+
+    def sign(self, message):
+        message.sign(self.private_key, self.address)
+
+    def handle_state_changes(self, state_changes):
+        self.state_changes.append(state_changes)
+
+    def handle_state_change(self, state_change):
+        # the commit of the state change
+        gevent.sleep(0.01)
+        self.state_changes.append(state_change)
+
+    @contextmanager
+    def batch_state_changes(self):
+        self.batches += 1
+        yield
+
+
+class RecordingTransport(UDPTransport):
+    """ Records the datagrams instead of sending them, the socket is never
+    used.
+    """
+
+    def __init__(self, delivered_batch_timeout, bundle_messages=True):
+        udpsocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        config = {
+            'retry_interval': 1,
+            'retries_before_backoff': 1,
+            'nat_keepalive_retries': 1,
+            'nat_keepalive_timeout': 1,
+            'nat_invitation_timeout': 1,
+            'delivered_batch_timeout': delivered_batch_timeout,
+            'bundle_messages': bundle_messages,
+        }
+        # the addresses are used as the host ports
+        discovery = {
+            factories.HOP1: factories.HOP1,
+            factories.HOP2: factories.HOP2,
+        }
+        super().__init__(discovery, udpsocket, None, config)
+
+        self.raiden = AcknowledgingRaiden()
+        self.datagrams = 0
+        self.sent = list()
+
+    def maybe_sendraw(self, host_port, messagedata):
+        self.datagrams += 1
+
+        if messagedata[0] == BUNDLE:
+            messages_data = unbundle(messagedata)
+        else:
+            messages_data = [messagedata]
+
+        for data in messages_data:
+            self.sent.append((host_port, decode(data)))
+
+
+def test_acknowledgements_are_batched():
+    transport = RecordingTransport(delivered_batch_timeout=0.01)
+
+    transport.acknowledge(factories.HOP1, 1)
+    transport.acknowledge(factories.HOP2, 2)
+    transport.acknowledge(factories.HOP1, 3)
+    assert not transport.sent
+
+    gevent.sleep(0.02)
+    assert not transport.addresses_to_delivered_flush
+
+    recipients_to_messages = dict(transport.sent)
+    assert recipients_to_messages[factories.HOP1].delivered_message_identifiers == [1, 3]
+    assert recipients_to_messages[factories.HOP1].sender == transport.raiden.address
+    # a single acknowledgement doesn't need a batch
+    assert isinstance(recipients_to_messages[factories.HOP2], Delivered)
+
+
+def test_full_batch_is_sent_without_waiting():
+    transport = RecordingTransport(delivered_batch_timeout=10)
+
+    for message_id in range(DELIVERED_BATCH_MAX_IDENTIFIERS + 1):
+        transport.acknowledge(factories.HOP1, message_id)
+
+    gevent.sleep(0)
+
+    # the last acknowledgement is piggybacked on the full batch
+    assert transport.datagrams == 1
+    delivered_batch, delivered = [message for _, message in transport.sent]
+    assert len(delivered_batch.delivered_message_identifiers) == DELIVERED_BATCH_MAX_IDENTIFIERS
+    assert delivered.delivered_message_identifier == DELIVERED_BATCH_MAX_IDENTIFIERS
+    assert not transport.addresses_to_delivered_flush
+
+
+def test_stop_sends_the_pending_acknowledgements():
+    transport = RecordingTransport(delivered_batch_timeout=10)
+    transport.start(transport.raiden, dict())
+
+    transport.acknowledge(factories.HOP1, 1)
+    ping = Ping(0)
+    transport.raiden.sign(ping)
+    transport.maybe_send(factories.HOP2, ping)
+
+    transport.stop_and_wait()
+
+    recipients_to_messages = dict(transport.sent)
+    assert recipients_to_messages[factories.HOP1].delivered_message_identifier == 1
+    assert recipients_to_messages[factories.HOP2] == ping
+    assert not transport.addresses_to_delivered_flush
+    assert not transport.addresses_to_outgoing_flush
+
+
+def test_network_state_changes_dont_block_the_caller():
+    transport = RecordingTransport(delivered_batch_timeout=0)
+    transport.start(transport.raiden, dict())
+
+    transport.set_node_network_state(factories.HOP1, NODE_NETWORK_UNREACHABLE)
+    transport.set_node_network_state(factories.HOP1, NODE_NETWORK_REACHABLE)
+    assert not transport.raiden.state_changes
+
+    gevent.sleep(0.05)
+    assert [
+        state_change.network_state
+        for state_change in transport.raiden.state_changes
+    ] == [NODE_NETWORK_UNREACHABLE, NODE_NETWORK_REACHABLE]
+
+    transport.stop_and_wait()
+
+
+def test_receive_delivered_batch():
+    transport = RecordingTransport(delivered_batch_timeout=0)
+    async_results = [AsyncResult() for _ in range(3)]
+    transport.messageids_to_asyncresults = dict(enumerate(async_results))
+
+    transport.receive_delivered(DeliveredBatch([0, 2, 7]))
+
+    assert [async_result.ready() for async_result in async_results] == [True, False, True]
+    assert list(transport.messageids_to_asyncresults) == [1]
+
+    # the state changes of the batch are handled together
+    state_changes, = transport.raiden.state_changes
+    assert [
+        state_change.message_identifier
+        for state_change in state_changes
+    ] == [0, 2, 7]
+
+
+def test_messages_are_bundled():
+    transport = RecordingTransport(delivered_batch_timeout=10)
+    transport.acknowledge(factories.HOP1, 1)
+
+    pings = [Ping(nonce) for nonce in range(20)]
+    for ping in pings:
+        transport.raiden.sign(ping)
+        transport.maybe_send(factories.HOP1, ping)
+    assert not transport.sent
+
+    gevent.sleep(0)
+
+    # the datagrams are limited to UDP_MAX_MESSAGE_SIZE
+    assert transport.datagrams == 2
+    *sent_pings, delivered = [message for _, message in transport.sent]
+    assert sent_pings == pings
+    assert delivered.delivered_message_identifier == 1
+
+
+def test_messages_are_not_bundled_if_disabled():
+    transport = RecordingTransport(delivered_batch_timeout=10, bundle_messages=False)
+
+    pings = [Ping(nonce) for nonce in range(3)]
+    for ping in pings:
+        transport.raiden.sign(ping)
+        transport.maybe_send(factories.HOP1, ping)
+
+    assert transport.datagrams == 3
+    assert [message for _, message in transport.sent] == pings
+
+
+def test_receive_bundle():
+    transport = RecordingTransport(delivered_batch_timeout=0)
+    async_results = [AsyncResult() for _ in range(3)]
+    transport.messageids_to_asyncresults = dict(enumerate(async_results))
+
+    def receive_ping(ping):
+        raise ValueError(ping)
+    transport.receive_ping = receive_ping
+
+    # the failing message doesn't prevent the next ones from being handled
+    messages = [DeliveredBatch([0, 1]), Ping(0), Delivered(2)]
+    for message in messages:
+        transport.raiden.sign(message)
+
+    transport.receive(bundle([message.encode() for message in messages]))
+
+    assert all(async_result.ready() for async_result in async_results)
+    assert transport.raiden.batches == 1
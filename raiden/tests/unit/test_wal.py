@@ -1,15 +1,26 @@
 # -*- coding: utf-8 -*-
 import sqlite3
+import tracemalloc
 
+import gevent
 import pytest
 
 from raiden.transfer.architecture import StateManager
 from raiden.storage.serialize import PickleSerializer
 from raiden.storage.sqlite import SQLiteStorage
-from raiden.storage.wal import WriteAheadLog
+from raiden.storage.wal import (
+    REPLAY_PROGRESS_STEP,
+    SnapshotPolicy,
+    WriteAheadLog,
+    restore_from_latest_snapshot,
+)
 from raiden.tests.utils import factories
-from raiden.transfer.architecture import TransitionResult
-from raiden.transfer.events import EventTransferSentFailed
+from raiden.transfer.architecture import State, TransitionResult
+from raiden.transfer.events import (
+    EventTransferReceivedSuccess,
+    EventTransferSentFailed,
+    EventTransferSentSuccess,
+)
 from raiden.transfer.state_change import (
     Block,
     ContractReceiveChannelWithdraw,
@@ -20,6 +31,23 @@ def state_transition_noop(state, state_change):  # pylint: disable=unused-argume
     return TransitionResult(state, list())
 
 
+class CountState(State):
+    def __init__(self, count):
+        self.count = count
+
+
+def state_transition_count(state, state_change):  # pylint: disable=unused-argument
+    count = state.count if state else 0
+    return TransitionResult(CountState(count + 1), list())
+
+
+def state_transition_fail_on_block(state, state_change):
+    if isinstance(state_change, Block) and state_change.block_number == 0:
+        raise ValueError('invalid block')
+
+    return state_transition_count(state, state_change)
+
+
 def new_wal():
     state = None
     serializer = PickleSerializer
@@ -125,3 +153,519 @@ def test_write_read_events():
     latest_event = new_events[-1]
     assert latest_event[0] == block_number
     assert isinstance(latest_event[1], EventTransferSentFailed)
+
+
+def write_transfer_events(storage, channel1, channel2):
+    state_change_id = storage.write_state_change('statechangedata')
+    storage.write_events(state_change_id, 10, [
+        EventTransferSentSuccess(1, 5, factories.HOP1, channel1),
+        EventTransferReceivedSuccess(2, 5, factories.HOP2, channel2),
+    ])
+    storage.write_events(state_change_id, 20, [
+        EventTransferSentFailed(3, 'no route', channel1),
+        EventTransferSentFailed(4, 'no route'),
+    ])
+
+
+def test_get_events_filters_by_indexed_columns():
+    wal = new_wal()
+    channel1 = factories.make_address()
+    channel2 = factories.make_address()
+    write_transfer_events(wal.storage, channel1, channel2)
+
+    def payment_identifiers(events):
+        return [event.identifier for _, event in events]
+
+    storage = wal.storage
+    assert payment_identifiers(storage.get_events()) == [1, 2, 3, 4]
+    assert payment_identifiers(storage.get_events(channel_identifier=channel1)) == [1, 3]
+    assert payment_identifiers(storage.get_events(payment_identifier=2)) == [2]
+    assert payment_identifiers(storage.get_events(from_block=11)) == [3, 4]
+    assert payment_identifiers(storage.get_events(to_block=10)) == [1, 2]
+    assert payment_identifiers(storage.get_events(
+        event_types=['EventTransferSentFailed'],
+        channel_identifier=channel1,
+    )) == [3]
+    assert storage.get_events(event_types=[]) == []
+
+    # the failure without a channel is kept when asking for a channel's events
+    assert payment_identifiers(storage.get_events(
+        channel_identifier=channel1,
+        include_unknown_channel=True,
+    )) == [1, 3, 4]
+
+    block_number, event = storage.get_events(payment_identifier=1)[0]
+    assert block_number == 10
+    assert event.channel_identifier == channel1
+
+    with pytest.raises(ValueError):
+        storage.get_events(to_block='pending')
+
+
+def test_upgrade_state_events_table(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    channel1 = factories.make_address()
+    channel2 = factories.make_address()
+
+    # the table as created by the previous version, without the indexed columns
+    conn = sqlite3.connect(database_path)
+    with conn:
+        conn.execute(
+            'CREATE TABLE state_changes ('
+            '    identifier INTEGER PRIMARY KEY AUTOINCREMENT, '
+            '    data BINARY'
+            ')'
+        )
+        conn.execute(
+            'CREATE TABLE state_events ('
+            '    identifier INTEGER PRIMARY KEY, '
+            '    source_statechange_id INTEGER NOT NULL, '
+            '    block_number INTEGER NOT NULL, '
+            '    data BINARY, '
+            '    FOREIGN KEY(source_statechange_id) REFERENCES state_changes(identifier)'
+            ')'
+        )
+        conn.execute('INSERT INTO state_changes(data) VALUES(?)', (b'statechangedata', ))
+        conn.execute(
+            'INSERT INTO state_events(source_statechange_id, block_number, data) '
+            'VALUES(1, 10, ?)',
+            (PickleSerializer.serialize(EventTransferSentFailed(1, 'no route', channel1)), ),
+        )
+        conn.execute(
+            'INSERT INTO state_events(source_statechange_id, block_number, data) '
+            'VALUES(1, 10, ?)',
+            (PickleSerializer.serialize(EventTransferReceivedSuccess(3, 5, factories.HOP2)), ),
+        )
+    conn.close()
+
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    storage.write_events(1, 20, [EventTransferReceivedSuccess(2, 5, factories.HOP1, channel2)])
+
+    assert [
+        event.identifier
+        for _, event in storage.get_events(event_types=['EventTransferSentFailed'])
+    ] == [1]
+    assert len(storage.get_events(channel_identifier=channel2)) == 1
+
+    # the event without a channel can't be indexed by it
+    assert [
+        event.identifier
+        for _, event in storage.get_events(
+            channel_identifier=channel2,
+            include_unknown_channel=True,
+        )
+    ] == [3, 2]
+
+    # opening an upgraded database is a no-op
+    storage.conn.close()
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    assert len(storage.get_events()) == 3
+
+
+def test_failed_upgrade_of_state_events_is_rolled_back(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    channel = factories.make_address()
+
+    conn = sqlite3.connect(database_path)
+    with conn:
+        conn.execute(
+            'CREATE TABLE state_changes ('
+            '    identifier INTEGER PRIMARY KEY AUTOINCREMENT, '
+            '    data BINARY'
+            ')'
+        )
+        conn.execute(
+            'CREATE TABLE state_events ('
+            '    identifier INTEGER PRIMARY KEY, '
+            '    source_statechange_id INTEGER NOT NULL, '
+            '    block_number INTEGER NOT NULL, '
+            '    data BINARY, '
+            '    FOREIGN KEY(source_statechange_id) REFERENCES state_changes(identifier)'
+            ')'
+        )
+        conn.execute('INSERT INTO state_changes(data) VALUES(?)', (b'statechangedata', ))
+        conn.execute(
+            'INSERT INTO state_events(source_statechange_id, block_number, data) '
+            'VALUES(1, 10, ?)',
+            (PickleSerializer.serialize(EventTransferSentFailed(1, 'no route', channel)), ),
+        )
+        conn.execute(
+            'INSERT INTO state_events(source_statechange_id, block_number, data) '
+            'VALUES(1, 10, ?)',
+            (b'not an event', ),
+        )
+
+    with pytest.raises(Exception):
+        SQLiteStorage(database_path, PickleSerializer)
+
+    # the columns are added with the indexed values or not at all, otherwise
+    # the next start would skip the events
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(state_events)')}
+    assert 'event_type' not in columns
+
+    with conn:
+        conn.execute('DELETE FROM state_events WHERE identifier = 2')
+    conn.close()
+
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    assert len(storage.get_events(channel_identifier=channel)) == 1
+
+
+def test_storage_with_failed_initialization_can_be_closed(monkeypatch):
+    def upgrade_state_events(self):  # pylint: disable=unused-argument
+        raise ValueError('upgrade failed')
+
+    monkeypatch.setattr(SQLiteStorage, 'upgrade_state_events', upgrade_state_events)
+
+    # __del__ closes the instance whose __init__ raised
+    storage = SQLiteStorage.__new__(SQLiteStorage)
+    with pytest.raises(ValueError):
+        storage.__init__(':memory:', PickleSerializer)
+
+    storage.close()
+
+
+def test_events_without_indexed_columns_are_indexed_on_open(tmpdir):
+    """ A database upgraded by a version that added the columns without
+    filling them.
+    """
+    database_path = str(tmpdir.join('log.db'))
+    channel = factories.make_address()
+
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    state_change_id = storage.write_state_change(Block(1))
+    storage.write_events(state_change_id, 1, [EventTransferSentFailed(1, 'no route', channel)])
+    with storage.conn:
+        storage.conn.execute(
+            'UPDATE state_events SET event_type = NULL, channel_identifier = NULL',
+        )
+    storage.close()
+
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    assert len(storage.get_events(channel_identifier=channel)) == 1
+
+
+def test_read_pool_queries_dont_block_the_hub(tmpdir):
+    database_path = str(tmpdir.join('log.db'))
+    storage = SQLiteStorage(database_path, PickleSerializer, read_pool_size=2)
+    channel1 = factories.make_address()
+    channel2 = factories.make_address()
+    write_transfer_events(storage, channel1, channel2)
+
+    # the committed writes are visible to the read-only connections
+    assert [
+        event.identifier
+        for _, event in storage.get_events(channel_identifier=channel1)
+    ] == [1, 3]
+    assert len(storage.get_events_by_block(0, 'latest')) == 4
+    assert len(storage.get_events_by_identifier(0, 'latest')) == 4
+
+    with pytest.raises(sqlite3.OperationalError):
+        storage.read_pool.run(lambda conn: conn.execute('DELETE FROM state_events'))
+
+    state_change_id = storage.write_state_change('statechangedata')
+    events = [EventTransferSentFailed(5, 'whatever', channel1)] * 50000
+    storage.write_events(state_change_id, 30, events)
+
+    ticks = 0
+    query_done = False
+
+    def ticker():
+        nonlocal ticks
+        while not query_done:
+            ticks += 1
+            gevent.sleep(0.001)
+
+    ticker_greenlet = gevent.spawn(ticker)
+    gevent.sleep(0)
+
+    result = storage.get_events(payment_identifier=5)
+    query_done = True
+    ticker_greenlet.join()
+
+    assert len(result) == len(events)
+    assert ticks > 1
+
+    storage.close()
+
+
+def test_restore_replays_state_changes_after_snapshot():
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    wal, events = restore_from_latest_snapshot(state_transition_count, storage)
+    assert wal.state_manager.current_state is None
+    assert not events
+
+    for block_number in range(1, 6):
+        wal.log_and_dispatch(Block(block_number), block_number)
+
+        if block_number == 3:
+            wal.snapshot()
+
+    state_change_id, snapshot = storage.get_state_snapshot()
+    assert (state_change_id, snapshot.count) == (3, 3)
+
+    # the snapshotted state change must not be applied twice
+    restored, _ = restore_from_latest_snapshot(state_transition_count, storage)
+    assert restored.state_manager.current_state.count == 5
+    assert restored.state_change_id == 5
+    assert restored.state_changes_since_snapshot == 2
+
+
+def test_restore_without_snapshot_replays_the_whole_log():
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+
+    # a log written without ever taking a snapshot, e.g. by a node that
+    # crashed before the first one
+    for block_number in range(1, 4):
+        storage.write_state_change(Block(block_number))
+
+    assert storage.get_state_snapshot() is None
+
+    def state_transition_with_event(state, state_change):
+        result = state_transition_count(state, state_change)
+        event = EventTransferSentFailed(state_change.block_number, 'reason')
+        return TransitionResult(result.new_state, [event])
+
+    restored, events = restore_from_latest_snapshot(state_transition_with_event, storage)
+    assert restored.state_manager.current_state.count == 3
+    assert [event.identifier for event in events] == [1, 2, 3]
+    assert restored.state_change_id == 3
+    assert restored.state_changes_since_snapshot == 3
+
+
+def test_snapshot_policy():
+    policy = SnapshotPolicy(state_changes=10, interval=60, log_size=1024)
+
+    assert not policy.is_due(state_changes=9, elapsed=59, log_size=1023)
+    assert policy.is_due(state_changes=10, elapsed=0, log_size=0)
+    assert policy.is_due(state_changes=0, elapsed=60, log_size=0)
+    assert policy.is_due(state_changes=0, elapsed=0, log_size=1024)
+
+    assert not SnapshotPolicy().is_due(state_changes=10 ** 6, elapsed=10 ** 6, log_size=10 ** 9)
+
+
+def test_log_and_dispatch_snapshots_periodically():
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    policy = SnapshotPolicy(state_changes=3)
+    wal, _ = restore_from_latest_snapshot(state_transition_count, storage, policy)
+
+    for block_number in range(1, 8):
+        wal.log_and_dispatch(Block(block_number), block_number)
+
+        if wal.snapshot_greenlet is not None:
+            wal.snapshot_greenlet.join()
+
+    state_change_id, snapshot = storage.get_state_snapshot()
+    assert (state_change_id, snapshot.count) == (6, 6)
+    assert wal.state_changes_since_snapshot == 1
+
+    # Only the latest snapshot is kept
+    cursor = storage.conn.execute('SELECT COUNT(*) FROM state_snapshot')
+    assert cursor.fetchone()[0] == 1
+
+    restored, _ = restore_from_latest_snapshot(state_transition_count, storage, policy)
+    assert restored.state_manager.current_state.count == 7
+    assert restored.state_changes_since_snapshot == 1
+
+
+def test_iterate_statechanges_reads_in_chunks():
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    for block_number in range(1, 11):
+        storage.write_state_change(Block(block_number))
+
+    state_changes = storage.iterate_statechanges(3, chunk_size=3)
+    assert [state_change.block_number for state_change in state_changes] == list(range(3, 11))
+    assert storage.count_statechanges(3) == 8
+
+    # the connection can be written to while the state changes are consumed
+    state_changes = storage.iterate_statechanges(1, chunk_size=3)
+    next(state_changes)
+    storage.write_state_change(Block(11))
+    assert len(list(state_changes)) == 10
+
+
+def test_restore_streams_large_log_within_memory_budget(tmpdir):
+    number_of_state_changes = 1000000
+    memory_budget = 2 * 1024 * 1024
+
+    database_path = str(tmpdir.join('log.db'))
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    data = PickleSerializer.serialize(Block(1))
+    with storage.transaction():
+        storage.conn.executemany(
+            'INSERT INTO state_changes(data) VALUES(?)',
+            ((data, ) for _ in range(number_of_state_changes)),
+        )
+    storage.conn.close()
+
+    progress = list()
+
+    def progress_callback(replayed, total):
+        progress.append((replayed, total))
+
+    storage = SQLiteStorage(database_path, PickleSerializer)
+    tracemalloc.start()
+    try:
+        wal, _ = restore_from_latest_snapshot(
+            state_transition_count,
+            storage,
+            progress_callback=progress_callback,
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert wal.state_manager.current_state.count == number_of_state_changes
+    assert wal.state_changes_since_snapshot == number_of_state_changes
+    assert peak < memory_budget
+
+    assert progress[0] == (REPLAY_PROGRESS_STEP, number_of_state_changes)
+    assert progress[-1] == (number_of_state_changes, number_of_state_changes)
+
+
+def test_group_commit_batches_concurrent_state_changes():
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    wal, _ = restore_from_latest_snapshot(
+        state_transition_count,
+        storage,
+        group_commit=True,
+    )
+
+    batches = list()
+    commit_batch = wal._commit_batch
+
+    def record_batch(batch):
+        batches.append(len(batch))
+        return commit_batch(batch)
+
+    wal._commit_batch = record_batch
+
+    greenlets = [
+        gevent.spawn(wal.log_and_dispatch, Block(block_number), block_number)
+        for block_number in range(1, 11)
+    ]
+    gevent.joinall(greenlets, raise_error=True)
+
+    assert batches == [10]
+    assert all(greenlet.value == list() for greenlet in greenlets)
+    assert wal.state_manager.current_state.count == 10
+    assert wal.state_change_id == 10
+
+    state_changes = storage.get_statechanges_by_identifier(0, 'latest')
+    assert [state_change.block_number for state_change in state_changes] == list(range(1, 11))
+
+
+def test_group_commit_failure_does_not_fail_the_batch():
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    wal, _ = restore_from_latest_snapshot(
+        state_transition_fail_on_block,
+        storage,
+        group_commit=True,
+    )
+
+    def log_and_dispatch(block_number):
+        try:
+            return wal.log_and_dispatch(Block(block_number), block_number)
+        except ValueError as e:
+            return e
+
+    greenlets = [
+        gevent.spawn(log_and_dispatch, block_number)
+        for block_number in (1, 0, 2)
+    ]
+    gevent.joinall(greenlets, raise_error=True)
+
+    assert greenlets[0].value == list()
+    assert isinstance(greenlets[1].value, ValueError)
+    assert greenlets[2].value == list()
+
+    # the failed state change is neither applied nor logged
+    assert wal.state_manager.current_state.count == 2
+    state_changes = storage.get_statechanges_by_identifier(0, 'latest')
+    assert [state_change.block_number for state_change in state_changes] == [1, 2]
+
+
+def test_failed_write_does_not_apply_the_state_change(monkeypatch):
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    wal, _ = restore_from_latest_snapshot(state_transition_count, storage)
+    wal.log_and_dispatch(Block(1), 1)
+
+    def write_events(state_change_id, block_number, events):  # pylint: disable=unused-argument
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(storage, 'write_events', write_events)
+
+    with pytest.raises(sqlite3.OperationalError):
+        wal.log_and_dispatch(Block(2), 2)
+
+    # the state change was dispatched before the write failed
+    assert wal.state_manager.current_state.count == 1
+    assert wal.state_change_id == 1
+    assert len(storage.get_statechanges_by_identifier(0, 'latest')) == 1
+
+
+def test_log_and_dispatch_batch_uses_a_single_transaction():
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    wal, _ = restore_from_latest_snapshot(state_transition_count, storage)
+
+    transactions = list()
+    transaction = storage.transaction
+
+    def record_transaction():
+        if storage.transaction_depth == 0:
+            transactions.append(wal.state_change_id)
+        return transaction()
+
+    storage.transaction = record_transaction
+
+    state_changes = [Block(block_number) for block_number in range(1, 11)]
+    events = wal.log_and_dispatch_batch(state_changes, 10)
+
+    assert events == [list()] * 10
+    assert len(transactions) == 1
+    assert wal.state_manager.current_state.count == 10
+    assert wal.state_change_id == 10
+    assert wal.state_changes_since_snapshot == 10
+
+    logged = storage.get_statechanges_by_identifier(0, 'latest')
+    assert [state_change.block_number for state_change in logged] == list(range(1, 11))
+
+
+def test_batch_orders_state_changes_of_other_greenlets():
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    wal, _ = restore_from_latest_snapshot(state_transition_count, storage)
+
+    with wal.batch() as batch:
+        wal.log_and_dispatch(Block(1), 1)
+
+        # the greenlet is applied inside the batch, and waits for its commit
+        greenlet = gevent.spawn(wal.log_and_dispatch, Block(2), 2)
+        gevent.sleep(0)
+        assert not greenlet.ready()
+
+        wal.log_and_dispatch(Block(3), 3)
+        assert wal.state_manager.current_state.count == 3
+        assert not storage.get_latest_state_change_id()
+
+    assert batch.committed.successful()
+    assert greenlet.get() == list()
+
+    logged = storage.get_statechanges_by_identifier(0, 'latest')
+    assert [state_change.block_number for state_change in logged] == [1, 2, 3]
+
+
+def test_batch_failure_logs_the_applied_state_changes():
+    storage = SQLiteStorage(':memory:', PickleSerializer)
+    wal, _ = restore_from_latest_snapshot(state_transition_fail_on_block, storage)
+
+    state_changes = [Block(1), Block(2), Block(0), Block(3)]
+    with pytest.raises(ValueError):
+        wal.log_and_dispatch_batch(state_changes, 3)
+
+    # the state changes before the failure are applied and logged
+    assert wal.state_manager.current_state.count == 2
+    logged = storage.get_statechanges_by_identifier(0, 'latest')
+    assert [state_change.block_number for state_change in logged] == [1, 2]
+
+    assert wal.log_and_dispatch(Block(3), 3) == list()
+    assert wal.state_change_id == 3
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # pylint: disable=invalid-name,too-many-locals,too-many-arguments,too-many-lines
 import random
+from copy import deepcopy
 
 import pytest
 
@@ -19,6 +20,7 @@ from raiden.transfer.mediated_transfer.state_change import (
 from raiden.transfer.mediated_transfer.events import (
     EventUnlockFailed,
     EventUnlockSuccess,
+    EventWithdrawFailed,
     SendBalanceProof,
     SendLockedTransfer,
     SendRefundTransfer,
@@ -1131,6 +1133,126 @@ def test_events_for_close_hold_for_unpaid_payee():
     assert pair.payer_state not in mediator.STATE_TRANSFER_PAID
 
 
+def test_block_handles_only_the_pairs_with_a_deadline():
+    """ The pairs are indexed by their next deadline, handling a Block with
+    the index must have the same outcome as checking every pair.
+    """
+    amount = 10
+    channelmap, transfers_pair = make_transfers_pair(
+        [HOP2_KEY, HOP3_KEY, HOP4_KEY, HOP5_KEY],
+        amount,
+    )
+    # the first payer channel must be closed once the lock is unsafe
+    transfers_pair[0].payee_state = 'payee_balance_proof'
+
+    mediator_state = MediatorTransferState(UNIT_SECRETHASH)
+    mediator_state.transfers_pair = transfers_pair
+    expected_channelmap, expected_pairs = deepcopy((channelmap, transfers_pair))
+
+    event_types = set()
+    last_block = max(pair.payer_transfer.lock.expiration for pair in transfers_pair) + 1
+    for block_number in range(1, last_block + 1):
+        expected_events = mediator.events_for_close(
+            expected_channelmap,
+            expected_pairs,
+            block_number,
+        )
+        expected_events += mediator.set_expired_pairs(expected_pairs, block_number)
+
+        iteration = mediator.handle_block(
+            channelmap,
+            mediator_state,
+            Block(block_number),
+            block_number,
+        )
+
+        assert iteration.events == expected_events
+        assert mediator_state.transfers_pair == expected_pairs
+        event_types.update(type(event) for event in iteration.events)
+
+        next_block_due = mediator.get_next_block_due(channelmap, mediator_state, block_number)
+        if next_block_due is not None:
+            assert next_block_due > block_number
+
+    assert event_types == {ContractSendChannelClose, EventUnlockFailed, EventWithdrawFailed}
+    assert all(pair.payer_state == 'payer_expired' for pair in transfers_pair)
+    assert mediator.get_next_block_due(channelmap, mediator_state, last_block) is None
+
+
+def test_state_change_updates_the_deadlines_of_the_pairs_it_changed(monkeypatch):
+    amount = UNIT_TRANSFER_AMOUNT
+    pseudo_random_generator = random.Random()
+
+    from_channel = factories.make_channel(
+        partner_balance=amount,
+        partner_address=UNIT_TRANSFER_SENDER,
+        token_address=UNIT_TOKEN_ADDRESS,
+    )
+    from_transfer = factories.make_signed_transfer_for(
+        from_channel,
+        amount,
+        HOP1,
+        HOP2,
+        HOP1_TIMEOUT,
+        UNIT_SECRET,
+    )
+    channel1 = factories.make_channel(
+        our_balance=amount,
+        partner_address=HOP2,
+        token_address=UNIT_TOKEN_ADDRESS,
+    )
+    channelmap = {
+        from_channel.identifier: from_channel,
+        channel1.identifier: channel1,
+    }
+
+    updated_pairs = list()
+    get_pair_block_due = mediator.get_pair_block_due
+
+    def recording_get_pair_block_due(channelidentifiers_to_channels, pair, block_number):
+        updated_pairs.append(pair)
+        return get_pair_block_due(channelidentifiers_to_channels, pair, block_number)
+
+    monkeypatch.setattr(mediator, 'get_pair_block_due', recording_get_pair_block_due)
+
+    block_number = 1
+    init_state_change = ActionInitMediator(
+        factories.make_address(),
+        [factories.route_from_channel(channel1)],
+        factories.route_from_channel(from_channel),
+        from_transfer,
+    )
+    mediator_state = mediator.state_transition(
+        None,
+        init_state_change,
+        channelmap,
+        pseudo_random_generator,
+        block_number,
+    ).new_state
+    assert updated_pairs == mediator_state.transfers_pair
+
+    # a reveal of another secret changes no pair
+    del updated_pairs[:]
+    mediator.state_transition(
+        mediator_state,
+        ReceiveSecretReveal(b'a' * 32, HOP2),
+        channelmap,
+        pseudo_random_generator,
+        block_number,
+    )
+    assert not updated_pairs
+
+    # learning the secret changes the whole path
+    mediator.state_transition(
+        mediator_state,
+        ReceiveSecretReveal(UNIT_SECRET, HOP2),
+        channelmap,
+        pseudo_random_generator,
+        block_number,
+    )
+    assert updated_pairs == mediator_state.transfers_pair
+
+
 def test_secret_learned():
     amount = UNIT_TRANSFER_AMOUNT
     target = HOP2
@@ -268,6 +268,39 @@ def test_handle_secretreveal():
     assert reveal.recipient == state.route.node_address
 
 
+def test_next_block_due_after_close():
+    """ Once the close is sent with the secret known no Block can change the
+    target state.
+    """
+    amount = 3
+    block_number = 10
+    pseudo_random_generator = random.Random()
+
+    from_channel, state = make_target_state(
+        UNIT_TRANSFER_TARGET,
+        amount,
+        block_number,
+        HOP1,
+        expiration=block_number + 30,
+    )
+    channel.handle_receive_lockedtransfer(from_channel, state.transfer)
+
+    unsafe_block = state.transfer.lock.expiration - from_channel.reveal_timeout
+    assert target.get_next_block_due(state, from_channel, block_number) == unsafe_block
+
+    channel.register_secret(from_channel, UNIT_SECRET, UNIT_SECRETHASH)
+    iteration = target.state_transition(
+        state,
+        Block(unsafe_block),
+        from_channel,
+        pseudo_random_generator,
+        unsafe_block,
+    )
+    assert must_contain_entry(iteration.events, ContractSendChannelClose, {})
+    assert state.state == 'waiting_close'
+    assert target.get_next_block_due(state, from_channel, unsafe_block) is None
+
+
 def test_handle_block():
     """ Increase the block number. """
     initiator = factories.HOP6
@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=invalid-name,too-many-locals
+import random
+from copy import deepcopy
+
+import networkx
+import pytest
+
+from raiden.storage.serialize import SERIALIZERS
+from raiden.tests.utils import factories
+from raiden.tests.utils.factories import (
+    UNIT_REGISTRY_IDENTIFIER,
+    UNIT_SECRET,
+    UNIT_SECRETHASH,
+    UNIT_TOKEN_ADDRESS,
+    UNIT_TRANSFER_AMOUNT,
+    UNIT_TRANSFER_SENDER,
+)
+from raiden.transfer import node
+from raiden.transfer.copy_on_write import (
+    TransitionUpdates,
+    channelstate_for_update,
+    copy_nodestate,
+    networkgraph_for_update,
+    tokennetwork_for_update,
+)
+from raiden.transfer.events import SendProcessed
+from raiden.transfer.mediated_transfer.events import EventWithdrawFailed, SendLockedTransfer
+from raiden.transfer.mediated_transfer.state_change import (
+    ActionCancelRoute,
+    ActionInitInitiator,
+    ActionInitTarget,
+)
+from raiden.transfer.state import (
+    NodeState,
+    PaymentNetworkState,
+    TokenNetworkGraphState,
+    TokenNetworkState,
+    TransactionExecutionStatus,
+)
+from raiden.transfer.state_change import (
+    ActionLeaveAllNetworks,
+    Block,
+    ContractReceiveChannelClosed,
+    ContractReceiveChannelNew,
+    ContractReceiveRouteNew,
+    ReceiveDelivered,
+    ReceiveProcessed,
+)
+
+UNIT_TOKEN_NETWORK_ADDRESS = b'networknetworknetwor'
+
+
+def make_node_state(number_of_channels, block_number=1):
+    our_address = factories.make_address()
+    channels = [
+        factories.make_channel(
+            our_balance=UNIT_TRANSFER_AMOUNT,
+            our_address=our_address,
+            token_address=UNIT_TOKEN_ADDRESS,
+        )
+        for _ in range(number_of_channels)
+    ]
+
+    graph = networkx.Graph()
+    for channel_state in channels:
+        graph.add_edge(our_address, channel_state.partner_state.address)
+
+    token_network_state = TokenNetworkState(
+        UNIT_TOKEN_NETWORK_ADDRESS,
+        UNIT_TOKEN_ADDRESS,
+        TokenNetworkGraphState(graph),
+        channels,
+    )
+    payment_network_state = PaymentNetworkState(
+        UNIT_REGISTRY_IDENTIFIER,
+        [token_network_state],
+    )
+
+    node_state = NodeState(random.Random(), block_number)
+    node_state.identifiers_to_paymentnetworks[UNIT_REGISTRY_IDENTIFIER] = payment_network_state
+
+    return node_state, channels
+
+
+def get_channels(node_state):
+    payment_network_state = node_state.identifiers_to_paymentnetworks[UNIT_REGISTRY_IDENTIFIER]
+    token_network_state = payment_network_state.tokenaddresses_to_tokennetworks[
+        UNIT_TOKEN_ADDRESS
+    ]
+    return token_network_state.channelidentifiers_to_channels
+
+
+def all_token_networks(node_state):
+    for payment_network_state in node_state.identifiers_to_paymentnetworks.values():
+        yield from payment_network_state.tokenaddresses_to_tokennetworks.values()
+
+
+def copy_for_comparison(node_state):
+    """ Deep copy of `node_state` that compares equal to it, random.Random
+    and networkx.Graph use identity for equality, so these are compared by
+    value separately.
+    """
+    state_copy = deepcopy(node_state)
+    state_copy.pseudo_random_generator = node_state.pseudo_random_generator
+
+    graphs_edges = list()
+    token_networks = zip(all_token_networks(node_state), all_token_networks(state_copy))
+    for token_network_state, token_network_copy in token_networks:
+        token_network_copy.network_graph = token_network_state.network_graph
+        graphs_edges.append(sorted(token_network_state.network_graph.network.edges()))
+
+    return state_copy, node_state.pseudo_random_generator.getstate(), graphs_edges
+
+
+def assert_unchanged(node_state, expected):
+    expected_state, expected_random_state, expected_graphs_edges = expected
+    graphs_edges = [
+        sorted(token_network_state.network_graph.network.edges())
+        for token_network_state in all_token_networks(node_state)
+    ]
+
+    assert node_state == expected_state
+    assert node_state.pseudo_random_generator.getstate() == expected_random_state
+    assert graphs_edges == expected_graphs_edges
+
+
+def test_state_transition_does_not_change_previous_state():
+    node_state, channels = make_node_state(number_of_channels=3)
+    channel_closed = channels[0]
+
+    closed = ContractReceiveChannelClosed(
+        UNIT_REGISTRY_IDENTIFIER,
+        UNIT_TOKEN_ADDRESS,
+        channel_closed.identifier,
+        channel_closed.partner_state.address,
+        2,
+    )
+    expected = copy_for_comparison(node_state)
+    iteration = node.state_transition(node_state, closed)
+    closed_state = iteration.new_state
+
+    assert_unchanged(node_state, expected)
+    assert closed_state != node_state
+
+    new_channels = get_channels(closed_state)
+    assert new_channels[channel_closed.identifier].close_transaction is not None
+    assert get_channels(node_state)[channel_closed.identifier].close_transaction is None
+
+    # the untouched channels are shared among the states
+    for channel_state in channels[1:]:
+        assert new_channels[channel_state.identifier] is channel_state
+
+    # the token network is copied, so the graph is not changed
+    new_route = ContractReceiveRouteNew(
+        UNIT_REGISTRY_IDENTIFIER,
+        UNIT_TOKEN_ADDRESS,
+        factories.make_address(),
+        factories.make_address(),
+    )
+
+    expected = copy_for_comparison(closed_state)
+    iteration = node.state_transition(closed_state, new_route)
+    assert_unchanged(closed_state, expected)
+
+    new_graph = all_token_networks(iteration.new_state).__next__().network_graph.network
+    assert new_graph.has_edge(new_route.participant1, new_route.participant2)
+
+
+def test_block_only_copies_due_channels():
+    node_state, channels = make_node_state(number_of_channels=3)
+    channel_closed = channels[0]
+    channel_closed.close_transaction = TransactionExecutionStatus(
+        None,
+        1,
+        TransactionExecutionStatus.SUCCESS,
+    )
+
+    settlement_block = 2 + channel_closed.settle_timeout
+    expected = copy_for_comparison(node_state)
+    iteration = node.state_transition(node_state, Block(settlement_block))
+
+    assert_unchanged(node_state, expected)
+    assert iteration.new_state.block_number == settlement_block
+    assert len(iteration.events) == 1
+
+    new_channels = get_channels(iteration.new_state)
+    assert new_channels[channel_closed.identifier] is not channel_closed
+    assert new_channels[channel_closed.identifier].settle_transaction is not None
+    assert channel_closed.settle_transaction is None
+
+    for channel_state in channels[1:]:
+        assert new_channels[channel_state.identifier] is channel_state
+
+
+def test_channel_is_copied_once_per_transition():
+    node_state, channels = make_node_state(number_of_channels=2)
+    channel_state = channels[0]
+    updates = TransitionUpdates()
+
+    new_node_state = copy_nodestate(node_state)
+    _, token_network_state = tokennetwork_for_update(
+        new_node_state,
+        UNIT_REGISTRY_IDENTIFIER,
+        UNIT_TOKEN_ADDRESS,
+        updates,
+    )
+    channel_copy = channelstate_for_update(token_network_state, channel_state, updates)
+    assert channelstate_for_update(token_network_state, channel_state, updates) is channel_copy
+
+    # the parts changed in place are not shared with the previous state
+    assert channel_copy is not channel_state
+    end_states = [
+        (channel_state.our_state, channel_copy.our_state),
+        (channel_state.partner_state, channel_copy.partner_state),
+    ]
+    for end_state, end_copy in end_states:
+        assert end_copy is not end_state
+        assert end_copy.secrethashes_to_lockedlocks is not end_state.secrethashes_to_lockedlocks
+        assert end_copy == end_state
+
+    ids_to_channels = token_network_state.channelidentifiers_to_channels
+    assert ids_to_channels[channels[1].identifier] is channels[1]
+    assert updates.channels == {(token_network_state.address, channel_state.identifier)}
+
+
+def test_new_route_shares_the_untouched_part_of_the_graph():
+    node_state, _ = make_node_state(number_of_channels=3)
+
+    def get_network(state):
+        payment_network = state.identifiers_to_paymentnetworks[UNIT_REGISTRY_IDENTIFIER]
+        token_network = payment_network.tokenaddresses_to_tokennetworks[UNIT_TOKEN_ADDRESS]
+        return token_network.network_graph.network
+
+    network = get_network(node_state)
+    edges = sorted(network.edges())
+    untouched = next(iter(network.nodes()))
+    participant1, participant2 = factories.make_address(), factories.make_address()
+
+    route_new = ContractReceiveRouteNew(
+        UNIT_REGISTRY_IDENTIFIER,
+        UNIT_TOKEN_ADDRESS,
+        participant1,
+        participant2,
+    )
+    new_network = get_network(node.state_transition(node_state, route_new).new_state)
+
+    # the previous graph is not changed
+    assert sorted(network.edges()) == edges
+    assert sorted(new_network.edges()) == sorted(edges + [(participant1, participant2)])
+    assert new_network.adj[untouched] == network.adj[untouched]
+    # pylint: disable=protected-access
+    assert new_network._adj[untouched] is network._adj[untouched]
+
+    # a second edge in the same transition changes the copy
+    updates = TransitionUpdates()
+    new_node_state = copy_nodestate(node_state)
+    _, token_network_state = tokennetwork_for_update(
+        new_node_state,
+        UNIT_REGISTRY_IDENTIFIER,
+        UNIT_TOKEN_ADDRESS,
+        updates,
+    )
+    first = networkgraph_for_update(token_network_state, (participant1, participant2), updates)
+    first.add_edge(participant1, participant2)
+    second = networkgraph_for_update(token_network_state, (participant1, untouched), updates)
+    second.add_edge(participant1, untouched)
+
+    assert second is first
+    assert sorted(network.edges()) == edges
+    assert participant1 not in network.adj[untouched]
+
+
+def test_block_visits_only_the_channels_with_a_deadline():
+    node_state, channels = make_node_state(number_of_channels=3)
+    channel_closed = channels[0]
+
+    closed = ContractReceiveChannelClosed(
+        UNIT_REGISTRY_IDENTIFIER,
+        UNIT_TOKEN_ADDRESS,
+        channel_closed.identifier,
+        channel_closed.partner_state.address,
+        2,
+    )
+    closed_state = node.state_transition(node_state, closed).new_state
+
+    channel_key = (UNIT_REGISTRY_IDENTIFIER, UNIT_TOKEN_ADDRESS, channel_closed.identifier)
+    settlement_block = 3 + channel_closed.settle_timeout
+    assert closed_state.channel_deadlines.keys_to_blocks == {channel_key: settlement_block}
+
+    iteration = node.state_transition(closed_state, Block(settlement_block - 1))
+    assert not iteration.events
+    assert (
+        get_channels(iteration.new_state)[channel_closed.identifier] is
+        get_channels(closed_state)[channel_closed.identifier]
+    )
+    assert iteration.new_state.channel_deadlines is closed_state.channel_deadlines
+
+    # a block can be skipped
+    iteration = node.state_transition(iteration.new_state, Block(settlement_block + 5))
+    assert len(iteration.events) == 1
+    assert not iteration.new_state.channel_deadlines.keys_to_blocks
+
+
+def test_block_visits_only_the_payment_tasks_with_a_deadline():
+    node_state, _ = make_node_state(number_of_channels=0)
+    channel_state = factories.make_channel(
+        our_address=factories.make_address(),
+        partner_address=UNIT_TRANSFER_SENDER,
+        partner_balance=UNIT_TRANSFER_AMOUNT,
+        token_address=UNIT_TOKEN_ADDRESS,
+    )
+    channel_new = ContractReceiveChannelNew(
+        UNIT_REGISTRY_IDENTIFIER,
+        UNIT_TOKEN_ADDRESS,
+        channel_state,
+    )
+    node_state = node.state_transition(node_state, channel_new).new_state
+
+    expiration = 50
+    transfer = factories.make_signed_transfer_for(
+        channel_state,
+        UNIT_TRANSFER_AMOUNT,
+        factories.HOP6,
+        channel_state.our_state.address,
+        expiration,
+        UNIT_SECRET,
+    )
+    init_target = ActionInitTarget(
+        UNIT_REGISTRY_IDENTIFIER,
+        factories.route_from_channel(channel_state),
+        transfer,
+    )
+    node_state = node.state_transition(node_state, init_target).new_state
+
+    close_block = expiration - channel_state.reveal_timeout
+    assert node_state.paymenttask_deadlines.keys_to_blocks == {UNIT_SECRETHASH: close_block}
+
+    # the task is not copied while no deadline is due
+    task = node_state.payment_mapping.secrethashes_to_task[UNIT_SECRETHASH]
+    iteration = node.state_transition(node_state, Block(close_block - 1))
+    assert iteration.new_state.payment_mapping.secrethashes_to_task[UNIT_SECRETHASH] is task
+
+    # the task is due on every block of the unsafe region, the expiration
+    # is reported once
+    block_state = iteration.new_state
+    withdraw_failed = list()
+    for block_number in range(close_block, expiration + 5):
+        iteration = node.state_transition(block_state, Block(block_number))
+        block_state = iteration.new_state
+        withdraw_failed.extend(
+            event
+            for event in iteration.events
+            if isinstance(event, EventWithdrawFailed)
+        )
+
+    assert len(withdraw_failed) == 1
+    assert not block_state.paymenttask_deadlines.keys_to_blocks
+
+
+def test_deadlines_are_computed_for_restored_states():
+    node_state, channels = make_node_state(number_of_channels=2)
+    channel_closed = channels[0]
+    channel_closed.close_transaction = TransactionExecutionStatus(
+        None,
+        1,
+        TransactionExecutionStatus.SUCCESS,
+    )
+
+    # states restored from an older snapshot don't have the deadlines
+    assert node_state.channel_deadlines is None
+
+    iteration = node.state_transition(node_state, ReceiveProcessed(1))
+    channel_key = (UNIT_REGISTRY_IDENTIFIER, UNIT_TOKEN_ADDRESS, channel_closed.identifier)
+    assert iteration.new_state.channel_deadlines.keys_to_blocks == {
+        channel_key: 2 + channel_closed.settle_timeout,
+    }
+
+
+def test_payment_task_does_not_change_previous_state():
+    node_state, channels = make_node_state(number_of_channels=3)
+    channel_used = channels[0]
+
+    transfer_description = factories.make_transfer_description(
+        UNIT_TRANSFER_AMOUNT,
+        UNIT_SECRET,
+        identifier=1,
+        target=channel_used.partner_state.address,
+    )
+    init_initiator = ActionInitInitiator(
+        UNIT_REGISTRY_IDENTIFIER,
+        transfer_description,
+        [factories.route_from_channel(channel_used)],
+    )
+
+    expected = copy_for_comparison(node_state)
+    iteration = node.state_transition(node_state, init_initiator)
+    initiator_state = iteration.new_state
+
+    assert_unchanged(node_state, expected)
+    assert UNIT_SECRETHASH in initiator_state.payment_mapping.secrethashes_to_task
+    assert not node_state.payment_mapping.secrethashes_to_task
+
+    new_channels = get_channels(initiator_state)
+    assert new_channels[channel_used.identifier].our_state.merkletree != (
+        channel_used.our_state.merkletree
+    )
+    for channel_state in channels[1:]:
+        assert new_channels[channel_state.identifier] is channel_state
+
+    send_transfer = next(e for e in iteration.events if isinstance(e, SendLockedTransfer))
+    assert not node_state.queueids_to_queues
+    assert initiator_state.queueids_to_queues
+
+    expected = copy_for_comparison(initiator_state)
+    processed = ReceiveProcessed(send_transfer.message_identifier)
+    iteration = node.state_transition(initiator_state, processed)
+
+    assert_unchanged(initiator_state, expected)
+    assert not any(iteration.new_state.queueids_to_queues.values())
+
+    expected = copy_for_comparison(initiator_state)
+    iteration = node.state_transition(initiator_state, ActionLeaveAllNetworks())
+    assert_unchanged(initiator_state, expected)
+    assert all(
+        channel_state.close_transaction is not None
+        for channel_state in get_channels(iteration.new_state).values()
+    )
+
+
+def test_state_change_without_handler_is_rejected():
+    node_state, _ = make_node_state(number_of_channels=3)
+    expected = copy_for_comparison(node_state)
+
+    # ActionCancelRoute is only dispatched by the initiator manager
+    cancel_route = ActionCancelRoute(UNIT_REGISTRY_IDENTIFIER, 1, [])
+    with pytest.raises(RuntimeError):
+        node.state_transition(node_state, cancel_route)
+
+    assert_unchanged(node_state, expected)
+
+
+def test_dispatch_statistics():
+    node_state, _ = make_node_state(number_of_channels=3)
+    node.reset_dispatch_statistics()
+
+    iteration = node.state_transition(node_state, ReceiveProcessed(1))
+    iteration = node.state_transition(iteration.new_state, ReceiveProcessed(2))
+    node.state_transition(iteration.new_state, ActionLeaveAllNetworks())
+
+    statistics = node.dispatch_statistics()
+    assert set(statistics) == {'ReceiveProcessed', 'ActionLeaveAllNetworks'}
+    assert statistics['ReceiveProcessed']['calls'] == 2
+    assert statistics['ReceiveProcessed']['events'] == 0
+    assert statistics['ReceiveProcessed']['elapsed'] > 0
+    assert statistics['ActionLeaveAllNetworks'] == {
+        'calls': 1,
+        'elapsed': statistics['ActionLeaveAllNetworks']['elapsed'],
+        'events': 3,
+    }
+
+    node.reset_dispatch_statistics()
+    assert node.dispatch_statistics() == dict()
+
+
+def make_queued_messages(recipient1, recipient2):
+    return {
+        (recipient1, 'global'): [
+            SendProcessed(recipient1, 'global', 1),
+            SendProcessed(recipient1, 'global', 2),
+            SendProcessed(recipient1, 'global', 1),
+        ],
+        (recipient2, 'global'): [SendProcessed(recipient2, 'global', 2)],
+        (recipient2, b'channel'): [SendProcessed(recipient2, b'channel', 1)],
+    }
+
+
+def get_queued_identifiers(node_state):
+    return {
+        queueid: [message.message_identifier for message in queue]
+        for queueid, queue in node_state.queueids_to_queues.items()
+    }
+
+
+def test_acknowledgements_remove_the_queued_messages():
+    recipient1 = factories.make_address()
+    recipient2 = factories.make_address()
+    node_state, _ = make_node_state(number_of_channels=1)
+    node_state.queueids_to_queues = make_queued_messages(recipient1, recipient2)
+    expected = copy_for_comparison(node_state)
+
+    delivered_state = node.state_transition(node_state, ReceiveDelivered(1)).new_state
+    assert_unchanged(node_state, expected)
+    assert get_queued_identifiers(delivered_state) == {
+        (recipient1, 'global'): [2],
+        (recipient2, 'global'): [2],
+        (recipient2, b'channel'): [1],
+    }
+
+    processed_state = node.state_transition(delivered_state, ReceiveProcessed(1)).new_state
+    processed_state = node.state_transition(processed_state, ReceiveProcessed(2)).new_state
+    assert not any(get_queued_identifiers(processed_state).values())
+    assert processed_state.messageidentifiers_to_queueids == dict()
+
+
+@pytest.mark.parametrize('serializer_name', sorted(SERIALIZERS))
+def test_message_index_survives_snapshots(serializer_name):
+    node_state, _ = make_node_state(number_of_channels=1)
+    node_state.queueids_to_queues = make_queued_messages(
+        factories.make_address(),
+        factories.make_address(),
+    )
+    node_state = node.state_transition(node_state, ReceiveProcessed(3)).new_state
+
+    serializer = SERIALIZERS[serializer_name]()
+    restored = serializer.deserialize(serializer.serialize(node_state))
+    assert restored.messageidentifiers_to_queueids == node_state.messageidentifiers_to_queueids
+
+    restored = node.state_transition(restored, ReceiveDelivered(2)).new_state
+    assert sorted(
+        message.message_identifier
+        for queue in restored.queueids_to_queues.values()
+        for message in queue
+    ) == [1, 1, 1]
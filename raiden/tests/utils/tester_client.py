@@ -705,6 +705,10 @@ class NettingChannelTesterMock:
                 signature=signature,
             )
 
+    def withdraw_many(self, unlock_proofs):
+        for unlock_proof in unlock_proofs:
+            self.withdraw(unlock_proof)
+
     def withdraw(self, unlock_proof):
         self._check_exists()
 
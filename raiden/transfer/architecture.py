@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 # pylint: disable=too-few-public-methods
-from copy import deepcopy
 from typing import List
 
 
@@ -100,7 +99,9 @@ class StateManager:
         """ Initialize the state manager.
 
         Args:
-            state_transition: function that can apply a StateChange message.
+            state_transition: function that can apply a StateChange message,
+                it must not modify the state it is given (e.g. by copying the
+                parts of the state it changes).
             current_state: current application state.
         """
         if not callable(state_transition):
@@ -124,13 +125,12 @@ class StateManager:
         """
         assert isinstance(state_change, StateChange)
 
-        # the state objects must be treated as immutable, so make a copy of the
-        # current state and pass the copy to the state machine to be modified.
-        next_state = deepcopy(self.current_state)
-
-        # update the current state by applying the change
+        # the state objects must be treated as immutable, the state transition
+        # is responsible for copying the parts of the state it modifies, so
+        # that a state transition costs proportionally to the changed state
+        # instead of the whole state tree.
         iteration = self.state_transition(
-            next_state,
+            self.current_state,
             state_change,
         )
 
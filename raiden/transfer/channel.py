@@ -27,8 +27,11 @@ from raiden.transfer.mediated_transfer.events import (
 from raiden.transfer.merkle_tree import (
     LEAVES,
     merkleroot,
-    compute_layers,
+    compute_layers_with,
+    compute_layers_without,
     compute_merkleproof_for,
+    compute_merkleproofs_for,
+    find_leaf,
 )
 from raiden.transfer.state import (
     CHANNEL_STATE_CLOSED,
@@ -58,7 +61,7 @@ from raiden.transfer.state_change import (
     ContractReceiveChannelWithdraw,
     ReceiveTransferDirect,
 )
-from raiden.utils import publickey_to_address, typing
+from raiden.utils import pex, publickey_to_address, typing
 from raiden.settings import DEFAULT_NUMBER_OF_CONFIRMATIONS_BLOCK
 
 
@@ -67,6 +70,10 @@ TransactionOrder = namedtuple(
     ('block_number', 'transaction')
 )
 
+# Compare the `amount_locked` of an end state with the sum of its locks every
+# time the locks change, this is O(locks) and is enabled by the tests
+CHECK_AMOUNT_LOCKED = False
+
 
 def is_lock_pending(end_state, secrethash):
     """True if the `secrethash` corresponds to a lock that is pending withdraw
@@ -88,6 +95,47 @@ def is_deposit_confirmed(channel_state, block_number):
     )
 
 
+def is_settlement_due(channel_state, block_number):
+    """True if the channel is closed and the settlement period is over."""
+    if get_status(channel_state) != CHANNEL_STATE_CLOSED:
+        return False
+
+    closed_block_number = channel_state.close_transaction.finished_block_number
+    settlement_end = closed_block_number + channel_state.settle_timeout
+    return block_number > settlement_end
+
+
+def is_block_due(channel_state, block_number):
+    """True if a Block at `block_number` changes the channel state, otherwise
+    `handle_block` is a noop for the channel.
+    """
+    return (
+        is_settlement_due(channel_state, block_number) or
+        is_deposit_confirmed(channel_state, block_number)
+    )
+
+
+def get_next_block_due(channel_state):
+    """Return the first block number for which `is_block_due` is True, or
+    None if no Block can change the channel state until it is updated by
+    another state change.
+    """
+    due_blocks = list()
+
+    if get_status(channel_state) == CHANNEL_STATE_CLOSED:
+        closed_block_number = channel_state.close_transaction.finished_block_number
+        due_blocks.append(closed_block_number + channel_state.settle_timeout + 1)
+
+    if channel_state.deposit_transaction_queue:
+        transaction_block_number = channel_state.deposit_transaction_queue[0].block_number
+        due_blocks.append(transaction_block_number + DEFAULT_NUMBER_OF_CONFIRMATIONS_BLOCK + 1)
+
+    if due_blocks:
+        return min(due_blocks)
+
+    return None
+
+
 def is_lock_locked(end_state, secrethash):
     """True if the `secrethash` is for a lock with an unknown secret."""
     return secrethash in end_state.secrethashes_to_lockedlocks
@@ -481,6 +529,20 @@ def is_valid_unlock(unlock, channel_state, sender_state):
 
 
 def get_amount_locked(end_state):
+    """ Return the sum of the amounts of the pending and the unclaimed locks
+    of `end_state`.
+    """
+    amount_locked = getattr(end_state, 'amount_locked', None)
+
+    # states stored before the counter was introduced
+    if amount_locked is None:
+        amount_locked = compute_amount_locked(end_state)
+        end_state.amount_locked = amount_locked
+
+    return amount_locked
+
+
+def compute_amount_locked(end_state):
     total_pending = sum(
         lock.amount
         for lock in end_state.secrethashes_to_lockedlocks.values()
@@ -533,13 +595,19 @@ def get_distributable(sender, receiver):
 def get_known_unlocks(end_state):
     """Generate unlocking proofs for the known secrets."""
 
+    partialproofs = list(end_state.secrethashes_to_unlockedlocks.values())
+    merkle_proofs = compute_merkleproofs_for(
+        end_state.merkletree,
+        [partialproof.lock.lockhash for partialproof in partialproofs],
+    )
+
     return [
-        compute_proof_for_lock(
-            end_state,
+        UnlockProofState(
+            merkle_proof,
+            partialproof.lock.encoded,
             partialproof.secret,
-            partialproof.lock,
         )
-        for partialproof in end_state.secrethashes_to_unlockedlocks.values()
+        for partialproof, merkle_proof in zip(partialproofs, merkle_proofs)
     ]
 
 
@@ -603,6 +671,31 @@ def get_status(channel_state):
     return result
 
 
+def check_amount_locked(end_state):
+    assert end_state.amount_locked == compute_amount_locked(end_state), (
+        'amount_locked of {} is out of sync with its locks'.format(pex(end_state.address))
+    )
+
+
+def _add_lock(end_state, lock):
+    """Adds the pending lock to the indexing structures.
+
+    Note:
+        This won't change the merkletree!
+    """
+    amount_locked = get_amount_locked(end_state)
+
+    previous_lock = end_state.secrethashes_to_lockedlocks.get(lock.secrethash)
+    if previous_lock is not None:
+        amount_locked -= previous_lock.amount
+
+    end_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+    end_state.amount_locked = amount_locked + lock.amount
+
+    if CHECK_AMOUNT_LOCKED:
+        check_amount_locked(end_state)
+
+
 def _del_lock(end_state, secrethash):
     """Removes the lock from the indexing structures.
 
@@ -611,12 +704,20 @@ def _del_lock(end_state, secrethash):
     """
     assert is_lock_pending(end_state, secrethash)
 
+    amount_locked = get_amount_locked(end_state)
+    lock = get_lock(end_state, secrethash)
+
     if secrethash in end_state.secrethashes_to_lockedlocks:
         del end_state.secrethashes_to_lockedlocks[secrethash]
 
     if secrethash in end_state.secrethashes_to_unlockedlocks:
         del end_state.secrethashes_to_unlockedlocks[secrethash]
 
+    end_state.amount_locked = amount_locked - lock.amount
+
+    if CHECK_AMOUNT_LOCKED:
+        check_amount_locked(end_state)
+
 
 def set_closed(channel_state, block_number):
     if not channel_state.close_transaction:
@@ -672,11 +773,8 @@ def compute_merkletree_with(
     # Use None to inform the caller the lockshash is already known
     result = None
 
-    leaves = merkletree.layers[LEAVES]
-    if lockhash not in leaves:
-        leaves = list(leaves)
-        leaves.append(lockhash)
-        result = MerkleTreeState(compute_layers(leaves))
+    if find_leaf(merkletree.layers[LEAVES], lockhash) is None:
+        result = MerkleTreeState(compute_layers_with(merkletree.layers, lockhash))
 
     return result
 
@@ -686,12 +784,9 @@ def compute_merkletree_without(merkletree, lockhash):
     result = None
 
     leaves = merkletree.layers[LEAVES]
-    if lockhash in leaves:
-        leaves = list(leaves)
-        leaves.remove(lockhash)
-
-        if leaves:
-            result = MerkleTreeState(compute_layers(leaves))
+    if find_leaf(leaves, lockhash) is not None:
+        if len(leaves) > 1:
+            result = MerkleTreeState(compute_layers_without(merkletree.layers, lockhash))
         else:
             result = EMPTY_MERKLE_TREE
 
@@ -922,7 +1017,7 @@ def send_lockedtransfer(
     lock = transfer.lock
     channel_state.our_state.balance_proof = transfer.balance_proof
     channel_state.our_state.merkletree = merkletree
-    channel_state.our_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+    _add_lock(channel_state.our_state, lock)
 
     return send_locked_transfer_event
 
@@ -959,7 +1054,7 @@ def send_refundtransfer(
 
     channel_state.our_state.balance_proof = mediated_transfer.balance_proof
     channel_state.our_state.merkletree = merkletree
-    channel_state.our_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+    _add_lock(channel_state.our_state, lock)
 
     refund_transfer = refund_from_sendmediated(send_mediated_transfer)
     return refund_transfer
@@ -1017,11 +1112,15 @@ def register_secret_endstate(end_state, secret, secrethash):
         pendinglock = end_state.secrethashes_to_lockedlocks[secrethash]
         del end_state.secrethashes_to_lockedlocks[secrethash]
 
+        # the lock is still counted in `amount_locked` until it is claimed
         end_state.secrethashes_to_unlockedlocks[secrethash] = UnlockPartialProofState(
             pendinglock,
             secret,
         )
 
+        if CHECK_AMOUNT_LOCKED:
+            check_amount_locked(end_state)
+
 
 def register_secret(channel_state, secret, secrethash):
     """This will register the secret and set the lock to the unlocked stated.
@@ -1063,12 +1162,16 @@ def handle_send_directtransfer(
         events.append(direct_transfer)
     else:
         if not is_open:
-            failure = EventTransferSentFailed(payment_identifier, 'Channel is not opened')
+            failure = EventTransferSentFailed(
+                payment_identifier,
+                'Channel is not opened',
+                channel_state.identifier,
+            )
             events.append(failure)
 
         elif not is_valid:
             msg = 'Transfer amount is invalid. Transfer: {}'.format(amount)
-            failure = EventTransferSentFailed(payment_identifier, msg)
+            failure = EventTransferSentFailed(payment_identifier, msg, channel_state.identifier)
             events.append(failure)
 
         elif not can_pay:
@@ -1080,7 +1183,7 @@ def handle_send_directtransfer(
                 amount,
             )
 
-            failure = EventTransferSentFailed(payment_identifier, msg)
+            failure = EventTransferSentFailed(payment_identifier, msg, channel_state.identifier)
             events.append(failure)
 
     return TransitionResult(channel_state, events)
@@ -1112,6 +1215,7 @@ def handle_receive_directtransfer(channel_state, direct_transfer):
             direct_transfer.payment_identifier,
             transfer_amount,
             channel_state.partner_state.address,
+            channel_state.identifier,
         )
         send_processed = SendProcessed(
             direct_transfer.balance_proof.sender,
@@ -1151,8 +1255,7 @@ def handle_receive_lockedtransfer(
         channel_state.partner_state.balance_proof = mediated_transfer.balance_proof
         channel_state.partner_state.merkletree = merkletree
 
-        lock = mediated_transfer.lock
-        channel_state.partner_state.secrethashes_to_lockedlocks[lock.secrethash] = lock
+        _add_lock(channel_state.partner_state, mediated_transfer.lock)
 
         send_processed = SendProcessed(
             mediated_transfer.balance_proof.sender,
@@ -1207,18 +1310,14 @@ def handle_block(channel_state, state_change, block_number):
 
     events = list()
 
-    if get_status(channel_state) == CHANNEL_STATE_CLOSED:
-        closed_block_number = channel_state.close_transaction.finished_block_number
-        settlement_end = closed_block_number + channel_state.settle_timeout
-
-        if state_change.block_number > settlement_end:
-            channel_state.settle_transaction = TransactionExecutionStatus(
-                state_change.block_number,
-                None,
-                None,
-            )
-            event = ContractSendChannelSettle(channel_state.identifier)
-            events.append(event)
+    if is_settlement_due(channel_state, state_change.block_number):
+        channel_state.settle_transaction = TransactionExecutionStatus(
+            state_change.block_number,
+            None,
+            None,
+        )
+        event = ContractSendChannelSettle(channel_state.identifier)
+        events.append(event)
 
     while is_deposit_confirmed(channel_state, block_number):
         order_deposit_transaction = heapq.heappop(channel_state.deposit_transaction_queue)
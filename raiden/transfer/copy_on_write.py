@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+""" Copy-on-write helpers for the node state tree.
+
+The state machines mutate the state objects they are given, so the previous
+node state must not be reachable from the objects handed to them. Instead of
+copying the whole tree for every state change, `node.state_transition` starts
+from a shallow copy of the `NodeState` and uses the functions below to replace
+only the nodes of the tree that are about to be changed, every untouched
+sub-tree is shared among the old and the new state.
+
+Rules:
+- A `*_for_update` function returns an object that is private to the new
+  state, and re-links it into its (also private) parents.
+- Objects obtained by reading the tree directly must be treated as immutable.
+
+The functions take the `TransitionUpdates` of the current transition, where
+the objects already copied are recorded, so that every object is copied at
+most once per transition, and where the updated channels and payment tasks
+are recorded, so that `node.state_transition` can refresh their block
+deadlines.
+"""
+import random
+from copy import copy, deepcopy
+
+import networkx
+
+from raiden.transfer.state import NodeState, PaymentMappingState, TokenNetworkGraphState
+
+
+# The message index is split in buckets, so that an update copies a bucket
+# and the mapping of buckets instead of an entry per queued message
+MESSAGE_INDEX_BUCKETS = 1024
+
+
+class TransitionUpdates:
+    """ The record of a single state transition: the token networks, channels
+    and payment tasks it updated, and the objects already copied for update,
+    which are private to the new state and can be changed in place.
+
+    `node.state_transition` creates a record per state change and passes it
+    to every helper below that copies or changes the tree.
+    """
+
+    __slots__ = (
+        'token_networks',
+        'channels',
+        'secrethashes',
+        'copied_channels',
+        'copied_graphs',
+        'copied_queueids',
+        'copied_buckets',
+        'queues_copied',
+        'message_index_copied',
+    )
+
+    def __init__(self):
+        # token network address -> (payment network identifier, token address)
+        self.token_networks = dict()
+
+        # (token network address, channel identifier)
+        self.channels = set()
+
+        self.secrethashes = set()
+
+        # (token network address, channel identifier)
+        self.copied_channels = set()
+
+        # token network address -> nodes with a private adjacency in the graph
+        self.copied_graphs = dict()
+
+        self.copied_queueids = set()
+        self.copied_buckets = set()
+        self.queues_copied = False
+        self.message_index_copied = False
+
+
+def track_channel(updates, token_network_state, channel_identifier):
+    """ Record that the channel was added or changed. """
+    updates.channels.add((token_network_state.address, channel_identifier))
+
+
+def track_tokennetwork(updates, payment_network_identifier, token_network_state):
+    """ Record that the token network was added, with all its channels. """
+    updates.token_networks[token_network_state.address] = (
+        payment_network_identifier,
+        token_network_state.token_address,
+    )
+
+    for channel_identifier in token_network_state.channelidentifiers_to_channels:
+        track_channel(updates, token_network_state, channel_identifier)
+
+
+def copy_endstate(end_state):
+    """ Copy of the channel end state, the mappings of locks are changed in
+    place by the channel state machine and are copied too. The locks, the
+    merkle tree and the balance proof are replaced, never changed, and are
+    shared.
+    """
+    new_end_state = copy(end_state)
+    new_end_state.secrethashes_to_lockedlocks = dict(end_state.secrethashes_to_lockedlocks)
+    new_end_state.secrethashes_to_unlockedlocks = dict(end_state.secrethashes_to_unlockedlocks)
+    return new_end_state
+
+
+def copy_channelstate(channel_state):
+    """ Copy of the channel state, with copies of the parts the channel state
+    machine changes in place: the end states, the deposit queue and the
+    transaction statuses.
+    """
+    new_channel_state = copy(channel_state)
+    new_channel_state.our_state = copy_endstate(channel_state.our_state)
+    new_channel_state.partner_state = copy_endstate(channel_state.partner_state)
+    new_channel_state.deposit_transaction_queue = list(channel_state.deposit_transaction_queue)
+    new_channel_state.open_transaction = copy(channel_state.open_transaction)
+    new_channel_state.close_transaction = copy(channel_state.close_transaction)
+    new_channel_state.settle_transaction = copy(channel_state.settle_transaction)
+    return new_channel_state
+
+
+def copy_nodestate(node_state: NodeState) -> NodeState:
+    """ Shallow copy of the node state. All the sub-trees are shared with
+    `node_state`, except for the pseudo random generator, which is mutated by
+    most of the transitions and is cheap to copy.
+    """
+    if node_state is None:
+        return None
+
+    # deepcopy of a Random instance is an order of magnitude slower than this
+    pseudo_random_generator = random.Random()
+    pseudo_random_generator.setstate(node_state.pseudo_random_generator.getstate())
+
+    new_state = copy(node_state)
+    new_state.pseudo_random_generator = pseudo_random_generator
+    return new_state
+
+
+def paymentnetwork_for_update(node_state, payment_network_identifier):
+    """ Return a private copy of the payment network, or None if it is
+    unknown.
+
+    The token network mappings of the copy are new dictionaries, but the token
+    networks themselves are shared, use `tokennetwork_for_update` to change
+    them.
+    """
+    payment_network_state = node_state.identifiers_to_paymentnetworks.get(
+        payment_network_identifier,
+    )
+
+    if payment_network_state is None:
+        return None
+
+    new_payment_network_state = copy(payment_network_state)
+    new_payment_network_state.tokenidentifiers_to_tokennetworks = dict(
+        payment_network_state.tokenidentifiers_to_tokennetworks,
+    )
+    new_payment_network_state.tokenaddresses_to_tokennetworks = dict(
+        payment_network_state.tokenaddresses_to_tokennetworks,
+    )
+
+    ids_to_payments = dict(node_state.identifiers_to_paymentnetworks)
+    ids_to_payments[payment_network_identifier] = new_payment_network_state
+    node_state.identifiers_to_paymentnetworks = ids_to_payments
+
+    return new_payment_network_state
+
+
+def tokennetwork_for_update(node_state, payment_network_identifier, token_address, updates):
+    """ Return the tuple (payment_network_state, token_network_state) with
+    private copies of the payment and token networks, either can be None if
+    it is unknown.
+
+    The channel mappings of the token network copy are new dictionaries, but
+    the channels are shared, use `CopyOnAccessChannelMap` or
+    `channelstate_for_update` to change them. The network graph is shared too.
+    """
+    payment_network_state = paymentnetwork_for_update(node_state, payment_network_identifier)
+
+    if payment_network_state is None:
+        return None, None
+
+    token_network_state = payment_network_state.tokenaddresses_to_tokennetworks.get(
+        token_address,
+    )
+
+    if token_network_state is None:
+        return payment_network_state, None
+
+    new_token_network_state = copy(token_network_state)
+    new_token_network_state.channelidentifiers_to_channels = dict(
+        token_network_state.channelidentifiers_to_channels,
+    )
+    new_token_network_state.partneraddresses_to_channels = dict(
+        token_network_state.partneraddresses_to_channels,
+    )
+
+    ids_to_tokens = payment_network_state.tokenidentifiers_to_tokennetworks
+    if ids_to_tokens.get(token_network_state.address) is token_network_state:
+        ids_to_tokens[token_network_state.address] = new_token_network_state
+
+    addrs_to_tokens = payment_network_state.tokenaddresses_to_tokennetworks
+    addrs_to_tokens[token_address] = new_token_network_state
+
+    updates.token_networks[token_network_state.address] = (
+        payment_network_identifier,
+        token_address,
+    )
+
+    return payment_network_state, new_token_network_state
+
+
+def channelstate_for_update(token_network_state, channel_state, updates):
+    """ Replace `channel_state` in the private `token_network_state` by a
+    private copy and return it. A channel is copied at most once per
+    transition, the copy is returned by the later calls.
+    """
+    channel_key = (token_network_state.address, channel_state.identifier)
+    ids_to_channels = token_network_state.channelidentifiers_to_channels
+
+    if channel_key in updates.copied_channels:
+        return ids_to_channels[channel_state.identifier]
+
+    new_channel_state = copy_channelstate(channel_state)
+
+    if ids_to_channels.get(channel_state.identifier) is channel_state:
+        ids_to_channels[channel_state.identifier] = new_channel_state
+
+    partner_address = channel_state.partner_state.address
+    partners_to_channels = token_network_state.partneraddresses_to_channels
+    if partners_to_channels.get(partner_address) is channel_state:
+        partners_to_channels[partner_address] = new_channel_state
+
+    updates.copied_channels.add(channel_key)
+    track_channel(updates, token_network_state, channel_state.identifier)
+
+    return new_channel_state
+
+
+def networkgraph_for_update(token_network_state, nodes, updates):
+    """ Return the network graph of the private `token_network_state`, ready
+    for the edges of `nodes` to be added.
+
+    Copying the whole graph costs a copy of every edge, so only the
+    mappings of nodes and the adjacency of `nodes` are copied, the adjacency
+    of the other nodes is shared with the previous graph and must not be
+    changed. The graph is replaced at most once per transition, so the route
+    cache, which is keyed by the graph, doesn't see it change.
+    """
+    address = token_network_state.address
+    network = token_network_state.network_graph.network
+    private_nodes = updates.copied_graphs.get(address)
+
+    if private_nodes is None:
+        previous_network = network
+        network = networkx.Graph()
+        network.graph = dict(previous_network.graph)
+        network._node = dict(previous_network._node)  # pylint: disable=protected-access
+        network._adj = dict(previous_network._adj)  # pylint: disable=protected-access
+
+        token_network_state.network_graph = TokenNetworkGraphState(network)
+        private_nodes = updates.copied_graphs[address] = set()
+
+    adjacency = network._adj  # pylint: disable=protected-access
+    for node in nodes:
+        if node not in private_nodes:
+            # a node missing from the graph gets a new adjacency when added
+            if node in adjacency:
+                adjacency[node] = dict(adjacency[node])
+            private_nodes.add(node)
+
+    return network
+
+
+def paymenttask_for_update(payment_mapping, secrethash, updates):
+    """ Replace the payment task for `secrethash` in the private
+    `payment_mapping` by a private copy and return it, or None if there is no
+    such task.
+    """
+    secrethashes_to_task = payment_mapping.secrethashes_to_task
+    sub_task = secrethashes_to_task.get(secrethash)
+
+    if sub_task is None:
+        return None
+
+    new_sub_task = deepcopy(sub_task)
+    secrethashes_to_task[secrethash] = new_sub_task
+    updates.secrethashes.add(secrethash)
+
+    return new_sub_task
+
+
+def set_paymenttask(payment_mapping, secrethash, sub_task, updates):
+    """ Set the payment task for `secrethash` in the private
+    `payment_mapping`.
+    """
+    payment_mapping.secrethashes_to_task[secrethash] = sub_task
+    updates.secrethashes.add(secrethash)
+
+
+def paymentmapping_for_update(node_state):
+    """ Replace the payment mapping of `node_state` by a private copy and
+    return it. The tasks are shared, use `paymenttask_for_update` to change
+    them.
+    """
+    payment_mapping = PaymentMappingState()
+    payment_mapping.secrethashes_to_task = dict(node_state.payment_mapping.secrethashes_to_task)
+    node_state.payment_mapping = payment_mapping
+
+    return payment_mapping
+
+
+def build_message_index(queueids_to_queues):
+    """ Return the index of the queued messages, see
+    `NodeState.messageidentifiers_to_queueids`.
+    """
+    message_index = dict()
+
+    for queueid, queue in queueids_to_queues.items():
+        for message in queue:
+            message_identifier = message.message_identifier
+            bucket = message_index.setdefault(message_identifier % MESSAGE_INDEX_BUCKETS, dict())
+            bucket[message_identifier] = bucket.get(message_identifier, ()) + (queueid, )
+
+    return message_index
+
+
+def get_queueids_for_message(node_state, message_identifier):
+    """ Return the queue identifiers of the messages with
+    `message_identifier`, once per message.
+    """
+    bucket = node_state.messageidentifiers_to_queueids.get(
+        message_identifier % MESSAGE_INDEX_BUCKETS,
+    )
+
+    if bucket is None:
+        return ()
+
+    return bucket.get(message_identifier, ())
+
+
+def set_queueids_for_message(node_state, message_identifier, queueids, updates):
+    """ Set the `queueids` of `message_identifier` in the message index. The
+    index and the bucket of `message_identifier` are copied the first time
+    they are changed in the transition.
+    """
+    bucket_key = message_identifier % MESSAGE_INDEX_BUCKETS
+
+    if not updates.message_index_copied:
+        node_state.messageidentifiers_to_queueids = dict(node_state.messageidentifiers_to_queueids)
+        updates.message_index_copied = True
+
+    message_index = node_state.messageidentifiers_to_queueids
+    if bucket_key in updates.copied_buckets:
+        bucket = message_index.get(bucket_key, dict())
+    else:
+        bucket = dict(message_index.get(bucket_key, ()))
+        updates.copied_buckets.add(bucket_key)
+
+    if queueids:
+        bucket[message_identifier] = queueids
+    else:
+        bucket.pop(message_identifier, None)
+
+    if bucket:
+        message_index[bucket_key] = bucket
+    else:
+        message_index.pop(bucket_key, None)
+
+
+def enqueue_message(node_state, queueid, message, updates):
+    """ Append `message` to the private copy of the queue `queueid`. """
+    queue = queue_for_update(node_state, queueid, updates)
+    queue.append(message)
+
+    message_identifier = message.message_identifier
+    queueids = get_queueids_for_message(node_state, message_identifier)
+    set_queueids_for_message(node_state, message_identifier, queueids + (queueid, ), updates)
+
+
+def remove_queued_messages(node_state, message_identifier, updates, queue_name=None):
+    """ Remove the messages with `message_identifier` from the queues, only
+    from the queues named `queue_name` if it is given.
+    """
+    queueids = get_queueids_for_message(node_state, message_identifier)
+
+    removed = [
+        queueid
+        for queueid in queueids
+        if queue_name is None or queueid[1] == queue_name
+    ]
+
+    if not removed:
+        return
+
+    for queueid in set(removed):
+        queue = queue_for_update(node_state, queueid, updates)
+        pending = removed.count(queueid)
+
+        # the acknowledgements usually arrive in order, so the messages are
+        # found close to the head of the queue
+        pos = 0
+        while pending:
+            if queue[pos].message_identifier == message_identifier:
+                del queue[pos]
+                pending -= 1
+            else:
+                pos += 1
+
+    kept = tuple(
+        queueid
+        for queueid in queueids
+        if queue_name is not None and queueid[1] != queue_name
+    )
+    set_queueids_for_message(node_state, message_identifier, kept, updates)
+
+
+def queue_for_update(node_state, queueid, updates):
+    """ Return a private copy of the message queue `queueid`, the queue is
+    created if it does not exist. The mapping of queues and each queue are
+    copied the first time they are changed in the transition.
+    """
+    if not updates.queues_copied:
+        node_state.queueids_to_queues = dict(node_state.queueids_to_queues)
+        updates.queues_copied = True
+
+    queueids_to_queues = node_state.queueids_to_queues
+    if queueid not in updates.copied_queueids:
+        queueids_to_queues[queueid] = list(queueids_to_queues.get(queueid, ()))
+        updates.copied_queueids.add(queueid)
+
+    return queueids_to_queues[queueid]
+
+
+class CopyOnAccessChannelMap:
+    """ Read-write view over the channels of a private token network copy.
+
+    The payment task state machines are given a mapping from channel
+    identifier to channel state, which they freely mutate. This view copies a
+    channel the first time it is accessed, so only the channels used by the
+    task are copied.
+    """
+
+    __slots__ = (
+        'token_network_state',
+        'updates',
+    )
+
+    def __init__(self, token_network_state, updates):
+        self.token_network_state = token_network_state
+        self.updates = updates
+
+    def _for_update(self, channel_state):
+        return channelstate_for_update(self.token_network_state, channel_state, self.updates)
+
+    def get(self, channel_identifier, default=None):
+        ids_to_channels = self.token_network_state.channelidentifiers_to_channels
+        channel_state = ids_to_channels.get(channel_identifier)
+
+        if channel_state is None:
+            return default
+
+        return self._for_update(channel_state)
+
+    def __getitem__(self, channel_identifier):
+        ids_to_channels = self.token_network_state.channelidentifiers_to_channels
+        channel_state = ids_to_channels[channel_identifier]
+        return self._for_update(channel_state)
+
+    def __contains__(self, channel_identifier):
+        return channel_identifier in self.token_network_state.channelidentifiers_to_channels
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.token_network_state.channelidentifiers_to_channels)
+
+    def keys(self):
+        return list(self.token_network_state.channelidentifiers_to_channels.keys())
+
+    def values(self):
+        return [self[channel_identifier] for channel_identifier in self.keys()]
+
+    def items(self):
+        return [
+            (channel_identifier, self[channel_identifier])
+            for channel_identifier in self.keys()
+        ]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+""" Block deadlines of the channels and payment tasks.
+
+Most channels and payment tasks don't change when a new block is mined, the
+`Block` state change is a noop until a settlement period ends, a deposit is
+confirmed or a lock gets close to its expiration. The node state keeps a
+`DeadlineQueueState` for the channels and another for the payment tasks, so
+that a `Block` is dispatched only to the entities with a deadline due.
+
+The queues are part of the node state, like the rest of the tree they are
+never changed in place, `update_deadlines` returns a new queue.
+"""
+from bisect import bisect_left, insort
+
+from raiden.transfer.state import DeadlineQueueState
+
+# Above this fraction of changed entries the queue is sorted from scratch
+REBUILD_FRACTION = 0.25
+
+
+def get_due(deadline_queue, block_number):
+    """ Return the keys with a deadline at or before `block_number`, ordered
+    by deadline.
+    """
+    ordered = deadline_queue.ordered
+
+    # a one element tuple sorts before every pair with the same block number
+    end = bisect_left(ordered, (block_number + 1, ))
+    return [key for _, key in ordered[:end]]
+
+
+def update_deadlines(deadline_queue, keys_to_blocks):
+    """ Return a copy of `deadline_queue` with the deadlines of
+    `keys_to_blocks` replaced, a block number of None removes the key.
+
+    `deadline_queue` itself is returned if no deadline changed.
+    """
+    current = deadline_queue.keys_to_blocks
+    changed = {
+        key: block_number
+        for key, block_number in keys_to_blocks.items()
+        if current.get(key) != block_number
+    }
+
+    if not changed:
+        return deadline_queue
+
+    if len(changed) > len(current) * REBUILD_FRACTION:
+        new_keys_to_blocks = dict(current)
+        new_keys_to_blocks.update(changed)
+        return DeadlineQueueState(new_keys_to_blocks)
+
+    new_queue = DeadlineQueueState()
+    new_queue.keys_to_blocks = dict(current)
+    new_queue.ordered = list(deadline_queue.ordered)
+
+    for key, block_number in changed.items():
+        previous_block_number = new_queue.keys_to_blocks.pop(key, None)
+        if previous_block_number is not None:
+            position = bisect_left(new_queue.ordered, (previous_block_number, key))
+            del new_queue.ordered[position]
+
+        if block_number is not None:
+            new_queue.keys_to_blocks[key] = block_number
+            insort(new_queue.ordered, (block_number, key))
+
+    return new_queue
@@ -128,12 +128,16 @@ class EventTransferSentSuccess(Event):
     Note:
         Mediators cannot use this event, since an unlock may be locally
         sucessful but there is no knowledge about the global transfer.
+
+        The channel_identifier is the channel used to pay the next hop, it is
+        used to index the event and not part of the event's identity.
     """
 
-    def __init__(self, identifier, amount, target):
+    def __init__(self, identifier, amount, target, channel_identifier=None):
         self.identifier = identifier
         self.amount = amount
         self.target = target
+        self.channel_identifier = channel_identifier
 
     def __repr__(self):
         return '<EventTransferSentSuccess identifier:{} amount:{} target:{}>'.format(
@@ -160,11 +164,15 @@ class EventTransferSentFailed(Event):
     Note:
         Mediators cannot use this event since they don't know when a transfer
         has failed, they may infer about lock successes and failures.
+
+        The channel_identifier is None if the transfer failed before a channel
+        was chosen.
     """
 
-    def __init__(self, identifier, reason):
+    def __init__(self, identifier, reason, channel_identifier=None):
         self.identifier = identifier
         self.reason = reason
+        self.channel_identifier = channel_identifier
 
     def __repr__(self):
         return '<EventTransferSentFailed id:{} reason:{}>'.format(
@@ -191,9 +199,11 @@ class EventTransferReceivedSuccess(Event):
         information to deduce when a transfer has failed, because the initiator may
         try again at a different time and/or with different routes, for this reason
         there is no correspoding `EventTransferReceivedFailed`.
+
+        The channel_identifier is the channel with the payer.
     """
 
-    def __init__(self, identifier, amount, initiator):
+    def __init__(self, identifier, amount, initiator, channel_identifier=None):
         if amount < 0:
             raise ValueError('transferred_amount cannot be negative')
 
@@ -203,6 +213,7 @@ class EventTransferReceivedSuccess(Event):
         self.identifier = identifier
         self.amount = amount
         self.initiator = initiator
+        self.channel_identifier = channel_identifier
 
     def __repr__(self):
         return '<EventTransferReceivedSuccess identifier:{} amount:{} initiator:{}>'.format(
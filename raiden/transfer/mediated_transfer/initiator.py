@@ -221,6 +221,7 @@ def handle_secretrequest(
         cancel = EventTransferSentFailed(
             identifier=initiator_state.transfer_description.payment_identifier,
             reason='bad secret request message from target',
+            channel_identifier=initiator_state.channel_identifier,
         )
         iteration = TransitionResult(None, [cancel])
 
@@ -266,6 +267,7 @@ def handle_secretreveal(
             transfer_description.payment_identifier,
             transfer_description.amount,
             transfer_description.target,
+            channel_state.identifier,
         )
 
         unlock_success = EventUnlockSuccess(
@@ -3,7 +3,7 @@ import itertools
 import random
 from typing import List, Dict
 
-from raiden.transfer import channel
+from raiden.transfer import channel, deadlines
 from raiden.transfer.architecture import TransitionResult
 from raiden.transfer.events import (
     ContractSendChannelWithdraw,
@@ -31,6 +31,7 @@ from raiden.transfer.state import (
     message_identifier_from_prng,
     CHANNEL_STATE_CLOSING,
     CHANNEL_STATE_OPENED,
+    DeadlineQueueState,
 )
 from raiden.transfer.state_change import (
     Block,
@@ -214,12 +215,106 @@ def get_pending_transfer_pairs(transfers_pair):
     pending_pairs = list(
         pair
         for pair in transfers_pair
-        if pair.payee_state not in STATE_TRANSFER_FINAL or
-        pair.payer_state not in STATE_TRANSFER_FINAL
+        if is_pair_pending(pair)
     )
     return pending_pairs
 
 
+def is_pair_pending(pair):
+    return (
+        pair.payee_state not in STATE_TRANSFER_FINAL or
+        pair.payer_state not in STATE_TRANSFER_FINAL
+    )
+
+
+def get_pair_block_due(channelidentifiers_to_channels, pair, block_number):
+    """ Return the first block number at which `handle_block` may change
+    `pair`, or None if it is at a final state.
+
+    The result may only get earlier by a change of the pair, which goes
+    through `state_transition`, so a stale deadline is safe to use.
+    """
+    if not is_pair_pending(pair):
+        return None
+
+    payer_channel_identifier = pair.payer_transfer.balance_proof.channel_address
+    payer_channel = channelidentifiers_to_channels.get(payer_channel_identifier)
+
+    # handle_block requires the payer channel, let it fail on the next
+    # block as it would without the deadlines
+    if payer_channel is None:
+        return block_number + 1
+
+    due_blocks = list()
+
+    close_block = pair.payer_transfer.lock.expiration - payer_channel.reveal_timeout
+    close_may_be_needed = (
+        pair.payee_state in STATE_TRANSFER_PAID and
+        pair.payer_state not in STATE_TRANSFER_PAID and
+        channel.get_status(payer_channel) == CHANNEL_STATE_OPENED
+    )
+    if close_block > block_number or close_may_be_needed:
+        due_blocks.append(close_block)
+
+    if pair.payer_state != 'payer_expired':
+        due_blocks.append(pair.payer_transfer.lock.expiration + 1)
+
+    if pair.payee_state != 'payee_expired':
+        due_blocks.append(pair.payee_transfer.lock.expiration + 1)
+
+    if due_blocks:
+        return min(due_blocks)
+
+    return None
+
+
+def update_pairs_deadlines(channelidentifiers_to_channels, state, block_number, positions=None):
+    """ Recompute the deadlines of the pairs at `positions` in
+    `state.pairs_deadlines`, all the pairs if `positions` is None.
+    """
+    pairs_deadlines = getattr(state, 'pairs_deadlines', None)
+    if pairs_deadlines is None:
+        pairs_deadlines = DeadlineQueueState()
+        positions = None
+
+    if positions is None:
+        positions = range(len(state.transfers_pair))
+
+    positions_to_blocks = {
+        position: get_pair_block_due(
+            channelidentifiers_to_channels,
+            state.transfers_pair[position],
+            block_number,
+        )
+        for position in positions
+    }
+    state.pairs_deadlines = deadlines.update_deadlines(pairs_deadlines, positions_to_blocks)
+
+
+def get_next_block_due(channelidentifiers_to_channels, state, block_number):
+    """ Return the first block number after `block_number` for which
+    `handle_block` may change the mediator state, or None if no Block can
+    change it until it is updated by another state change.
+    """
+    pairs_deadlines = getattr(state, 'pairs_deadlines', None)
+
+    if pairs_deadlines is not None:
+        if pairs_deadlines.ordered:
+            return max(pairs_deadlines.ordered[0][0], block_number + 1)
+        return None
+
+    due_blocks = list()
+    for pair in state.transfers_pair:
+        pair_block = get_pair_block_due(channelidentifiers_to_channels, pair, block_number)
+        if pair_block is not None:
+            due_blocks.append(pair_block)
+
+    if due_blocks:
+        return max(min(due_blocks), block_number + 1)
+
+    return None
+
+
 def get_timeout_blocks(settle_timeout, closed_block_number, payer_lock_expiration, block_number):
     """ Return the timeout blocks, it's the base value from which the payees
     lock timeout must be computed.
@@ -941,9 +1036,17 @@ def handle_block(channelidentifiers_to_channels, state, state_change, block_numb
     """
     assert state_change.block_number == block_number
 
+    if getattr(state, 'pairs_deadlines', None) is None:
+        update_pairs_deadlines(channelidentifiers_to_channels, state, block_number - 1)
+
+    # only the pairs with a deadline due can change, the order of the pairs
+    # is kept for the order of the events
+    due_positions = sorted(deadlines.get_due(state.pairs_deadlines, block_number))
+    due_pairs = [state.transfers_pair[position] for position in due_positions]
+
     close_events = events_for_close(
         channelidentifiers_to_channels,
-        state.transfers_pair,
+        due_pairs,
         block_number,
     )
 
@@ -954,10 +1057,17 @@ def handle_block(channelidentifiers_to_channels, state, state_change, block_numb
     # )
 
     unlock_fail_events = set_expired_pairs(
-        state.transfers_pair,
+        due_pairs,
         block_number,
     )
 
+    update_pairs_deadlines(
+        channelidentifiers_to_channels,
+        state,
+        block_number,
+        due_positions,
+    )
+
     iteration = TransitionResult(
         state,
         close_events + unlock_fail_events,
@@ -1186,8 +1296,13 @@ def state_transition(
 
     iteration = TransitionResult(mediator_state, list())
 
+    # the positions of the pairs whose deadlines must be recomputed, None for
+    # all of them. Block updates the deadlines of the pairs it handled.
+    touched_positions = list()
+
     if isinstance(state_change, ActionInitMediator):
         if mediator_state is None:
+            touched_positions = None
             iteration = handle_init(
                 state_change,
                 channelidentifiers_to_channels,
@@ -1204,6 +1319,9 @@ def state_transition(
         )
 
     elif isinstance(state_change, ReceiveTransferRefund):
+        # the refund only adds a pair
+        pairs_before = len(mediator_state.transfers_pair)
+
         iteration = handle_refundtransfer(
             mediator_state,
             state_change,
@@ -1212,7 +1330,11 @@ def state_transition(
             block_number,
         )
 
+        touched_positions = list(range(pairs_before, len(mediator_state.transfers_pair)))
+
     elif isinstance(state_change, ReceiveSecretReveal):
+        secret_known = mediator_state.secret is not None
+
         iteration = handle_secretreveal(
             mediator_state,
             state_change,
@@ -1221,7 +1343,12 @@ def state_transition(
             block_number,
         )
 
+        # learning the secret moves the whole path forward
+        if not secret_known and mediator_state.secret is not None:
+            touched_positions = None
+
     elif isinstance(state_change, ContractReceiveChannelWithdraw):
+        touched_positions = None
         iteration = handle_contractwithdraw(
             mediator_state,
             state_change,
@@ -1237,6 +1364,21 @@ def state_transition(
             channelidentifiers_to_channels,
         )
 
+        balance_proof_sender = state_change.balance_proof.sender
+        touched_positions = [
+            position
+            for position, pair in enumerate(mediator_state.transfers_pair)
+            if pair.payer_transfer.balance_proof.sender == balance_proof_sender
+        ]
+
+    if iteration.new_state is not None and (touched_positions is None or touched_positions):
+        update_pairs_deadlines(
+            channelidentifiers_to_channels,
+            iteration.new_state,
+            block_number,
+            touched_positions,
+        )
+
     # this is the place for paranoia
     if iteration.new_state is not None:
         sanity_check(iteration.new_state)
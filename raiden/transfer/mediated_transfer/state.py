@@ -130,6 +130,7 @@ class MediatorTransferState(State):
         'secrethash',
         'secret',
         'transfers_pair',
+        'pairs_deadlines',
     )
 
     def __init__(self, secrethash: typing.Keccak256):
@@ -138,6 +139,10 @@ class MediatorTransferState(State):
         self.secret = None
         self.transfers_pair = list()
 
+        # DeadlineQueueState of the positions in `transfers_pair`, computed
+        # from the pairs by the mediator
+        self.pairs_deadlines = None
+
     def __repr__(self):
         return '<MediatorTransferState secrethash:{} qtd_transfers:{}>'.format(
             pex(self.secrethash),
@@ -163,7 +168,6 @@ class TargetTransferState(State):
         'route',
         'transfer',
         'secret',
-        'hahslock',
         'state',
     )
 
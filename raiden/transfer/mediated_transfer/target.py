@@ -164,6 +164,7 @@ def handle_unlock(target_state, state_change, channel_state):
                 transfer.payment_identifier,
                 transfer.lock.amount,
                 transfer.initiator,
+                channel_state.identifier,
             )
 
             unlock_success = EventWithdrawSuccess(
@@ -193,8 +194,11 @@ def handle_block(target_state, channel_state, block_number):
         transfer.lock.secrethash,
     )
 
-    if not secret_known and block_number > transfer.lock.expiration:
-        # XXX: emit the event only once
+    if target_state.state == 'expired':
+        # the failure was already emitted
+        events = list()
+
+    elif not secret_known and block_number > transfer.lock.expiration:
         failed = EventWithdrawFailed(
             identifier=transfer.payment_identifier,
             secrethash=transfer.lock.secrethash,
@@ -212,6 +216,28 @@ def handle_block(target_state, channel_state, block_number):
     return iteration
 
 
+def get_next_block_due(target_state, channel_state, block_number):
+    """ Return the first block number after `block_number` for which
+    `handle_block` may change the target state, or None if no Block can
+    change it anymore.
+    """
+    if target_state.state == 'expired':
+        return None
+
+    lock = target_state.transfer.lock
+    if target_state.state == 'waiting_close':
+        # the close was already sent, with the secret known the lock is
+        # withdrawn by the channel and a Block can't expire it
+        if channel.is_secret_known(channel_state.partner_state, lock.secrethash):
+            return None
+
+        due_block = lock.expiration + 1
+    else:
+        due_block = lock.expiration - channel_state.reveal_timeout
+
+    return max(due_block, block_number + 1)
+
+
 def state_transition(
         target_state,
         state_change,
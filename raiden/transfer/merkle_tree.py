@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from bisect import bisect_left
+
 from raiden.utils import split_in_pairs
 from raiden.exceptions import HashLengthNot32
 from raiden.utils import sha3
@@ -61,6 +63,90 @@ def compute_layers(elements):
     return tree
 
 
+def find_leaf(leaves, element):
+    """ Return the position of `element` in the sorted `leaves`, or None if
+    it is not a leaf.
+    """
+    position = bisect_left(leaves, element)
+
+    if position < len(leaves) and leaves[position] == element:
+        return position
+
+    return None
+
+
+def compute_layers_with(layers, element):
+    """ Computes the layers of the merkletree with `element` added to the
+    leaves of `layers`.
+
+    Only the hashes at or after the position of `element` in each layer are
+    computed, the ones before are the same as in `layers`.
+    """
+    if len(element) != 32:
+        raise HashLengthNot32()
+
+    leaves = layers[LEAVES]
+    position = bisect_left(leaves, element)
+
+    if position < len(leaves) and leaves[position] == element:
+        raise ValueError('Duplicated element')
+
+    new_leaves = list(leaves)
+    new_leaves.insert(position, element)
+
+    return _update_layers(layers, new_leaves, position)
+
+
+def compute_layers_without(layers, element):
+    """ Computes the layers of the merkletree with `element` removed from the
+    leaves of `layers`, which must not become empty.
+
+    Raises:
+        ValueError: If the element is not part of the merkletree.
+    """
+    position = find_leaf(layers[LEAVES], element)
+
+    if position is None:
+        raise ValueError('Unknown element')
+
+    new_leaves = list(layers[LEAVES])
+    del new_leaves[position]
+    assert new_leaves, 'Use EMPTY_MERKLE_TREE if there are no elements'
+
+    return _update_layers(layers, new_leaves, position)
+
+
+def _update_layers(layers, new_leaves, position):
+    """ Computes the layers for `new_leaves`, which differ from the leaves
+    of `layers` from `position` onwards.
+
+    The leaves are paired by position, so a change shifts the pairs after it,
+    but the hashes of the leaves before `position` are kept.
+    """
+    tree = [new_leaves]
+
+    layer = new_leaves
+    depth = 0
+    while len(layer) > 1:
+        depth += 1
+        position //= 2
+
+        if depth < len(layers) and len(layers[depth - 1]) > 1:
+            next_layer = layers[depth][:position]
+        else:
+            next_layer = list()
+            position = 0
+
+        for index in range(position * 2, len(layer), 2):
+            pair = layer[index + 1] if index + 1 < len(layer) else None
+            next_layer.append(hash_pair(layer[index], pair))
+
+        tree.append(next_layer)
+        layer = next_layer
+
+    return tree
+
+
 def compute_merkleproof_for(merkletree, element):
     """ Containment proof for element.
 
@@ -68,9 +154,12 @@ def compute_merkleproof_for(merkletree, element):
     merkleroot, from the leaf `element` up to `root`.
 
     Raises:
-        IndexError: If the element is not part of the merkletree.
+        ValueError: If the element is not part of the merkletree.
     """
-    idx = merkletree.layers[LEAVES].index(element)
+    idx = find_leaf(merkletree.layers[LEAVES], element)
+
+    if idx is None:
+        raise ValueError('Unknown element')
 
     proof = []
     for layer in merkletree.layers:
@@ -89,6 +178,41 @@ def compute_merkleproof_for(merkletree, element):
     return proof
 
 
+def compute_merkleproofs_for(merkletree, elements):
+    """ Containment proofs for all the `elements`, in the same order.
+
+    The layers are walked once for all the proofs.
+
+    Raises:
+        ValueError: If an element is not part of the merkletree.
+    """
+    leaves = merkletree.layers[LEAVES]
+    indexes = list()
+
+    for element in elements:
+        idx = find_leaf(leaves, element)
+
+        if idx is None:
+            raise ValueError('Unknown element')
+
+        indexes.append(idx)
+
+    proofs = [list() for _ in indexes]
+    for layer in merkletree.layers:
+        layer_size = len(layer)
+
+        for position, idx in enumerate(indexes):
+            pair = idx ^ 1
+
+            # with an odd number of elements the rightmost one does not have a pair.
+            if pair < layer_size:
+                proofs[position].append(layer[pair])
+
+            indexes[position] = idx // 2
+
+    return proofs
+
+
 def validate_proof(proof, root, leaf_element):
     """ Checks that `leaf_element` was contained in the tree represented by
     `merkleroot`.
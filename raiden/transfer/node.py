@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
+import time
+from collections import defaultdict
+
 from raiden.transfer import (
     channel,
     token_network,
     views,
 )
+from raiden.transfer.deadlines import get_due, update_deadlines
 from raiden.transfer.mediated_transfer import (
     initiator_manager,
     mediator,
@@ -13,7 +17,23 @@ from raiden.transfer.architecture import (
     SendMessageEvent,
     TransitionResult,
 )
+from raiden.transfer.copy_on_write import (
+    CopyOnAccessChannelMap,
+    build_message_index,
+    channelstate_for_update,
+    copy_nodestate,
+    enqueue_message,
+    paymentmapping_for_update,
+    paymentnetwork_for_update,
+    paymenttask_for_update,
+    remove_queued_messages,
+    set_paymenttask,
+    TransitionUpdates,
+    tokennetwork_for_update,
+    track_tokennetwork,
+)
 from raiden.transfer.state import (
+    DeadlineQueueState,
     NodeState,
     PaymentMappingState,
     PaymentNetworkState,
@@ -74,92 +94,169 @@ def get_token_network(node_state, payment_network_identifier, token_address):
     return token_network_state
 
 
-def subdispatch_to_all_channels(node_state, state_change, block_number):
+def get_channelmap_for_update(
+        node_state,
+        payment_network_identifier,
+        token_address,
+        channelmaps,
+        updates):
+    """ Return a `CopyOnAccessChannelMap` for the token network, or None if
+    it is unknown.
+
+    `channelmaps` caches the views already created in the current transition,
+    so that the token network is copied at most once.
+    """
+    key = (payment_network_identifier, token_address)
+
+    if key not in channelmaps:
+        _, token_network_state = tokennetwork_for_update(
+            node_state,
+            payment_network_identifier,
+            token_address,
+            updates,
+        )
+
+        channelmap = None
+        if token_network_state:
+            channelmap = CopyOnAccessChannelMap(token_network_state, updates)
+
+        channelmaps[key] = channelmap
+
+    return channelmaps[key]
+
+
+def subdispatch_to_all_channels(node_state, state_change, block_number, updates):
+    """ Dispatch the Block `state_change` to the channels.
+
+    Only the channels with a deadline due in `node_state.channel_deadlines`
+    are copied and dispatched, for every other channel the Block is a noop.
+    """
     events = list()
+    token_networks = dict()
 
-    for payment_network in node_state.identifiers_to_paymentnetworks.values():
-        for token_network_state in payment_network.tokenaddresses_to_tokennetworks.values():
-            for channel_state in token_network_state.channelidentifiers_to_channels.values():
-                result = channel.state_transition(
-                    channel_state,
-                    state_change,
-                    node_state.pseudo_random_generator,
-                    block_number,
-                )
-                events.extend(result.events)
+    for channel_key in get_due(node_state.channel_deadlines, block_number):
+        payment_network_identifier, token_address, channel_identifier = channel_key
+        channel_state = get_channel_by_key(node_state, channel_key)
+
+        if channel_state is None or not channel.is_block_due(channel_state, block_number):
+            continue
+
+        token_network_key = (payment_network_identifier, token_address)
+        if token_network_key not in token_networks:
+            _, token_networks[token_network_key] = tokennetwork_for_update(
+                node_state,
+                payment_network_identifier,
+                token_address,
+                updates,
+            )
+
+        channel_state = channelstate_for_update(
+            token_networks[token_network_key],
+            channel_state,
+            updates,
+        )
+        result = channel.state_transition(
+            channel_state,
+            state_change,
+            node_state.pseudo_random_generator,
+            block_number,
+        )
+        events.extend(result.events)
 
     return TransitionResult(node_state, events)
 
 
-def subdispatch_to_all_lockedtransfers(node_state, state_change):
+def subdispatch_to_all_lockedtransfers(node_state, state_change, updates):
+    """ Dispatch the Block `state_change` to the payment tasks with a
+    deadline due in `node_state.paymenttask_deadlines`.
+    """
     events = list()
 
-    for secrethash in node_state.payment_mapping.secrethashes_to_task.keys():
-        result = subdispatch_to_paymenttask(node_state, state_change, secrethash)
+    due_secrethashes = get_due(node_state.paymenttask_deadlines, node_state.block_number)
+    if not due_secrethashes:
+        return TransitionResult(node_state, events)
+
+    payment_mapping = paymentmapping_for_update(node_state)
+    channelmaps = dict()
+
+    for secrethash in due_secrethashes:
+        result = dispatch_to_paymenttask(
+            node_state,
+            state_change,
+            secrethash,
+            payment_mapping,
+            channelmaps,
+            updates,
+        )
         events.extend(result.events)
 
     return TransitionResult(node_state, events)
 
 
-def subdispatch_to_paymenttask(node_state, state_change, secrethash):
+def subdispatch_to_paymenttask(node_state, state_change, secrethash, updates):
+    if secrethash not in node_state.payment_mapping.secrethashes_to_task:
+        return TransitionResult(node_state, list())
+
+    payment_mapping = paymentmapping_for_update(node_state)
+    channelmaps = dict()
+
+    return dispatch_to_paymenttask(
+        node_state,
+        state_change,
+        secrethash,
+        payment_mapping,
+        channelmaps,
+        updates,
+    )
+
+
+def dispatch_to_paymenttask(
+        node_state,
+        state_change,
+        secrethash,
+        payment_mapping,
+        channelmaps,
+        updates):
     block_number = node_state.block_number
-    sub_task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
+    sub_task = paymenttask_for_update(payment_mapping, secrethash, updates)
     events = list()
 
     if sub_task:
         pseudo_random_generator = node_state.pseudo_random_generator
+        channelmap = get_channelmap_for_update(
+            node_state,
+            sub_task.payment_network_identifier,
+            sub_task.token_address,
+            channelmaps,
+            updates,
+        )
 
         if isinstance(sub_task, PaymentMappingState.InitiatorTask):
-            payment_network_identifier = sub_task.payment_network_identifier
-            token_address = sub_task.token_address
-
-            token_network_state = get_token_network(
-                node_state,
-                payment_network_identifier,
-                token_address,
-            )
-
-            if token_network_state:
+            if channelmap:
                 sub_iteration = initiator_manager.state_transition(
                     sub_task.manager_state,
                     state_change,
-                    token_network_state.channelidentifiers_to_channels,
+                    channelmap,
                     pseudo_random_generator,
                     block_number,
                 )
                 events = sub_iteration.events
 
         elif isinstance(sub_task, PaymentMappingState.MediatorTask):
-            payment_network_identifier = sub_task.payment_network_identifier
-            token_address = sub_task.token_address
-
-            token_network_state = get_token_network(
-                node_state,
-                payment_network_identifier,
-                token_address,
-            )
-
-            if token_network_state:
+            if channelmap:
                 sub_iteration = mediator.state_transition(
                     sub_task.mediator_state,
                     state_change,
-                    token_network_state.channelidentifiers_to_channels,
+                    channelmap,
                     pseudo_random_generator,
                     block_number,
                 )
                 events = sub_iteration.events
 
         elif isinstance(sub_task, PaymentMappingState.TargetTask):
-            payment_network_identifier = sub_task.payment_network_identifier
-            token_address = sub_task.token_address
-            channel_identifier = sub_task.channel_identifier
-
-            channel_state = views.get_channelstate_by_tokenaddress(
-                node_state,
-                payment_network_identifier,
-                token_address,
-                channel_identifier,
-            )
+            channel_state = None
+            if channelmap:
+                channel_state = channelmap.get(sub_task.channel_identifier)
 
             if channel_state:
                 sub_iteration = target.state_transition(
@@ -179,7 +276,8 @@ def subdispatch_initiatortask(
         state_change,
         payment_network_identifier,
         token_address,
-        secrethash):
+        secrethash,
+        updates):
 
     block_number = node_state.block_number
     sub_task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
@@ -201,15 +299,21 @@ def subdispatch_initiatortask(
     if is_valid_subtask:
         pseudo_random_generator = node_state.pseudo_random_generator
 
-        token_network_state = get_token_network(
+        payment_mapping = paymentmapping_for_update(node_state)
+        if sub_task:
+            sub_task = paymenttask_for_update(payment_mapping, secrethash, updates)
+            manager_state = sub_task.manager_state
+
+        _, token_network_state = tokennetwork_for_update(
             node_state,
             payment_network_identifier,
             token_address,
+            updates,
         )
         iteration = initiator_manager.state_transition(
             manager_state,
             state_change,
-            token_network_state.channelidentifiers_to_channels,
+            CopyOnAccessChannelMap(token_network_state, updates),
             pseudo_random_generator,
             block_number,
         )
@@ -221,7 +325,7 @@ def subdispatch_initiatortask(
                 token_address,
                 iteration.new_state,
             )
-            node_state.payment_mapping.secrethashes_to_task[secrethash] = sub_task
+            set_paymenttask(payment_mapping, secrethash, sub_task, updates)
 
     return TransitionResult(node_state, events)
 
@@ -231,7 +335,8 @@ def subdispatch_mediatortask(
         state_change,
         payment_network_identifier,
         token_address,
-        secrethash):
+        secrethash,
+        updates):
 
     block_number = node_state.block_number
     sub_task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
@@ -251,17 +356,23 @@ def subdispatch_mediatortask(
 
     events = list()
     if is_valid_subtask:
-        token_network_state = get_token_network(
+        payment_mapping = paymentmapping_for_update(node_state)
+        if sub_task:
+            sub_task = paymenttask_for_update(payment_mapping, secrethash, updates)
+            mediator_state = sub_task.mediator_state
+
+        _, token_network_state = tokennetwork_for_update(
             node_state,
             payment_network_identifier,
             token_address,
+            updates,
         )
 
         pseudo_random_generator = node_state.pseudo_random_generator
         iteration = mediator.state_transition(
             mediator_state,
             state_change,
-            token_network_state.channelidentifiers_to_channels,
+            CopyOnAccessChannelMap(token_network_state, updates),
             pseudo_random_generator,
             block_number,
         )
@@ -273,7 +384,7 @@ def subdispatch_mediatortask(
                 token_address,
                 iteration.new_state,
             )
-            node_state.payment_mapping.secrethashes_to_task[secrethash] = sub_task
+            set_paymenttask(payment_mapping, secrethash, sub_task, updates)
 
     return TransitionResult(node_state, events)
 
@@ -284,7 +395,8 @@ def subdispatch_targettask(
         payment_network_identifier,
         token_address,
         channel_identifier,
-        secrethash):
+        secrethash,
+        updates):
 
     block_number = node_state.block_number
     sub_task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
@@ -315,6 +427,19 @@ def subdispatch_targettask(
     if channel_state:
         pseudo_random_generator = node_state.pseudo_random_generator
 
+        payment_mapping = paymentmapping_for_update(node_state)
+        if sub_task:
+            sub_task = paymenttask_for_update(payment_mapping, secrethash, updates)
+            target_state = sub_task.target_state
+
+        _, token_network_state = tokennetwork_for_update(
+            node_state,
+            payment_network_identifier,
+            token_address,
+            updates,
+        )
+        channel_state = channelstate_for_update(token_network_state, channel_state, updates)
+
         iteration = target.state_transition(
             target_state,
             state_change,
@@ -331,12 +456,12 @@ def subdispatch_targettask(
                 channel_identifier,
                 iteration.new_state,
             )
-            node_state.payment_mapping.secrethashes_to_task[secrethash] = sub_task
+            set_paymenttask(payment_mapping, secrethash, sub_task, updates)
 
     return TransitionResult(node_state, events)
 
 
-def maybe_add_tokennetwork(node_state, payment_network_identifier, token_network_state):
+def maybe_add_tokennetwork(node_state, payment_network_identifier, token_network_state, updates):
     token_network_identifier = token_network_state.address
     token_address = token_network_state.token_address
 
@@ -352,22 +477,166 @@ def maybe_add_tokennetwork(node_state, payment_network_identifier, token_network
             [token_network_state],
         )
 
-        ids_to_payments = node_state.identifiers_to_paymentnetworks
+        ids_to_payments = dict(node_state.identifiers_to_paymentnetworks)
         ids_to_payments[payment_network_identifier] = payment_network_state
+        node_state.identifiers_to_paymentnetworks = ids_to_payments
+        track_tokennetwork(updates, payment_network_identifier, token_network_state)
 
     elif token_network_state_previous is None:
+        payment_network_state = paymentnetwork_for_update(
+            node_state,
+            payment_network_identifier,
+        )
         ids_to_tokens = payment_network_state.tokenidentifiers_to_tokennetworks
         addrs_to_tokens = payment_network_state.tokenaddresses_to_tokennetworks
 
         ids_to_tokens[token_network_identifier] = token_network_state
         addrs_to_tokens[token_address] = token_network_state
+        track_tokennetwork(updates, payment_network_identifier, token_network_state)
+
+
+def get_channel_by_key(node_state, channel_key):
+    """ Return the channel for the `channel_key` of the channel deadlines, a
+    tuple (payment_network_identifier, token_address, channel_identifier).
+    """
+    payment_network_identifier, token_address, channel_identifier = channel_key
+    token_network_state = get_token_network(
+        node_state,
+        payment_network_identifier,
+        token_address,
+    )
+
+    if token_network_state is None:
+        return None
+
+    return token_network_state.channelidentifiers_to_channels.get(channel_identifier)
+
+
+def get_channel_deadline(node_state, channel_key):
+    channel_state = get_channel_by_key(node_state, channel_key)
+
+    if channel_state is None:
+        return None
+
+    return channel.get_next_block_due(channel_state)
+
+
+def get_paymenttask_deadline(node_state, secrethash):
+    sub_task = node_state.payment_mapping.secrethashes_to_task.get(secrethash)
+
+    # A Block is a noop for the initiator
+    if sub_task is None or isinstance(sub_task, PaymentMappingState.InitiatorTask):
+        return None
+
+    token_network_state = get_token_network(
+        node_state,
+        sub_task.payment_network_identifier,
+        sub_task.token_address,
+    )
+    if token_network_state is None:
+        return None
+
+    ids_to_channels = token_network_state.channelidentifiers_to_channels
+    block_number = node_state.block_number
+
+    if isinstance(sub_task, PaymentMappingState.MediatorTask):
+        if not ids_to_channels:
+            return None
+
+        return mediator.get_next_block_due(ids_to_channels, sub_task.mediator_state, block_number)
+
+    channel_state = ids_to_channels.get(sub_task.channel_identifier)
+    if channel_state is None:
+        return None
+
+    return target.get_next_block_due(sub_task.target_state, channel_state, block_number)
+
+
+def compute_deadlines(node_state):
+    """ Compute the deadlines of all the channels and payment tasks, used
+    for node states created or restored without them.
+    """
+    channels_to_blocks = dict()
+
+    ids_to_paymentnetworks = node_state.identifiers_to_paymentnetworks
+    for payment_network_identifier, payment_network in ids_to_paymentnetworks.items():
+        addrs_to_tokens = payment_network.tokenaddresses_to_tokennetworks
+        for token_address, token_network_state in addrs_to_tokens.items():
+            ids_to_channels = token_network_state.channelidentifiers_to_channels
+            for channel_identifier, channel_state in ids_to_channels.items():
+                channel_key = (payment_network_identifier, token_address, channel_identifier)
+                channels_to_blocks[channel_key] = channel.get_next_block_due(channel_state)
+
+    node_state.channel_deadlines = DeadlineQueueState(channels_to_blocks)
+    node_state.paymenttask_deadlines = DeadlineQueueState({
+        secrethash: get_paymenttask_deadline(node_state, secrethash)
+        for secrethash in node_state.payment_mapping.secrethashes_to_task
+    })
+
+
+def has_deadlines(node_state):
+    # the attributes are missing from the states pickled before they existed
+    return (
+        getattr(node_state, 'channel_deadlines', None) is not None and
+        getattr(node_state, 'paymenttask_deadlines', None) is not None
+    )
+
+
+def find_token_network_key(node_state, token_network_identifier):
+    ids_to_paymentnetworks = node_state.identifiers_to_paymentnetworks
+    for payment_network_identifier, payment_network in ids_to_paymentnetworks.items():
+        ids_to_tokens = payment_network.tokenidentifiers_to_tokennetworks
+        token_network_state = ids_to_tokens.get(token_network_identifier)
+
+        if token_network_state is not None:
+            return payment_network_identifier, token_network_state.token_address
+
+    return None
+
+
+def update_node_deadlines(node_state, updates):
+    """ Refresh the deadlines of the channels and payment tasks recorded in
+    `updates`, and of the ones that were due at the current block.
+    """
+    if not has_deadlines(node_state):
+        compute_deadlines(node_state)
+        return
+
+    block_number = node_state.block_number
+
+    channel_keys = set(get_due(node_state.channel_deadlines, block_number))
+    for token_network_identifier, channel_identifier in updates.channels:
+        token_network_key = updates.token_networks.get(token_network_identifier)
+        if token_network_key is None:
+            token_network_key = find_token_network_key(node_state, token_network_identifier)
+
+        if token_network_key is not None:
+            channel_keys.add(token_network_key + (channel_identifier, ))
+
+    secrethashes = set(get_due(node_state.paymenttask_deadlines, block_number))
+    secrethashes.update(updates.secrethashes)
+
+    node_state.channel_deadlines = update_deadlines(
+        node_state.channel_deadlines,
+        {
+            channel_key: get_channel_deadline(node_state, channel_key)
+            for channel_key in channel_keys
+        },
+    )
+    node_state.paymenttask_deadlines = update_deadlines(
+        node_state.paymenttask_deadlines,
+        {
+            secrethash: get_paymenttask_deadline(node_state, secrethash)
+            for secrethash in secrethashes
+        },
+    )
 
 
 def sanity_check(iteration):
     assert isinstance(iteration.new_state, NodeState)
 
 
-def handle_block(node_state, state_change):
+def handle_block(node_state, state_change, updates):
     block_number = state_change.block_number
     node_state.block_number = block_number
 
@@ -376,16 +645,18 @@ def handle_block(node_state, state_change):
         node_state,
         state_change,
         block_number,
+        updates,
     )
     transfers_result = subdispatch_to_all_lockedtransfers(
         node_state,
         state_change,
+        updates,
     )
     events = channels_result.events + transfers_result.events
     return TransitionResult(node_state, events)
 
 
-def handle_node_init(node_state, state_change):
+def handle_node_init(node_state, state_change, updates):
     node_state = NodeState(
         state_change.pseudo_random_generator,
         state_change.block_number,
@@ -394,12 +665,13 @@ def handle_node_init(node_state, state_change):
     return TransitionResult(node_state, events)
 
 
-def handle_token_network_action(node_state, state_change):
+def handle_token_network_action(node_state, state_change, updates):
     token_address = state_change.token_address
-    payment_network_state, token_network_state = get_networks(
+    payment_network_state, token_network_state = tokennetwork_for_update(
         node_state,
         state_change.payment_network_identifier,
         token_address,
+        updates,
     )
 
     events = list()
@@ -410,6 +682,7 @@ def handle_token_network_action(node_state, state_change):
             state_change,
             pseudo_random_generator,
             node_state.block_number,
+            updates,
         )
 
         if iteration.new_state is None:
@@ -420,53 +693,62 @@ def handle_token_network_action(node_state, state_change):
     return TransitionResult(node_state, events)
 
 
-def handle_delivered(node_state, state_change):
-    # TODO: improve the complexity of this algorithm
-    for queueid, queue in node_state.queueids_to_queues.items():
-        if queueid[1] == 'global':
-            remove = []
-
-            for pos, message in enumerate(queue):
-                if message.message_identifier == state_change.message_identifier:
-                    remove.append(pos)
-
-            for removepos in reversed(remove):
-                queue.pop(removepos)
-
+def handle_delivered(node_state, state_change, updates):
+    remove_queued_messages(node_state, state_change.message_identifier, updates, 'global')
     return TransitionResult(node_state, [])
 
 
-def handle_new_token_network(node_state, state_change):
+def handle_new_token_network(node_state, state_change, updates):
     events = list()
 
     token_network_state = state_change.token_network
     payment_network_identifier = state_change.payment_network_identifier
-    payment_network = node_state.identifiers_to_paymentnetworks.get(payment_network_identifier)
+    payment_network = paymentnetwork_for_update(node_state, payment_network_identifier)
 
     if payment_network is not None:
         tokens_to_networks = payment_network.tokenidentifiers_to_tokennetworks
         tokens_to_networks[token_network_state.address] = token_network_state
+        track_tokennetwork(updates, payment_network_identifier, token_network_state)
 
     # TODO: add ContractSend
     return TransitionResult(node_state, events)
 
 
-def handle_node_change_network_state(node_state, state_change):
+def handle_node_change_network_state(node_state, state_change, updates):
     events = list()
 
     node_address = state_change.node_address
     network_state = state_change.network_state
-    node_state.nodeaddresses_to_networkstates[node_address] = network_state
+
+    nodeaddresses_to_networkstates = dict(node_state.nodeaddresses_to_networkstates)
+    nodeaddresses_to_networkstates[node_address] = network_state
+    node_state.nodeaddresses_to_networkstates = nodeaddresses_to_networkstates
 
     return TransitionResult(node_state, events)
 
 
-def handle_leave_all_networks(node_state):
+def handle_leave_all_networks(  # pylint: disable=unused-argument
+        node_state,
+        state_change,
+        updates):
     events = list()
 
-    for payment_network_state in node_state.identifiers_to_paymentnetworks.values():
-        for token_network_state in payment_network_state.tokenaddresses_to_tokennetworks.values():
-            for channel_state in token_network_state.partneraddresses_to_channels.values():
+    ids_to_paymentnetworks = node_state.identifiers_to_paymentnetworks
+    for payment_network_identifier, payment_network in ids_to_paymentnetworks.items():
+        for token_address in payment_network.tokenaddresses_to_tokennetworks.keys():
+            _, token_network_state = tokennetwork_for_update(
+                node_state,
+                payment_network_identifier,
+                token_address,
+                updates,
+            )
+
+            for channel_state in list(token_network_state.partneraddresses_to_channels.values()):
+                channel_state = channelstate_for_update(
+                    token_network_state,
+                    channel_state,
+                    updates,
+                )
                 events.extend(channel.events_for_close(
                     channel_state,
                     node_state.block_number,
@@ -475,34 +757,42 @@ def handle_leave_all_networks(node_state):
     return TransitionResult(node_state, events)
 
 
-def handle_new_payment_network(node_state, state_change):
+def handle_new_payment_network(node_state, state_change, updates):
     events = list()
 
     payment_network = state_change.payment_network
     payment_network_identifier = payment_network.address
     if payment_network_identifier not in node_state.identifiers_to_paymentnetworks:
-        node_state.identifiers_to_paymentnetworks[payment_network_identifier] = payment_network
+        ids_to_payments = dict(node_state.identifiers_to_paymentnetworks)
+        ids_to_payments[payment_network_identifier] = payment_network
+        node_state.identifiers_to_paymentnetworks = ids_to_payments
+
+        addrs_to_tokens = payment_network.tokenaddresses_to_tokennetworks
+        for token_network_state in addrs_to_tokens.values():
+            track_tokennetwork(updates, payment_network_identifier, token_network_state)
 
     return TransitionResult(node_state, events)
 
 
-def handle_tokenadded(node_state, state_change):
+def handle_tokenadded(node_state, state_change, updates):
     events = list()
     maybe_add_tokennetwork(
         node_state,
         state_change.payment_network_identifier,
         state_change.token_network,
+        updates,
     )
 
     return TransitionResult(node_state, events)
 
 
-def handle_channel_withdraw(node_state, state_change):
+def handle_channel_withdraw(node_state, state_change, updates):
     token_address = state_change.token_address
-    payment_network_state, token_network_state = get_networks(
+    payment_network_state, token_network_state = tokennetwork_for_update(
         node_state,
         state_change.payment_network_identifier,
         state_change.token_address,
+        updates,
     )
 
     # first dispatch the withdraw to update the channel
@@ -514,6 +804,7 @@ def handle_channel_withdraw(node_state, state_change):
             state_change,
             pseudo_random_generator,
             node_state.block_number,
+            updates,
         )
         events.extend(sub_iteration.events)
 
@@ -526,21 +817,23 @@ def handle_channel_withdraw(node_state, state_change):
     sub_iteration_secret_reveal = handle_secret_reveal(
         node_state,
         state_change,
+        updates,
     )
     events.extend(sub_iteration_secret_reveal.events)
 
     return TransitionResult(node_state, events)
 
 
-def handle_secret_reveal(node_state, state_change):
+def handle_secret_reveal(node_state, state_change, updates):
     return subdispatch_to_paymenttask(
         node_state,
         state_change,
-        state_change.secrethash
+        state_change.secrethash,
+        updates,
     )
 
 
-def handle_init_initiator(node_state, state_change):
+def handle_init_initiator(node_state, state_change, updates):
     transfer = state_change.transfer
     secrethash = transfer.secrethash
     payment_network_identifier = state_change.payment_network_identifier
@@ -552,10 +845,11 @@ def handle_init_initiator(node_state, state_change):
         payment_network_identifier,
         token_address,
         secrethash,
+        updates,
     )
 
 
-def handle_init_mediator(node_state, state_change):
+def handle_init_mediator(node_state, state_change, updates):
     transfer = state_change.from_transfer
     secrethash = transfer.lock.secrethash
     payment_network_identifier = state_change.payment_network_identifier
@@ -567,10 +861,11 @@ def handle_init_mediator(node_state, state_change):
         payment_network_identifier,
         token_address,
         secrethash,
+        updates,
     )
 
 
-def handle_init_target(node_state, state_change):
+def handle_init_target(node_state, state_change, updates):
     transfer = state_change.transfer
     secrethash = transfer.lock.secrethash
     payment_network_identifier = state_change.payment_network_identifier
@@ -584,199 +879,160 @@ def handle_init_target(node_state, state_change):
         token_address,
         channel_identifier,
         secrethash,
+        updates,
     )
 
 
-def handle_receive_transfer_refund(node_state, state_change):
+def handle_receive_transfer_refund(node_state, state_change, updates):
     return subdispatch_to_paymenttask(
         node_state,
         state_change,
-        state_change.transfer.lock.secrethash
+        state_change.transfer.lock.secrethash,
+        updates,
     )
 
 
-def handle_receive_transfer_refund_cancel_route(node_state, state_change):
+def handle_receive_transfer_refund_cancel_route(node_state, state_change, updates):
     return subdispatch_to_paymenttask(
         node_state,
         state_change,
-        state_change.transfer.lock.secrethash
+        state_change.transfer.lock.secrethash,
+        updates,
     )
 
 
-def handle_receive_secret_request(node_state, state_change):
+def handle_receive_secret_request(node_state, state_change, updates):
     secrethash = state_change.secrethash
-    return subdispatch_to_paymenttask(node_state, state_change, secrethash)
+    return subdispatch_to_paymenttask(node_state, state_change, secrethash, updates)
 
 
-def handle_receive_secret_reveal(node_state, state_change):
-    secrethash = state_change.secrethash
-    return subdispatch_to_paymenttask(node_state, state_change, secrethash)
-
-
-def handle_processed(node_state, state_change):
-    # TODO: improve the complexity of this algorithm
-    for queue in node_state.queueids_to_queues.values():
-        remove = []
+def handle_processed(node_state, state_change, updates):
+    remove_queued_messages(node_state, state_change.message_identifier, updates)
+    return TransitionResult(node_state, [])
 
-        for pos, message in enumerate(queue):
-            if message.message_identifier == state_change.message_identifier:
-                remove.append(pos)
 
-        for removepos in reversed(remove):
-            queue.pop(removepos)
+def handle_receive_unlock(node_state, state_change, updates):
+    secrethash = state_change.secrethash
+    return subdispatch_to_paymenttask(node_state, state_change, secrethash, updates)
 
-    return TransitionResult(node_state, [])
 
+class StateChangeStatistics:
+    """ Counters of the state changes of one type dispatched in this
+    process.
+    """
+    __slots__ = (
+        'calls',
+        'elapsed',
+        'events',
+    )
 
-def handle_receive_unlock(node_state, state_change):
-    secrethash = state_change.secrethash
-    return subdispatch_to_paymenttask(node_state, state_change, secrethash)
+    def __init__(self):
+        self.calls = 0
+        self.elapsed = 0.0
+        self.events = 0
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'elapsed': self.elapsed,
+            'events': self.events,
+        }
+
+
+# Handler of each state change type, the lookup is by exact type
+STATE_CHANGE_HANDLERS = {
+    Block: handle_block,
+    ActionInitNode: handle_node_init,
+    ActionNewTokenNetwork: handle_new_token_network,
+    ActionChannelClose: handle_token_network_action,
+    ActionChangeNodeNetworkState: handle_node_change_network_state,
+    ActionTransferDirect: handle_token_network_action,
+    ActionLeaveAllNetworks: handle_leave_all_networks,
+    ActionInitInitiator: handle_init_initiator,
+    ActionInitMediator: handle_init_mediator,
+    ActionInitTarget: handle_init_target,
+    ContractReceiveNewPaymentNetwork: handle_new_payment_network,
+    ContractReceiveNewTokenNetwork: handle_tokenadded,
+    ContractReceiveChannelWithdraw: handle_channel_withdraw,
+    ContractReceiveChannelNew: handle_token_network_action,
+    ContractReceiveChannelClosed: handle_token_network_action,
+    ContractReceiveChannelNewBalance: handle_token_network_action,
+    ContractReceiveChannelSettled: handle_token_network_action,
+    ContractReceiveRouteNew: handle_token_network_action,
+    ReceiveDelivered: handle_delivered,
+    ReceiveTransferDirect: handle_token_network_action,
+    ReceiveSecretReveal: handle_secret_reveal,
+    ReceiveTransferRefundCancelRoute: handle_receive_transfer_refund_cancel_route,
+    ReceiveTransferRefund: handle_receive_transfer_refund,
+    ReceiveSecretRequest: handle_receive_secret_request,
+    ReceiveProcessed: handle_processed,
+    ReceiveUnlock: handle_receive_unlock,
+}
+
+# Statistics per state change type name, updated by `state_transition`
+STATE_CHANGE_STATISTICS = defaultdict(StateChangeStatistics)
+
+
+def dispatch_statistics():
+    """ Return the number of calls, the cumulative time in seconds and the
+    number of emitted events per state change type, for all the state
+    changes dispatched by this process.
+    """
+    return {
+        type_name: statistics.to_dict()
+        for type_name, statistics in STATE_CHANGE_STATISTICS.items()
+    }
+
+
+def reset_dispatch_statistics():
+    STATE_CHANGE_STATISTICS.clear()
+
+
+def handle_unknown_state_change(  # pylint: disable=unused-argument
+        node_state,
+        state_change,
+        updates):
+    raise RuntimeError('No handler for the state change {}'.format(state_change))
 
 
 def state_transition(node_state, state_change):
-    # pylint: disable=too-many-branches,unidiomatic-typecheck
+    """ Apply `state_change` to a copy of `node_state`.
+
+    `node_state` is not modified, only the parts of the tree changed by the
+    state change are copied, the rest is shared with the new state. The
+    block deadlines of the changed channels and payment tasks are refreshed
+    afterwards.
+    """
+    start = time.perf_counter()
+    state_change_type = type(state_change)
+
+    updates = TransitionUpdates()
+    node_state = copy_nodestate(node_state)
+
+    if node_state is not None:
+        if not has_deadlines(node_state):
+            compute_deadlines(node_state)
+
+        # missing from the states pickled before the index existed
+        if getattr(node_state, 'messageidentifiers_to_queueids', None) is None:
+            node_state.messageidentifiers_to_queueids = build_message_index(
+                node_state.queueids_to_queues,
+            )
 
-    if type(state_change) == Block:
-        iteration = handle_block(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionInitNode:
-        iteration = handle_node_init(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionNewTokenNetwork:
-        iteration = handle_new_token_network(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionChannelClose:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionChangeNodeNetworkState:
-        iteration = handle_node_change_network_state(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionTransferDirect:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionLeaveAllNetworks:
-        iteration = handle_leave_all_networks(
-            node_state,
-        )
-    elif type(state_change) == ActionInitInitiator:
-        iteration = handle_init_initiator(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionInitMediator:
-        iteration = handle_init_mediator(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ActionInitTarget:
-        iteration = handle_init_target(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveNewPaymentNetwork:
-        iteration = handle_new_payment_network(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveNewTokenNetwork:
-        iteration = handle_tokenadded(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelWithdraw:
-        iteration = handle_channel_withdraw(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelNew:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelClosed:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelNewBalance:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveChannelSettled:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ContractReceiveRouteNew:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveDelivered:
-        iteration = handle_delivered(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveTransferDirect:
-        iteration = handle_token_network_action(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveSecretReveal:
-        iteration = handle_secret_reveal(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveTransferRefundCancelRoute:
-        iteration = handle_receive_transfer_refund_cancel_route(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveTransferRefund:
-        iteration = handle_receive_transfer_refund(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveSecretRequest:
-        iteration = handle_receive_secret_request(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveSecretReveal:
-        iteration = handle_receive_secret_reveal(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveProcessed:
-        iteration = handle_processed(
-            node_state,
-            state_change,
-        )
-    elif type(state_change) == ReceiveUnlock:
-        iteration = handle_receive_unlock(
-            node_state,
-            state_change,
-        )
+    handler = STATE_CHANGE_HANDLERS.get(state_change_type, handle_unknown_state_change)
+    iteration = handler(node_state, state_change, updates)
 
     sanity_check(iteration)
+    update_node_deadlines(iteration.new_state, updates)
 
     for event in iteration.events:
         if isinstance(event, SendMessageEvent):
             queueid = (event.recipient, event.queue_name)
-            queue = node_state.queueids_to_queues.setdefault(queueid, [])
-            queue.append(event)
+            enqueue_message(node_state, queueid, event, updates)
+
+    statistics = STATE_CHANGE_STATISTICS[state_change_type.__name__]
+    statistics.calls += 1
+    statistics.elapsed += time.perf_counter() - start
+    statistics.events += len(iteration.events)
 
     return iteration
@@ -81,6 +81,9 @@ class NodeState(State):
         'identifiers_to_paymentnetworks',
         'nodeaddresses_to_networkstates',
         'payment_mapping',
+        'channel_deadlines',
+        'paymenttask_deadlines',
+        'messageidentifiers_to_queueids',
     )
 
     def __init__(self, pseudo_random_generator: random.Random, block_number: typing.BlockNumber):
@@ -94,6 +97,14 @@ class NodeState(State):
         self.nodeaddresses_to_networkstates = dict()
         self.payment_mapping = PaymentMappingState()
 
+        # Derived from the rest of the state, None if they must be recomputed
+        self.channel_deadlines = None
+        self.paymenttask_deadlines = None
+
+        # Bucket of the message identifier -> message identifier -> the
+        # identifiers of the queues with a message for it, once per message
+        self.messageidentifiers_to_queueids = None
+
     def __repr__(self):
         return '<NodeState block:{} networks:{} qtd_transfers:{}>'.format(
             self.block_number,
@@ -116,6 +127,45 @@ class NodeState(State):
         return not self.__eq__(other)
 
 
+class DeadlineQueueState(State):
+    """ Block deadlines of the entities of the node state.
+
+    Maps a key to the first block number at which a `Block` state change must
+    be dispatched to the entity, the (block_number, key) pairs are kept
+    sorted so the entities that are due are found by bisection.
+    """
+
+    __slots__ = (
+        'keys_to_blocks',
+        'ordered',
+    )
+
+    def __init__(self, keys_to_blocks: typing.Dict = None):
+        keys_to_blocks = {
+            key: block_number
+            for key, block_number in (keys_to_blocks or dict()).items()
+            if block_number is not None
+        }
+
+        self.keys_to_blocks = keys_to_blocks
+        self.ordered = sorted(
+            (block_number, key)
+            for key, block_number in keys_to_blocks.items()
+        )
+
+    def __repr__(self):
+        return '<DeadlineQueueState entries:{}>'.format(len(self.keys_to_blocks))
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, DeadlineQueueState) and
+            self.keys_to_blocks == other.keys_to_blocks
+        )
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
 class PaymentNetworkState(State):
     """ Corresponds to a registry smart contract. """
 
@@ -759,6 +809,7 @@ class NettingChannelEndState(State):
         'secrethashes_to_unlockedlocks',
         'merkletree',
         'balance_proof',
+        'amount_locked',
     )
 
     def __init__(self, address: typing.Address, balance: typing.TokenAmount):
@@ -776,6 +827,10 @@ class NettingChannelEndState(State):
         self.merkletree = EMPTY_MERKLE_TREE
         self.balance_proof = None
 
+        # Sum of the amounts of the locked and unlocked locks, kept up to date
+        # by the functions in `raiden.transfer.channel` that change the locks
+        self.amount_locked = 0
+
     def __repr__(self):
         return '<NettingChannelEndState address:{} contract_balance:{} merkletree:{}>'.format(
             pex(self.address),
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 from raiden.transfer import channel
 from raiden.transfer.architecture import TransitionResult
+from raiden.transfer.copy_on_write import (
+    channelstate_for_update,
+    networkgraph_for_update,
+    track_channel,
+)
 from raiden.transfer.events import EventTransferSentFailed
 from raiden.transfer.state_change import (
     ActionChannelClose,
@@ -21,11 +26,24 @@ def maybe_update_subtask(new_state, secrethash, secrethashes_to_states):
         del secrethashes_to_states[secrethash]
 
 
+def add_edge(token_network_state, participant1, participant2, updates):
+    """ Add the channel to the network graph. The graph may be shared with
+    a previous state, see `networkgraph_for_update`.
+    """
+    network = networkgraph_for_update(
+        token_network_state,
+        (participant1, participant2),
+        updates,
+    )
+    network.add_edge(participant1, participant2)
+
+
 def subdispatch_to_channel_by_id(
         token_network_state,
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
 ):
     events = list()
 
@@ -33,6 +51,7 @@ def subdispatch_to_channel_by_id(
     channel_state = ids_to_channels.get(state_change.channel_identifier)
 
     if channel_state:
+        channel_state = channelstate_for_update(token_network_state, channel_state, updates)
         result = channel.state_transition(
             channel_state,
             state_change,
@@ -49,16 +68,18 @@ def handle_channel_close(
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
 ):
     return subdispatch_to_channel_by_id(
         token_network_state,
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
     )
 
 
-def handle_channelnew(token_network_state, state_change):
+def handle_channelnew(token_network_state, state_change, updates):
     events = list()
 
     channel_state = state_change.channel_state
@@ -66,13 +87,11 @@ def handle_channelnew(token_network_state, state_change):
     our_address = channel_state.our_state.address
     partner_address = channel_state.partner_state.address
 
-    token_network_state.network_graph.network.add_edge(
-        our_address,
-        partner_address,
-    )
+    add_edge(token_network_state, our_address, partner_address, updates)
 
     token_network_state.channelidentifiers_to_channels[channel_id] = channel_state
     token_network_state.partneraddresses_to_channels[partner_address] = channel_state
+    track_channel(updates, token_network_state, channel_id)
 
     return TransitionResult(token_network_state, events)
 
@@ -82,12 +101,14 @@ def handle_balance(
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
 ):
     return subdispatch_to_channel_by_id(
         token_network_state,
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
     )
 
 
@@ -96,12 +117,14 @@ def handle_closed(
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
 ):
     return subdispatch_to_channel_by_id(
         token_network_state,
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
     )
 
 
@@ -110,21 +133,25 @@ def handle_settled(
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
 ):
     return subdispatch_to_channel_by_id(
         token_network_state,
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
     )
 
 
-def handle_newroute(token_network_state, state_change):
+def handle_newroute(token_network_state, state_change, updates):
     events = list()
 
-    token_network_state.network_graph.network.add_edge(
+    add_edge(
+        token_network_state,
         state_change.participant1,
         state_change.participant2,
+        updates,
     )
 
     return TransitionResult(token_network_state, events)
@@ -135,11 +162,13 @@ def handle_action_transfer_direct(
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
 ):
     receiver_address = state_change.receiver_address
     channel_state = token_network_state.partneraddresses_to_channels.get(receiver_address)
 
     if channel_state:
+        channel_state = channelstate_for_update(token_network_state, channel_state, updates)
         iteration = channel.state_transition(
             channel_state,
             state_change,
@@ -162,6 +191,7 @@ def handle_receive_transfer_direct(
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
 ):
     events = list()
 
@@ -169,6 +199,7 @@ def handle_receive_transfer_direct(
     channel_state = token_network_state.channelidentifiers_to_channels.get(channel_id)
 
     if channel_state:
+        channel_state = channelstate_for_update(token_network_state, channel_state, updates)
         result = channel.state_transition(
             channel_state,
             state_change,
@@ -185,6 +216,7 @@ def handle_receive_transfer_refund(
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
 ):
     events = list()
 
@@ -192,6 +224,7 @@ def handle_receive_transfer_refund(
     channel_state = token_network_state.channelidentifiers_to_channels.get(channel_id)
 
     if channel_state:
+        channel_state = channelstate_for_update(token_network_state, channel_state, updates)
         result = channel.state_transition(
             channel_state,
             state_change,
@@ -208,6 +241,7 @@ def state_transition(
         state_change,
         pseudo_random_generator,
         block_number,
+        updates,
 ):
     # pylint: disable=too-many-branches,unidiomatic-typecheck
 
@@ -217,11 +251,13 @@ def state_transition(
             state_change,
             pseudo_random_generator,
             block_number,
+            updates,
         )
     elif type(state_change) == ContractReceiveChannelNew:
         iteration = handle_channelnew(
             token_network_state,
             state_change,
+            updates,
         )
     elif type(state_change) == ContractReceiveChannelNewBalance:
         iteration = handle_balance(
@@ -229,6 +265,7 @@ def state_transition(
             state_change,
             pseudo_random_generator,
             block_number,
+            updates,
         )
     elif type(state_change) == ContractReceiveChannelClosed:
         iteration = handle_closed(
@@ -236,6 +273,7 @@ def state_transition(
             state_change,
             pseudo_random_generator,
             block_number,
+            updates,
         )
     elif type(state_change) == ContractReceiveChannelSettled:
         iteration = handle_settled(
@@ -243,11 +281,13 @@ def state_transition(
             state_change,
             pseudo_random_generator,
             block_number,
+            updates,
         )
     elif type(state_change) == ContractReceiveRouteNew:
         iteration = handle_newroute(
             token_network_state,
             state_change,
+            updates,
         )
     elif type(state_change) == ActionTransferDirect:
         iteration = handle_action_transfer_direct(
@@ -255,6 +295,7 @@ def state_transition(
             state_change,
             pseudo_random_generator,
             block_number,
+            updates,
         )
     elif type(state_change) == ReceiveTransferDirect:
         iteration = handle_receive_transfer_direct(
@@ -262,6 +303,7 @@ def state_transition(
             state_change,
             pseudo_random_generator,
             block_number,
+            updates,
         )
     else:
         raise RuntimeError(state_change)
@@ -74,6 +74,7 @@ def handle_message_refundtransfer(raiden: 'RaidenService', message: RefundTransf
         from_transfer.target,
         from_transfer.lock.amount,
         message.sender,
+        raiden.route_planner,
     )
 
     role = views.get_transfer_role(
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+""" Replays the state changes of an existing node database through
+`node.state_transition`, without network nor blockchain, and reports:
+
+- the replay throughput,
+- the p50/p99 latency, net allocated memory blocks and emitted events per
+  state change type,
+- the inclusive time spent in each `handle_*` and `subdispatch_*` function of
+  the state machine (with --handlers, which adds overhead to the replay).
+
+The database is opened read-only. Like the node's restore, the replay starts
+from the latest snapshot, or from the first state change if there is none.
+
+The results can be stored as a baseline and later runs compared against it,
+the exit status is 1 if the throughput or the latency of any state change
+type regressed by more than the tolerance::
+
+    python -m raiden.utils.profiling.replay node.db --save-baseline base.json
+    python -m raiden.utils.profiling.replay node.db --baseline base.json
+"""
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from functools import wraps
+from urllib.request import pathname2url
+
+import click
+
+from raiden.storage.serialize import SERIALIZERS
+from raiden.transfer import channel, node, token_network
+from raiden.transfer.architecture import StateManager
+from raiden.transfer.mediated_transfer import (
+    initiator,
+    initiator_manager,
+    mediator,
+    target,
+)
+
+PROFILED_MODULES = (
+    node,
+    token_network,
+    channel,
+    initiator_manager,
+    initiator,
+    mediator,
+    target,
+)
+PROFILED_PREFIXES = ('handle_', 'subdispatch_')
+
+# State change types with fewer samples are not compared to the baseline,
+# their percentiles are noise
+MIN_SAMPLES_FOR_COMPARISON = 100
+
+READ_CHUNK_SIZE = 1000
+
+
+def percentile(sorted_values, fraction):
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def open_read_only(database_path):
+    uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(database_path)))
+    return sqlite3.connect(uri, uri=True)
+
+
+def load_initial_state(conn, serializer):
+    """ Return (state, first_state_change_id) to start the replay from. """
+    # like the restore, the state changes before the latest snapshot are not
+    # replayed, whether or not the log was compacted
+    row = conn.execute(
+        'SELECT statechange_id, data FROM state_snapshot ORDER BY identifier DESC LIMIT 1',
+    ).fetchone()
+
+    if row is None:
+        return None, 1
+
+    statechange_id, data = row
+    return serializer.deserialize(data), statechange_id + 1
+
+
+def iterate_state_changes(conn, serializer, from_identifier):
+    last_identifier = from_identifier - 1
+
+    while True:
+        rows = conn.execute(
+            'SELECT identifier, data FROM state_changes WHERE identifier > ? '
+            'ORDER BY identifier LIMIT ?',
+            (last_identifier, READ_CHUNK_SIZE),
+        ).fetchall()
+
+        if not rows:
+            return
+
+        last_identifier = rows[-1][0]
+        for _, data in rows:
+            yield serializer.deserialize(data)
+
+
+class HandlerProfiler:
+    """ Wraps the state machine handlers to measure the time spent in them,
+    the time is inclusive of the nested handlers.
+    """
+
+    def __init__(self):
+        self.elapsed = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.originals = list()
+        self.original_handlers = dict()
+
+    def wrap(self, name, function):
+        @wraps(function)
+        def profiled(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.elapsed[name] += time.perf_counter() - start
+                self.calls[name] += 1
+
+        return profiled
+
+    def install(self):
+        for module in PROFILED_MODULES:
+            module_name = module.__name__.split('.')[-1]
+
+            for attribute, value in list(vars(module).items()):
+                is_handler = (
+                    attribute.startswith(PROFILED_PREFIXES) and
+                    callable(value) and
+                    getattr(value, '__module__', None) == module.__name__
+                )
+                if is_handler:
+                    name = '{}.{}'.format(module_name, attribute)
+                    self.originals.append((module, attribute, value))
+                    setattr(module, attribute, self.wrap(name, value))
+
+        # the node dispatches through its handler table
+        self.original_handlers = dict(node.STATE_CHANGE_HANDLERS)
+        for state_change_type, handler in self.original_handlers.items():
+            node.STATE_CHANGE_HANDLERS[state_change_type] = getattr(node, handler.__name__)
+
+    def uninstall(self):
+        for module, attribute, value in self.originals:
+            setattr(module, attribute, value)
+        self.originals = list()
+
+        node.STATE_CHANGE_HANDLERS.update(self.original_handlers)
+
+
+def replay(conn, serializer):
+    """ Replay the log and return the measurements. """
+    state, first_identifier = load_initial_state(conn, serializer)
+    state_manager = StateManager(node.state_transition, state)
+
+    latencies = defaultdict(list)
+    allocated_blocks = defaultdict(int)
+    dispatch_elapsed = 0.0
+    node.reset_dispatch_statistics()
+
+    for state_change in iterate_state_changes(conn, serializer, first_identifier):
+        blocks_before = sys.getallocatedblocks()
+        start = time.perf_counter()
+
+        state_manager.dispatch(state_change)
+
+        elapsed = time.perf_counter() - start
+        blocks_after = sys.getallocatedblocks()
+
+        type_name = type(state_change).__name__
+        latencies[type_name].append(elapsed)
+        allocated_blocks[type_name] += blocks_after - blocks_before
+        dispatch_elapsed += elapsed
+
+    state_changes = sum(len(values) for values in latencies.values())
+    statistics = node.dispatch_statistics()
+
+    per_type = dict()
+    for type_name, values in latencies.items():
+        values.sort()
+        per_type[type_name] = {
+            'count': len(values),
+            'p50': percentile(values, 0.5),
+            'p99': percentile(values, 0.99),
+            'allocated_blocks': allocated_blocks[type_name] / len(values),
+            'events': statistics[type_name]['events'] / len(values),
+        }
+
+    return {
+        'state_changes': state_changes,
+        'throughput': state_changes / dispatch_elapsed if dispatch_elapsed else 0.0,
+        'per_type': per_type,
+    }
+
+
+def profile_handlers(conn, serializer):
+    profiler = HandlerProfiler()
+    profiler.install()
+    try:
+        replay(conn, serializer)
+    finally:
+        profiler.uninstall()
+
+    return {
+        name: {'calls': profiler.calls[name], 'elapsed': elapsed}
+        for name, elapsed in profiler.elapsed.items()
+    }
+
+
+def compare_to_baseline(result, baseline, tolerance):
+    """ Return the list of regressions of `result` compared to `baseline`. """
+    regressions = list()
+
+    minimum_throughput = baseline['throughput'] * (1 - tolerance)
+    if result['throughput'] < minimum_throughput:
+        regressions.append('throughput {:.0f} sc/s, baseline {:.0f} sc/s'.format(
+            result['throughput'],
+            baseline['throughput'],
+        ))
+
+    for type_name, expected in baseline['per_type'].items():
+        current = result['per_type'].get(type_name)
+
+        enough_samples = (
+            current is not None and
+            min(current['count'], expected['count']) >= MIN_SAMPLES_FOR_COMPARISON
+        )
+        if not enough_samples:
+            continue
+
+        for key in ('p50', 'p99'):
+            if current[key] > expected[key] * (1 + tolerance):
+                regressions.append('{} {} {:.3f}ms, baseline {:.3f}ms'.format(
+                    type_name,
+                    key,
+                    current[key] * 1000,
+                    expected[key] * 1000,
+                ))
+
+    return regressions
+
+
+def print_result(result, handlers):
+    print('{} state changes replayed, {:.0f} sc/s'.format(
+        result['state_changes'],
+        result['throughput'],
+    ))
+    print()
+    print('{:<45} {:>8} {:>10} {:>10} {:>10} {:>8}'.format(
+        'state change',
+        'count',
+        'p50',
+        'p99',
+        'blocks',
+        'events',
+    ))
+    per_type = sorted(result['per_type'].items(), key=lambda item: -item[1]['count'])
+    for type_name, values in per_type:
+        print('{:<45} {:>8} {:>8.3f}ms {:>8.3f}ms {:>10.1f} {:>8.2f}'.format(
+            type_name,
+            values['count'],
+            values['p50'] * 1000,
+            values['p99'] * 1000,
+            values['allocated_blocks'],
+            values['events'],
+        ))
+
+    if handlers:
+        print()
+        print('{:<55} {:>8} {:>12}'.format('handler', 'calls', 'inclusive'))
+        sorted_handlers = sorted(handlers.items(), key=lambda item: -item[1]['elapsed'])
+        for name, values in sorted_handlers:
+            print('{:<55} {:>8} {:>10.1f}ms'.format(
+                name,
+                values['calls'],
+                values['elapsed'] * 1000,
+            ))
+
+
+@click.command()
+@click.option('--serializer', 'serializer_name', type=click.Choice(SERIALIZERS), default='pickle')
+@click.option('--handlers', is_flag=True, help='Profile the handlers.')
+@click.option('--save-baseline', type=click.Path(dir_okay=False))
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False))
+@click.option('--tolerance', default=0.1, type=float)
+@click.argument('database_path', type=click.Path(exists=True, dir_okay=False))
+def main(serializer_name, handlers, save_baseline, baseline, tolerance, database_path):
+    conn = open_read_only(database_path)
+    serializer = SERIALIZERS[serializer_name]()
+
+    result = replay(conn, serializer)
+
+    handlers_result = None
+    if handlers:
+        handlers_result = profile_handlers(conn, serializer)
+
+    conn.close()
+    print_result(result, handlers_result)
+
+    if save_baseline:
+        with open(save_baseline, 'w') as handler:
+            json.dump(result, handler, indent=2, sort_keys=True)
+
+    if baseline:
+        with open(baseline) as handler:
+            baseline_result = json.load(handler)
+
+        regressions = compare_to_baseline(result, baseline_result, tolerance)
+
+        print()
+        if regressions:
+            print('Regressions against {}:'.format(baseline))
+            for regression in regressions:
+                print('  ' + regression)
+            sys.exit(1)
+
+        print('No regressions against {}'.format(baseline))
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter